@@ -735,6 +735,7 @@ export class ApiConstruct extends Construct {
           INDEX_TABLE_NAME: props.indexTableName,
           EMBEDDING_ENDPOINT: props.embeddingAndRerankerEndPoint,
           OPENAI_KEY_ARN: openAiKey.secretArn,
+          DOC_STORE_BUCKET: resBucketName,
         },
       });
 
@@ -911,9 +912,12 @@ export class ApiConstruct extends Construct {
           INDEX_TABLE: props.indexTableName,
           CHATBOT_TABLE: props.chatbotTableName,
           MODEL_TABLE: props.modelTableName,
+          DOC_STORE_BUCKET: resBucketName,
         },
         layers: [apiLambdaOnlineSourceLayer, apiLambdaJobSourceLayer],
       });
+      // whole documents, index versions and intent artifacts of the ingestion job
+      lambdaOnlineFunctions.addToRolePolicy(this.iamHelper.s3Statement);
 
       lambdaOnlineQueryPreprocess.grantInvoke(lambdaOnlineMain);
 
@@ -25,6 +25,7 @@ export class DynamoDBConstruct extends Construct {
 
   public readonly byUserIdIndex: string = "byUserId";
   public readonly bySessionIdIndex: string = "bySessionId";
+  public readonly bySessionIdTimestampIndex: string = "bySessionIdTimestamp";
   public readonly byTimestampIndex: string = "byTimestamp";
 
   constructor(scope: Construct, id: string) {
@@ -85,6 +86,12 @@ export class DynamoDBConstruct extends Construct {
       indexName: this.bySessionIdIndex,
       partitionKey: { name: "sessionId", type: dynamodb.AttributeType.STRING },
     });
+    messagesTable.addGlobalSecondaryIndex({
+      indexName: this.bySessionIdTimestampIndex,
+      partitionKey: sessionIdAttr,
+      sortKey: timestampAttr,
+      projectionType: dynamodb.ProjectionType.ALL,
+    });
 
     const promptTable = new DynamoDBTable(this, "Prompt", groupNameAttr2, sortKeyAttr).table;
     const indexTable = new DynamoDBTable(this, "Index", groupNameAttr, indexIdAttr).table;
@@ -83,6 +83,7 @@ export class IAMHelper extends Construct {
       [
         "dynamodb:Query",
         "dynamodb:GetItem",
+        "dynamodb:BatchGetItem",
         "dynamodb:PutItem",
         "dynamodb:UpdateItem",
         "dynamodb:Describe*",
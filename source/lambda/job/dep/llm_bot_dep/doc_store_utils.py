@@ -0,0 +1,244 @@
+"""
+Whole document store, written by the ingestion job and read by the online
+retrievers when the whole source document is used as context.
+
+Each document is stored once per index as zlib compressed json holding the
+ordered full text, keyed by a hash of its file path. The ingestion job also
+writes a version marker per index after each run, used by the online caches
+to invalidate entries built from an older version of the index, and artifacts
+derived from a whole index, e.g. the local intent index of intent_index_utils.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+DOC_STORE_FORMAT_VERSION = 1
+
+
+def get_index_version_key(index_name: str) -> str:
+    return f"{index_name}/_version.json"
+
+
+def get_index_artifact_key(index_name: str, artifact_name: str) -> str:
+    return f"{index_name}/{artifact_name}"
+
+
+def get_doc_key(index_name: str, file_path: str) -> str:
+    """Object key of a document, relative to the store prefix"""
+    file_path_hash = hashlib.sha256(file_path.encode("utf-8")).hexdigest()
+    return f"{index_name}/{file_path_hash}.json.z"
+
+
+def build_doc_text(chunks: Iterable[Tuple[str, str, str]]) -> Tuple[str, int]:
+    """Concatenate the chunks of a document in reading order
+
+    Only chunks with a `$<group>-...-<section>` chunk id are kept, duplicated
+    (chunk_id, content_type) pairs are dropped, the rest is ordered by
+    (group, content_type, section).
+
+    Args:
+        chunks (Iterable[Tuple[str, str, str]]): (chunk_id, content_type, text)
+
+    Returns:
+        Tuple[str, int]: the document text and the number of chunks in it
+    """
+    chunk_list = []
+    chunk_id_set = set()
+    for chunk_id, content_type, text in chunks:
+        if not chunk_id or not chunk_id.startswith("$"):
+            continue
+        try:
+            chunk_group_id = int(chunk_id.split("-")[0].strip("$"))
+            chunk_section_id = int(chunk_id.split("-")[-1])
+        except ValueError:
+            logger.warning("Skip chunk with invalid chunk id: %s", chunk_id)
+            continue
+        if (chunk_id, content_type) in chunk_id_set:
+            continue
+        chunk_id_set.add((chunk_id, content_type))
+        chunk_list.append((chunk_group_id, content_type or "", chunk_section_id, text))
+    sorted_chunk_list = sorted(chunk_list, key=lambda x: (x[0], x[1], x[2]))
+    return "\n".join(x[3] for x in sorted_chunk_list), len(sorted_chunk_list)
+
+
+def encode_doc(file_path: str, text: str, chunk_num: int) -> bytes:
+    doc = {
+        "version": DOC_STORE_FORMAT_VERSION,
+        "file_path": file_path,
+        "chunk_num": chunk_num,
+        "text": text,
+    }
+    return zlib.compress(json.dumps(doc, ensure_ascii=False).encode("utf-8"))
+
+
+def decode_doc(data: bytes) -> dict:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class DocStoreBackendBase:
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def put(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class S3DocStoreBackend(DocStoreBackendBase):
+    def __init__(self, s3_client, bucket: str, prefix: str = "doc-store"):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _get_object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self._get_object_key(key)
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return response["Body"].read()
+
+    def put(self, key: str, data: bytes) -> None:
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self._get_object_key(key),
+            Body=data,
+        )
+
+    def delete(self, key: str) -> None:
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self._get_object_key(key))
+
+
+class LocalDocStoreBackend(DocStoreBackendBase):
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.root_dir, *key.split("/"))
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._get_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file first so readers never see a partial document
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        path = self._get_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class DocStore:
+    """Keyed store of whole documents on top of a S3 or local backend"""
+
+    def __init__(self, backend: DocStoreBackendBase):
+        self.backend = backend
+
+    @classmethod
+    def from_environ(cls, s3_client=None):
+        """Document store configured by DOC_STORE_BACKEND (s3 or local),
+        DOC_STORE_BUCKET, DOC_STORE_PREFIX and DOC_STORE_LOCAL_DIR
+
+        Returns:
+            DocStore: None if the document store is not configured
+        """
+        bucket = os.environ.get("DOC_STORE_BUCKET", "")
+        prefix = os.environ.get("DOC_STORE_PREFIX", "doc-store")
+        local_dir = os.environ.get("DOC_STORE_LOCAL_DIR", "")
+        backend = os.environ.get(
+            "DOC_STORE_BACKEND", "local" if local_dir else ("s3" if bucket else "none")
+        ).lower()
+        if backend == "s3" and bucket:
+            if s3_client is None:
+                import boto3
+                s3_client = boto3.client("s3")
+            return cls(S3DocStoreBackend(s3_client, bucket, prefix))
+        if backend == "local" and local_dir:
+            return cls(LocalDocStoreBackend(local_dir))
+        return None
+
+    def put_doc(self, index_name: str, file_path: str, chunks: List[Tuple[str, str, str]]) -> int:
+        """Store the whole text of a document
+
+        Args:
+            index_name (str): index the chunks are ingested into
+            file_path (str): s3 path of the source file, `metadata.file_path` of the chunks
+            chunks (List[Tuple[str, str, str]]): (chunk_id, content_type, text) in any order
+
+        Returns:
+            int: number of chunks stored, 0 if the document has no ordered chunks and is not stored
+        """
+        text, chunk_num = build_doc_text(chunks)
+        if chunk_num == 0:
+            return 0
+        self.backend.put(get_doc_key(index_name, file_path), encode_doc(file_path, text, chunk_num))
+        return chunk_num
+
+    def get_doc(self, index_name: str, file_path: str) -> Optional[str]:
+        """Get the whole text of a document, None if it is not stored"""
+        data = self.backend.get(get_doc_key(index_name, file_path))
+        if data is None:
+            return None
+        doc = decode_doc(data)
+        # guard against hash collisions
+        if doc.get("file_path") != file_path:
+            return None
+        return doc["text"]
+
+    def delete_doc(self, index_name: str, file_path: str) -> None:
+        self.backend.delete(get_doc_key(index_name, file_path))
+
+    def put_index_version(self, index_name: str) -> str:
+        """Mark the index as changed, called after each ingestion or deletion run"""
+        version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        self.backend.put(
+            get_index_version_key(index_name),
+            json.dumps({"index_name": index_name, "version": version}).encode("utf-8"),
+        )
+        return version
+
+    def get_index_version(self, index_name: str) -> Optional[str]:
+        """Version of the index, None if it has never been written by the ingestion job"""
+        data = self.backend.get(get_index_version_key(index_name))
+        if data is None:
+            return None
+        return json.loads(data.decode("utf-8"))["version"]
+
+    def put_index_artifact(self, index_name: str, artifact_name: str, data: bytes) -> None:
+        """Store an artifact built from the whole index"""
+        self.backend.put(get_index_artifact_key(index_name, artifact_name), data)
+
+    def get_index_artifact(self, index_name: str, artifact_name: str) -> Optional[bytes]:
+        """Artifact of the index, None if it is not stored"""
+        return self.backend.get(get_index_artifact_key(index_name, artifact_name))
+
+    def delete_index_artifact(self, index_name: str, artifact_name: str) -> None:
+        self.backend.delete(get_index_artifact_key(index_name, artifact_name))
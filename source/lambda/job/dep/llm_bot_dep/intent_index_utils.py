@@ -0,0 +1,184 @@
+"""
+Local intent index, the example embeddings of an intention index exported
+by the ingestion job as a compact numpy artifact, searched in-process by the
+online intention detection instead of a kNN query to OpenSearch.
+
+Intention indexes hold a few hundred examples, so the artifact is searched
+exhaustively with the score function of the k-NN method of the index, giving
+the same hits and scores as the OpenSearch kNN query.
+"""
+
+import copy
+import io
+import json
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INTENT_INDEX_ARTIFACT = "_intent_index.npz"
+INTENT_INDEX_FORMAT_VERSION = 1
+# default k-NN method of the indexes created by OpenSearchVectorSearch
+DEFAULT_KNN_ENGINE = "nmslib"
+DEFAULT_KNN_SPACE_TYPE = "l2"
+SUPPORTED_SPACE_TYPES = ("l2", "cosinesimil", "innerproduct")
+# the online kNN queries never return the vectors
+SOURCE_EXCLUDES = ["*.additional_vecs"]
+
+
+def get_knn_method(mapping: dict, vector_field: str = "vector_field") -> Tuple[str, str]:
+    """(engine, space_type) of the vector field in the response of indices.get_mapping"""
+    for index_mapping in mapping.values():
+        properties = index_mapping.get("mappings", {}).get("properties", {})
+        method = properties.get(vector_field, {}).get("method", {})
+        if method:
+            return (
+                method.get("engine", DEFAULT_KNN_ENGINE),
+                method.get("space_type", DEFAULT_KNN_SPACE_TYPE),
+            )
+    return DEFAULT_KNN_ENGINE, DEFAULT_KNN_SPACE_TYPE
+
+
+def build_export_query(max_examples: int) -> dict:
+    """Search body returning all the examples of the index with their vectors"""
+    return {
+        "size": max_examples + 1,
+        "query": {"match_all": {}},
+        "sort": ["_doc"],
+        "_source": {"excludes": SOURCE_EXCLUDES},
+    }
+
+
+def knn_scores(embeddings: np.ndarray, query_vector: np.ndarray, engine: str, space_type: str) -> np.ndarray:
+    """Scores of OpenSearch k-NN, computed in float32 as the k-NN engines do
+
+    Args:
+        embeddings (np.ndarray): (n, dim) float32 example embeddings
+        query_vector (np.ndarray): (dim,) float32 query embedding
+        engine (str): nmslib, faiss or lucene
+        space_type (str): l2, cosinesimil or innerproduct
+
+    Returns:
+        np.ndarray: (n,) float32 scores
+    """
+    one = np.float32(1)
+    if space_type == "l2":
+        distances = np.sum(np.square(embeddings - query_vector), axis=-1, dtype=np.float32)
+        return one / (one + distances)
+    if space_type == "cosinesimil":
+        norms = np.linalg.norm(embeddings, axis=-1) * np.linalg.norm(query_vector)
+        cosine = (embeddings @ query_vector) / np.where(norms == 0, one, norms).astype(np.float32)
+        if engine == "lucene":
+            return (one + cosine) / np.float32(2)
+        return one / (one + (one - cosine))
+    if space_type == "innerproduct":
+        distances = -(embeddings @ query_vector)
+        return np.where(distances >= 0, one / (one + distances), one - distances).astype(np.float32)
+    raise ValueError(f"unsupported space type: {space_type}")
+
+
+class LocalIntentIndex:
+    """Example embeddings of an intention index and the `_source` of their documents"""
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        sources: List[dict],
+        ids: List[str],
+        engine: str = DEFAULT_KNN_ENGINE,
+        space_type: str = DEFAULT_KNN_SPACE_TYPE,
+    ):
+        if space_type not in SUPPORTED_SPACE_TYPES:
+            raise ValueError(f"unsupported space type: {space_type}")
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.embeddings = embeddings.reshape(len(sources), -1) if sources else embeddings.reshape(0, 0)
+        self.sources = sources
+        self.ids = ids
+        self.engine = engine
+        self.space_type = space_type
+
+    def __len__(self):
+        return len(self.sources)
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    @classmethod
+    def from_search_response(
+        cls,
+        response: dict,
+        vector_field: str = "vector_field",
+        engine: str = DEFAULT_KNN_ENGINE,
+        space_type: str = DEFAULT_KNN_SPACE_TYPE,
+    ):
+        """Build from the response of the search built by `build_export_query`"""
+        embeddings, sources, ids = [], [], []
+        for hit in response["hits"]["hits"]:
+            source = dict(hit["_source"])
+            vector = source.pop(vector_field, None)
+            if vector is None:
+                continue
+            embeddings.append(vector)
+            sources.append(source)
+            ids.append(hit["_id"])
+        return cls(np.asarray(embeddings, dtype=np.float32), sources, ids, engine, space_type)
+
+    def to_bytes(self) -> bytes:
+        meta = {
+            "version": INTENT_INDEX_FORMAT_VERSION,
+            "engine": self.engine,
+            "space_type": self.space_type,
+            "ids": self.ids,
+            "sources": self.sources,
+        }
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            embeddings=self.embeddings,
+            meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        with np.load(io.BytesIO(data), allow_pickle=False) as artifact:
+            embeddings = artifact["embeddings"]
+            meta = json.loads(artifact["meta"].tobytes().decode("utf-8"))
+        if meta.get("version") != INTENT_INDEX_FORMAT_VERSION:
+            raise ValueError(f"unsupported intent index version: {meta.get('version')}")
+        return cls(embeddings, meta["sources"], meta["ids"], meta["engine"], meta["space_type"])
+
+    def search(self, query_vector, size: int = 10, index_name: Optional[str] = None) -> dict:
+        """Exhaustive kNN search, the response has the shape of an OpenSearch search response
+
+        Args:
+            query_vector: query embedding
+            size (int): number of hits
+            index_name (str): `_index` of the hits
+
+        Returns:
+            dict: {"hits": {"hits": [{"_id", "_score", "_source"}, ...]}}
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        if len(self) and query_vector.shape[0] != self.dim:
+            raise ValueError(
+                f"query dimension {query_vector.shape[0]} does not match the intent index dimension {self.dim}"
+            )
+        hits = []
+        if len(self) and size > 0:
+            scores = knn_scores(self.embeddings, query_vector, self.engine, self.space_type)
+            # stable, ties keep the ingestion order
+            top = np.argsort(-scores, kind="stable")[:size]
+            hits = [
+                {
+                    "_index": index_name,
+                    "_id": self.ids[i],
+                    "_score": float(scores[i]),
+                    "_source": copy.deepcopy(self.sources[i]),
+                }
+                for i in top
+            ]
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
@@ -9,6 +9,8 @@ from langchain.llms.utils import enforce_stop_tokens
 from typing import Dict, List, Optional, Any,Iterator
 from langchain_core.outputs import GenerationChunk
 import boto3
+import functools
+from botocore.config import Config
 from langchain_core.pydantic_v1 import Extra, root_validator
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import (
@@ -364,8 +366,20 @@ class SagemakerEndpointChat(BaseChatModel):
         return text
         
 
-def SagemakerEndpointVectorOrCross(prompt: str, endpoint_name: str, region_name: str, model_type: str, stop: List[str], target_model=None, **kwargs) -> SagemakerEndpoint:
+@functools.lru_cache(maxsize=None)
+def get_sagemaker_runtime_client(region_name=None):
+    """sagemaker runtime client shared by all the endpoint calls of the process"""
+    return boto3.client(
+        "sagemaker-runtime",
+        region_name=region_name,
+        config=Config(max_pool_connections=50, tcp_keepalive=True)
+    )
+
+
+def SagemakerEndpointVectorOrCross(prompt: str, endpoint_name: str, region_name: str, model_type: str, stop: List[str], target_model=None, client=None, **kwargs) -> SagemakerEndpoint:
     """
+    client: sagemaker runtime client, defaults to the client shared by the process
+
     original class invocation:
         response = self.client.invoke_endpoint(
             EndpointName=self.endpoint_name,
@@ -379,10 +393,8 @@ def SagemakerEndpointVectorOrCross(prompt: str, endpoint_name: str, region_name:
         endpoint_kwargs={"TargetModel":target_model}
     else:
         endpoint_kwargs=None
-    client = boto3.client(
-            "sagemaker-runtime",
-            region_name=region_name
-        )
+    if client is None:
+        client = get_sagemaker_runtime_client(region_name)
     if model_type == "vector" or model_type == "bce":
         content_handler = vectorContentHandler()
         embeddings = SagemakerEndpointEmbeddings(
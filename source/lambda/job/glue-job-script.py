@@ -86,6 +86,13 @@ except Exception as e:
 
 from llm_bot_dep import sm_utils
 from llm_bot_dep.constant import SplittingType
+from llm_bot_dep.doc_store_utils import DocStore, S3DocStoreBackend
+from llm_bot_dep.intent_index_utils import (
+    INTENT_INDEX_ARTIFACT,
+    LocalIntentIndex,
+    build_export_query,
+    get_knn_method,
+)
 from llm_bot_dep.loaders.auto import cb_process_object
 from llm_bot_dep.storage_utils import save_content_to_s3
 
@@ -129,6 +136,11 @@ etl_object_table = dynamodb.Table(etl_object_table_name)
 
 ENHANCE_CHUNK_SIZE = 25000
 OBJECT_EXPIRY_TIME = 3600
+# whole documents read by the online retrievers, see llm_bot_dep.doc_store_utils
+DOC_STORE_PREFIX = "doc-store"
+doc_store = DocStore(S3DocStoreBackend(s3_client, res_bucket, DOC_STORE_PREFIX))
+# intention indexes up to this size are exported for the in-process intent search
+INTENT_INDEX_MAX_EXAMPLES = int(os.environ.get("INTENT_INDEX_MAX_EXAMPLES", 5000))
 
 credentials = boto3.Session().get_credentials()
 awsauth = AWS4Auth(refreshable_credentials=credentials, region=region, service="es")
@@ -508,10 +520,58 @@ class OpenSearchDeleteWorker:
             return
 
 
+def save_doc_to_store(file_path: str, chunks: list):
+    try:
+        chunk_num = doc_store.put_doc(aos_index_name, file_path, chunks)
+        logger.info("Saved %d chunks of %s to the document store", chunk_num, file_path)
+    except Exception as e:
+        logger.error("Error saving %s to the document store: %s", file_path, e)
+
+
+def update_index_version():
+    """invalidate the online caches built on the previous version of the index"""
+    try:
+        version = doc_store.put_index_version(aos_index_name)
+        logger.info("Index %s updated to version %s", aos_index_name, version)
+    except Exception as e:
+        logger.error("Error updating the version of index %s: %s", aos_index_name, e)
+
+
+def export_intent_index(docsearch: OpenSearchVectorSearch):
+    """Export the example embeddings of the intention index, read by the online
+    intention detection instead of a kNN query, see llm_bot_dep.intent_index_utils"""
+    try:
+        engine, space_type = get_knn_method(
+            docsearch.client.indices.get_mapping(index=aos_index_name)
+        )
+        response = docsearch.client.search(
+            index=aos_index_name, body=build_export_query(INTENT_INDEX_MAX_EXAMPLES)
+        )
+        if len(response["hits"]["hits"]) > INTENT_INDEX_MAX_EXAMPLES:
+            # too large to search in-process, the online side queries the index
+            logger.info("Index %s has more than %d examples, not exported", aos_index_name, INTENT_INDEX_MAX_EXAMPLES)
+            doc_store.delete_index_artifact(aos_index_name, INTENT_INDEX_ARTIFACT)
+            return
+        intent_index = LocalIntentIndex.from_search_response(
+            response, engine=engine, space_type=space_type
+        )
+        doc_store.put_index_artifact(aos_index_name, INTENT_INDEX_ARTIFACT, intent_index.to_bytes())
+        logger.info("Exported %d examples of index %s", len(intent_index), aos_index_name)
+    except Exception as e:
+        logger.error("Error exporting the intent index %s: %s", aos_index_name, e)
+        try:
+            # a stale artifact would hide the changes of this run
+            doc_store.delete_index_artifact(aos_index_name, INTENT_INDEX_ARTIFACT)
+        except Exception as delete_error:
+            logger.error("Error deleting the intent index %s: %s", aos_index_name, delete_error)
+
+
 def ingestion_pipeline(
     s3_files_iterator, batch_chunk_processor, ingestion_worker, extract_only=False
 ):
     for file_type, file_content, kwargs in s3_files_iterator:
+        # (chunk_id, content_type, text) of the ingested chunks, keyed by file path
+        doc_chunks = {}
         input_body = {
             "s3Path": f"s3://{kwargs['bucket']}/{kwargs['key']}",
             "s3Bucket": kwargs["bucket"],
@@ -548,9 +608,22 @@ def ingestion_pipeline(
                     save_content_to_s3(
                         s3_client, document, res_bucket, SplittingType.CHUNK.value
                     )
+                    doc_chunks.setdefault(
+                        document.metadata.get("file_path", ""), []
+                    ).append(
+                        (
+                            document.metadata.get("chunk_id", ""),
+                            document.metadata.get("content_type", ""),
+                            document.page_content,
+                        )
+                    )
 
                 if not extract_only:
                     ingestion_worker.aos_ingestion(batch)
+
+            if not extract_only:
+                for file_path, chunks in doc_chunks.items():
+                    save_doc_to_store(file_path, chunks)
         except Exception as e:
             logger.error(
                 "Error processing object %s: %s",
@@ -570,6 +643,9 @@ def ingestion_pipeline(
         finally:
             etl_object_table.put_item(Item=input_body)
 
+    if not extract_only:
+        update_index_version()
+
 
 def delete_pipeline(s3_files_iterator, document_generator, delete_worker):
     for _, _, kwargs in s3_files_iterator:
@@ -581,6 +657,7 @@ def delete_pipeline(s3_files_iterator, document_generator, delete_worker):
                 if len(batch) == 0:
                     continue
                 delete_worker.aos_deletion(batch)
+            doc_store.delete_doc(delete_worker.index_name, s3_path)
 
         except Exception as e:
             logger.error(
@@ -590,6 +667,8 @@ def delete_pipeline(s3_files_iterator, document_generator, delete_worker):
             )
             traceback.print_exc()
 
+    update_index_version()
+
 
 def create_processors_and_workers(
     operation_type, docsearch, embedding_model_endpoint, file_processor
@@ -697,6 +776,9 @@ def main():
             "Invalid operation type. Valid types: create, delete, update, extract_only"
         )
 
+    if index_type == "intention" and operation_type != "extract_only":
+        export_intent_index(docsearch)
+
 
 if __name__ == "__main__":
     logger.info("boto3 version: %s", boto3.__version__)
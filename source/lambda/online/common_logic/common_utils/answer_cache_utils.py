@@ -0,0 +1,266 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from .aws_client_utils import get_client
+from .cache_utils import LRUTTLCache, stable_hash
+
+logger = logging.getLogger("answer_cache_utils")
+
+enable_answer_cache = os.environ.get("ENABLE_ANSWER_CACHE", "false").lower() in ("true", "1", "t")
+answer_cache_maxsize = int(os.environ.get("ANSWER_CACHE_MAXSIZE", 1024))
+answer_cache_ttl = float(os.environ.get("ANSWER_CACHE_TTL", 3600))
+# cosine similarity of the query embeddings for a semantic hit
+answer_cache_similarity_threshold = float(os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.97))
+# seconds before the index versions written by the ingestion job are read again
+index_version_ttl = float(os.environ.get("ANSWER_CACHE_INDEX_VERSION_TTL", 60))
+
+# per request fields of the chatbot config, not part of the cache scope
+SCOPE_EXCLUDED_CONFIG_KEYS = ("user_id", "enable_trace")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def collect_index_names(config) -> List[str]:
+    """index names of all the retrievers in the chatbot config"""
+    index_names = set()
+    if isinstance(config, dict):
+        for key, value in config.items():
+            if key == "index_name" and isinstance(value, str):
+                index_names.add(value)
+            else:
+                index_names.update(collect_index_names(value))
+    elif isinstance(config, (list, tuple)):
+        for value in config:
+            index_names.update(collect_index_names(value))
+    return sorted(index_names)
+
+
+class IndexVersionReader:
+    """
+    Reads the index versions written by the ingestion job to the document
+    store, see doc_store_utils. Without a document store every index has
+    version None, AnswerCache.is_enabled turns the cache off in that case.
+    """
+
+    def __init__(self, doc_store=None, ttl: float = index_version_ttl):
+        self._doc_store = doc_store
+        self._doc_store_loaded = doc_store is not None
+        self.versions = LRUTTLCache(maxsize=256, ttl=ttl)
+
+    def get_doc_store(self):
+        if not self._doc_store_loaded:
+            from doc_store_utils import DocStore
+            self._doc_store = DocStore.from_environ(get_client("s3"))
+            self._doc_store_loaded = True
+        return self._doc_store
+
+    def get_version(self, index_name: str) -> Optional[str]:
+        version = self.versions.get(index_name)
+        if version is not None:
+            return version[0]
+        doc_store = self.get_doc_store()
+        value = None
+        if doc_store is not None:
+            try:
+                value = doc_store.get_index_version(index_name)
+            except Exception as e:
+                logger.error(f"get version of index {index_name} failed: {e}")
+        self.versions.set(index_name, (value,))
+        return value
+
+    def get_versions(self, index_names: List[str]) -> dict:
+        return {index_name: self.get_version(index_name) for index_name in index_names}
+
+
+class AnswerCache:
+    """
+    Answers of whole turns, scoped per chatbot config and index versions.
+    A lookup first checks the normalized query, then the most similar cached
+    query embedding of the scope above the similarity threshold.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = answer_cache_maxsize,
+        ttl: float = answer_cache_ttl,
+        similarity_threshold: float = answer_cache_similarity_threshold,
+        index_version_reader: IndexVersionReader = None,
+    ):
+        self.entries = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self.maxsize = maxsize
+        self.similarity_threshold = similarity_threshold
+        self.index_version_reader = index_version_reader or IndexVersionReader()
+        # (scope, normalized query) -> (unit query embedding, expire_at), bounded
+        # like the entries so that stale scopes do not keep their vectors
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        self._enabled = None
+
+    def is_enabled(self) -> bool:
+        """the cache is off without a document store, re-ingested indexes would keep serving stale answers"""
+        if self._enabled is None:
+            self._enabled = self.index_version_reader.get_doc_store() is not None
+            if not self._enabled:
+                logger.error(
+                    "ENABLE_ANSWER_CACHE is on but no document store is configured, "
+                    "set DOC_STORE_BUCKET to enable the answer cache"
+                )
+        return self._enabled
+
+    def get_scope(self, chatbot_config: dict) -> str:
+        """cache scope of the chatbot config, changes when one of its indexes is re-ingested"""
+        config = {
+            k: v for k, v in chatbot_config.items() if k not in SCOPE_EXCLUDED_CONFIG_KEYS
+        }
+        index_versions = self.index_version_reader.get_versions(collect_index_names(chatbot_config))
+        return stable_hash(config, index_versions)
+
+    @staticmethod
+    def _to_unit_vector(embedding):
+        if isinstance(embedding, dict):
+            embedding = embedding.get("dense_vecs", embedding.get("embedding"))
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        if vector.size == 0 or norm == 0:
+            return None
+        return vector / norm
+
+    def _search_similar(self, scope: str, vector):
+        now = time.monotonic()
+        queries, vectors = [], []
+        with self._lock:
+            for key, (query_vector, expire_at) in list(self._embeddings.items()):
+                if expire_at is not None and expire_at <= now:
+                    del self._embeddings[key]
+                elif key[0] == scope:
+                    queries.append(key[1])
+                    vectors.append(query_vector)
+        if not vectors:
+            return None, 0.0
+        matrix = np.stack(vectors)
+        if matrix.shape[1] != vector.shape[0]:
+            return None, 0.0
+        similarities = matrix @ vector
+        best = int(np.argmax(similarities))
+        return queries[best], float(similarities[best])
+
+    def get(self, scope: str, query: str, embedding_fn: Optional[Callable[[str], list]] = None):
+        """
+        Look up a cached answer
+
+        :param scope: see `get_scope`
+        :param query: user query
+        :param embedding_fn: embeds the query, None disables the semantic lookup
+
+        :return: (entry, hit info), entry is None on a miss
+        """
+        normalized_query = normalize_query(query)
+        entry = self.entries.get((scope, normalized_query))
+        if entry is not None:
+            self.stats["exact_hits"] += 1
+            return entry, {"hit_type": "exact", "similarity": 1.0}
+
+        if embedding_fn is not None:
+            vector = self._embed(embedding_fn, query)
+            if vector is not None:
+                similar_query, similarity = self._search_similar(scope, vector)
+                if similar_query is not None and similarity >= self.similarity_threshold:
+                    entry = self.entries.get((scope, similar_query))
+                    if entry is not None:
+                        self.stats["semantic_hits"] += 1
+                        return entry, {
+                            "hit_type": "semantic",
+                            "similarity": round(similarity, 4),
+                            "cached_query": similar_query,
+                        }
+                    self._forget(scope, similar_query)
+        self.stats["misses"] += 1
+        return None, {"hit_type": "miss"}
+
+    def set(self, scope: str, query: str, entry: dict, embedding_fn: Optional[Callable[[str], list]] = None):
+        """
+        Cache the answer of a turn
+
+        :param entry: answer, extra_response, ddb_additional_kwargs and latency of the turn
+        """
+        normalized_query = normalize_query(query)
+        self.entries.set((scope, normalized_query), entry)
+        self.stats["sets"] += 1
+        if embedding_fn is None:
+            return
+        vector = self._embed(embedding_fn, query)
+        if vector is None:
+            return
+        key = (scope, normalized_query)
+        expire_at = None if self.entries.ttl is None else time.monotonic() + self.entries.ttl
+        with self._lock:
+            self._embeddings[key] = (vector, expire_at)
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.maxsize:
+                self._embeddings.popitem(last=False)
+
+    def record_saving(self, saved_seconds: float):
+        with self._lock:
+            self.stats["saved_ms"] += int(saved_seconds * 1000)
+
+    def _embed(self, embedding_fn, query):
+        try:
+            return self._to_unit_vector(embedding_fn(query))
+        except Exception as e:
+            logger.error(f"answer cache query embedding failed: {e}")
+            return None
+
+    def _forget(self, scope, normalized_query):
+        with self._lock:
+            self._embeddings.pop((scope, normalized_query), None)
+
+    def clear(self):
+        self.entries.clear()
+        with self._lock:
+            self._embeddings.clear()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["embeddings"] = len(self._embeddings)
+        lookups = stats.get("exact_hits", 0) + stats.get("semantic_hits", 0) + stats.get("misses", 0)
+        hits = stats.get("exact_hits", 0) + stats.get("semantic_hits", 0)
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+    def reset_stats(self):
+        self.stats.clear()
+
+
+answer_cache = AnswerCache()
+
+
+def get_answer_cache_stats():
+    return answer_cache.get_stats()
+
+
+class AnswerRecorder:
+    """Records a streamed answer, `completed` is set once it is fully consumed"""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.chunks = []
+        self.completed = False
+
+    def __iter__(self):
+        for chunk in self.answer:
+            self.chunks.append(chunk)
+            yield chunk
+        self.completed = True
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+from collections import Counter
+
+import boto3
+import requests
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+
+from .cache_utils import stable_hash
+
+logger = logging.getLogger("aws_client_utils")
+
+aws_client_max_pool_connections = int(os.environ.get("AWS_CLIENT_MAX_POOL_CONNECTIONS", 50))
+aws_client_connect_timeout = float(os.environ.get("AWS_CLIENT_CONNECT_TIMEOUT", 10))
+aws_client_read_timeout = float(os.environ.get("AWS_CLIENT_READ_TIMEOUT", 300))
+http_session_pool_maxsize = int(os.environ.get("HTTP_SESSION_POOL_MAXSIZE", 20))
+
+default_client_config = Config(
+    max_pool_connections=aws_client_max_pool_connections,
+    tcp_keepalive=True,
+    connect_timeout=aws_client_connect_timeout,
+    read_timeout=aws_client_read_timeout,
+    retries={"max_attempts": 3, "mode": "standard"},
+)
+
+
+class AWSClientRegistry:
+    """
+    Process wide registry of boto3 clients and http sessions.
+    Clients are created lazily on first use and reused across invocations of
+    a warm container, keyed by service, region, credentials and client config.
+    """
+
+    def __init__(self, default_config: Config = default_client_config) -> None:
+        self.default_config = default_config
+        self._clients = {}
+        self._sessions = {}
+        self._http_sessions = {}
+        self._lock = threading.Lock()
+        self.construction_counts = Counter()
+        self.hit_counts = Counter()
+
+    @staticmethod
+    def _get_config_key(config: Config):
+        if config is None:
+            return None
+        return stable_hash(vars(config))
+
+    def get_session(self, credentials_profile_name: str = None, region_name: str = None):
+        session_key = (credentials_profile_name, region_name)
+        session = self._sessions.get(session_key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(session_key)
+                if session is None:
+                    session = boto3.Session(
+                        profile_name=credentials_profile_name,
+                        region_name=region_name
+                    )
+                    self._sessions[session_key] = session
+                    self.construction_counts["session"] += 1
+        return session
+
+    def get_client(
+        self,
+        service_name: str,
+        region_name: str = None,
+        credentials_profile_name: str = None,
+        config: Config = None,
+        **client_kwargs
+    ):
+        """Get a shared boto3 client, created on first use
+
+        Args:
+            service_name (str): aws service name, e.g. `sagemaker-runtime`
+            region_name (str, optional): defaults to the session region
+            credentials_profile_name (str, optional): credentials profile, defaults to the default credentials
+            config (Config, optional): merged into the default client config
+            client_kwargs: other boto3 client kwargs, e.g. `endpoint_url`
+
+        Returns:
+            boto3 client
+        """
+        client_key = (
+            service_name,
+            region_name,
+            credentials_profile_name,
+            self._get_config_key(config),
+            stable_hash(client_kwargs)
+        )
+        client = self._clients.get(client_key)
+        if client is not None:
+            self.hit_counts[service_name] += 1
+            return client
+
+        session = self.get_session(credentials_profile_name, region_name)
+        with self._lock:
+            client = self._clients.get(client_key)
+            if client is None:
+                client_config = self.default_config
+                if config is not None:
+                    client_config = client_config.merge(config)
+                client = session.client(
+                    service_name,
+                    region_name=region_name,
+                    config=client_config,
+                    **client_kwargs
+                )
+                self._clients[client_key] = client
+                self.construction_counts[service_name] += 1
+                logger.info(f"aws client created, service: {service_name}, region: {region_name}")
+            else:
+                self.hit_counts[service_name] += 1
+        return client
+
+    def get_http_session(self, name: str = "default"):
+        """Get a shared requests session with a keep-alive connection pool"""
+        http_session = self._http_sessions.get(name)
+        if http_session is None:
+            with self._lock:
+                http_session = self._http_sessions.get(name)
+                if http_session is None:
+                    http_session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=http_session_pool_maxsize,
+                        pool_maxsize=http_session_pool_maxsize
+                    )
+                    http_session.mount("https://", adapter)
+                    http_session.mount("http://", adapter)
+                    self._http_sessions[name] = http_session
+                    self.construction_counts["http_session"] += 1
+        return http_session
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._sessions.clear()
+            for http_session in self._http_sessions.values():
+                http_session.close()
+            self._http_sessions.clear()
+
+    def get_stats(self):
+        return {
+            "clients": len(self._clients),
+            "construction_counts": dict(self.construction_counts),
+            "hit_counts": dict(self.hit_counts),
+        }
+
+    def reset_stats(self):
+        self.construction_counts.clear()
+        self.hit_counts.clear()
+
+
+aws_client_registry = AWSClientRegistry()
+get_client = aws_client_registry.get_client
+get_http_session = aws_client_registry.get_http_session
+get_aws_client_stats = aws_client_registry.get_stats
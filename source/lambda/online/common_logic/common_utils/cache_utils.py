@@ -0,0 +1,172 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+_MISSING = object()
+
+
+def stable_hash(*parts) -> str:
+    """Build a stable md5 hash from json-serializable parts
+
+    Args:
+        parts: values which make up the cache key
+
+    Returns:
+        str: hex digest
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+class LRUTTLCache:
+    """
+    Thread safe in-process cache with LRU eviction and per entry expiration.
+    `ttl=None` means entries never expire.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        assert maxsize > 0, maxsize
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expire_at = item
+            if expire_at is not None and expire_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class SharedCacheBackendBase:
+    """
+    Interface of the optional shared cache tier, e.g. ElastiCache or DynamoDB.
+    Values passed in are json-serializable.
+    """
+
+    def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+
+class TieredCache:
+    """
+    Two tier cache: an in-process LRUTTLCache in front of an optional
+    shared backend. Shared tier hits are promoted to the local tier and
+    errors raised by the shared tier are counted and swallowed.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        shared_backend: Optional[SharedCacheBackendBase] = None,
+    ):
+        self.local = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self.shared_backend = shared_backend
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+
+    def set_shared_backend(self, shared_backend: Optional[SharedCacheBackendBase]):
+        self.shared_backend = shared_backend
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.shared_backend is None:
+            return default
+        try:
+            value = self.shared_backend.get(key)
+        except Exception:
+            self.shared_errors += 1
+            return default
+        if value is None:
+            self.shared_misses += 1
+            return default
+        self.shared_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.local.set(key, value, ttl=ttl)
+        if self.shared_backend is None:
+            return
+        try:
+            self.shared_backend.set(key, value, ttl=ttl or self.local.ttl)
+        except Exception:
+            self.shared_errors += 1
+
+    def clear(self) -> None:
+        self.local.clear()
+
+    def get_stats(self) -> dict:
+        stats = self.local.get_stats()
+        stats.update(
+            {
+                "shared_hits": self.shared_hits,
+                "shared_misses": self.shared_misses,
+                "shared_errors": self.shared_errors,
+            }
+        )
+        return stats
+
+    def reset_stats(self) -> None:
+        self.local.reset_stats()
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
@@ -1,11 +1,32 @@
+import copy
 import logging
+import time
 from datetime import datetime
 from typing import List
 import os
 import boto3
 
+from .cache_utils import LRUTTLCache, stable_hash
 from .chatbot import Chatbot
 
+logger = logging.getLogger("chatbot_utils")
+
+enable_chatbot_cache = os.environ.get("ENABLE_CHATBOT_CACHE", "true").lower() in ("true", "1", "t")
+# after revalidate_ttl seconds, the chatbot item is read again and the cached
+# index/model records are kept if its version is unchanged
+chatbot_cache_revalidate_ttl = float(os.environ.get("CHATBOT_CACHE_REVALIDATE_TTL", 60))
+# after max_age seconds, the whole chatbot config is resolved again
+chatbot_cache_max_age = float(os.environ.get("CHATBOT_CACHE_MAX_AGE", 600))
+# max keys of one BatchGetItem request
+BATCH_GET_MAX_KEYS = 100
+
+chatbot_cache = LRUTTLCache(maxsize=256, ttl=chatbot_cache_max_age)
+
+
+def get_chatbot_version(chatbot_content: dict):
+    """version stamp of a chatbot item, changes whenever the item is updated"""
+    return stable_hash(chatbot_content)
+
 
 class ChatbotManager:
     def __init__(self, chatbot_table, index_table, model_table):
@@ -23,38 +44,188 @@ class ChatbotManager:
         model_table = dynamodb.Table(model_table_name)
         index_table = dynamodb.Table(index_table_name)
         chatbot_manager = cls(chatbot_table, index_table, model_table)
-        return chatbot_manager 
+        return chatbot_manager
 
-    def get_chatbot(self, group_name: str, chatbot_id: str):
-        """Get chatbot from chatbot id and add index, model, etc. data
+    def _get_cache_key(self, group_name: str, chatbot_id: str):
+        return (
+            self.chatbot_table.name,
+            self.index_table.name,
+            self.model_table.name,
+            group_name,
+            chatbot_id
+        )
+
+    def _batch_get_items(self, table, keys: List[dict]):
+        """BatchGetItem of the unique keys, retrying the unprocessed keys
+
+        Args:
+            table: DynamoDB table
+            keys (List[dict]): item keys
+
+        Returns:
+            list: items found
+        """
+        unique_keys = list({stable_hash(key): key for key in keys}.values())
+        items = []
+        for i in range(0, len(unique_keys), BATCH_GET_MAX_KEYS):
+            request_items = {table.name: {"Keys": unique_keys[i:i + BATCH_GET_MAX_KEYS]}}
+            retry_num = 0
+            while request_items:
+                response = table.meta.client.batch_get_item(RequestItems=request_items)
+                items.extend(response.get("Responses", {}).get(table.name, []))
+                request_items = response.get("UnprocessedKeys")
+                if request_items:
+                    retry_num += 1
+                    time.sleep(min(0.05 * 2 ** retry_num, 1))
+        return items
+
+    def resolve_chatbot_content(self, group_name: str, chatbot_content: dict):
+        """Replace the index ids of a chatbot item with the index records
+        and their embedding model records, one BatchGetItem per table
 
         Args:
             group_name (str): group name
-            chatbot_id (str): chatbot id
+            chatbot_content (dict): chatbot item
 
         Returns:
-            Chatbot instance
+            dict: resolved chatbot item
         """
-        chatbot_response = self.chatbot_table.get_item(
-            Key={"groupName": group_name, "chatbotId": chatbot_id}
+        index_ids = [
+            index_id
+            for index_item in chatbot_content.get("indexIds").values()
+            for index_id in index_item.get("value").values()
+        ]
+        index_items = self._batch_get_items(
+            self.index_table,
+            [{"groupName": group_name, "indexId": index_id} for index_id in index_ids]
         )
-        chatbot_content = chatbot_response.get("Item")
-        if not chatbot_content:
-            return Chatbot.from_dynamodb_item({})
+        index_contents = {item["indexId"]: item for item in index_items}
+
+        model_ids = [
+            item.get("modelIds").get("embedding") for item in index_items
+            if item.get("modelIds").get("embedding")
+        ]
+        model_items = self._batch_get_items(
+            self.model_table,
+            [{"groupName": group_name, "modelId": model_id} for model_id in model_ids]
+        )
+        model_contents = {item["modelId"]: item for item in model_items}
+
         for index_type, index_item in chatbot_content.get("indexIds").items():
             for tag, index_id in index_item.get("value").items():
-                index_content = self.index_table.get_item(
-                    Key={"groupName": group_name, "indexId": index_id}
-                ).get("Item")
+                index_content = copy.deepcopy(index_contents.get(index_id))
                 embedding_model_id = index_content.get("modelIds").get("embedding")
                 if embedding_model_id:
-                    model_content = self.model_table.get_item(
-                        Key={"groupName": group_name, "modelId": embedding_model_id}
-                    ).get("Item")
-                    index_content["modelIds"]["embedding"] = model_content
+                    index_content["modelIds"]["embedding"] = copy.deepcopy(
+                        model_contents.get(embedding_model_id)
+                    )
                 chatbot_content["indexIds"][index_type]["value"][tag] = index_content
+        return chatbot_content
 
-        chatbot = Chatbot.from_dynamodb_item(chatbot_content)
+    def _load_chatbot_entry(self, group_name: str, chatbot_id: str):
+        """Get the resolved chatbot item, the version of the chatbot item and
+        the version of the resolved content, using the cached resolved
+        content if the version of the chatbot item is unchanged"""
+        cache_key = self._get_cache_key(group_name, chatbot_id)
+        cached = chatbot_cache.get(cache_key) if enable_chatbot_cache else None
+        if cached is not None and time.monotonic() - cached["validated_at"] < chatbot_cache_revalidate_ttl:
+            return cached
+
+        chatbot_response = self.chatbot_table.get_item(
+            Key={"groupName": group_name, "chatbotId": chatbot_id}
+        )
+        chatbot_content = chatbot_response.get("Item")
+        if not chatbot_content:
+            chatbot_cache.delete(cache_key)
+            return {"chatbot_content": {}, "version": None, "resolved_version": None}
+        version = get_chatbot_version(chatbot_content)
+        if cached is not None and cached["version"] == version:
+            cached["validated_at"] = time.monotonic()
+            return cached
+
+        chatbot_content = self.resolve_chatbot_content(group_name, chatbot_content)
+        entry = {
+            "chatbot_content": chatbot_content,
+            "version": version,
+            # changes with the index and model records as well
+            "resolved_version": stable_hash(chatbot_content),
+            "validated_at": time.monotonic(),
+        }
+        if enable_chatbot_cache:
+            chatbot_cache.set(cache_key, entry)
+        return entry
+
+    def get_chatbot_version(self, group_name: str, chatbot_id: str):
+        """Version stamp of the resolved chatbot, the chatbot item with its
+        index and model records, None if the chatbot does not exist. Updates
+        of the chatbot item change it after `chatbot_cache_revalidate_ttl`,
+        updates of the index and model records after `chatbot_cache_max_age`
+        """
+        return self._load_chatbot_entry(group_name, chatbot_id)["resolved_version"]
+
+    def get_chatbot(self, group_name: str, chatbot_id: str):
+        """Get chatbot from chatbot id and add index, model, etc. data
+
+        Args:
+            group_name (str): group name
+            chatbot_id (str): chatbot id
+
+        Returns:
+            Chatbot instance
+        """
+        chatbot_content = self._load_chatbot_entry(group_name, chatbot_id)["chatbot_content"]
+        chatbot = Chatbot.from_dynamodb_item(copy.deepcopy(chatbot_content))
 
         return chatbot
 
+    def invalidate(self, group_name: str = None, chatbot_id: str = None):
+        """Drop a cached chatbot, or all cached chatbots if no chatbot id is given"""
+        if chatbot_id is None:
+            chatbot_cache.clear()
+            return
+        chatbot_cache.delete(self._get_cache_key(group_name, chatbot_id))
+
+    def warm_up(self, chatbot_keys: List[tuple]):
+        """Resolve and cache chatbots ahead of the first request, e.g. at Lambda init
+
+        Args:
+            chatbot_keys (List[tuple]): (group_name, chatbot_id) pairs
+        """
+        for group_name, chatbot_id in chatbot_keys:
+            try:
+                self._load_chatbot_entry(group_name, chatbot_id)
+            except Exception as e:
+                logger.warning(f"Fail to warm up chatbot {group_name}/{chatbot_id}: {e}")
+
+
+_environ_chatbot_manager = None
+
+
+def get_environ_chatbot_manager():
+    """ChatbotManager from the environment, created once per container"""
+    global _environ_chatbot_manager
+    if _environ_chatbot_manager is None:
+        _environ_chatbot_manager = ChatbotManager.from_environ()
+    return _environ_chatbot_manager
+
+
+def get_chatbot_cache_stats():
+    return chatbot_cache.get_stats()
+
+
+def warm_up_chatbot_cache(chatbot_keys: List[tuple] = None):
+    """Warm up the chatbot cache with tables from the environment
+
+    Args:
+        chatbot_keys (List[tuple], optional): (group_name, chatbot_id) pairs,
+            defaults to WARM_UP_CHATBOTS, e.g. `Admin/admin,Admin/retail`
+    """
+    if chatbot_keys is None:
+        chatbot_keys = [
+            tuple(key.strip().split("/", 1))
+            for key in os.environ.get("WARM_UP_CHATBOTS", "").split(",")
+            if "/" in key
+        ]
+    if not chatbot_keys or not enable_chatbot_cache:
+        return
+    get_environ_chatbot_manager().warm_up(chatbot_keys)
@@ -1,5 +1,10 @@
+import atexit
 import json
+import logging
 import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from typing import List
 
@@ -11,6 +16,29 @@ from langchain.schema.messages import BaseMessage
 from .constant import MessageType
 
 client = boto3.resource("dynamodb")
+logger = logging.getLogger("ddb_utils")
+
+# buffer the chat history writes of a turn and send them in one transaction
+enable_write_behind = os.environ.get("ENABLE_CHAT_HISTORY_WRITE_BEHIND", "false").lower() in ("true", "1", "t")
+# durable: flush synchronously once the final frame is sent,
+# otherwise flush in a background thread, drained before the main handler returns
+write_behind_durable = os.environ.get("CHAT_HISTORY_WRITE_BEHIND_DURABLE", "true").lower() in ("true", "1", "t")
+
+_write_behind_executor = ThreadPoolExecutor(max_workers=1)
+_write_behind_lock = threading.Lock()
+_pending_histories = set()
+_pending_futures = set()
+
+# newest first window of the chat history, 0 means no limit
+chat_history_max_messages = int(os.environ.get("CHAT_HISTORY_MAX_MESSAGES", 0))
+chat_history_max_tokens = int(os.environ.get("CHAT_HISTORY_MAX_TOKENS", 0))
+chat_history_page_size = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", 50))
+
+
+def estimate_token_num(text: str):
+    """rough token estimation, one token per CJK character and per 4 other characters"""
+    cjk_num = sum(1 for c in text if "\u4e00" <= c <= "\u9fff")
+    return cjk_num + math.ceil((len(text) - cjk_num) / 4)
 
 
 class DynamoDBChatMessageHistory(BaseChatMessageHistory):
@@ -21,13 +49,25 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
         session_id: str,
         user_id: str,
         client_type: str,
+        write_behind: bool = None,
+        durable: bool = None,
+        ddb_resource=None,
     ):
-        self.sessions_table = client.Table(sessions_table_name)
-        self.messages_table = client.Table(messages_table_name)
+        ddb_resource = ddb_resource or client
+        self.sessions_table = ddb_resource.Table(sessions_table_name)
+        self.messages_table = ddb_resource.Table(messages_table_name)
         self.session_id = session_id
         self.user_id = user_id
         self.client_type = client_type
         self.MESSAGE_BY_SESSION_ID_INDEX_NAME = "bySessionId"
+        # sorted by createTimestamp, used by the windowed history loading
+        self.MESSAGE_BY_SESSION_ID_TIMESTAMP_INDEX_NAME = "bySessionIdTimestamp"
+        self.write_behind = enable_write_behind if write_behind is None else write_behind
+        self.durable = write_behind_durable if durable is None else durable
+        self.pending_message_items = []
+        # None means no pending session upsert
+        self.pending_latest_question = None
+        self.pending_lock = threading.Lock()
 
     @property
     def session(self):
@@ -58,6 +98,27 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
 
         return items
 
+    @staticmethod
+    def _item_to_langchain(item):
+        assert item["role"] in [
+            MessageType.AI_MESSAGE_TYPE,
+            MessageType.HUMAN_MESSAGE_TYPE,
+        ]
+        role = item["role"]
+        additional_kwargs = json.loads(item["additional_kwargs"])
+        langchain_message_template = {
+            "role": role,
+            "content": item["content"],
+            "additional_kwargs": {
+                "message_id": item["messageId"],
+                "create_time": item["createTimestamp"],
+                "entry_type": item["entryType"],
+                "custom_message_id": item["customMessageId"],
+                **additional_kwargs,
+            },
+        }
+        return langchain_message_template
+
     @property
     def messages_as_langchain(self):
         response = {}
@@ -77,28 +138,107 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
         ret = []
 
         for item in items:
-            assert item["role"] in [
-                MessageType.AI_MESSAGE_TYPE,
-                MessageType.HUMAN_MESSAGE_TYPE,
-            ]
-            role = item["role"]
-            additional_kwargs = json.loads(item["additional_kwargs"])
-            langchain_message_template = {
-                "role": role,
-                "content": item["content"],
-                "additional_kwargs": {
-                    "message_id": item["messageId"],
-                    "create_time": item["createTimestamp"],
-                    "entry_type": item["entryType"],
-                    "custom_message_id": item["customMessageId"],
-                    **additional_kwargs,
-                },
-            }
-            ret.append(langchain_message_template)
+            ret.append(self._item_to_langchain(item))
+        return ret
+
+    def _query_recent_items(self, max_messages: int, max_tokens: int, page_size: int):
+        """read newest first, page by page, until the message or token budget is reached"""
+        projection_fields = [
+            "messageId", "role", "content", "createTimestamp",
+            "entryType", "customMessageId", "additional_kwargs"
+        ]
+        query_kwargs = {
+            "KeyConditionExpression": "sessionId = :session_id",
+            "ExpressionAttributeValues": {":session_id": self.session_id},
+            "IndexName": self.MESSAGE_BY_SESSION_ID_TIMESTAMP_INDEX_NAME,
+            "ScanIndexForward": False,
+            # attribute names like role are reserved words
+            "ProjectionExpression": ", ".join(f"#f{i}" for i in range(len(projection_fields))),
+            "ExpressionAttributeNames": {f"#f{i}": field for i, field in enumerate(projection_fields)},
+        }
+        items = []
+        token_num = 0
+        while True:
+            limit = page_size
+            if max_messages:
+                limit = min(page_size, max_messages - len(items))
+            response = self.messages_table.query(Limit=limit, **query_kwargs)
+            for item in response.get("Items", []):
+                item_token_num = estimate_token_num(item["content"])
+                if max_tokens and token_num + item_token_num > max_tokens:
+                    return items
+                items.append(item)
+                token_num += item_token_num
+                if max_messages and len(items) >= max_messages:
+                    return items
+            if "LastEvaluatedKey" not in response:
+                return items
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def get_recent_messages_as_langchain(
+        self,
+        max_messages: int = None,
+        max_tokens: int = None,
+        page_size: int = None,
+    ):
+        """
+        Windowed history loading, the read cost only depends on the window size
+        instead of the session length.
+
+        Args:
+            max_messages (int, optional): max number of messages, 0 means no limit.
+                Defaults to CHAT_HISTORY_MAX_MESSAGES.
+            max_tokens (int, optional): max estimated tokens of the message contents,
+                0 means no limit. Defaults to CHAT_HISTORY_MAX_TOKENS.
+            page_size (int, optional): Limit of each query. Defaults to CHAT_HISTORY_PAGE_SIZE.
+
+        Returns:
+            list: messages in ascending time order, starting with a user message
+        """
+        max_messages = chat_history_max_messages if max_messages is None else max_messages
+        max_tokens = chat_history_max_tokens if max_tokens is None else max_tokens
+        page_size = page_size or chat_history_page_size
+        try:
+            items = self._query_recent_items(max_messages, max_tokens, page_size)
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ValidationException":
+                logger.error(error)
+                return []
+            # the timestamp index is not deployed yet, load the whole session
+            logger.warning(f"Index {self.MESSAGE_BY_SESSION_ID_TIMESTAMP_INDEX_NAME} not available: {error}")
+            return self._truncate_langchain_messages(self.messages_as_langchain, max_messages, max_tokens)
+
+        items = items[::-1]
+        # keep user/ai pairs, drop the leading ai message cut from its question
+        while items and items[0]["role"] != MessageType.HUMAN_MESSAGE_TYPE:
+            items = items[1:]
+        return [self._item_to_langchain(item) for item in items]
+
+    @staticmethod
+    def _truncate_langchain_messages(messages: list, max_messages: int, max_tokens: int):
+        ret = []
+        token_num = 0
+        for message in messages[::-1]:
+            if max_messages and len(ret) >= max_messages:
+                break
+            message_token_num = estimate_token_num(message["content"])
+            if max_tokens and token_num + message_token_num > max_tokens:
+                break
+            ret.append(message)
+            token_num += message_token_num
+        ret = ret[::-1]
+        while ret and ret[0]["role"] != MessageType.HUMAN_MESSAGE_TYPE:
+            ret = ret[1:]
         return ret
 
     def update_session(self, latest_question=""):
         """Add the session to the record in DynamoDB"""
+        if self.write_behind:
+            with self.pending_lock:
+                # keep the latest non empty question of the pending turn
+                if latest_question or self.pending_latest_question is None:
+                    self.pending_latest_question = latest_question
+            return
         session = self.session
         # If this session already exists, update lastModifiedTimestamp
         if session:
@@ -144,25 +284,114 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
         """Append the message to the record in DynamoDB"""
         current_timestamp = datetime.utcnow().isoformat() + "Z"
         additional_kwargs = additional_kwargs or {}
+        item = {
+            "messageId": message_id,
+            "sessionId": self.session_id,
+            "role": message_type,
+            "customMessageId": custom_message_id,
+            "inputMessageId": input_message_id,
+            "entryType": entry_type,
+            "content": message_content,
+            "createTimestamp": current_timestamp,
+            "lastModifiedTimestamp": current_timestamp,
+            "additional_kwargs": json.dumps(additional_kwargs),
+        }
+        if self.write_behind:
+            with self.pending_lock:
+                self.pending_message_items.append(item)
+            with _write_behind_lock:
+                _pending_histories.add(self)
+            return
 
         try:
-            self.messages_table.put_item(
-                Item={
-                    "messageId": message_id,
-                    "sessionId": self.session_id,
-                    "role": message_type,
-                    "customMessageId": custom_message_id,
-                    "inputMessageId": input_message_id,
-                    "entryType": entry_type,
-                    "content": message_content,
-                    "createTimestamp": current_timestamp,
-                    "lastModifiedTimestamp": current_timestamp,
-                    "additional_kwargs": json.dumps(additional_kwargs),
-                }
-            )
+            self.messages_table.put_item(Item=item)
         except ClientError as err:
             print(f"Error adding message: {err}")
 
+    def has_pending_writes(self):
+        return bool(self.pending_message_items) or self.pending_latest_question is not None
+
+    def _get_session_upsert_kwargs(self, latest_question):
+        """update the session if it exists, otherwise create it, without reading it first"""
+        current_timestamp = datetime.utcnow().isoformat() + "Z"
+        update_expression = (
+            "SET lastModifiedTimestamp = :t, "
+            "clientType = if_not_exists(clientType, :c), "
+            "startTime = if_not_exists(startTime, :t), "
+            "createTimestamp = if_not_exists(createTimestamp, :t)"
+        )
+        expression_attribute_values = {":t": current_timestamp, ":c": self.client_type}
+        if latest_question:
+            update_expression += ", latestQuestion = :q"
+            expression_attribute_values[":q"] = latest_question
+        else:
+            update_expression += ", latestQuestion = if_not_exists(latestQuestion, :q)"
+            expression_attribute_values[":q"] = ""
+        return {
+            "Key": {"sessionId": self.session_id, "userId": self.user_id},
+            "UpdateExpression": update_expression,
+            "ExpressionAttributeValues": expression_attribute_values,
+        }
+
+    def flush(self):
+        """
+        Send the buffered messages and the session upsert of the turn with one
+        transact_write_items call, fall back to single writes if it fails
+        """
+        with self.pending_lock:
+            message_items = self.pending_message_items
+            latest_question = self.pending_latest_question
+            self.pending_message_items = []
+            self.pending_latest_question = None
+        with _write_behind_lock:
+            _pending_histories.discard(self)
+        if not message_items and latest_question is None:
+            return
+
+        transact_items = [
+            {"Put": {"TableName": self.messages_table.name, "Item": item}}
+            for item in message_items
+        ]
+        session_upsert_kwargs = None
+        if latest_question is not None:
+            session_upsert_kwargs = self._get_session_upsert_kwargs(latest_question)
+            transact_items.append(
+                {"Update": {"TableName": self.sessions_table.name, **session_upsert_kwargs}}
+            )
+        try:
+            self.messages_table.meta.client.transact_write_items(TransactItems=transact_items)
+            return
+        except ClientError as err:
+            logger.error(f"Error writing chat history transaction, fall back to single writes: {err}")
+
+        for item in message_items:
+            try:
+                self.messages_table.put_item(Item=item)
+            except ClientError as err:
+                logger.error(f"Error adding message: {err}")
+        if session_upsert_kwargs is not None:
+            try:
+                self.sessions_table.update_item(**session_upsert_kwargs)
+            except ClientError as err:
+                logger.error(f"Error updating session: {err}")
+
+    def persist(self):
+        """
+        Persist the buffered writes after the final frame is sent. Durable mode
+        flushes synchronously, otherwise the flush runs in the background
+        and is drained by `flush_pending_chat_history` before the main
+        handler returns, as atexit does not run when lambda freezes.
+        """
+        if not self.write_behind or not self.has_pending_writes():
+            return
+        if self.durable:
+            self.flush()
+            return
+        future = _write_behind_executor.submit(self.flush)
+        with _write_behind_lock:
+            _pending_futures.add(future)
+        future.add_done_callback(_discard_future)
+
     def add_user_message(
         self,
         message_id,
@@ -213,6 +442,30 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
             print(err)
 
 
+def _discard_future(future):
+    with _write_behind_lock:
+        _pending_futures.discard(future)
+
+
+def flush_pending_chat_history(timeout: float = None):
+    """Wait for the background flushes and flush the histories still buffered"""
+    with _write_behind_lock:
+        futures = list(_pending_futures)
+    if futures:
+        wait(futures, timeout=timeout)
+    with _write_behind_lock:
+        histories = list(_pending_histories)
+    for history in histories:
+        try:
+            history.flush()
+        except Exception as err:
+            logger.error(f"Error flushing chat history of session {history.session_id}: {err}")
+
+
+# local runs, lambda drains the flushes in the main handler
+atexit.register(flush_pending_chat_history)
+
+
 def filter_chat_history_by_time(
     chat_history: List[BaseMessage], start_time=-math.inf, end_time=math.inf
 ):
@@ -2,6 +2,17 @@ class LambdaInvokeError(Exception):
     pass
 
 
+class UndeclaredStateFieldError(Exception):
+    def __init__(self, handler_name, field, access) -> None:
+        super().__init__()
+        self.handler_name = handler_name
+        self.field = field
+        self.access = access
+
+    def __str__(self):
+        return f"{self.handler_name}: {self.access} of state field {self.field} not declared in its state_projection"
+
+
 class ToolExceptionBase(Exception):
     def __init__(self, *args: object) -> None:
         super().__init__(*args)
@@ -2,13 +2,24 @@ import enum
 import functools
 import importlib
 import json
+import os
 import time
 from typing import Any, Dict, Optional, Callable,Union
 
-import requests
-from common_logic.common_utils.constant import StreamMessageType
+from common_logic.common_utils.aws_client_utils import get_client, get_http_session
 from common_logic.common_utils.logger_utils import get_logger
-from common_logic.common_utils.websocket_utils import is_websocket_request, send_to_ws_client
+from common_logic.common_utils.payload_codec_utils import (
+    ACCEPT_PAYLOAD_CODECS_KEY,
+    decode_payload,
+    encode_payload,
+    negotiate_codec,
+    resolve_codec,
+)
+from common_logic.common_utils.websocket_utils import (
+    flush_traces,
+    is_websocket_request,
+    send_trace_to_ws_client,
+)
 from langchain.pydantic_v1 import BaseModel, Field, root_validator
 
 from .exceptions import LambdaInvokeError
@@ -19,6 +30,8 @@ class LAMBDA_INVOKE_MODE(enum.Enum):
     LAMBDA = "lambda"
     LOCAL = "local"
     API_GW = "api_gw"
+    # in-process handlers, except the lambdas in fused_remote_lambda_names
+    FUSED = "fused"
 
     @classmethod
     def has_value(cls, value):
@@ -30,6 +43,35 @@ class LAMBDA_INVOKE_MODE(enum.Enum):
 
 
 _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
+# invoke mode set by chatbot_lambda_call_wrapper in the deployed lambdas
+_deployed_lambda_invoke_mode = os.environ.get("LAMBDA_INVOKE_MODE", LAMBDA_INVOKE_MODE.LOCAL.value).lower()
+if _deployed_lambda_invoke_mode not in (
+    LAMBDA_INVOKE_MODE.LOCAL.value, LAMBDA_INVOKE_MODE.FUSED.value, LAMBDA_INVOKE_MODE.LAMBDA.value
+):
+    logger.warning(f"invalid LAMBDA_INVOKE_MODE: {_deployed_lambda_invoke_mode}, use local")
+    _deployed_lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
+# lambdas still invoked remotely in fused mode, e.g. hops needing their own
+# memory, timeout or IAM role. Streamed responses can only be returned in-process.
+fused_remote_lambda_names = {
+    name.strip() for name in os.environ.get("FUSED_REMOTE_LAMBDA_NAMES", "").split(",") if name.strip()
+}
+# codec of the payloads of remote hops, e.g. orjson+zstd, see payload_codec_utils.
+# Empty for plain json, the callees must support the envelope before it is set.
+lambda_payload_codec = os.environ.get("LAMBDA_PAYLOAD_CODEC", "").strip()
+if lambda_payload_codec:
+    lambda_payload_codec = resolve_codec(lambda_payload_codec)
+lambda_payload_compress_min_bytes = int(os.environ.get("LAMBDA_PAYLOAD_COMPRESS_MIN_BYTES", 4096))
+# lambda name -> handler, run in-process by the fused mode
+_local_handlers: Dict[str, Callable] = {}
+# handlers of the online lambdas, imported by preload_local_handlers
+FUSED_HANDLER_MODULES = [
+    ("lambda_query_preprocess.query_preprocess", "lambda_handler"),
+    ("lambda_intention_detection.intention", "lambda_handler"),
+    ("lambda_agent.agent", "lambda_handler"),
+    ("lambda_llm_generate.llm_generate", "lambda_handler"),
+    ("functions.functions_utils.retriever.retriever", "lambda_handler"),
+    ("functions.lambda_tool", "lambda_handler"),
+]
 
 _is_current_invoke_local = False
 _current_stream_use = True
@@ -49,36 +91,28 @@ class LambdaInvoker(BaseModel):
         if values.get("client") is not None:
             return values
         try:
-            import boto3
-
-            try:
-                if values["credentials_profile_name"] is not None:
-                    session = boto3.Session(
-                        profile_name=values["credentials_profile_name"]
-                    )
-                else:
-                    # use default credentials
-                    session = boto3.Session()
-
-                values["client"] = session.client(
-                    "lambda", region_name=values["region_name"]
-                )
-
-            except Exception as e:
-                raise ValueError(
-                    "Could not load credentials to authenticate with AWS client. "
-                    "Please check that credentials in the specified "
-                    f"profile name are valid. {e}"
-                ) from e
-
-        except ImportError:
-            raise ImportError(
-                "Could not import boto3 python package. "
-                "Please install it with `pip install boto3`."
+            # shared client, created on first use
+            values["client"] = get_client(
+                "lambda",
+                region_name=values["region_name"],
+                credentials_profile_name=values["credentials_profile_name"]
             )
+        except Exception as e:
+            raise ValueError(
+                "Could not load credentials to authenticate with AWS client. "
+                "Please check that credentials in the specified "
+                f"profile name are valid. {e}"
+            ) from e
         return values
 
     def invoke_with_lambda(self, lambda_name: str, event_body: dict):
+        if lambda_payload_codec:
+            event_body = encode_payload(
+                event_body,
+                lambda_payload_codec,
+                compress_min_bytes=lambda_payload_compress_min_bytes,
+                accept_codecs=[lambda_payload_codec],
+            )
         invoke_response = self.client.invoke(
             FunctionName=lambda_name,
             InvocationType="RequestResponse",
@@ -98,7 +132,7 @@ class LambdaInvoker(BaseModel):
             )
             raise LambdaInvokeError(error)
 
-        return response_body
+        return decode_payload(response_body)
 
     def invoke_with_local(
         self, 
@@ -114,8 +148,30 @@ class LambdaInvoker(BaseModel):
         ret =lambda_fn(event_body)
         return ret
 
+    def invoke_with_fused(
+        self,
+        lambda_name: str,
+        event_body: dict,
+        lambda_module_path: Union[str, Callable] = None,
+        handler_name="lambda_handler"
+        ):
+        """
+        Run the registered handler of the lambda, or the handler of
+        lambda_module_path, in-process. The event is passed without
+        serialization. Lambdas in fused_remote_lambda_names, or without a
+        local handler, are invoked remotely.
+        """
+        local_handler = _local_handlers.get(lambda_name) or lambda_module_path
+        if lambda_name in fused_remote_lambda_names or local_handler is None:
+            return self.invoke_with_lambda(lambda_name=lambda_name, event_body=event_body)
+        return self.invoke_with_local(
+            lambda_module_path=local_handler,
+            event_body=event_body,
+            handler_name=handler_name,
+        )
+
     def invoke_with_apigateway(self, url, event_body: dict):
-        r = requests.post(url, json=event_body)
+        r = get_http_session("apigateway").post(url, json=event_body)
         data = r.json()
         if r.status_code != 200:
             raise LambdaInvokeError(str(data))
@@ -151,6 +207,13 @@ class LambdaInvoker(BaseModel):
             )
         elif lambda_invoke_mode == LAMBDA_INVOKE_MODE.API_GW.value:
             return self.invoke_with_apigateway(url=apigetway_url, event_body=event_body)
+        elif lambda_invoke_mode == LAMBDA_INVOKE_MODE.FUSED.value:
+            return self.invoke_with_fused(
+                lambda_name=lambda_name,
+                event_body=event_body,
+                lambda_module_path=lambda_module_path,
+                handler_name=handler_name,
+            )
 
 
 obj = LambdaInvoker()
@@ -158,6 +221,63 @@ invoke_with_local = obj.invoke_with_local
 invoke_with_lambda = obj.invoke_with_lambda
 invoke_with_apigateway = obj.invoke_with_apigateway
 invoke_lambda = obj.invoke_lambda
+invoke_with_fused = obj.invoke_with_fused
+
+
+def register_local_handler(lambda_name: str, handler: Callable):
+    """Run the handler in-process for the hops to lambda_name in fused mode"""
+    _local_handlers[lambda_name] = handler
+
+
+def preload_local_handlers(handler_modules=None):
+    """
+    Import the handler modules during the init of the lambda, so the first
+    fused hop to each of them does not pay the import.
+    """
+    for lambda_module_path, handler_name in handler_modules or FUSED_HANDLER_MODULES:
+        try:
+            getattr(importlib.import_module(lambda_module_path), handler_name)
+        except Exception as e:
+            # imported again by the first hop
+            logger.error(f"preload handler {lambda_module_path}.{handler_name} failed: {e}")
+
+
+def get_deployed_lambda_invoke_mode():
+    return _deployed_lambda_invoke_mode
+
+
+def decode_request(event):
+    """
+    Decode the event of a remote hop encoded by invoke_with_lambda.
+    Returns the event and the codec of the response, None for plain json.
+    """
+    if not isinstance(event, dict):
+        return event, None
+    response_codec = None
+    if ACCEPT_PAYLOAD_CODECS_KEY in event:
+        event = dict(event)
+        response_codec = negotiate_codec(event.pop(ACCEPT_PAYLOAD_CODECS_KEY))
+    return decode_payload(event), response_codec
+
+
+def encode_response(response, response_codec):
+    if response_codec is None:
+        return response
+    return encode_payload(
+        response, response_codec, compress_min_bytes=lambda_payload_compress_min_bytes
+    )
+
+
+def payload_codec_wrapper(fn):
+    """
+    Decode the encoded events of remote hops and encode the response in the
+    accepted codec, for the handlers without chatbot_lambda_call_wrapper.
+    """
+    @functools.wraps(fn)
+    def inner(event, context=None):
+        event, response_codec = decode_request(event)
+        return encode_response(fn(event, context), response_codec)
+    return inner
 
 
 def chatbot_lambda_call_wrapper(fn):
@@ -172,13 +292,13 @@ def chatbot_lambda_call_wrapper(fn):
         # avoid recursive lambda calling
         if context is not None and type(context).__name__ == "LambdaContext":
             context = context.__dict__
-            _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
+            _lambda_invoke_mode = _deployed_lambda_invoke_mode
         
         if "Records" in event:
             records = event["Records"]
             assert len(records) == 1, "Please set sqs batch size to 1"
             event = json.loads(records[0]["body"])
-            _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
+            _lambda_invoke_mode = _deployed_lambda_invoke_mode
             current_lambda_invoke_mode = LAMBDA_INVOKE_MODE.API_GW.value
 
         context = context or {}
@@ -192,10 +312,13 @@ def chatbot_lambda_call_wrapper(fn):
 
         # apigateway wrap event into body
         if "body" in event:
-            _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
+            _lambda_invoke_mode = _deployed_lambda_invoke_mode
             current_lambda_invoke_mode = LAMBDA_INVOKE_MODE.API_GW.value
             event = json.loads(event["body"])
         
+        # remote hops with a payload codec
+        event, response_codec = decode_request(event)
+
         # set _enable_trace
         _is_main_lambda_inner = False # local valiable to represent main lambda
         if _is_main_lambda:
@@ -204,7 +327,13 @@ def chatbot_lambda_call_wrapper(fn):
             _is_main_lambda_inner = True 
 
         # run 
-        ret = fn(event, context=context)
+        try:
+            ret = fn(event, context=context)
+        finally:
+            # batched trace infos of the request
+            if _is_main_lambda_inner:
+                flush_traces()
+        ret = encode_response(ret, response_codec)
         # save response to body
         # TODO
         if current_lambda_invoke_mode == LAMBDA_INVOKE_MODE.API_GW.value:
@@ -245,14 +374,7 @@ def send_trace(
 
     if enable_trace:
         if current_stream_use and ws_connection_id is not None:
-            send_to_ws_client(
-                message={
-                    "message_type": StreamMessageType.MONITOR,
-                    "message": trace_info,
-                    "created_time": time.time(),
-                },
-                ws_connection_id=ws_connection_id,
-            )
+            send_trace_to_ws_client(trace_info, ws_connection_id)
             if not is_running_local():
                 logger.info(trace_info)
         else:
@@ -0,0 +1,170 @@
+"""
+Codecs of the payloads of remote lambda hops. An encoded payload is a json
+envelope holding the base64 of the serialized, optionally compressed, body
+and the name of its codec, e.g. `orjson+zstd`. Payloads too small to gain
+from compression stay plain json, base64 would only make them larger. The
+caller lists the codecs it accepts for the response in the request, callees
+which do not support any of them answer with plain json.
+
+orjson, msgpack and zstandard are used if they are installed, json and zlib
+are always available.
+"""
+import base64
+import json
+import logging
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("payload_codec_utils")
+
+PAYLOAD_CODEC_KEY = "__payload_codec__"
+PAYLOAD_KEY = "__payload__"
+ACCEPT_PAYLOAD_CODECS_KEY = "__accept_payload_codecs__"
+
+# codec name -> (dumps, loads)
+_serializers: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {}
+# compression name -> (compress, decompress)
+_compressions: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {}
+# preferred first, used when a requested codec is not installed
+_serializer_fallbacks = ["msgpack", "orjson", "json"]
+_compression_fallbacks = ["zstd", "zlib"]
+
+
+def register_payload_serializer(name: str, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any]):
+    _serializers[name] = (dumps, loads)
+
+
+def register_payload_compression(name: str, compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes]):
+    _compressions[name] = (compress, decompress)
+
+
+register_payload_serializer(
+    "json",
+    lambda obj: json.dumps(obj, ensure_ascii=False).encode("utf-8"),
+    lambda data: json.loads(data.decode("utf-8")),
+)
+register_payload_compression("zlib", lambda data: zlib.compress(data, 1), zlib.decompress)
+
+if orjson is not None:
+    register_payload_serializer(
+        "orjson", orjson.dumps, orjson.loads
+    )
+
+if msgpack is not None:
+    register_payload_serializer(
+        "msgpack",
+        lambda obj: msgpack.packb(obj, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False),
+    )
+
+if zstandard is not None:
+    register_payload_compression(
+        "zstd",
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+
+def parse_codec(codec: str) -> Tuple[str, Optional[str]]:
+    """`orjson+zstd` -> ("orjson", "zstd"), `json` -> ("json", None)"""
+    serializer, _, compression = codec.partition("+")
+    return serializer, compression or None
+
+
+def is_codec_supported(codec: str) -> bool:
+    serializer, compression = parse_codec(codec)
+    return serializer in _serializers and (compression is None or compression in _compressions)
+
+
+def resolve_codec(codec: str) -> str:
+    """The codec, or the nearest supported one if its libraries are not installed"""
+    serializer, compression = parse_codec(codec)
+    if serializer not in _serializers:
+        serializer = next(s for s in _serializer_fallbacks if s in _serializers)
+    if compression is not None and compression not in _compressions:
+        compression = next(c for c in _compression_fallbacks if c in _compressions)
+    resolved = f"{serializer}+{compression}" if compression else serializer
+    if resolved != codec:
+        logger.warning(f"payload codec {codec} is not supported, use {resolved}")
+    return resolved
+
+
+def negotiate_codec(accept_codecs: List[str]) -> Optional[str]:
+    """The first accepted codec supported here, None for plain json"""
+    for codec in accept_codecs or []:
+        if is_codec_supported(codec):
+            return codec
+    return None
+
+
+def is_encoded_payload(payload: Any) -> bool:
+    return isinstance(payload, dict) and PAYLOAD_CODEC_KEY in payload
+
+
+def encode_payload(
+    obj: Any,
+    codec: str,
+    compress_min_bytes: int = 0,
+    accept_codecs: Optional[List[str]] = None,
+) -> Any:
+    """Encode obj into a json envelope
+
+    Args:
+        obj: json-serializable payload
+        codec (str): `<serializer>[+<compression>]`
+        compress_min_bytes (int): payloads of compressed codecs smaller than
+            this are returned as plain json
+        accept_codecs (list): codecs accepted for the response, requests only
+
+    Returns:
+        the envelope, or obj if it is not worth compressing
+    """
+    serializer, compression = parse_codec(codec)
+    try:
+        data = _serializers[serializer][0](obj)
+    except (TypeError, OverflowError):
+        # e.g. non str keys or ints beyond 64 bits, the json of the plain hop
+        serializer = "json"
+        data = _serializers[serializer][0](obj)
+    if compression is not None and len(data) < compress_min_bytes:
+        if accept_codecs and isinstance(obj, dict):
+            return {**obj, ACCEPT_PAYLOAD_CODECS_KEY: accept_codecs}
+        return obj
+    if compression is not None:
+        data = _compressions[compression][0](data)
+    envelope = {
+        PAYLOAD_CODEC_KEY: f"{serializer}+{compression}" if compression else serializer,
+        PAYLOAD_KEY: base64.b64encode(data).decode("ascii"),
+    }
+    if accept_codecs:
+        envelope[ACCEPT_PAYLOAD_CODECS_KEY] = accept_codecs
+    return envelope
+
+
+def decode_payload(payload: Any) -> Any:
+    """Decode an envelope built by encode_payload, other payloads are returned as is"""
+    if not is_encoded_payload(payload):
+        return payload
+    codec = payload[PAYLOAD_CODEC_KEY]
+    if not is_codec_supported(codec):
+        raise ValueError(f"unsupported payload codec: {codec}")
+    serializer, compression = parse_codec(codec)
+    data = base64.b64decode(payload[PAYLOAD_KEY])
+    if compression is not None:
+        data = _compressions[compression][1](data)
+    return _serializers[serializer][1](data)
@@ -1,17 +1,25 @@
 import boto3
 import os
 import json 
+import logging
+import time
 
 from langchain.pydantic_v1 import BaseModel,Field
 from collections import defaultdict
+from common_logic.common_utils.cache_utils import LRUTTLCache, stable_hash
 from common_logic.common_utils.constant import LLMModelType,LLMTaskType
 import copy
 from common_logic.common_utils.constant import SceneType, MessageType
 
+logger = logging.getLogger("prompt_utils")
+
 ddb_prompt_table_name = os.environ.get("PROMPT_TABLE_NAME", "")
 dynamodb_resource = boto3.resource("dynamodb")
 ddb_prompt_table = dynamodb_resource.Table(ddb_prompt_table_name)
 
+enable_prompt_template_cache = os.environ.get("ENABLE_PROMPT_TEMPLATE_CACHE", "true").lower() in ("true", "1", "t")
+prompt_template_cache_ttl = float(os.environ.get("PROMPT_TEMPLATE_CACHE_TTL", 60))
+
 
 # export models to front
 EXPORT_MODEL_IDS = [
@@ -32,6 +40,80 @@ class PromptTemplate(BaseModel):
     prompt_template: str = Field(description="prompt template")
 
 
+class PromptTemplateStore:
+    """
+    In-memory cache of the prompt table. All the templates of a group are
+    loaded with one query and kept for `ttl` seconds, updates are picked up
+    when the ttl expires or the group is invalidated. Each group carries a
+    version stamp built from the SortKey and LastModifiedTime of its items,
+    only reported in the cache stats, it does not invalidate the cache.
+    """
+
+    def __init__(self, table, ttl: float = 60, maxsize: int = 64) -> None:
+        self.table = table
+        self.cache = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self.query_num = 0
+        # group name -> version of the last loaded templates
+        self.versions = {}
+
+    def load_group(self, group_name: str):
+        query_kwargs = {
+            "KeyConditionExpression": "GroupName = :group_name",
+            "ExpressionAttributeValues": {":group_name": group_name},
+        }
+        items = []
+        while True:
+            response = self.table.query(**query_kwargs)
+            self.query_num += 1
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                break
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        templates = {item["SortKey"]: item.get("Prompt", {}) for item in items}
+        version = stable_hash(sorted(
+            (item["SortKey"], item.get("LastModifiedTime", "")) for item in items
+        ))
+        group = {
+            "templates": templates,
+            "version": version,
+            "loaded_at": time.time(),
+        }
+        self.cache.set(group_name, group)
+        self.versions[group_name] = version
+        logger.info(f"prompt templates of group {group_name} loaded, version: {version}")
+        return group
+
+    def get_group(self, group_name: str):
+        group = self.cache.get(group_name)
+        if group is None:
+            group = self.load_group(group_name)
+        return group
+
+    def preload(self, group_name: str):
+        """Load every template of a group in one query, return the group version"""
+        return self.get_group(group_name)["version"]
+
+    def get_prompt(self, group_name: str, model_id: str, scene: str):
+        return self.get_group(group_name)["templates"].get(f"{model_id}__{scene}", {})
+
+    def invalidate(self, group_name: str = None):
+        if group_name is None:
+            self.cache.clear()
+            return
+        self.cache.delete(group_name)
+
+    def get_stats(self):
+        stats = self.cache.get_stats()
+        stats["query_num"] = self.query_num
+        return stats
+
+    def get_versions(self, group_names: list):
+        return {
+            group_name: self.versions[group_name]
+            for group_name in group_names if group_name in self.versions
+        }
+
+
 class PromptTemplateManager:
     def __init__(self) -> None:
         self.prompt_templates = defaultdict(dict)
@@ -75,6 +157,9 @@ class PromptTemplateManager:
 
     
     def get_prompt_templates_from_ddb(self, group_name:str, model_id:str, task_type:str, scene:str="common"):
+        if enable_prompt_template_cache:
+            prompt = prompt_template_store.get_prompt(group_name, model_id, scene)
+            return copy.deepcopy(prompt.get(task_type, {}))
         response = ddb_prompt_table.get_item(
             Key={"GroupName": group_name, "SortKey": f"{model_id}__{scene}"}
         )
@@ -110,6 +195,7 @@ class PromptTemplateManager:
         pass 
 
 
+prompt_template_store = PromptTemplateStore(ddb_prompt_table, ttl=prompt_template_cache_ttl)
 prompt_template_manager = PromptTemplateManager()
 get_prompt_template = prompt_template_manager.get_prompt_template
 register_prompt_template = prompt_template_manager.register_prompt_template
@@ -118,6 +204,20 @@ get_all_templates = prompt_template_manager.get_all_templates
 get_prompt_templates_from_ddb = prompt_template_manager.get_prompt_templates_from_ddb
 
 
+def preload_prompt_templates(group_name: str):
+    """Load all the templates of a group ahead of the LLM calling steps, return its version"""
+    if not enable_prompt_template_cache:
+        return None
+    return prompt_template_store.preload(group_name)
+
+
+def get_prompt_template_cache_stats(group_name: str = None):
+    stats = prompt_template_store.get_stats()
+    if group_name is not None:
+        stats["versions"] = prompt_template_store.get_versions([group_name])
+    return stats
+
+
 #### rag template #######
 
 CLAUDE_RAG_SYSTEM_PROMPT = """You are a customer service agent, and answering user's query. You ALWAYS follow these guidelines when writing your response:
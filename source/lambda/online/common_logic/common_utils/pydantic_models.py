@@ -6,7 +6,7 @@ from pydantic import BaseModel,ConfigDict,Field
 from typing import Union,Any
 
 from common_logic.common_utils.constant import ChatbotMode,SceneType,LLMModelType,IndexType
-from common_logic.common_utils.chatbot_utils import ChatbotManager
+from common_logic.common_utils.chatbot_utils import get_environ_chatbot_manager
 from common_logic.common_utils.logger_utils import get_logger
 from common_logic.common_utils.python_utils import update_nest_dict
 
@@ -74,6 +74,12 @@ class QQMatchConfig(ForbidBaseModel):
     reranks: list[RerankConfig] = Field(default_factory=list)
     threshold: float = 0.9
 
+class IntentionDetectionConfig(ForbidBaseModel):
+    # run qq match and intention retrieval concurrently
+    concurrent_mode: bool = False
+    qq_match_timeout: float = 10
+    intention_timeout: float = 10
+
 class RagToolConfig(AllowBaseModel):
     retrievers: list[PrivateKnowledgeRetrieverConfig] = Field(default_factory=list)
     rerankers: list[RerankConfig] = Field(default_factory=list)
@@ -102,6 +108,7 @@ class ChatbotConfig(AllowBaseModel):
     query_process_config: QueryProcessConfig = Field(default_factory=QueryProcessConfig)
     intention_config: IntentionConfig = Field(default_factory=IntentionConfig)
     qq_match_config: QQMatchConfig = Field(default_factory=QQMatchConfig)
+    intention_detection_config: IntentionDetectionConfig = Field(default_factory=IntentionDetectionConfig)
     agent_config: AgentConfig = Field(default_factory=AgentConfig)
     chat_config: LLMConfig = Field(default_factory=LLMConfig)
     private_knowledge_config: PrivateKnowledgeConfig = Field(default_factory=PrivateKnowledgeConfig)
@@ -151,7 +158,7 @@ class ChatbotConfig(AllowBaseModel):
     
     @classmethod
     def get_index_infos_from_ddb(cls,group_name,chatbot_id):
-        chatbot_manager = ChatbotManager.from_environ()
+        chatbot_manager = get_environ_chatbot_manager()
         chatbot = chatbot_manager.get_chatbot(group_name, chatbot_id)
         _infos = chatbot.index_ids or {}
         infos = {}
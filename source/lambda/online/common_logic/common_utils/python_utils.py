@@ -12,3 +12,9 @@ def update_nest_dict(d:dict, u:dict):
 def add_messages(left: list, right: list):
     """Add-don't-overwrite."""
     return left + right
+
+
+def extend_messages(left: list, right: list):
+    """Append-only, extends left in place instead of copying it."""
+    left.extend(right)
+    return left
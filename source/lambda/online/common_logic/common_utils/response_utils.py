@@ -3,7 +3,7 @@ import logging
 import time
 import traceback
 from common_logic.common_utils.ddb_utils import DynamoDBChatMessageHistory
-from common_logic.common_utils.websocket_utils import send_to_ws_client
+from common_logic.common_utils.websocket_utils import CoalescingWebsocketSender, flush_traces, send_to_ws_client
 from common_logic.common_utils.constant import StreamMessageType
 logger = logging.getLogger("response_utils")
 
@@ -48,6 +48,10 @@ def api_response(event_body:dict,response:dict):
         entry_type=event_body['entry_type'],
         additional_kwargs=response.get("ddb_additional_kwargs",{})
     )
+    # api mode is write-through, the response is the final frame and is
+    # returned after the chat history is written, write-behind only
+    # batches the writes into one transaction
+    ddb_history_obj.persist()
 
     return {
             "session_id": event_body['session_id'],
@@ -75,8 +79,12 @@ def stream_response(event_body:dict, response:dict):
         answer = iter([answer])
 
     ddb_history_obj = event_body["ddb_history_obj"]
+    answer_str = ""
+    sender = None
 
     try:
+        # batched trace infos of the graph go before the answer
+        flush_traces(ws_connection_id)
         send_to_ws_client(message={
                 "message_type": StreamMessageType.START,
                 "message_id": f"ai_{message_id}",
@@ -84,7 +92,14 @@ def stream_response(event_body:dict, response:dict):
             },
             ws_connection_id=ws_connection_id
         )
-        answer_str = ""
+        sender = CoalescingWebsocketSender(
+            ws_connection_id,
+            message={
+                "message_id": f"ai_{message_id}",
+                "custom_message_id": custom_message_id,
+            },
+            send_message=send_to_ws_client
+        )
 
         for i, chunk in enumerate(answer):
             if i == 0 and log_first_token_time:
@@ -93,21 +108,11 @@ def stream_response(event_body:dict, response:dict):
                 logger.info(
                     f"{custom_message_id} running time of first token whole {entry_type} entry: {first_token_time-request_timestamp}s"
                 )
-            send_to_ws_client(message={
-                    "message_type": StreamMessageType.CHUNK,
-                    "message_id": f"ai_{message_id}",
-                    "custom_message_id": custom_message_id,
-                    "message": {
-                        "role": "assistant",
-                        "content": chunk,
-                        # "knowledge_sources": sources,
-                    },
-                    "chunk_id": i,
-                },
-                ws_connection_id=ws_connection_id
-            )
+            sender.send(chunk)
 
-            answer_str += chunk
+        # the last chunks are sent before the context and end messages
+        sender.close()
+        answer_str = sender.answer
         
         if log_first_token_time:
             logger.info(
@@ -142,6 +147,7 @@ def stream_response(event_body:dict, response:dict):
             )
 
         # send end
+        flush_traces(ws_connection_id)
         send_to_ws_client(
             {
                 "message_type": StreamMessageType.END,
@@ -158,6 +164,10 @@ def stream_response(event_body:dict, response:dict):
         # bedrock error
         error = traceback.format_exc()
         logger.info(error)
+        if sender is not None:
+            sender.close(raise_error=False)
+            answer_str = sender.answer
+        flush_traces(ws_connection_id)
         send_to_ws_client(
             {
                 "message_type": StreamMessageType.ERROR,
@@ -167,6 +177,11 @@ def stream_response(event_body:dict, response:dict):
             },
             ws_connection_id=ws_connection_id
         )
+    finally:
+        if sender is not None:
+            sender.close(raise_error=False)
+        # with write-behind, the chat history is written after the final frame
+        ddb_history_obj.persist()
     return answer_str
 
 
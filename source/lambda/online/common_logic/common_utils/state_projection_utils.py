@@ -0,0 +1,177 @@
+"""
+Declarative projection of the chatbot state for lambda hops. A handler
+declares the state fields it reads and writes with `state_projection`, the
+caller sends only the declared reads and merges back only the declared
+writes, returned by the handler under STATE_WRITES_KEY. Handlers without a
+declaration still get the whole state.
+
+With `validate_state_projection` (VALIDATE_STATE_PROJECTION, on in tests)
+the handlers get a copy of the state which raises UndeclaredStateFieldError
+on reads and writes of undeclared fields, and on in-place changes of fields
+not declared as writes.
+"""
+import functools
+import importlib
+import json
+import os
+from typing import Callable, List, Optional, Union
+
+from langchain.pydantic_v1 import BaseModel, Field
+
+from .exceptions import UndeclaredStateFieldError
+
+STATE_WRITES_KEY = "__state_writes__"
+
+validate_state_projection = os.environ.get("VALIDATE_STATE_PROJECTION", "false").lower() in ("true", "1", "t")
+
+
+def get_path_value(state: dict, path: str):
+    value = state
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = dict.get(value, key)
+    return value
+
+
+class StateProjection(BaseModel):
+    reads: List[str] = Field(description="state fields read by the handler")
+    writes: List[str] = Field(description="state fields written by the handler", default=[])
+    # dotted paths of config values naming state fields read by the
+    # handler, e.g. the query_key of a retriever config
+    field_refs: List[str] = Field(description="config paths of read state fields", default=[])
+
+    def get_reads(self, state: dict) -> List[str]:
+        reads = list(self.reads)
+        for field_ref in self.field_refs:
+            field = get_path_value(state, field_ref)
+            if isinstance(field, str) and field not in reads:
+                reads.append(field)
+        return reads
+
+    def project(self, state: dict) -> dict:
+        return {key: state[key] for key in self.get_reads(state) if key in state}
+
+    def get_writes(self, state: dict) -> dict:
+        return {key: dict.__getitem__(state, key) for key in self.writes if key in state}
+
+
+def merge_state_projections(*projections: Optional[StateProjection]) -> Optional[StateProjection]:
+    """Projection of a chain of handlers, None if any of them reads the whole state"""
+    if any(projection is None for projection in projections):
+        return None
+    merged = StateProjection(reads=[], writes=[], field_refs=[])
+    for projection in projections:
+        for name in ("reads", "writes", "field_refs"):
+            values = getattr(merged, name)
+            values.extend(v for v in getattr(projection, name) if v not in values)
+    return merged
+
+
+def get_state_projection(
+    lambda_module_path: Union[str, Callable], handler_name: str = "lambda_handler"
+) -> Optional[StateProjection]:
+    """Projection declared by the handler, None if it is not declared"""
+    if callable(lambda_module_path):
+        handler = lambda_module_path
+    else:
+        handler = getattr(importlib.import_module(lambda_module_path), handler_name)
+    return getattr(handler, "state_projection", None)
+
+
+def project_state(state: dict, projection: Optional[StateProjection]) -> dict:
+    """Fields of the state sent to a handler"""
+    if projection is None:
+        return state
+    return projection.project(state)
+
+
+def pop_state_writes(output) -> dict:
+    """Declared writes returned by a handler, removed from its output"""
+    if isinstance(output, dict):
+        return output.pop(STATE_WRITES_KEY, None) or {}
+    return {}
+
+
+class ProjectedState(dict):
+    """Copy of the state which only allows the declared reads and writes"""
+
+    def __init__(self, state: dict, projection: StateProjection, handler_name: str):
+        super().__init__(state)
+        self.reads = set(projection.get_reads(state)) | set(projection.writes)
+        self.writes = set(projection.writes)
+        self.handler_name = handler_name
+
+    def _check_read(self, key):
+        if key not in self.reads:
+            raise UndeclaredStateFieldError(self.handler_name, key, "read")
+
+    def __getitem__(self, key):
+        self._check_read(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._check_read(key)
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self._check_read(key)
+        return super().setdefault(key, default)
+
+    def __setitem__(self, key, value):
+        if key not in self.writes:
+            raise UndeclaredStateFieldError(self.handler_name, key, "write")
+        super().__setitem__(key, value)
+
+
+def _dumps_fields(state: dict, keys) -> dict:
+    return {
+        key: json.dumps(dict.__getitem__(state, key), sort_keys=True, default=str)
+        for key in keys if key in state
+    }
+
+
+def state_projection(
+    reads: List[str],
+    writes: List[str] = (),
+    field_refs: List[str] = (),
+    state_key: Optional[str] = None,
+):
+    """
+    Declare the state fields read and written by a lambda handler.
+
+    Args:
+        reads (list): state fields read by the handler
+        writes (list): state fields written by the handler, merged back by the caller
+        field_refs (list): dotted config paths naming state fields read by the handler
+        state_key (str): key of the state in the event, None if the event is the state
+    """
+    projection = StateProjection(reads=list(reads), writes=list(writes), field_refs=list(field_refs))
+
+    def inner(fn):
+        handler_name = f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(event, context=None):
+            state = event[state_key] if state_key else event
+            snapshot = None
+            if validate_state_projection:
+                state = ProjectedState(state, projection, handler_name)
+                event = {**event, state_key: state} if state_key else state
+                unwritten_keys = [key for key in projection.get_reads(state) if key not in projection.writes]
+                snapshot = _dumps_fields(state, unwritten_keys)
+            output = fn(event, context)
+            if snapshot is not None:
+                for key, value in _dumps_fields(state, snapshot).items():
+                    if value != snapshot[key]:
+                        raise UndeclaredStateFieldError(handler_name, key, "in-place write")
+            if projection.writes and isinstance(output, dict):
+                output[STATE_WRITES_KEY] = {
+                    **(output.get(STATE_WRITES_KEY) or {}),
+                    **projection.get_writes(state),
+                }
+            return output
+
+        wrapper.state_projection = projection
+        return wrapper
+    return inner
@@ -0,0 +1,257 @@
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils.answer_cache_utils import (
+    AnswerCache,
+    AnswerRecorder,
+    IndexVersionReader,
+    collect_index_names,
+)
+from doc_store_utils import DocStore, LocalDocStoreBackend
+
+CHATBOT_CONFIG = {
+    "group_name": "Admin",
+    "chatbot_id": "admin",
+    "chatbot_mode": "agent",
+    "user_id": "user_1",
+    "enable_trace": True,
+    "qq_match_config": {"retrievers": [{"index_name": "admin-qq-default", "embedding_model_endpoint": "endpoint"}]},
+    "intention_config": {"retrievers": []},
+    "private_knowledge_config": {"retrievers": [{"index_name": "admin-qd-default"}]},
+}
+
+EMBEDDINGS = {
+    "what is s3": [1.0, 0.0, 0.0],
+    "what's s3": [0.99, 0.05, 0.0],
+    "what is ec2": [0.6, 0.8, 0.0],
+}
+
+
+class FakeEmbedding:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, query):
+        self.queries.append(query)
+        return EMBEDDINGS[query]
+
+
+class NoDocStoreIndexVersionReader(IndexVersionReader):
+    """index version reader of a deployment without DOC_STORE_BUCKET"""
+
+    def get_doc_store(self):
+        return None
+
+
+def build_entry(answer="s3 is an object storage service"):
+    return {
+        "answer": answer,
+        "extra_response": {"contexts": ["s3 doc"]},
+        "ddb_additional_kwargs": {},
+        "latency": 3.0,
+    }
+
+
+class TestAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.doc_store = DocStore(LocalDocStoreBackend(self.tmp_dir.name))
+        self.cache = AnswerCache(
+            maxsize=16,
+            ttl=60,
+            similarity_threshold=0.97,
+            index_version_reader=IndexVersionReader(self.doc_store, ttl=0.05),
+        )
+        self.embedding = FakeEmbedding()
+        self.scope = self.cache.get_scope(CHATBOT_CONFIG)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_exact_hit_of_normalized_query(self):
+        self.cache.set(self.scope, "What is  S3", build_entry(), self.embedding)
+        entry, hit_info = self.cache.get(self.scope, " what is s3 ", self.embedding)
+        self.assertEqual(entry["answer"], "s3 is an object storage service")
+        self.assertEqual(hit_info["hit_type"], "exact")
+        # exact hits do not embed the query
+        self.assertEqual(self.embedding.queries, ["What is  S3"])
+
+    def test_semantic_hit_above_threshold(self):
+        self.cache.set(self.scope, "what is s3", build_entry(), self.embedding)
+        entry, hit_info = self.cache.get(self.scope, "what's s3", self.embedding)
+        self.assertIsNotNone(entry)
+        self.assertEqual(hit_info["hit_type"], "semantic")
+        self.assertEqual(hit_info["cached_query"], "what is s3")
+        entry, hit_info = self.cache.get(self.scope, "what is ec2", self.embedding)
+        self.assertIsNone(entry)
+        self.assertEqual(hit_info["hit_type"], "miss")
+        stats = self.cache.get_stats()
+        self.assertEqual((stats["semantic_hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_scope(self):
+        self.cache.set(self.scope, "what is s3", build_entry(), self.embedding)
+        # per request fields do not change the scope
+        self.assertEqual(self.cache.get_scope({**CHATBOT_CONFIG, "user_id": "user_2", "enable_trace": False}), self.scope)
+        other_scope = self.cache.get_scope({**CHATBOT_CONFIG, "chatbot_id": "other"})
+        self.assertNotEqual(other_scope, self.scope)
+        entry, _ = self.cache.get(other_scope, "what is s3", self.embedding)
+        self.assertIsNone(entry)
+
+    def test_invalidated_on_reingestion(self):
+        self.cache.set(self.scope, "what is s3", build_entry(), self.embedding)
+        self.doc_store.put_index_version("admin-qd-default")
+        time.sleep(0.06)
+        new_scope = self.cache.get_scope(CHATBOT_CONFIG)
+        self.assertNotEqual(new_scope, self.scope)
+        entry, _ = self.cache.get(new_scope, "what is s3", self.embedding)
+        self.assertIsNone(entry)
+
+    def test_collect_index_names(self):
+        self.assertEqual(collect_index_names(CHATBOT_CONFIG), ["admin-qd-default", "admin-qq-default"])
+
+    def test_embedding_error(self):
+        def broken_embedding(query):
+            raise RuntimeError("endpoint unavailable")
+        self.cache.set(self.scope, "what is s3", build_entry(), broken_embedding)
+        entry, hit_info = self.cache.get(self.scope, "what's s3", broken_embedding)
+        self.assertIsNone(entry)
+        entry, _ = self.cache.get(self.scope, "what is s3", broken_embedding)
+        self.assertIsNotNone(entry)
+
+    def test_embeddings_bounded_across_scopes(self):
+        def embedding_fn(query):
+            return [float(ord(c)) for c in query[-3:]]
+
+        for version in range(5):
+            self.doc_store.put_index_version("admin-qd-default")
+            time.sleep(0.06)
+            scope = self.cache.get_scope(CHATBOT_CONFIG)
+            for i in range(10):
+                self.cache.set(scope, f"query {version} {i:03d}", build_entry(), embedding_fn)
+        # the vectors of the stale scopes are evicted with the entries
+        self.assertEqual(self.cache.get_stats()["embeddings"], 16)
+        self.assertEqual(len(self.cache.entries), 16)
+
+    def test_embeddings_expire(self):
+        cache = AnswerCache(ttl=0.05, index_version_reader=IndexVersionReader(self.doc_store))
+        cache.set(self.scope, "what is s3", build_entry(), self.embedding)
+        self.assertEqual(cache.get_stats()["embeddings"], 1)
+        time.sleep(0.06)
+        entry, _ = cache.get(self.scope, "what's s3", self.embedding)
+        self.assertIsNone(entry)
+        self.assertEqual(cache.get_stats()["embeddings"], 0)
+
+    def test_disabled_without_doc_store(self):
+        self.assertTrue(self.cache.is_enabled())
+        cache = AnswerCache(index_version_reader=NoDocStoreIndexVersionReader())
+        with self.assertLogs("answer_cache_utils", level="ERROR") as logs:
+            self.assertFalse(cache.is_enabled())
+            self.assertFalse(cache.is_enabled())
+        self.assertEqual(len(logs.output), 1)
+
+    def test_answer_recorder(self):
+        def broken_stream():
+            yield "s3 is"
+            raise RuntimeError("stream broken")
+        recorder = AnswerRecorder(iter(["s3 is ", "object storage"]))
+        self.assertEqual("".join(recorder), "s3 is object storage")
+        self.assertTrue(recorder.completed)
+        recorder = AnswerRecorder(broken_stream())
+        with self.assertRaises(RuntimeError):
+            list(recorder)
+        self.assertFalse(recorder.completed)
+
+
+class TestCommonEntryAnswerCache(unittest.TestCase):
+    def setUp(self):
+        from lambda_main.main_utils.online_entries import common_entry
+        self.common_entry = common_entry
+        self.responses = []
+        self._origin_process_response = common_entry.process_response
+        self._origin_answer_cache = common_entry.answer_cache
+        self._origin_embedding_fn = common_entry.get_answer_cache_embedding_fn
+        # exact lookups only, no embedding endpoint here
+        common_entry.get_answer_cache_embedding_fn = lambda chatbot_config: None
+        common_entry.process_response = self.fake_process_response
+        common_entry.answer_cache = AnswerCache(index_version_reader=IndexVersionReader(DocStore(LocalDocStoreBackend("/nonexistent"))))
+
+    def tearDown(self):
+        self.common_entry.process_response = self._origin_process_response
+        self.common_entry.answer_cache = self._origin_answer_cache
+        self.common_entry.get_answer_cache_embedding_fn = self._origin_embedding_fn
+
+    def fake_process_response(self, event_body, response):
+        answer = response["answer"]
+        if not isinstance(answer, str):
+            answer = "".join(answer)
+        self.responses.append({**response, "answer": answer})
+        return answer
+
+    def build_state(self, answer, tool_name="rag_tool", stream=True):
+        event_body = {
+            "request_timestamp": time.time() - 3,
+            "stream": stream,
+            "ws_connection_id": None,
+            "chatbot_config": {**CHATBOT_CONFIG, "enable_trace": False},
+        }
+        return {
+            "event_body": event_body,
+            "query": "what is s3",
+            "stream": stream,
+            "ws_connection_id": None,
+            "enable_trace": False,
+            "trace_infos": [],
+            "chatbot_config": {**CHATBOT_CONFIG, "group_name": "Admin"},
+            "answer": answer,
+            "extra_response": {"contexts": ["s3 doc"]},
+            "ddb_additional_kwargs": {},
+            "intent_type": "intention detected",
+            "function_calling_parsed_tool_calls": [{"name": tool_name}],
+            "answer_cache_scope": "scope",
+        }
+
+    def test_streamed_answer_cached_and_replayed(self):
+        self.common_entry.final_results_preparation(self.build_state(iter(["s3 is ", "object storage"])))
+        answer_cache = self.common_entry.answer_cache
+        entry, hit_info = answer_cache.get("scope", "What is S3")
+        self.assertEqual(entry["answer"], "s3 is object storage")
+        self.assertGreaterEqual(entry["latency"], 3)
+
+        event_body = self.build_state(None)["event_body"]
+        event_body["request_timestamp"] = time.time()
+        app_response = self.common_entry.cached_answer_response(event_body, entry, hit_info)
+        self.assertEqual(app_response, "s3 is object storage")
+        self.assertEqual(self.responses[-1]["extra_response"], {"contexts": ["s3 doc"]})
+        self.assertGreater(answer_cache.get_stats()["saved_ms"], 2000)
+
+    def test_tool_answers_not_cached(self):
+        self.common_entry.final_results_preparation(self.build_state("sunny", tool_name="get_weather", stream=False))
+        entry, _ = self.common_entry.answer_cache.get("scope", "what is s3")
+        self.assertIsNone(entry)
+        self.assertEqual(self.responses[-1]["answer"], "sunny")
+
+    def test_incomplete_stream_not_cached(self):
+        def broken_stream():
+            yield "s3 is"
+            raise RuntimeError("stream broken")
+
+        def process_response(event_body, response):
+            # stream_response swallows the errors of the answer stream
+            try:
+                list(response["answer"])
+            except RuntimeError:
+                pass
+            return ""
+        self.common_entry.process_response = process_response
+        self.common_entry.final_results_preparation(self.build_state(broken_stream()))
+        entry, _ = self.common_entry.answer_cache.get("scope", "what is s3")
+        self.assertIsNone(entry)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import sys
+import threading
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from botocore.config import Config
+from common_logic.common_utils.aws_client_utils import (
+    AWSClientRegistry,
+    aws_client_registry,
+)
+from common_logic.common_utils.lambda_invoke_utils import LambdaInvoker
+
+
+class TestAWSClientRegistry(unittest.TestCase):
+    def setUp(self):
+        aws_client_registry.clear()
+        aws_client_registry.reset_stats()
+
+    def test_client_reused_across_invocations(self):
+        registry = AWSClientRegistry()
+        clients = [registry.get_client("sagemaker-runtime", region_name="us-east-1") for _ in range(10)]
+        self.assertTrue(all(client is clients[0] for client in clients))
+        self.assertEqual(registry.get_stats()["construction_counts"], {"session": 1, "sagemaker-runtime": 1})
+        self.assertEqual(registry.get_stats()["hit_counts"]["sagemaker-runtime"], 9)
+
+    def test_client_key(self):
+        registry = AWSClientRegistry()
+        client = registry.get_client("sagemaker-runtime", region_name="us-east-1")
+        self.assertIsNot(registry.get_client("sagemaker-runtime", region_name="us-west-2"), client)
+        self.assertIsNot(registry.get_client("lambda", region_name="us-east-1"), client)
+        self.assertIsNot(
+            registry.get_client("sagemaker-runtime", region_name="us-east-1", config=Config(read_timeout=10)),
+            client
+        )
+        self.assertIs(registry.get_client("sagemaker-runtime", region_name="us-east-1"), client)
+        self.assertEqual(registry.get_stats()["clients"], 4)
+
+    def test_tuned_config(self):
+        registry = AWSClientRegistry()
+        client = registry.get_client("sagemaker-runtime", region_name="us-east-1", config=Config(read_timeout=10))
+        self.assertEqual(client.meta.config.max_pool_connections, 50)
+        self.assertTrue(client.meta.config.tcp_keepalive)
+        self.assertEqual(client.meta.config.read_timeout, 10)
+
+    def test_concurrent_lazy_creation(self):
+        registry = AWSClientRegistry()
+        clients = []
+        threads = [
+            threading.Thread(target=lambda: clients.append(registry.get_client("bedrock-runtime", region_name="us-east-1")))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        self.assertEqual(registry.get_stats()["construction_counts"]["bedrock-runtime"], 1)
+
+    def test_lambda_invoker_and_http_session(self):
+        invokers = [LambdaInvoker(region_name="us-east-1") for _ in range(5)]
+        self.assertTrue(all(invoker.client is invokers[0].client for invoker in invokers))
+        self.assertIs(aws_client_registry.get_http_session("apigateway"), aws_client_registry.get_http_session("apigateway"))
+        self.assertEqual(
+            aws_client_registry.get_stats()["construction_counts"],
+            {"session": 1, "lambda": 1, "http_session": 1}
+        )
+
+    def test_model_clients_reused(self):
+        from lambda_llm_generate.llm_generate_utils.llm_models import (
+            Claude3Sonnet,
+            SagemakerModelBase,
+        )
+
+        llms = [Claude3Sonnet.create_model(region_name="us-east-1") for _ in range(3)]
+        self.assertTrue(all(llm.client is llms[0].client for llm in llms))
+        clients = [SagemakerModelBase.create_client("us-east-1") for _ in range(3)]
+        self.assertTrue(all(client is clients[0] for client in clients))
+        construction_counts = aws_client_registry.get_stats()["construction_counts"]
+        self.assertEqual(construction_counts["bedrock-runtime"], 1)
+        self.assertEqual(construction_counts["sagemaker-runtime"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+
+sys.path.extend([".", "common_logic", os.path.dirname(__file__)])
+
+from chat_history_write_behind_TEST import (
+    MESSAGES_TABLE_NAME,
+    get_history_obj,
+    write_turn,
+)
+from common_logic.common_utils.constant import MessageType
+from common_logic.common_utils.ddb_utils import estimate_token_num
+from common_logic.common_utils.logger_utils import get_logger
+from fake_dynamodb import FakeDynamoDBResource
+
+logger = get_logger("benchmark")
+
+
+def build_session(ddb_resource, turn_num, session_id="session_1"):
+    history_obj = get_history_obj(ddb_resource, write_behind=False, session_id=session_id)
+    messages_table = ddb_resource.tables[MESSAGES_TABLE_NAME]
+    for i in range(turn_num):
+        write_turn(history_obj, query=f"question {i}", answer=f"answer {i} " * 10, message_id=str(i))
+    # timestamps of the fake turns must be strictly increasing
+    items = sorted(
+        messages_table.items.values(),
+        key=lambda x: (int(x["messageId"].split("_")[1]), x["role"] == MessageType.AI_MESSAGE_TYPE)
+    )
+    for i, item in enumerate(items):
+        item["createTimestamp"] = f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}Z"
+    ddb_resource.request_counter.clear()
+    ddb_resource.read_items = 0
+    return history_obj
+
+
+class TestChatHistoryWindow(unittest.TestCase):
+    def test_same_tail_as_full_load(self):
+        ddb_resource = FakeDynamoDBResource()
+        history_obj = build_session(ddb_resource, turn_num=30)
+        full = history_obj.messages_as_langchain
+        window = history_obj.get_recent_messages_as_langchain(max_messages=6, max_tokens=0)
+        self.assertEqual(window, full[-6:])
+        self.assertEqual(window[0]["role"], MessageType.HUMAN_MESSAGE_TYPE)
+
+    def test_constant_read_cost(self):
+        read_items = []
+        for turn_num in (10, 100, 400):
+            ddb_resource = FakeDynamoDBResource()
+            history_obj = build_session(ddb_resource, turn_num=turn_num)
+            history_obj.get_recent_messages_as_langchain(max_messages=10, max_tokens=0)
+            read_items.append(ddb_resource.read_items)
+        logger.info(f"items read for 10/100/400 turns: {read_items}")
+        self.assertEqual(read_items, [10, 10, 10])
+
+    def test_token_budget(self):
+        ddb_resource = FakeDynamoDBResource()
+        history_obj = build_session(ddb_resource, turn_num=50)
+        window = history_obj.get_recent_messages_as_langchain(max_messages=0, max_tokens=100, page_size=4)
+        token_num = sum(estimate_token_num(m["content"]) for m in window)
+        self.assertLessEqual(token_num, 100)
+        self.assertGreater(len(window), 0)
+        self.assertEqual(window[0]["role"], MessageType.HUMAN_MESSAGE_TYPE)
+        self.assertEqual(window, history_obj.messages_as_langchain[-len(window):])
+
+    def test_paginates_without_budget(self):
+        ddb_resource = FakeDynamoDBResource()
+        history_obj = build_session(ddb_resource, turn_num=20)
+        window = history_obj.get_recent_messages_as_langchain(max_messages=0, max_tokens=0, page_size=7)
+        self.assertEqual(window, history_obj.messages_as_langchain)
+
+    def test_fallback_without_timestamp_index(self):
+        ddb_resource = FakeDynamoDBResource(missing_indexes=("bySessionIdTimestamp",))
+        history_obj = build_session(ddb_resource, turn_num=10)
+        window = history_obj.get_recent_messages_as_langchain(max_messages=5, max_tokens=0)
+        self.assertEqual(window, history_obj.messages_as_langchain[-4:])
+
+    def test_estimate_token_num(self):
+        self.assertEqual(estimate_token_num("abcdefgh"), 2)
+        self.assertEqual(estimate_token_num("你好"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
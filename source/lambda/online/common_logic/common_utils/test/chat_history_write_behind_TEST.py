@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", os.path.dirname(__file__)])
+
+from common_logic.common_utils import ddb_utils, response_utils
+from common_logic.common_utils.constant import StreamMessageType
+from common_logic.common_utils.ddb_utils import DynamoDBChatMessageHistory
+from common_logic.common_utils.logger_utils import get_logger
+from fake_dynamodb import FakeDynamoDBResource
+
+logger = get_logger("benchmark")
+
+SESSIONS_TABLE_NAME = "fake-sessions-table"
+MESSAGES_TABLE_NAME = "fake-messages-table"
+
+
+def get_history_obj(ddb_resource, write_behind, durable=True, session_id="session_1"):
+    return DynamoDBChatMessageHistory(
+        sessions_table_name=SESSIONS_TABLE_NAME,
+        messages_table_name=MESSAGES_TABLE_NAME,
+        session_id=session_id,
+        user_id="user_1",
+        client_type="test_client",
+        write_behind=write_behind,
+        durable=durable,
+        ddb_resource=ddb_resource,
+    )
+
+
+def write_turn(history_obj, query="what is s3", answer="object storage", message_id="1"):
+    response_utils.write_chat_history_to_ddb(
+        query=query,
+        answer=answer,
+        ddb_obj=history_obj,
+        message_id=message_id,
+        custom_message_id="custom_1",
+        entry_type="common",
+        additional_kwargs={"figure": []},
+    )
+
+
+def get_stream_event_body(history_obj, message_id="1"):
+    return {
+        "request_timestamp": time.time(),
+        "entry_type": "common",
+        "message_id": message_id,
+        "ws_connection_id": "connection_1",
+        "custom_message_id": "custom_1",
+        "query": "what is s3",
+        "ddb_history_obj": history_obj,
+    }
+
+
+class TestChatHistoryWriteBehind(unittest.TestCase):
+    def setUp(self):
+        self.frames = []
+        self._origin_send_to_ws_client = response_utils.send_to_ws_client
+
+        def fake_send_to_ws_client(message, ws_connection_id):
+            self.frames.append(message["message_type"])
+
+        response_utils.send_to_ws_client = fake_send_to_ws_client
+
+    def tearDown(self):
+        response_utils.send_to_ws_client = self._origin_send_to_ws_client
+
+    def test_round_trips_per_turn(self):
+        sync_resource = FakeDynamoDBResource()
+        write_turn(get_history_obj(sync_resource, write_behind=False))
+
+        write_behind_resource = FakeDynamoDBResource()
+        history_obj = get_history_obj(write_behind_resource, write_behind=True)
+        write_turn(history_obj)
+        self.assertEqual(write_behind_resource.round_trips, 0)
+        history_obj.persist()
+        logger.info(f"ddb round trips per turn, sync: {dict(sync_resource.request_counter)}, "
+                    f"write-behind: {dict(write_behind_resource.request_counter)}")
+        self.assertEqual(sync_resource.round_trips, 6)
+        self.assertEqual(write_behind_resource.round_trips, 1)
+        self.assertEqual(write_behind_resource.request_counter["transact_write_items"], 1)
+
+    def test_same_records_as_sync_mode(self):
+        sync_resource = FakeDynamoDBResource()
+        write_turn(get_history_obj(sync_resource, write_behind=False))
+        write_behind_resource = FakeDynamoDBResource()
+        history_obj = get_history_obj(write_behind_resource, write_behind=True)
+        write_turn(history_obj)
+        history_obj.persist()
+
+        ignored = ("createTimestamp", "lastModifiedTimestamp", "startTime")
+        for table_name in (SESSIONS_TABLE_NAME, MESSAGES_TABLE_NAME):
+            expected = {
+                k: {f: v for f, v in item.items() if f not in ignored}
+                for k, item in sync_resource.tables[table_name].items.items()
+            }
+            actual = {
+                k: {f: v for f, v in item.items() if f not in ignored}
+                for k, item in write_behind_resource.tables[table_name].items.items()
+            }
+            self.assertEqual(actual, expected)
+        session = write_behind_resource.tables[SESSIONS_TABLE_NAME].items[("session_1", "user_1")]
+        self.assertEqual(session["latestQuestion"], "what is s3")
+        self.assertIn("startTime", session)
+
+    def test_existing_session_keeps_start_time(self):
+        ddb_resource = FakeDynamoDBResource()
+        history_obj = get_history_obj(ddb_resource, write_behind=True)
+        write_turn(history_obj, message_id="1")
+        history_obj.persist()
+        sessions = ddb_resource.tables[SESSIONS_TABLE_NAME].items
+        start_time = sessions[("session_1", "user_1")]["startTime"]
+        write_turn(history_obj, query="what is ec2", message_id="2")
+        history_obj.persist()
+        self.assertEqual(sessions[("session_1", "user_1")]["startTime"], start_time)
+        self.assertEqual(sessions[("session_1", "user_1")]["latestQuestion"], "what is ec2")
+        self.assertEqual(len(history_obj.messages), 4)
+
+    def test_written_after_final_frame(self):
+        ddb_resource = FakeDynamoDBResource()
+        history_obj = get_history_obj(ddb_resource, write_behind=True)
+        origin_transact_write_items = ddb_resource.fake_client.transact_write_items
+
+        def transact_write_items(TransactItems):
+            self.frames.append("DDB_WRITE")
+            return origin_transact_write_items(TransactItems=TransactItems)
+
+        ddb_resource.fake_client.transact_write_items = transact_write_items
+        response = {"answer": iter(["object ", "storage"]), "ddb_additional_kwargs": {}, "extra_response": {}}
+        answer = response_utils.stream_response(get_stream_event_body(history_obj), response)
+        self.assertEqual(answer, "object storage")
+        self.assertEqual(self.frames.index(StreamMessageType.END) + 1, self.frames.index("DDB_WRITE"))
+
+    def test_non_durable_flush_on_shutdown(self):
+        ddb_resource = FakeDynamoDBResource(latency=0.05)
+        history_obj = get_history_obj(ddb_resource, write_behind=True, durable=False)
+        write_turn(history_obj)
+        history_obj.persist()
+        # another turn buffered but never persisted
+        other_history_obj = get_history_obj(ddb_resource, write_behind=True, session_id="session_2")
+        write_turn(other_history_obj, message_id="2")
+        ddb_utils.flush_pending_chat_history()
+        self.assertFalse(history_obj.has_pending_writes())
+        self.assertFalse(other_history_obj.has_pending_writes())
+        self.assertEqual(ddb_resource.request_counter["transact_write_items"], 2)
+        self.assertEqual(len(ddb_resource.tables[MESSAGES_TABLE_NAME].items), 4)
+
+    def test_transaction_failure_falls_back(self):
+        ddb_resource = FakeDynamoDBResource()
+        ddb_resource.fake_client.fail_transactions = True
+        history_obj = get_history_obj(ddb_resource, write_behind=True)
+        write_turn(history_obj)
+        history_obj.persist()
+        self.assertEqual(len(ddb_resource.tables[MESSAGES_TABLE_NAME].items), 2)
+        self.assertEqual(len(ddb_resource.tables[SESSIONS_TABLE_NAME].items), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import sys
+import unittest
+
+sys.path.extend([".", "common_logic", os.path.dirname(__file__)])
+
+from common_logic.common_utils import chatbot_utils
+from common_logic.common_utils.chatbot_utils import ChatbotManager
+from common_logic.common_utils.logger_utils import get_logger
+from fake_dynamodb import FakeDynamoDBResource
+
+logger = get_logger("benchmark")
+
+GROUP_NAME = "Admin"
+CHATBOT_ID = "admin"
+
+
+def build_tables(index_num=6, model_num=2):
+    ddb_resource = FakeDynamoDBResource()
+    chatbot_table = ddb_resource.Table("fake-chatbot-table")
+    index_table = ddb_resource.Table("fake-index-table")
+    model_table = ddb_resource.Table("fake-model-table")
+    for i in range(model_num):
+        model_table.put_item(Item={
+            "groupName": GROUP_NAME,
+            "modelId": f"model-{i}",
+            "parameter": {"ModelEndpoint": f"endpoint-{i}", "ModelName": f"model-{i}.tar.gz"},
+        })
+    index_ids = {"qq": {"count": 0, "value": {}}, "qd": {"count": 0, "value": {}}}
+    for i in range(index_num):
+        index_type = "qq" if i % 2 else "qd"
+        index_table.put_item(Item={
+            "groupName": GROUP_NAME,
+            "indexId": f"index-{i}",
+            "indexType": index_type,
+            "kbType": "aos",
+            "modelIds": {"embedding": f"model-{i % model_num}"},
+        })
+        index_ids[index_type]["value"][f"tag-{i}"] = f"index-{i}"
+    chatbot_table.put_item(Item={
+        "groupName": GROUP_NAME,
+        "chatbotId": CHATBOT_ID,
+        "indexIds": index_ids,
+        "updateTime": "2024-01-01",
+    })
+    ddb_resource.request_counter.clear()
+    return ddb_resource, ChatbotManager(chatbot_table, index_table, model_table)
+
+
+def legacy_get_chatbot_index_ids(chatbot_manager, group_name, chatbot_id):
+    """one get_item per index and per model, the behavior before the cache"""
+    chatbot_content = chatbot_manager.chatbot_table.get_item(
+        Key={"groupName": group_name, "chatbotId": chatbot_id}
+    ).get("Item")
+    for index_type, index_item in chatbot_content.get("indexIds").items():
+        for tag, index_id in index_item.get("value").items():
+            index_content = chatbot_manager.index_table.get_item(
+                Key={"groupName": group_name, "indexId": index_id}
+            ).get("Item")
+            embedding_model_id = index_content.get("modelIds").get("embedding")
+            if embedding_model_id:
+                index_content["modelIds"]["embedding"] = chatbot_manager.model_table.get_item(
+                    Key={"groupName": group_name, "modelId": embedding_model_id}
+                ).get("Item")
+            chatbot_content["indexIds"][index_type]["value"][tag] = index_content
+    return chatbot_content["indexIds"]
+
+
+class TestChatbotCache(unittest.TestCase):
+    def setUp(self):
+        chatbot_utils.chatbot_cache.clear()
+        chatbot_utils.chatbot_cache.reset_stats()
+
+    def test_parity_with_get_item_resolution(self):
+        ddb_resource, chatbot_manager = build_tables()
+        expected = legacy_get_chatbot_index_ids(chatbot_manager, GROUP_NAME, CHATBOT_ID)
+        legacy_round_trips = ddb_resource.round_trips
+        ddb_resource.request_counter.clear()
+        chatbot = chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID)
+        logger.info(f"ddb round trips of a cold resolution, get_item: {legacy_round_trips}, "
+                    f"batch: {dict(ddb_resource.request_counter)}")
+        self.assertEqual(chatbot.index_ids, expected)
+        self.assertEqual(ddb_resource.request_counter["get_item"], 1)
+        self.assertEqual(ddb_resource.request_counter["batch_get_item"], 2)
+
+    def test_warm_container_is_free(self):
+        ddb_resource, chatbot_manager = build_tables()
+        chatbot_manager.warm_up([(GROUP_NAME, CHATBOT_ID)])
+        ddb_resource.request_counter.clear()
+        for _ in range(5):
+            chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID)
+        self.assertEqual(ddb_resource.round_trips, 0)
+        self.assertEqual(chatbot_utils.get_chatbot_cache_stats()["hits"], 5)
+
+    def test_returned_chatbot_is_a_copy(self):
+        _, chatbot_manager = build_tables()
+        chatbot = chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID)
+        chatbot.index_ids["qq"]["value"].clear()
+        self.assertTrue(chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID).index_ids["qq"]["value"])
+
+    def test_version_based_invalidation(self):
+        origin_ttl = chatbot_utils.chatbot_cache_revalidate_ttl
+        chatbot_utils.chatbot_cache_revalidate_ttl = 0
+        try:
+            ddb_resource, chatbot_manager = build_tables()
+            chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID)
+            ddb_resource.request_counter.clear()
+            # unchanged version, only the chatbot item is read again
+            chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID)
+            self.assertEqual(dict(ddb_resource.request_counter), {"get_item": 1})
+
+            chatbot_manager.chatbot_table.items[(GROUP_NAME, CHATBOT_ID)]["indexIds"]["qq"]["value"].pop("tag-1")
+            chatbot = chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID)
+            self.assertNotIn("tag-1", chatbot.index_ids["qq"]["value"])
+            self.assertEqual(ddb_resource.request_counter["batch_get_item"], 2)
+        finally:
+            chatbot_utils.chatbot_cache_revalidate_ttl = origin_ttl
+
+    def test_explicit_invalidation(self):
+        ddb_resource, chatbot_manager = build_tables()
+        chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID)
+        chatbot_manager.invalidate(GROUP_NAME, CHATBOT_ID)
+        ddb_resource.request_counter.clear()
+        chatbot_manager.get_chatbot(GROUP_NAME, CHATBOT_ID)
+        self.assertEqual(ddb_resource.request_counter["batch_get_item"], 2)
+
+    def test_missing_chatbot(self):
+        _, chatbot_manager = build_tables()
+        self.assertEqual(chatbot_manager.get_chatbot(GROUP_NAME, "missing").index_ids, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
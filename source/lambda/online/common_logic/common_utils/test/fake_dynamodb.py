@@ -0,0 +1,168 @@
+"""Local in-memory stand-in of the boto3 DynamoDB resource used by chat history tests."""
+import copy
+import re
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+IF_NOT_EXISTS_PATTERN = re.compile(r"if_not_exists\((\w+),\s*(:\w+)\)")
+# table name keyword -> key attribute names
+DEFAULT_KEY_SCHEMAS = {
+    "session": ("sessionId", "userId"),
+    "message": ("sessionId", "messageId"),
+    "chatbot": ("groupName", "chatbotId"),
+    "index": ("groupName", "indexId"),
+    "model": ("groupName", "modelId"),
+    "prompt": ("GroupName", "SortKey"),
+}
+
+
+class FakeTableMeta:
+    def __init__(self, fake_client):
+        self.client = fake_client
+
+
+class FakeTable:
+    def __init__(self, resource, name: str, key_names: tuple):
+        self.resource = resource
+        self.name = name
+        self.key_names = key_names
+        self.items = {}
+        self.meta = FakeTableMeta(resource.fake_client)
+
+    def _key(self, item: dict):
+        return tuple(item.get(k) for k in self.key_names)
+
+    def _call(self, operation):
+        self.resource.request_counter[operation] += 1
+        if self.resource.latency:
+            time.sleep(self.resource.latency)
+
+    def put_item(self, Item: dict):
+        self._call("put_item")
+        self.items[self._key(Item)] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key: dict):
+        self._call("get_item")
+        item = self.items.get(self._key(Key))
+        return {"Item": copy.deepcopy(item)} if item is not None else {}
+
+    def _update(self, Key: dict, UpdateExpression: str, ExpressionAttributeValues: dict):
+        item = self.items.setdefault(self._key(Key), dict(Key))
+        assignments = UpdateExpression.strip()[len("SET"):]
+        for assignment in re.split(r",\s*(?![^()]*\))", assignments):
+            name, value = [part.strip() for part in assignment.split("=", 1)]
+            matched = IF_NOT_EXISTS_PATTERN.fullmatch(value)
+            if matched:
+                if name not in item:
+                    item[name] = ExpressionAttributeValues[matched.group(2)]
+            else:
+                item[name] = ExpressionAttributeValues[value]
+        return item
+
+    def update_item(self, Key: dict, UpdateExpression: str, ExpressionAttributeValues: dict, **kwargs):
+        self._call("update_item")
+        return {"Attributes": dict(self._update(Key, UpdateExpression, ExpressionAttributeValues))}
+
+    def query(
+        self,
+        KeyConditionExpression: str,
+        ExpressionAttributeValues: dict,
+        IndexName: str = None,
+        ScanIndexForward: bool = True,
+        Limit: int = None,
+        ExclusiveStartKey: dict = None,
+        ProjectionExpression: str = None,
+        ExpressionAttributeNames: dict = None,
+    ):
+        self._call("query")
+        if IndexName in self.resource.missing_indexes:
+            raise ClientError(
+                {"Error": {"Code": "ValidationException", "Message": "The table does not have the specified index"}},
+                "Query"
+            )
+        # only `key = :value` conditions are supported
+        key_name, value_name = [part.strip() for part in KeyConditionExpression.split("=")]
+        key_value = ExpressionAttributeValues[value_name]
+        items = [copy.deepcopy(item) for item in self.items.values() if item.get(key_name) == key_value]
+        # indexes with a sort key return items ordered by createTimestamp
+        if IndexName and IndexName != "bySessionId":
+            items = sorted(items, key=lambda x: x["createTimestamp"], reverse=not ScanIndexForward)
+        start = ExclusiveStartKey["offset"] if ExclusiveStartKey else 0
+        end = start + Limit if Limit else len(items)
+        page = items[start:end]
+        self.resource.read_items += len(page)
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            fields = [names.get(f.strip(), f.strip()) for f in ProjectionExpression.split(",")]
+            page = [{f: item[f] for f in fields if f in item} for item in page]
+        response = {"Items": page}
+        if end < len(items):
+            response["LastEvaluatedKey"] = {"offset": end}
+        return response
+
+
+class FakeDynamoDBClient:
+    def __init__(self, resource):
+        self.resource = resource
+        self.fail_transactions = False
+
+    def batch_get_item(self, RequestItems: dict):
+        self.resource.request_counter["batch_get_item"] += 1
+        if self.resource.latency:
+            time.sleep(self.resource.latency)
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.resource.tables[table_name]
+            responses[table_name] = [
+                copy.deepcopy(table.items[table._key(key)]) for key in request["Keys"]
+                if table._key(key) in table.items
+            ]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def transact_write_items(self, TransactItems: list):
+        self.resource.request_counter["transact_write_items"] += 1
+        if self.resource.latency:
+            time.sleep(self.resource.latency)
+        if self.fail_transactions:
+            raise ClientError(
+                {"Error": {"Code": "TransactionCanceledException", "Message": "fake"}},
+                "TransactWriteItems"
+            )
+        for transact_item in TransactItems:
+            if "Put" in transact_item:
+                table = self.resource.tables[transact_item["Put"]["TableName"]]
+                table.items[table._key(transact_item["Put"]["Item"])] = dict(transact_item["Put"]["Item"])
+            elif "Update" in transact_item:
+                update = dict(transact_item["Update"])
+                table = self.resource.tables[update.pop("TableName")]
+                table._update(**update)
+        return {}
+
+
+class FakeDynamoDBResource:
+    """
+    Supports the calls made by DynamoDBChatMessageHistory and ChatbotManager,
+    the key attributes of a table are picked from DEFAULT_KEY_SCHEMAS by its name.
+    """
+
+    def __init__(self, latency: float = 0.0, missing_indexes: tuple = ()):
+        self.latency = latency
+        self.missing_indexes = missing_indexes
+        # number of items read by queries, proportional to the RCU cost
+        self.read_items = 0
+        self.request_counter = Counter()
+        self.fake_client = FakeDynamoDBClient(self)
+        self.tables = {}
+
+    @property
+    def round_trips(self):
+        return sum(self.request_counter.values())
+
+    def Table(self, name: str):
+        if name not in self.tables:
+            key_names = next(v for k, v in DEFAULT_KEY_SCHEMAS.items() if k in name.lower())
+            self.tables[name] = FakeTable(self, name, key_names)
+        return self.tables[name]
@@ -0,0 +1,216 @@
+import io
+import json
+import sys
+import time
+import types
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils import lambda_invoke_utils
+from common_logic.common_utils.lambda_invoke_utils import (
+    chatbot_lambda_call_wrapper,
+    invoke_lambda,
+    preload_local_handlers,
+    register_local_handler,
+)
+from common_logic.common_utils.logger_utils import get_logger
+
+logger = get_logger("benchmark")
+
+
+class FakeLambdaClient:
+    """Invokes the handlers with json payloads, as the lambda service"""
+
+    def __init__(self, handlers, invoke_overhead=0.0):
+        self.handlers = handlers
+        self.invoke_overhead = invoke_overhead
+        self.invoked = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invoked.append(FunctionName)
+        time.sleep(self.invoke_overhead)
+        response = self.handlers[FunctionName](json.loads(Payload))
+        return {"Payload": io.BytesIO(json.dumps(response).encode("utf-8"))}
+
+
+def build_stub_handlers(work_latency=0.0, doc_num=20):
+    """stubs of the online lambdas of a rag turn, with the nested hops of the real ones"""
+    def preprocess(event_body):
+        time.sleep(work_latency)
+        return {"query": event_body["query"].strip()}
+
+    def retriever(event_body):
+        time.sleep(work_latency)
+        return {"result": {"docs": [{"page_content": "s3 doc " * 100, "score": 0.9} for _ in range(doc_num)]}}
+
+    def intention(event_body):
+        time.sleep(work_latency)
+        res = invoke_lambda(
+            event_body={"query": event_body["query"], "type": "qq"},
+            lambda_name="Online_Functions",
+            lambda_module_path=retriever,
+        )
+        return [{"intent": "rag", "query": doc["page_content"][:10]} for doc in res["result"]["docs"]]
+
+    def llm_generate(event_body):
+        time.sleep(work_latency)
+        return {"answer": "s3 is an object storage service"}
+
+    def agent(event_body):
+        time.sleep(work_latency)
+        return invoke_lambda(
+            event_body={"llm_input": event_body},
+            lambda_name="Online_LLM_Generate",
+            lambda_module_path=llm_generate,
+        )
+
+    return {
+        "Online_Query_Preprocess": preprocess,
+        "Online_Intention_Detection": intention,
+        "Online_Functions": retriever,
+        "Online_Agent": agent,
+        "Online_LLM_Generate": llm_generate,
+    }
+
+
+def run_turn(handlers, query="what is s3"):
+    """hops of the common entry for a rag turn"""
+    query = invoke_lambda(
+        event_body={"query": query},
+        lambda_name="Online_Query_Preprocess",
+        lambda_module_path=handlers["Online_Query_Preprocess"],
+    )["query"]
+    intention = invoke_lambda(
+        event_body={"query": query},
+        lambda_name="Online_Intention_Detection",
+        lambda_module_path=handlers["Online_Intention_Detection"],
+    )
+    contexts = invoke_lambda(
+        event_body={"query": query, "type": "qd"},
+        lambda_name="Online_Functions",
+        lambda_module_path=handlers["Online_Functions"],
+    )["result"]["docs"]
+    return invoke_lambda(
+        event_body={"query": query, "intention": intention, "contexts": contexts},
+        lambda_name="Online_Agent",
+        lambda_module_path=handlers["Online_Agent"],
+    )["answer"]
+
+
+class LambdaInvokeTestBase(unittest.TestCase):
+    lambda_invoke_mode = "fused"
+
+    def setUp(self):
+        self.handlers = build_stub_handlers()
+        self.fake_client = FakeLambdaClient(self.handlers)
+        self._origin = (
+            lambda_invoke_utils.obj.client,
+            lambda_invoke_utils._lambda_invoke_mode,
+            lambda_invoke_utils.fused_remote_lambda_names,
+            dict(lambda_invoke_utils._local_handlers),
+        )
+        lambda_invoke_utils.obj.client = self.fake_client
+        lambda_invoke_utils._lambda_invoke_mode = self.lambda_invoke_mode
+        lambda_invoke_utils.fused_remote_lambda_names = set()
+
+    def tearDown(self):
+        (
+            lambda_invoke_utils.obj.client,
+            lambda_invoke_utils._lambda_invoke_mode,
+            lambda_invoke_utils.fused_remote_lambda_names,
+            local_handlers,
+        ) = self._origin
+        lambda_invoke_utils._local_handlers.clear()
+        lambda_invoke_utils._local_handlers.update(local_handlers)
+
+
+class TestFusedInvoke(LambdaInvokeTestBase):
+    def test_hops_run_in_process(self):
+        self.assertEqual(run_turn(self.handlers), "s3 is an object storage service")
+        self.assertEqual(self.fake_client.invoked, [])
+
+    def test_event_not_serialized(self):
+        events = []
+        register_local_handler("Online_Fake", lambda event_body: events.append(event_body) or {})
+        event_body = {"query": "what is s3", "state": object()}
+        invoke_lambda(event_body=event_body, lambda_name="Online_Fake")
+        self.assertIs(events[0], event_body)
+
+    def test_remote_lambda_names(self):
+        lambda_invoke_utils.fused_remote_lambda_names = {"Online_Functions"}
+        self.assertEqual(run_turn(self.handlers), "s3 is an object storage service")
+        # the nested hop of the intention detection and the qd retrieval
+        self.assertEqual(self.fake_client.invoked, ["Online_Functions", "Online_Functions"])
+
+    def test_registered_handler_and_module_path(self):
+        module = types.ModuleType("fake_fused_handler_module")
+        module.lambda_handler = lambda event_body: {"handler": "module"}
+        sys.modules[module.__name__] = module
+        try:
+            response = invoke_lambda(event_body={}, lambda_name="Online_Fake", lambda_module_path=module.__name__)
+            self.assertEqual(response, {"handler": "module"})
+            # the registered handler takes precedence
+            register_local_handler("Online_Fake", lambda event_body: {"handler": "registered"})
+            response = invoke_lambda(event_body={}, lambda_name="Online_Fake", lambda_module_path=module.__name__)
+            self.assertEqual(response, {"handler": "registered"})
+            preload_local_handlers([(module.__name__, "lambda_handler"), ("fake_missing_module", "lambda_handler")])
+        finally:
+            del sys.modules[module.__name__]
+
+    def test_no_local_handler(self):
+        self.handlers["Online_Fake"] = lambda event_body: {"handler": "remote"}
+        self.assertEqual(invoke_lambda(event_body={}, lambda_name="Online_Fake"), {"handler": "remote"})
+        self.assertEqual(self.fake_client.invoked, ["Online_Fake"])
+
+
+class TestDeployedInvokeMode(LambdaInvokeTestBase):
+    lambda_invoke_mode = "lambda"
+
+    def test_wrapper_sets_deployed_mode(self):
+        class LambdaContext:
+            pass
+
+        modes = []
+
+        @chatbot_lambda_call_wrapper
+        def handler(event_body, context):
+            modes.append(lambda_invoke_utils._lambda_invoke_mode)
+            return {}
+
+        origin_deployed_mode = lambda_invoke_utils._deployed_lambda_invoke_mode
+        try:
+            for deployed_mode in ("local", "fused"):
+                lambda_invoke_utils._deployed_lambda_invoke_mode = deployed_mode
+                handler({"query": "what is s3"}, LambdaContext())
+        finally:
+            lambda_invoke_utils._deployed_lambda_invoke_mode = origin_deployed_mode
+        self.assertEqual(modes, ["local", "fused"])
+
+    def test_distributed_mode(self):
+        self.assertEqual(run_turn(self.handlers), "s3 is an object storage service")
+        self.assertEqual(len(self.fake_client.invoked), 6)
+
+
+def benchmark(turn_num=20, invoke_overhead=0.015, work_latency=0.001):
+    """end-to-end latency of a rag turn, each remote hop pays the invoke overhead and json serialization"""
+    handlers = build_stub_handlers(work_latency=work_latency)
+    origin = (lambda_invoke_utils.obj.client, lambda_invoke_utils._lambda_invoke_mode)
+    lambda_invoke_utils.obj.client = FakeLambdaClient(handlers, invoke_overhead=invoke_overhead)
+    try:
+        for lambda_invoke_mode in ("lambda", "fused"):
+            lambda_invoke_utils._lambda_invoke_mode = lambda_invoke_mode
+            start = time.perf_counter()
+            for _ in range(turn_num):
+                run_turn(handlers)
+            cost = (time.perf_counter() - start) / turn_num
+            logger.info(f"bench mode: {lambda_invoke_mode}, 6 hops, {invoke_overhead * 1000:.0f}ms per invoke, latency: {cost * 1000:.1f}ms")
+    finally:
+        lambda_invoke_utils.obj.client, lambda_invoke_utils._lambda_invoke_mode = origin
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
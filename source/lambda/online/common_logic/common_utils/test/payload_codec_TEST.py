@@ -0,0 +1,211 @@
+import io
+import json
+import random
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils import lambda_invoke_utils
+from common_logic.common_utils.lambda_invoke_utils import (
+    chatbot_lambda_call_wrapper,
+    invoke_with_lambda,
+    payload_codec_wrapper,
+)
+from common_logic.common_utils.logger_utils import get_logger
+from common_logic.common_utils.payload_codec_utils import (
+    ACCEPT_PAYLOAD_CODECS_KEY,
+    PAYLOAD_CODEC_KEY,
+    decode_payload,
+    encode_payload,
+    is_codec_supported,
+    negotiate_codec,
+    resolve_codec,
+)
+
+logger = get_logger("benchmark")
+
+WORDS = [
+    "amazon", "s3", "bucket", "object", "storage", "lifecycle", "policy", "region", "replication",
+    "版本", "存储", "对象", "策略", "the", "of", "and", "is", "a", "to", "in", "for", "with",
+]
+
+
+def build_rag_state(doc_num=10, doc_words=200, history_num=10, trace_num=20, seed=0):
+    """event body of a rag hop, contexts, chat history and trace infos"""
+    rng = random.Random(seed)
+
+    def text(word_num):
+        return " ".join(rng.choice(WORDS) for _ in range(word_num))
+
+    return {
+        "query": "what is the lifecycle policy of s3",
+        "chatbot_config": {
+            "chatbot_id": "admin",
+            "group_name": "Admin",
+            "enable_trace": True,
+            "private_knowledge_config": {"retrievers": [{"index_name": "admin-qd-default", "top_k": doc_num}]},
+        },
+        "chat_history": [
+            {"role": "user" if i % 2 == 0 else "ai", "content": text(40)} for i in range(history_num)
+        ],
+        "contexts": [
+            {
+                "page_content": text(doc_words),
+                "score": rng.random(),
+                "source": f"s3://bucket/docs/{i}.pdf",
+                "retrieval_content": text(20),
+                "figure": [],
+            }
+            for i in range(doc_num)
+        ],
+        "trace_infos": [f"Enter: node_{i}, time: {1700000000 + i * 0.1}" for i in range(trace_num)],
+    }
+
+
+class FakeLambdaClient:
+    """Invokes the handlers with json payloads, as the lambda service"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.payloads.append(Payload)
+        response = self.handler(json.loads(Payload))
+        return {"Payload": io.BytesIO(json.dumps(response).encode("utf-8"))}
+
+
+def get_supported_codecs():
+    codecs = []
+    for serializer in ("json", "orjson", "msgpack"):
+        for compression in (None, "zlib", "zstd"):
+            codec = f"{serializer}+{compression}" if compression else serializer
+            if is_codec_supported(codec):
+                codecs.append(codec)
+    return codecs
+
+
+class TestPayloadCodec(unittest.TestCase):
+    def test_round_trip(self):
+        state = build_rag_state()
+        for codec in get_supported_codecs():
+            envelope = encode_payload(state, codec)
+            self.assertEqual(envelope[PAYLOAD_CODEC_KEY], codec)
+            # the envelope itself is a json lambda payload
+            self.assertEqual(decode_payload(json.loads(json.dumps(envelope))), state)
+
+    def test_small_payload_plain(self):
+        payload = encode_payload({"query": "what is s3"}, "json+zlib", compress_min_bytes=4096)
+        self.assertEqual(payload, {"query": "what is s3"})
+        payload = encode_payload({"query": "what is s3"}, "json+zlib", compress_min_bytes=4096, accept_codecs=["json+zlib"])
+        self.assertEqual(payload, {"query": "what is s3", ACCEPT_PAYLOAD_CODECS_KEY: ["json+zlib"]})
+        envelope = encode_payload(build_rag_state(), "json+zlib", compress_min_bytes=4096)
+        self.assertEqual(envelope[PAYLOAD_CODEC_KEY], "json+zlib")
+
+    def test_resolve_and_negotiate(self):
+        self.assertEqual(resolve_codec("json+zlib"), "json+zlib")
+        self.assertTrue(is_codec_supported(resolve_codec("msgpack+zstd")))
+        self.assertEqual(negotiate_codec(["cbor+brotli", "json+zlib"]), "json+zlib")
+        self.assertIsNone(negotiate_codec(["cbor"]))
+        self.assertIsNone(negotiate_codec(None))
+        with self.assertRaises(ValueError):
+            decode_payload({PAYLOAD_CODEC_KEY: "cbor", "__payload__": ""})
+
+    def test_not_encoded_payload(self):
+        self.assertEqual(decode_payload({"query": "what is s3"}), {"query": "what is s3"})
+        self.assertEqual(decode_payload([1, 2]), [1, 2])
+
+
+class TestRemoteHopCodec(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self._origin = (lambda_invoke_utils.obj.client, lambda_invoke_utils.lambda_payload_codec)
+        lambda_invoke_utils.lambda_payload_codec = "json+zlib"
+
+    def tearDown(self):
+        lambda_invoke_utils.obj.client, lambda_invoke_utils.lambda_payload_codec = self._origin
+
+    def invoke(self, handler, event_body):
+        client = FakeLambdaClient(handler)
+        lambda_invoke_utils.obj.client = client
+        return invoke_with_lambda(lambda_name="Online_Fake", event_body=event_body), client
+
+    def test_chatbot_lambda_call_wrapper(self):
+        @chatbot_lambda_call_wrapper
+        def handler(event_body, context=None):
+            self.events.append(event_body)
+            return {"contexts": event_body["contexts"]}
+
+        state = build_rag_state()
+        response, client = self.invoke(handler, state)
+        self.assertEqual(self.events[0], state)
+        self.assertEqual(response, {"contexts": state["contexts"]})
+        self.assertLess(len(client.payloads[0]), len(json.dumps(state)) / 2)
+
+    def test_payload_codec_wrapper(self):
+        @payload_codec_wrapper
+        def handler(event, context=None):
+            return {"code": 0, "result": {"docs": event["contexts"]}}
+
+        state = build_rag_state()
+        response, _ = self.invoke(handler, state)
+        self.assertEqual(response["result"]["docs"], state["contexts"])
+        # small requests are plain json, the callee drops the accepted codecs
+        response, client = self.invoke(handler, {"contexts": []})
+        self.assertEqual(json.loads(client.payloads[0])[ACCEPT_PAYLOAD_CODECS_KEY], ["json+zlib"])
+        self.assertEqual(response, {"code": 0, "result": {"docs": []}})
+
+    def test_response_codec_not_accepted(self):
+        @payload_codec_wrapper
+        def handler(event, context=None):
+            return {"query": event["query"]}
+
+        def old_caller_handler(event):
+            # e.g. a caller accepting only codecs not installed here
+            event[ACCEPT_PAYLOAD_CODECS_KEY] = ["cbor"]
+            return handler(event)
+
+        response, _ = self.invoke(old_caller_handler, build_rag_state())
+        self.assertEqual(response, {"query": "what is the lifecycle policy of s3"})
+
+    def test_plain_json_by_default(self):
+        lambda_invoke_utils.lambda_payload_codec = ""
+
+        @chatbot_lambda_call_wrapper
+        def handler(event_body, context=None):
+            return {"query": event_body["query"]}
+
+        response, client = self.invoke(handler, {"query": "what is s3"})
+        self.assertEqual(json.loads(client.payloads[0]), {"query": "what is s3"})
+        self.assertEqual(response, {"query": "what is s3"})
+
+
+def benchmark(repeat=5):
+    """encode and decode of both sides of a hop, from a typical rag state to near the 6MB payload limit"""
+    states = {
+        "typical": build_rag_state(doc_num=5, doc_words=200, history_num=6),
+        "large": build_rag_state(doc_num=50, doc_words=600, history_num=40, trace_num=200),
+        "worst": build_rag_state(doc_num=400, doc_words=1200, history_num=200, trace_num=1000),
+    }
+    codecs = ["plain"] + get_supported_codecs()
+    for name, state in states.items():
+        for codec in codecs:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                if codec == "plain":
+                    payload = json.dumps(state)
+                    json.loads(payload)
+                else:
+                    payload = json.dumps(encode_payload(state, codec, compress_min_bytes=4096))
+                    decode_payload(json.loads(payload))
+            cost = (time.perf_counter() - start) / repeat
+            logger.info(f"bench state: {name}, codec: {codec}, payload: {len(payload) / 1024:.0f}KB, encode+decode: {cost * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import unittest
+
+sys.path.extend([".", "common_logic", os.path.dirname(__file__)])
+
+from common_logic.common_utils import prompt_utils
+from common_logic.common_utils.constant import LLMTaskType
+from common_logic.common_utils.prompt_utils import PromptTemplateStore
+from fake_dynamodb import FakeDynamoDBResource
+
+GROUP_NAME = "Admin"
+MODEL_IDS = ["anthropic.claude-3-sonnet-20240229-v1:0", "anthropic.claude-3-haiku-20240307-v1:0"]
+
+
+def build_prompt_table():
+    ddb_resource = FakeDynamoDBResource()
+    prompt_table = ddb_resource.Table("fake-prompt-table")
+    for model_id in MODEL_IDS:
+        prompt_table.put_item(Item={
+            "GroupName": GROUP_NAME,
+            "SortKey": f"{model_id}__common",
+            "ModelId": model_id,
+            "Scene": "common",
+            "Prompt": {
+                LLMTaskType.RAG: {"system_prompt": f"rag prompt of {model_id}"},
+                LLMTaskType.CHAT: {"system_prompt": f"chat prompt of {model_id}"},
+            },
+            "LastModifiedTime": "1700000000",
+        })
+    ddb_resource.request_counter.clear()
+    return ddb_resource, prompt_table
+
+
+class TestPromptTemplateCache(unittest.TestCase):
+    def setUp(self):
+        self.ddb_resource, self.prompt_table = build_prompt_table()
+        self._origin_store = prompt_utils.prompt_template_store
+        self._origin_table = prompt_utils.ddb_prompt_table
+        prompt_utils.prompt_template_store = PromptTemplateStore(self.prompt_table, ttl=60)
+        prompt_utils.ddb_prompt_table = self.prompt_table
+
+    def tearDown(self):
+        prompt_utils.prompt_template_store = self._origin_store
+        prompt_utils.ddb_prompt_table = self._origin_table
+
+    def get_turn_templates(self):
+        """the prompt lookups of one agent turn: agent, rag and chat steps"""
+        return [
+            prompt_utils.get_prompt_templates_from_ddb(GROUP_NAME, model_id=model_id, task_type=task_type)
+            for model_id in MODEL_IDS
+            for task_type in (LLMTaskType.TOOL_CALLING, LLMTaskType.RAG, LLMTaskType.CHAT)
+        ]
+
+    def test_parity_with_get_item(self):
+        cached = self.get_turn_templates()
+        origin = prompt_utils.enable_prompt_template_cache
+        prompt_utils.enable_prompt_template_cache = False
+        try:
+            expected = self.get_turn_templates()
+        finally:
+            prompt_utils.enable_prompt_template_cache = origin
+        self.assertEqual(cached, expected)
+        self.assertEqual(cached[1], {"system_prompt": f"rag prompt of {MODEL_IDS[0]}"})
+        self.assertEqual(cached[0], {})
+
+    def test_one_query_per_group(self):
+        prompt_utils.preload_prompt_templates(GROUP_NAME)
+        for _ in range(3):
+            self.get_turn_templates()
+        self.assertEqual(dict(self.ddb_resource.request_counter), {"query": 1})
+        stats = prompt_utils.get_prompt_template_cache_stats(GROUP_NAME)
+        self.assertEqual(stats["query_num"], 1)
+        self.assertEqual(stats["hits"], 18)
+        self.assertIn(GROUP_NAME, stats["versions"])
+
+    def test_version_changes_on_update(self):
+        version = prompt_utils.preload_prompt_templates(GROUP_NAME)
+        item = self.prompt_table.get_item(Key={"GroupName": GROUP_NAME, "SortKey": f"{MODEL_IDS[0]}__common"})["Item"]
+        item["Prompt"][LLMTaskType.RAG]["system_prompt"] = "new rag prompt"
+        item["LastModifiedTime"] = "1700000100"
+        self.prompt_table.put_item(Item=item)
+        # served from cache until the ttl expires or the group is invalidated
+        self.assertEqual(
+            prompt_utils.get_prompt_templates_from_ddb(GROUP_NAME, MODEL_IDS[0], LLMTaskType.RAG)["system_prompt"],
+            f"rag prompt of {MODEL_IDS[0]}"
+        )
+        prompt_utils.prompt_template_store.invalidate(GROUP_NAME)
+        self.assertNotEqual(prompt_utils.preload_prompt_templates(GROUP_NAME), version)
+        self.assertEqual(
+            prompt_utils.get_prompt_templates_from_ddb(GROUP_NAME, MODEL_IDS[0], LLMTaskType.RAG)["system_prompt"],
+            "new rag prompt"
+        )
+
+    def test_ttl_expiration(self):
+        prompt_utils.prompt_template_store = PromptTemplateStore(self.prompt_table, ttl=0)
+        self.get_turn_templates()
+        self.assertEqual(self.ddb_resource.request_counter["query"], 6)
+
+    def test_returned_templates_are_copies(self):
+        prompt_utils.get_prompt_templates_from_ddb(GROUP_NAME, MODEL_IDS[0], LLMTaskType.RAG)["system_prompt"] = "changed"
+        self.assertEqual(
+            prompt_utils.get_prompt_templates_from_ddb(GROUP_NAME, MODEL_IDS[0], LLMTaskType.RAG)["system_prompt"],
+            f"rag prompt of {MODEL_IDS[0]}"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+import json
+import sys
+import threading
+import time
+import unittest
+from typing import Annotated, TypedDict
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils import websocket_utils
+from common_logic.common_utils.constant import StreamMessageType
+from common_logic.common_utils.lambda_invoke_utils import (
+    node_monitor_wrapper,
+    send_trace,
+)
+from common_logic.common_utils.logger_utils import get_logger
+from common_logic.common_utils.python_utils import add_messages, extend_messages
+from common_logic.common_utils.response_utils import stream_response
+from common_logic.common_utils.websocket_utils import TraceWebsocketSender, flush_traces
+from langgraph.graph import END, StateGraph
+
+logger = get_logger("benchmark")
+
+
+class FakeWebsocketClient:
+    """Local stand-in of the api gateway management client, each post takes post_latency"""
+
+    def __init__(self, post_latency=0.0, fail=False):
+        self.post_latency = post_latency
+        self.fail = fail
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        time.sleep(self.post_latency)
+        if self.fail:
+            raise ConnectionError("fake GoneException")
+        with self.lock:
+            self.messages.append(json.loads(Data))
+
+    def get_messages(self, message_type):
+        return [message for message in self.messages if message["message_type"] == message_type]
+
+
+class FakeHistory:
+    def add_user_message(self, *args):
+        pass
+
+    def add_ai_message(self, *args, **kwargs):
+        pass
+
+    def persist(self):
+        pass
+
+
+def build_nodes(node_num=10, work_latency=0.0):
+    def build_node(i):
+        def node(state):
+            time.sleep(work_latency)
+            return {"current_monitor_infos": f"node {i} output"}
+        node.__name__ = f"node_{i}"
+        return node_monitor_wrapper(node)
+    return [build_node(i) for i in range(node_num)]
+
+
+def run_nodes(nodes, enable_trace=True, ws_connection_id="connection_1"):
+    state = {"stream": True, "ws_connection_id": ws_connection_id, "enable_trace": enable_trace, "trace_infos": []}
+    for node in nodes:
+        node(state)
+    return state
+
+
+class TraceSenderTestBase(unittest.TestCase):
+    flush_interval = 0.04
+
+    def setUp(self):
+        self.ws_client = FakeWebsocketClient()
+        self._origin = (websocket_utils.ws_client, websocket_utils.ws_trace_flush_interval)
+        websocket_utils.ws_client = self.ws_client
+        websocket_utils.ws_trace_flush_interval = self.flush_interval
+
+    def tearDown(self):
+        flush_traces()
+        websocket_utils.ws_client, websocket_utils.ws_trace_flush_interval = self._origin
+
+    def get_trace(self):
+        return "".join(message["message"] for message in self.ws_client.get_messages(StreamMessageType.MONITOR))
+
+
+class TestTraceSender(TraceSenderTestBase):
+    def test_batched_traces(self):
+        trace_infos = [f"\n\n trace {i}" for i in range(100)]
+        for trace_info in trace_infos:
+            send_trace(trace_info, True, "connection_1", True)
+        flush_traces("connection_1")
+        self.assertEqual(self.get_trace(), "".join(trace_infos))
+        self.assertLess(len(self.ws_client.messages), 10)
+
+    def test_node_monitor_not_blocked(self):
+        self.ws_client.post_latency = 0.02
+        start = time.perf_counter()
+        state = run_nodes(build_nodes(node_num=10))
+        # 30 trace infos of 20ms each if they were sent in the request path
+        self.assertLess(time.perf_counter() - start, 0.2)
+        self.assertEqual(len(state["trace_infos"]), 20)
+        flush_traces()
+        trace = self.get_trace()
+        self.assertLess(trace.index("**Exit node_0**"), trace.index("**Enter node_1**"))
+        self.assertIn("**Exit node_9**", trace)
+
+    def test_drop_under_pressure(self):
+        self.ws_client.post_latency = 0.05
+        sender = TraceWebsocketSender("connection_1", max_frame_chars=100, max_pending_chars=100)
+        start = time.perf_counter()
+        for i in range(200):
+            sender.send(f"\n\n trace {i:03d}")
+        self.assertLess(time.perf_counter() - start, 0.05)
+        sender.close()
+        trace = self.get_trace()
+        self.assertIn("trace messages dropped", trace)
+        self.assertIn("trace 000", trace)
+
+    def test_send_error_logged(self):
+        self.ws_client.fail = True
+        send_trace("\n\n trace", True, "connection_1", True)
+        flush_traces()
+        self.assertEqual(self.ws_client.messages, [])
+
+    def test_flushed_before_answer(self):
+        run_nodes(build_nodes(node_num=3))
+        event_body = {
+            "request_timestamp": time.time(),
+            "entry_type": "common",
+            "message_id": "1",
+            "ws_connection_id": "connection_1",
+            "custom_message_id": "custom_1",
+            "query": "what is s3",
+            "ddb_history_obj": FakeHistory(),
+        }
+        response = {"answer": iter(["object ", "storage"]), "ddb_additional_kwargs": {}, "extra_response": {}}
+        stream_response(event_body, response)
+        message_types = [message["message_type"] for message in self.ws_client.messages]
+        start_index = message_types.index(StreamMessageType.START)
+        self.assertNotIn(StreamMessageType.MONITOR, message_types[start_index:])
+        self.assertIn("**Exit node_2**", self.get_trace())
+
+
+class TestSyncTrace(TraceSenderTestBase):
+    flush_interval = 0
+
+    def test_message_per_trace(self):
+        run_nodes(build_nodes(node_num=3))
+        self.assertEqual(len(self.ws_client.get_messages(StreamMessageType.MONITOR)), 9)
+        run_nodes(build_nodes(node_num=3), enable_trace=False)
+        self.assertEqual(len(self.ws_client.messages), 9)
+
+
+class TestTraceInfosReducer(unittest.TestCase):
+    def test_graph_trace_infos(self):
+        class State(TypedDict):
+            trace_infos: Annotated[list[str], extend_messages]
+
+        def build_node(name):
+            def node(state):
+                state["trace_infos"].append(f"Enter: {name}")
+                return {"trace_infos": [f"Exit: {name}"]}
+            return node
+
+        workflow = StateGraph(State)
+        workflow.add_node("node_a", build_node("node_a"))
+        workflow.add_node("node_b", build_node("node_b"))
+        workflow.set_entry_point("node_a")
+        workflow.add_edge("node_a", "node_b")
+        workflow.add_edge("node_b", END)
+        output = workflow.compile().invoke({"trace_infos": ["Start"]})
+        self.assertEqual(
+            output["trace_infos"], ["Start", "Enter: node_a", "Exit: node_a", "Enter: node_b", "Exit: node_b"]
+        )
+
+
+def benchmark(node_num=10, work_latency=0.005, post_latency=0.015, repeat=3):
+    """latency of the nodes of a request with tracing off and on, each trace message post takes post_latency"""
+    origin = (websocket_utils.ws_client, websocket_utils.ws_trace_flush_interval)
+    nodes = build_nodes(node_num=node_num, work_latency=work_latency)
+    try:
+        for name, enable_trace, flush_interval in (
+            ("off", False, 0), ("on, sync", True, 0), ("on, batched 40ms", True, 0.04)
+        ):
+            ws_client = FakeWebsocketClient(post_latency=post_latency)
+            websocket_utils.ws_client = ws_client
+            websocket_utils.ws_trace_flush_interval = flush_interval
+            start = time.perf_counter()
+            for _ in range(repeat):
+                run_nodes(nodes, enable_trace=enable_trace)
+            cost = (time.perf_counter() - start) / repeat
+            flush_traces()
+            logger.info(f"bench trace: {name}, {node_num} nodes, request path: {cost * 1000:.1f}ms, "
+                        f"monitor messages: {len(ws_client.messages) / repeat:.0f}")
+    finally:
+        websocket_utils.ws_client, websocket_utils.ws_trace_flush_interval = origin
+
+    for reducer in (add_messages, extend_messages):
+        trace_infos = []
+        start = time.perf_counter()
+        for i in range(20000):
+            trace_infos = reducer(trace_infos, [f"Enter: node_{i}, time: {time.time()}"])
+        logger.info(f"bench reducer: {reducer.__name__}, 20000 updates: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
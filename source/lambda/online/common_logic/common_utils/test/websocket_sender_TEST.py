@@ -0,0 +1,179 @@
+import json
+import sys
+import threading
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils import websocket_utils
+from common_logic.common_utils.constant import StreamMessageType
+from common_logic.common_utils.logger_utils import get_logger
+from common_logic.common_utils.response_utils import stream_response
+from common_logic.common_utils.websocket_utils import CoalescingWebsocketSender
+
+logger = get_logger("benchmark")
+
+
+class FakeWebsocketClient:
+    """Local stand-in of the api gateway management client, each post takes post_latency"""
+
+    def __init__(self, post_latency=0.0, fail_at=None):
+        self.post_latency = post_latency
+        self.fail_at = fail_at
+        self.messages = []
+        self.post_times = []
+        self.lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        time.sleep(self.post_latency)
+        with self.lock:
+            if self.fail_at is not None and len(self.messages) == self.fail_at:
+                self.fail_at = None
+                raise ConnectionError("fake GoneException")
+            self.messages.append(json.loads(Data))
+            self.post_times.append(time.perf_counter())
+
+    def get_messages(self, message_type):
+        return [message for message in self.messages if message["message_type"] == message_type]
+
+
+class FakeHistory:
+    def __init__(self):
+        self.answers = []
+
+    def add_user_message(self, *args):
+        pass
+
+    def add_ai_message(self, message_id, custom_message_id, entry_type, answer, **kwargs):
+        self.answers.append(answer)
+
+    def persist(self):
+        pass
+
+
+def generate_tokens(token_num=200, token_interval=0.001):
+    for i in range(token_num):
+        time.sleep(token_interval)
+        yield f"tok{i} "
+
+
+def run_stream(answer, history=None):
+    event_body = {
+        "request_timestamp": time.time(),
+        "entry_type": "common",
+        "message_id": "1",
+        "ws_connection_id": "connection_1",
+        "custom_message_id": "custom_1",
+        "query": "what is s3",
+        "ddb_history_obj": history or FakeHistory(),
+    }
+    response = {"answer": answer, "ddb_additional_kwargs": {}, "extra_response": {}}
+    return stream_response(event_body, response)
+
+
+class WebsocketSenderTestBase(unittest.TestCase):
+    flush_interval = 0.04
+    post_latency = 0.0
+
+    def setUp(self):
+        self.ws_client = FakeWebsocketClient(post_latency=self.post_latency)
+        self._origin = (websocket_utils.ws_client, websocket_utils.ws_stream_flush_interval)
+        websocket_utils.ws_client = self.ws_client
+        websocket_utils.ws_stream_flush_interval = self.flush_interval
+
+    def tearDown(self):
+        websocket_utils.ws_client, websocket_utils.ws_stream_flush_interval = self._origin
+
+    def assert_stream(self, answer, expected_answer):
+        message_types = [message["message_type"] for message in self.ws_client.messages]
+        self.assertEqual(message_types[0], StreamMessageType.START)
+        self.assertEqual(message_types[-2:], [StreamMessageType.CONTEXT, StreamMessageType.END])
+        chunks = self.ws_client.get_messages(StreamMessageType.CHUNK)
+        self.assertEqual([chunk["chunk_id"] for chunk in chunks], list(range(len(chunks))))
+        self.assertEqual("".join(chunk["message"]["content"] for chunk in chunks), expected_answer)
+        self.assertEqual(answer, expected_answer)
+        return chunks
+
+
+class TestCoalescingSender(WebsocketSenderTestBase):
+    def test_coalesced_stream(self):
+        history = FakeHistory()
+        expected_answer = "".join(generate_tokens(token_interval=0))
+        start = time.perf_counter()
+        answer = run_stream(generate_tokens(), history)
+        chunks = self.assert_stream(answer, expected_answer)
+        self.assertEqual(history.answers, [expected_answer])
+        self.assertLess(len(chunks), 20)
+        # the first token is not held back by the window
+        self.assertEqual(chunks[0]["message"]["content"], "tok0 ")
+        self.assertLess(self.ws_client.post_times[1] - start, self.flush_interval)
+
+    def test_frame_size(self):
+        sender = CoalescingWebsocketSender("connection_1", message={}, max_frame_chars=50, max_pending_chars=100)
+        for token in generate_tokens(token_num=100, token_interval=0):
+            sender.send(token)
+        sender.close()
+        chunks = self.ws_client.get_messages(StreamMessageType.CHUNK)
+        self.assertEqual("".join(chunk["message"]["content"] for chunk in chunks), sender.answer)
+        self.assertTrue(all(len(chunk["message"]["content"]) < 100 + len("tok99 ") for chunk in chunks))
+
+    def test_backpressure(self):
+        self.ws_client.post_latency = 0.02
+        sender = CoalescingWebsocketSender("connection_1", message={}, max_frame_chars=20, max_pending_chars=40)
+        start = time.perf_counter()
+        for token in generate_tokens(token_num=50, token_interval=0):
+            sender.send(token)
+            self.assertLessEqual(sender.pending_chars, 40 + len(token))
+        # the producer waited for the slow connection
+        self.assertGreater(time.perf_counter() - start, 0.1)
+        sender.close()
+        chunks = self.ws_client.get_messages(StreamMessageType.CHUNK)
+        self.assertEqual("".join(chunk["message"]["content"] for chunk in chunks), sender.answer)
+
+    def test_send_error(self):
+        # the second chunk message fails, e.g. the client disconnected
+        self.ws_client.fail_at = 2
+        answer = run_stream(generate_tokens(token_num=50))
+        message_types = [message["message_type"] for message in self.ws_client.messages]
+        self.assertEqual(message_types[-1], StreamMessageType.ERROR)
+        self.assertNotIn(StreamMessageType.END, message_types)
+        self.assertTrue("".join(generate_tokens(token_num=50, token_interval=0)).startswith(answer))
+
+
+class TestUncoalescedSender(WebsocketSenderTestBase):
+    flush_interval = 0
+
+    def test_message_per_chunk(self):
+        answer = run_stream(generate_tokens(token_num=50, token_interval=0))
+        chunks = self.assert_stream(answer, "".join(generate_tokens(token_num=50, token_interval=0)))
+        self.assertEqual(len(chunks), 50)
+        answer = run_stream("object storage")
+        self.assertEqual(answer, "object storage")
+
+
+def benchmark(token_num=300, token_interval=0.002, post_latency=0.015):
+    """messages, time to first token and duration of a streamed answer over a websocket with post_latency per message"""
+    origin = (websocket_utils.ws_client, websocket_utils.ws_stream_flush_interval)
+    try:
+        for flush_interval in (0, 0.03, 0.05):
+            ws_client = FakeWebsocketClient(post_latency=post_latency)
+            websocket_utils.ws_client = ws_client
+            websocket_utils.ws_stream_flush_interval = flush_interval
+            start = time.perf_counter()
+            run_stream(generate_tokens(token_num=token_num, token_interval=token_interval))
+            cost = time.perf_counter() - start
+            chunk_num = len(ws_client.get_messages(StreamMessageType.CHUNK))
+            # post_times[0] is the start message
+            first_token = ws_client.post_times[1] - start
+            logger.info(f"bench flush interval: {flush_interval * 1000:.0f}ms, {token_num} tokens, chunk messages: {chunk_num}, "
+                        f"first token: {first_token * 1000:.1f}ms, answer: {cost * 1000:.0f}ms")
+    finally:
+        websocket_utils.ws_client, websocket_utils.ws_stream_flush_interval = origin
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
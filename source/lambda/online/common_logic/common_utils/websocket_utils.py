@@ -1,12 +1,34 @@
 import json
+import os
+import threading
+import time
+from typing import Callable
 
 import boto3
+from common_logic.common_utils.constant import StreamMessageType
 from common_logic.common_utils.logger_utils import get_logger
 
 logger = get_logger("websocket_utils")
 
 ws_client = None
 
+# window in which the chunks of a streamed answer are coalesced into one
+# message, 0 sends every chunk as its own message
+ws_stream_flush_interval = float(os.environ.get("WS_STREAM_FLUSH_INTERVAL_MS", 0)) / 1000
+# a message is sent before the window ends once it holds this many chars
+ws_stream_max_frame_chars = int(os.environ.get("WS_STREAM_MAX_FRAME_CHARS", 2048))
+# chars waiting to be sent before the producer blocks
+ws_stream_max_pending_chars = int(os.environ.get("WS_STREAM_MAX_PENDING_CHARS", 65536))
+# window in which trace infos are batched into one MONITOR message, 0 sends
+# every trace info at once
+ws_trace_flush_interval = float(os.environ.get("WS_TRACE_FLUSH_INTERVAL_MS", 0)) / 1000
+# chars of trace infos waiting to be sent, newer ones are dropped beyond it
+ws_trace_max_pending_chars = int(os.environ.get("WS_TRACE_MAX_PENDING_CHARS", 262144))
+
+# ws_connection_id -> TraceWebsocketSender
+_trace_senders = {}
+_trace_senders_lock = threading.Lock()
+
 
 class WebsocketClientError(Exception):
     pass
@@ -40,3 +62,221 @@ def send_to_ws_client(message: dict, ws_connection_id):
         Data=json.dumps(message).encode("utf-8"),
     )
 
+
+
+class CoalescingWebsocketSender:
+    """Sends the chunks of a streamed answer as CHUNK messages.
+
+    With a flush interval, the chunks are sent by a background thread, in
+    order, and the chunks produced within the interval go out as one
+    message. The first chunk is sent at once. The producer blocks while
+    more than max_pending_chars are waiting, e.g. on a slow connection.
+    Without a flush interval every chunk is sent at once by the caller.
+    """
+
+    def __init__(
+        self,
+        ws_connection_id,
+        message: dict,
+        flush_interval: float = None,
+        max_frame_chars: int = None,
+        max_pending_chars: int = None,
+        send_message: Callable = None,
+    ):
+        """
+        Args:
+            ws_connection_id: websocket connection of the answer
+            message (dict): fields of the CHUNK messages, e.g. the message_id
+            flush_interval (float): coalescing window in seconds
+            max_frame_chars (int): chars of a message sent before the window ends
+            max_pending_chars (int): chars waiting to be sent before send blocks
+            send_message (callable): sends a message, send_to_ws_client by default
+        """
+        self.ws_connection_id = ws_connection_id
+        self.message = message
+        self.flush_interval = ws_stream_flush_interval if flush_interval is None else flush_interval
+        self.max_frame_chars = max_frame_chars or ws_stream_max_frame_chars
+        self.max_pending_chars = max(max_pending_chars or ws_stream_max_pending_chars, self.max_frame_chars)
+        self.send_message = send_message or send_to_ws_client
+        self.answer_chunks = []
+        self.chunk_id = 0
+        self.pending = []
+        self.pending_chars = 0
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = None
+        if self.flush_interval > 0:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    @property
+    def answer(self) -> str:
+        return "".join(self.answer_chunks)
+
+    def _build_message(self, content: str) -> dict:
+        return {
+            "message_type": StreamMessageType.CHUNK,
+            **self.message,
+            "message": {"role": "assistant", "content": content},
+            "chunk_id": self.chunk_id,
+        }
+
+    def _post(self, content: str):
+        self.send_message(
+            message=self._build_message(content),
+            ws_connection_id=self.ws_connection_id,
+        )
+        self.chunk_id += 1
+
+    def _take_pending(self) -> str:
+        content = "".join(self.pending)
+        self.pending = []
+        self.pending_chars = 0
+        return content
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def send(self, chunk: str):
+        self.answer_chunks.append(chunk)
+        if self.thread is None:
+            self._post(chunk)
+            return
+        with self.condition:
+            while self.pending_chars >= self.max_pending_chars and self.error is None:
+                self.condition.wait()
+            self._raise_error()
+            self.pending.append(chunk)
+            self.pending_chars += len(chunk)
+            self.condition.notify_all()
+
+    def _run(self):
+        last_post_time = float("-inf")
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                # at most one message per window, unless a frame is full
+                deadline = last_post_time + self.flush_interval
+                while not self.closed and self.pending_chars < self.max_frame_chars:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                content = self._take_pending()
+                self.condition.notify_all()
+            last_post_time = time.monotonic()
+            try:
+                self._post(content)
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+
+    def close(self, raise_error: bool = True):
+        """Send the pending chunks and stop the background thread.
+
+        Args:
+            raise_error (bool): raise the error of a failed send
+        """
+        if self.thread is not None:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+            self.thread.join()
+        if raise_error:
+            self._raise_error()
+
+
+class TraceWebsocketSender(CoalescingWebsocketSender):
+    """Sends trace infos as MONITOR messages, batched as the chunks of an answer.
+
+    Tracing never blocks the request, trace infos beyond max_pending_chars
+    are dropped and counted in the next message, and failed sends are
+    logged.
+    """
+
+    def __init__(
+        self,
+        ws_connection_id,
+        flush_interval: float = None,
+        max_frame_chars: int = 16384,
+        max_pending_chars: int = None,
+        send_message: Callable = None,
+    ):
+        super().__init__(
+            ws_connection_id,
+            message={},
+            flush_interval=ws_trace_flush_interval if flush_interval is None else flush_interval,
+            max_frame_chars=max_frame_chars,
+            max_pending_chars=max_pending_chars or ws_trace_max_pending_chars,
+            send_message=send_message,
+        )
+        self.dropped_num = 0
+
+    def _build_message(self, content: str) -> dict:
+        return {
+            "message_type": StreamMessageType.MONITOR,
+            "message": content,
+            "created_time": time.time(),
+        }
+
+    def _take_pending(self) -> str:
+        content = super()._take_pending()
+        if self.dropped_num:
+            content += f"\n\n ... {self.dropped_num} trace messages dropped"
+            self.dropped_num = 0
+        return content
+
+    def send(self, trace_info: str):
+        if self.thread is None:
+            self._post(trace_info)
+            return
+        with self.condition:
+            if self.closed or self.error is not None or self.pending_chars >= self.max_pending_chars:
+                self.dropped_num += 1
+                return
+            self.pending.append(trace_info)
+            self.pending_chars += len(trace_info)
+            self.condition.notify_all()
+
+    def close(self, raise_error: bool = False):
+        super().close(raise_error=False)
+        if self.error is not None:
+            logger.error(f"Error sending trace infos to {self.ws_connection_id}: {self.error}")
+
+
+def send_trace_to_ws_client(trace_info: str, ws_connection_id):
+    """Send a trace info as a MONITOR message, batched in the background with a trace flush interval"""
+    if ws_trace_flush_interval <= 0:
+        send_to_ws_client(
+            message={
+                "message_type": StreamMessageType.MONITOR,
+                "message": trace_info,
+                "created_time": time.time(),
+            },
+            ws_connection_id=ws_connection_id,
+        )
+        return
+    with _trace_senders_lock:
+        sender = _trace_senders.get(ws_connection_id)
+        if sender is None:
+            sender = _trace_senders[ws_connection_id] = TraceWebsocketSender(ws_connection_id)
+    sender.send(trace_info)
+
+
+def flush_traces(ws_connection_id=None):
+    """Send the pending trace infos of the connection, of all connections if None"""
+    with _trace_senders_lock:
+        if ws_connection_id is None:
+            senders = list(_trace_senders.values())
+            _trace_senders.clear()
+        else:
+            senders = [_trace_senders.pop(ws_connection_id)] if ws_connection_id in _trace_senders else []
+    for sender in senders:
+        sender.close()
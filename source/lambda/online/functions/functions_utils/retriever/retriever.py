@@ -1,3 +1,4 @@
+import copy
 import json
 import os
 
@@ -11,6 +12,7 @@ from functions.functions_utils.retriever.utils.aos_retrievers import QueryDocume
 from functions.functions_utils.retriever.utils.reranker import BGEReranker, MergeReranker
 from functions.functions_utils.retriever.utils.context_utils import retriever_results_format
 from functions.functions_utils.retriever.utils.websearch_retrievers import GoogleRetriever
+from functions.functions_utils.retriever.utils.fan_out_retriever import FanOutRetriever
 
 from langchain.retrievers import ContextualCompressionRetriever, AmazonKnowledgeBasesRetriever
 from langchain_community.retrievers import AmazonKnowledgeBasesRetriever
@@ -20,7 +22,9 @@ from langchain.schema.runnable import (
     RunnableLambda,
     RunnablePassthrough,
 )
-from common_logic.common_utils.lambda_invoke_utils import chatbot_lambda_call_wrapper
+from common_logic.common_utils.lambda_invoke_utils import chatbot_lambda_call_wrapper, payload_codec_wrapper
+from common_logic.common_utils.aws_client_utils import get_client
+from common_logic.common_utils.cache_utils import LRUTTLCache, stable_hash
 from common_logic.common_utils.chatbot_utils import ChatbotManager
 
 logger = logging.getLogger("retriever")
@@ -40,12 +44,19 @@ chatbot_manager = ChatbotManager(chatbot_table, index_table, model_table)
 
 region = boto3.Session().region_name
 
-knowledgebase_client = boto3.client("bedrock-agent-runtime", region)
-sm_client = boto3.client("sagemaker-runtime")
+knowledgebase_client = get_client("bedrock-agent-runtime", region_name=region)
+sm_client = get_client("sagemaker-runtime")
+
+enable_retriever_chain_cache = os.environ.get("ENABLE_RETRIEVER_CHAIN_CACHE", "true").lower() in ("true", "1", "t")
+# retriever chains are reused across invocations of a warm container, the query is bound at invoke time
+retriever_chain_cache = LRUTTLCache(maxsize=int(os.environ.get("RETRIEVER_CHAIN_CACHE_MAXSIZE", 32)))
+# run retrievers concurrently with per retriever deadlines instead of one after another
+enable_retriever_fan_out = os.environ.get("ENABLE_RETRIEVER_FAN_OUT", "true").lower() in ("true", "1", "t")
 
 def get_bedrock_kb_retrievers(knowledge_base_id_list, top_k:int):
     retriever_list = [
         AmazonKnowledgeBasesRetriever(
+            client=knowledgebase_client,
             knowledge_base_id=knowledge_base_id,
             retrieval_config={"vectorSearchConfiguration": {"numberOfResults": top_k}})
         for knowledge_base_id in knowledge_base_id_list
@@ -80,8 +91,11 @@ def get_custom_qq_retrievers(config:dict):
     )
     return [qq_retriever]
 
-def get_whole_chain(retriever_list, reranker_config):
-    lotr = MergerRetriever(retrievers=retriever_list)
+def get_whole_chain(retriever_list, reranker_config, retriever_timeouts=None):
+    if enable_retriever_fan_out:
+        lotr = FanOutRetriever(retrievers=retriever_list, timeouts=retriever_timeouts)
+    else:
+        lotr = MergerRetriever(retrievers=retriever_list)
     if len(reranker_config):
         default_reranker_config = {
             "enable_debug": False,
@@ -113,20 +127,53 @@ def get_custom_retrievers(retriever):
     return retriever_dict[retriever['index_type']](retriever)
 
 
+def build_retriever_chain(retriever_configs: list, reranker_config: dict):
+    retriever_list = []
+    retriever_timeouts = []
+    for retriever in retriever_configs:
+        retrievers = get_custom_retrievers(retriever)
+        retriever_list.extend(retrievers)
+        retriever_timeouts.extend([retriever.get("timeout")] * len(retrievers))
+    if len(retriever_list) > 0:
+        whole_chain = get_whole_chain(retriever_list, reranker_config, retriever_timeouts)
+    else:
+        whole_chain = RunnablePassthrough.assign(docs = lambda x: [])
+    return whole_chain
+
+
+def get_retriever_chain(retriever_configs: list, reranker_config: dict):
+    """Get the retriever chain of the retriever and reranker configs,
+    built once per config and reused by later invocations
+
+    :param retriever_configs: retriever configs of the event
+    :param reranker_config: config of the first reranker
+    :return: runnable taking {"query": ..., "debug_info": ...}
+    """
+    if not enable_retriever_chain_cache:
+        return build_retriever_chain(retriever_configs, reranker_config)
+    cache_key = stable_hash(retriever_configs, reranker_config)
+    whole_chain = retriever_chain_cache.get(cache_key)
+    if whole_chain is None:
+        whole_chain = build_retriever_chain(
+            copy.deepcopy(retriever_configs), copy.deepcopy(reranker_config)
+        )
+        retriever_chain_cache.set(cache_key, whole_chain)
+    return whole_chain
+
+
+def get_retriever_chain_cache_stats():
+    return retriever_chain_cache.get_stats()
+
+
+@payload_codec_wrapper
 def lambda_handler(event, context=None):
     event_body = event
-    retriever_list = []
-    for retriever in event_body["retrievers"]:
-        retriever_list.extend(get_custom_retrievers(retriever))
     rerankers = event_body.get("rerankers", None)
     if rerankers:
         reranker_config = rerankers[0]["config"]
     else:
         reranker_config = {}
-    if len(retriever_list) > 0:
-        whole_chain = get_whole_chain(retriever_list, reranker_config)
-    else:
-        whole_chain = RunnablePassthrough.assign(docs = lambda x: [])
+    whole_chain = get_retriever_chain(event_body["retrievers"], reranker_config)
     docs = whole_chain.invoke({"query": event_body["query"], "debug_info": {}})
     return {"code":0, "result": docs}
 
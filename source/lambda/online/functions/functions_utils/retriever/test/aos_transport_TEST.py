@@ -0,0 +1,178 @@
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep", os.path.dirname(__file__)])
+
+from common_logic.common_utils.logger_utils import get_logger
+from fake_opensearch import FakeAsyncOpenSearch, FakeOpenSearch
+from functions.functions_utils.retriever.utils.aos_transport import (
+    AsyncOpenSearchTransport,
+    MSearchCoalescer,
+)
+from functions.functions_utils.retriever.utils.aos_utils import LLMBotOpenSearchClient
+
+logger = get_logger("benchmark")
+
+INDEX_NAMES = ["fake-qq-index", "fake-qd-index", "fake-intention-index"]
+
+
+def build_indices_data(doc_num=5):
+    return {
+        index_name: [
+            {"text": f"{index_name} doc {i}", "metadata": {"source": f"{index_name}-{i}"}}
+            for i in range(doc_num)
+        ]
+        for index_name in INDEX_NAMES
+    }
+
+
+def get_aos_client(transport="sync", coalesce=False, window=0.002, **fake_kwargs):
+    fake_client = FakeOpenSearch(build_indices_data(), **fake_kwargs)
+    client = fake_client
+    if transport == "async":
+        client = AsyncOpenSearchTransport(client=FakeAsyncOpenSearch(fake_client))
+    aos_client = LLMBotOpenSearchClient("fake-opensearch-host", client=client, coalesce=coalesce)
+    if coalesce:
+        aos_client.coalescer.window = window
+    aos_client.invalidate_index_metadata()
+    for index_name in INDEX_NAMES:
+        aos_client.index_exists(index_name)
+    fake_client.request_counter.clear()
+    return aos_client, fake_client
+
+
+def run_turn(aos_client, executor, turn_id=0):
+    """one turn searches every index concurrently, like the fan out retriever"""
+    futures = [
+        executor.submit(aos_client.search, index_name, "basic", f"{index_name}-{turn_id % 5}", "metadata.source", 3)
+        for index_name in INDEX_NAMES
+    ]
+    return [future.result() for future in futures]
+
+
+class TestMSearchCoalescer(unittest.TestCase):
+    def test_concurrent_searches_across_indices_in_one_msearch(self):
+        aos_client, fake_client = get_aos_client(coalesce=True, window=0.05)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            responses = run_turn(aos_client, executor, turn_id=2)
+        self.assertEqual(fake_client.request_counter["msearch"], 1)
+        self.assertEqual(fake_client.request_counter["search"], 0)
+        self.assertEqual(
+            [r["hits"]["hits"][0]["_source"]["metadata"]["source"] for r in responses],
+            [f"{index_name}-2" for index_name in INDEX_NAMES]
+        )
+        self.assertEqual(aos_client.get_coalescer_stats(), {"round_trips": 1, "searches": 3, "max_batch_size": 3})
+
+    def test_parity_with_direct_search(self):
+        direct_client, _ = get_aos_client()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            expected = [run_turn(direct_client, executor, turn_id=i) for i in range(5)]
+        coalesced_client, _ = get_aos_client(coalesce=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            responses = [run_turn(coalesced_client, executor, turn_id=i) for i in range(5)]
+        self.assertEqual(responses, expected)
+
+    def test_msearch_merged_with_concurrent_search(self):
+        aos_client, fake_client = get_aos_client(coalesce=True, window=0.05)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            msearch_future = executor.submit(
+                aos_client.msearch, INDEX_NAMES[1], "basic", [f"{INDEX_NAMES[1]}-1", f"{INDEX_NAMES[1]}-3"], "metadata.source", 1
+            )
+            search_future = executor.submit(aos_client.search, INDEX_NAMES[0], "basic", f"{INDEX_NAMES[0]}-4", "metadata.source", 1)
+            msearch_responses, search_response = msearch_future.result(), search_future.result()
+        self.assertEqual(fake_client.request_counter["msearch"], 1)
+        self.assertEqual(len(msearch_responses), 2)
+        self.assertEqual(search_response["hits"]["hits"][0]["_source"]["metadata"]["source"], f"{INDEX_NAMES[0]}-4")
+
+    def test_missing_index_invalidates_metadata(self):
+        aos_client, fake_client = get_aos_client(coalesce=True)
+        del fake_client.indices_data[INDEX_NAMES[0]]
+        self.assertEqual(aos_client.search(INDEX_NAMES[0], "basic", "a", "metadata.source"), [])
+        self.assertIsNone(aos_client.index_metadata_cache.get(INDEX_NAMES[0]))
+
+    def test_max_batch_size(self):
+        fake_client = FakeOpenSearch(build_indices_data())
+        coalescer = MSearchCoalescer(fake_client, window=0.05, max_batch_size=2)
+        responses = coalescer.msearch([(INDEX_NAMES[0], {"query": {}}) for _ in range(5)])
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(fake_client.request_counter["msearch"], 3)
+
+    def test_transport_error_fails_every_waiter(self):
+        class BrokenClient:
+            def msearch(self, body):
+                raise ConnectionError("connection reset")
+
+        coalescer = MSearchCoalescer(BrokenClient(), window=0.01)
+        with self.assertRaises(ConnectionError):
+            coalescer.search(INDEX_NAMES[0], {"query": {}})
+
+
+class TestAsyncTransport(unittest.TestCase):
+    def test_parity_with_sync_client(self):
+        sync_client, _ = get_aos_client()
+        async_client, fake_client = get_aos_client(transport="async")
+        try:
+            for index_name in INDEX_NAMES:
+                self.assertEqual(
+                    async_client.search(index_name, "basic", f"{index_name}-1", "metadata.source"),
+                    sync_client.search(index_name, "basic", f"{index_name}-1", "metadata.source")
+                )
+            self.assertEqual(
+                async_client.msearch(INDEX_NAMES[0], "basic", ["a", f"{INDEX_NAMES[0]}-0"], "metadata.source"),
+                sync_client.msearch(INDEX_NAMES[0], "basic", ["a", f"{INDEX_NAMES[0]}-0"], "metadata.source")
+            )
+            self.assertFalse(async_client.index_exists("missing-index"))
+        finally:
+            async_client.client.close()
+
+    def test_concurrent_threads_share_one_loop(self):
+        async_client, fake_client = get_aos_client(transport="async", latency=0.05)
+        try:
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=40) as executor:
+                for future in [executor.submit(run_turn, async_client, executor, i) for i in range(10)]:
+                    future.result()
+            self.assertLess(time.perf_counter() - start, 0.5)
+            self.assertEqual(fake_client.request_counter["search"], 30)
+            self.assertTrue(any(t.name == "aos_async_transport" for t in threading.enumerate()))
+        finally:
+            async_client.client.close()
+
+
+def benchmark(latency=0.01, item_latency=0.0005, rounds=3):
+    modes = [
+        ("sync, pool 10", {"transport": "sync", "coalesce": False, "max_connections": 10}),
+        ("sync, pool 32", {"transport": "sync", "coalesce": False, "max_connections": 32}),
+        ("sync, pool 32, coalesced", {"transport": "sync", "coalesce": True, "max_connections": 32}),
+        ("async, pool 32", {"transport": "async", "coalesce": False, "max_connections": 32}),
+        ("async, pool 32, coalesced", {"transport": "async", "coalesce": True, "max_connections": 32}),
+    ]
+    for concurrency in (1, 10, 100):
+        for name, kwargs in modes:
+            aos_client, fake_client = get_aos_client(latency=latency, item_latency=item_latency, **kwargs)
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency * (len(INDEX_NAMES) + 1))
+            start = time.perf_counter()
+            for _ in range(rounds):
+                turns = [executor.submit(run_turn, aos_client, executor, i) for i in range(concurrency)]
+                for turn in turns:
+                    turn.result()
+            elapsed = time.perf_counter() - start
+            executor.shutdown()
+            if kwargs["transport"] == "async":
+                aos_client.client.close()
+            logger.info(
+                f"bench concurrent turns: {concurrency}, {name}: "
+                f"{concurrency * rounds / elapsed:.1f} turns/s, "
+                f"{fake_client.round_trips / (concurrency * rounds):.2f} requests/turn"
+            )
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -0,0 +1,123 @@
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+import numpy as np
+from common_logic.common_utils.logger_utils import get_logger
+from functions.functions_utils.retriever.utils import reranker
+from functions.functions_utils.retriever.utils.reranker import (
+    BGEM3Reranker,
+    batch_colbert_score,
+    pad_colbert_vecs,
+)
+from langchain.docstore.document import Document
+
+logger = get_logger("benchmark")
+
+DIM = 1024
+
+
+def build_colbert_vecs(rng, token_num, dim=DIM):
+    vecs = rng.standard_normal((token_num, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=-1, keepdims=True)
+
+
+def colbert_score_one_by_one(q_reps, p_reps_list):
+    """the previous per document scorer"""
+    scores = []
+    for p_reps in p_reps_list:
+        token_scores = np.einsum('nik,njk->nij', np.asarray([q_reps]), np.asarray([p_reps]))
+        scores.append(np.sum(token_scores.max(-1)) / 1)
+    return np.asarray(scores)
+
+
+class TestBatchColbertScore(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.query = build_colbert_vecs(self.rng, 12)
+        self.docs = [build_colbert_vecs(self.rng, n) for n in (5, 40, 1, 77, 23)]
+
+    def test_parity(self):
+        expected = colbert_score_one_by_one(self.query, self.docs)
+        scores = batch_colbert_score(self.query, self.docs, dtype=np.float32)
+        np.testing.assert_allclose(scores, expected, rtol=1e-5, atol=1e-5)
+
+    def test_nested_lists(self):
+        expected = colbert_score_one_by_one(self.query, self.docs)
+        scores = batch_colbert_score(self.query.tolist(), [d.tolist() for d in self.docs])
+        np.testing.assert_allclose(scores, expected, rtol=1e-5, atol=1e-5)
+
+    def test_float16_storage(self):
+        padded, lengths = pad_colbert_vecs(self.docs, np.float16)
+        self.assertEqual(padded.dtype, np.float16)
+        self.assertEqual(padded.shape, (5, 77, DIM))
+        self.assertEqual(lengths.tolist(), [5, 40, 1, 77, 23])
+        expected = colbert_score_one_by_one(self.query, self.docs)
+        scores = batch_colbert_score(self.query, self.docs, dtype=np.float16)
+        np.testing.assert_allclose(scores, expected, rtol=1e-2, atol=1e-2)
+        self.assertEqual(np.argsort(scores).tolist(), np.argsort(expected).tolist())
+
+    def test_blocks(self):
+        origin_max_block_elements = reranker.colbert_score_max_block_elements
+        reranker.colbert_score_max_block_elements = 1
+        try:
+            scores = batch_colbert_score(self.query, self.docs, dtype=np.float32)
+        finally:
+            reranker.colbert_score_max_block_elements = origin_max_block_elements
+        np.testing.assert_allclose(scores, colbert_score_one_by_one(self.query, self.docs), rtol=1e-5, atol=1e-5)
+
+    def test_empty_candidates(self):
+        self.assertEqual(batch_colbert_score(self.query, []).shape, (0,))
+        scores = batch_colbert_score(self.query, [[], self.docs[0]])
+        self.assertEqual(scores[0], 0)
+        self.assertGreater(scores[1], 0)
+
+    def test_reranker(self):
+        docs = [
+            Document(
+                page_content=f"doc {i}",
+                metadata={
+                    "retrieval_data": {"colbert": d.tolist()},
+                    "retrieval_content": f"doc {i}",
+                    "source": f"source {i}",
+                },
+            )
+            for i, d in enumerate(self.docs)
+        ]
+        query = {"colbert": self.query.tolist(), "debug_info": {}}
+        results = BGEM3Reranker().compress_documents(docs, query)
+        expected = colbert_score_one_by_one(self.query, self.docs)
+        self.assertEqual(
+            [doc.page_content for doc in results],
+            [f"doc {i}" for i in np.argsort(-expected)]
+        )
+        self.assertEqual(len(query["debug_info"]["knowledge_qa_rerank"]), 5)
+
+
+def benchmark():
+    rng = np.random.default_rng(0)
+    query = build_colbert_vecs(rng, 32)
+    logger.info("bench candidates, doc tokens, one by one ms, batched float32 ms, batched float16 ms")
+    for candidate_num in (10, 50, 200):
+        for token_num in (64, 256, 512):
+            docs = [build_colbert_vecs(rng, int(token_num * rng.uniform(0.5, 1.0))) for _ in range(candidate_num)]
+            doc_lists = [d.tolist() for d in docs]
+            latencies = []
+            for score_func in (
+                lambda: colbert_score_one_by_one(query.tolist(), doc_lists),
+                lambda: batch_colbert_score(query.tolist(), doc_lists, dtype=np.float32),
+                lambda: batch_colbert_score(query.tolist(), doc_lists, dtype=np.float16),
+            ):
+                start = time.perf_counter()
+                score_func()
+                latencies.append((time.perf_counter() - start) * 1000)
+            logger.info(f"bench {candidate_num}, {token_num}, " + ", ".join(f"{x:.1f}" for x in latencies))
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
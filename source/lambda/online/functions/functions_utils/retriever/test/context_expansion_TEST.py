@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep", os.path.dirname(__file__)])
+
+from common_logic.common_utils.logger_utils import get_logger
+from fake_opensearch import FakeOpenSearch
+from functions.functions_utils.retriever.utils.aos_utils import LLMBotOpenSearchClient
+from functions.functions_utils.retriever.utils.context_expansion import (
+    ContextExpander,
+    benchmark_context_expansion,
+)
+
+logger = get_logger("benchmark")
+
+INDEX_NAME = "fake-qd-index"
+
+
+def build_chunks(doc_num=5, section_num=8):
+    chunks = []
+    for doc_id in range(1, doc_num + 1):
+        for section_id in range(1, section_num + 1):
+            chunk_id = f"${doc_id}-{section_id}"
+            chunks.append({
+                "text": f"doc {doc_id} section {section_id}",
+                "metadata": {
+                    "chunk_id": chunk_id,
+                    "file_path": f"s3://bucket/doc_{doc_id}.md",
+                    "heading_hierarchy": {
+                        "previous": f"${doc_id}-{section_id - 1}" if section_id > 1 else "",
+                        "next": f"${doc_id}-{section_id + 1}" if section_id < section_num else "",
+                    },
+                },
+            })
+    return chunks
+
+
+def build_hits(chunks, hit_num):
+    step = max(len(chunks) // hit_num, 1)
+    return [{"_score": 1.0, "_source": chunk} for chunk in chunks[::step][:hit_num]]
+
+
+def legacy_get_context(aos_client, aos_hit, index_name, window_size):
+    """one search per neighbor, the behavior before batched expansion"""
+    chunk_id = aos_hit["_source"]["metadata"]["chunk_id"]
+    chunk_id_prefix = "-".join(chunk_id.split("-")[:-1])
+    section_id = int(chunk_id.split("-")[-1])
+
+    def _get(chunk_id):
+        response = aos_client.search(
+            index_name=index_name,
+            query_type="basic",
+            query_term=chunk_id,
+            field="metadata.chunk_id",
+            size=1,
+        )
+        hits = response["hits"]["hits"]
+        return hits[0]["_source"]["text"] if hits else None
+
+    previous_content_list = []
+    for previous_section_id in range(section_id - 1, max(section_id - window_size, 1) - 1, -1):
+        text = _get(f"{chunk_id_prefix}-{previous_section_id}")
+        if text is None:
+            break
+        previous_content_list.insert(0, text)
+    next_content_list = []
+    for next_section_id in range(section_id + 1, section_id + window_size + 1):
+        text = _get(f"{chunk_id_prefix}-{next_section_id}")
+        if text is None:
+            break
+        next_content_list.append(text)
+    return [previous_content_list, next_content_list]
+
+
+def get_aos_client(chunks, latency=0.0):
+    fake_client = FakeOpenSearch({INDEX_NAME: chunks}, latency=latency)
+    return LLMBotOpenSearchClient("fake-opensearch-host", client=fake_client), fake_client
+
+
+class TestContextExpansion(unittest.TestCase):
+    def test_parity_with_sequential_lookups(self):
+        chunks = build_chunks()
+        hits = build_hits(chunks, hit_num=10)
+        aos_client, _ = get_aos_client(chunks)
+        for window_size in (1, 2, 3):
+            windows = ContextExpander(aos_client, INDEX_NAME).expand(hits, window_size)
+            expected = [legacy_get_context(aos_client, hit, INDEX_NAME, window_size) for hit in hits]
+            self.assertEqual(windows, expected)
+
+    def test_single_round_trip_for_full_windows(self):
+        chunks = build_chunks(section_num=20)
+        hits = [{"_score": 1.0, "_source": c} for c in chunks if c["metadata"]["chunk_id"].endswith("-10")]
+        aos_client, fake_client = get_aos_client(chunks)
+        expander = ContextExpander(aos_client, INDEX_NAME)
+        windows = expander.expand(hits, window_size=3)
+        self.assertEqual(expander.stats["round_trips"], 1)
+        self.assertEqual(fake_client.request_counter["msearch"], 1)
+        self.assertEqual(windows[0][0], ["doc 1 section 7", "doc 1 section 8", "doc 1 section 9"])
+        self.assertEqual(windows[0][1], ["doc 1 section 11", "doc 1 section 12", "doc 1 section 13"])
+
+    def test_heading_hierarchy_fallback(self):
+        chunks = [
+            {"text": "a", "metadata": {"chunk_id": "$1-1", "heading_hierarchy": {"previous": "", "next": "$2-1"}}},
+            {"text": "b", "metadata": {"chunk_id": "$2-1", "heading_hierarchy": {"previous": "$1-1", "next": "$3-1"}}},
+            {"text": "c", "metadata": {"chunk_id": "$3-1", "heading_hierarchy": {"previous": "$2-1", "next": ""}}},
+        ]
+        aos_client, _ = get_aos_client(chunks)
+        windows = ContextExpander(aos_client, INDEX_NAME).expand([{"_source": chunks[1]}], window_size=2)
+        self.assertEqual(windows, [[["a"], ["c"]]])
+
+    def test_hits_without_chunk_id(self):
+        aos_client, fake_client = get_aos_client([])
+        windows = ContextExpander(aos_client, INDEX_NAME).expand([{"_source": {"metadata": {}}}], window_size=2)
+        self.assertEqual(windows, [[[], []]])
+        self.assertEqual(fake_client.round_trips, 0)
+
+
+def benchmark(latency=0.005, hit_num=10):
+    chunks = build_chunks(doc_num=20, section_num=20)
+    hits = build_hits(chunks, hit_num)
+    for window_size in (1, 2, 4):
+        aos_client, fake_client = get_aos_client(chunks, latency=latency)
+        start = time.perf_counter()
+        for hit in hits:
+            legacy_get_context(aos_client, hit, INDEX_NAME, window_size)
+        legacy_latency = time.perf_counter() - start
+        legacy_round_trips = fake_client.round_trips
+
+        aos_client, fake_client = get_aos_client(chunks, latency=latency)
+        result = benchmark_context_expansion(aos_client, INDEX_NAME, hits, window_size)
+        logger.info(
+            f"hits: {hit_num}, window_size: {window_size}, "
+            f"sequential: {legacy_round_trips} round trips {legacy_latency:.3f}s, "
+            f"batched: {fake_client.round_trips} round trips {result['total_latency']:.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -0,0 +1,107 @@
+import sys
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils.cache_utils import LRUTTLCache, SharedCacheBackendBase
+from functions.functions_utils.retriever.utils import aos_retrievers
+
+
+class FakeEmbeddingEndpoint:
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, prompt, endpoint_name, model_type, stop, region_name, target_model=None, client=None):
+        self.prompts.append(prompt)
+        return [float(len(prompt)), float(len(self.prompts))]
+
+
+class DictSharedBackend(SharedCacheBackendBase):
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.fake_endpoint = FakeEmbeddingEndpoint()
+        self._origin_endpoint = aos_retrievers.SagemakerEndpointVectorOrCross
+        aos_retrievers.SagemakerEndpointVectorOrCross = self.fake_endpoint
+        aos_retrievers.query_embedding_cache.clear()
+        aos_retrievers.query_embedding_cache.reset_stats()
+        aos_retrievers.query_embedding_cache.set_shared_backend(None)
+
+    def tearDown(self):
+        aos_retrievers.SagemakerEndpointVectorOrCross = self._origin_endpoint
+
+    def test_same_query_embedded_once(self):
+        for _ in range(3):
+            aos_retrievers.get_similarity_embedding("what is s3", "endpoint", "model.tar.gz", "vector")
+        self.assertEqual(len(self.fake_endpoint.prompts), 1)
+        stats = aos_retrievers.get_embedding_cache_stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_query_normalization(self):
+        aos_retrievers.get_similarity_embedding("what is  s3 ", "endpoint", "model.tar.gz", "vector")
+        aos_retrievers.get_similarity_embedding("what is s3", "endpoint", "model.tar.gz", "vector")
+        self.assertEqual(len(self.fake_endpoint.prompts), 1)
+
+    def test_instruction_prefix_is_part_of_key(self):
+        aos_retrievers.get_similarity_embedding("what is s3", "endpoint", "model.tar.gz", "vector")
+        aos_retrievers.get_relevance_embedding("what is s3", "en", "endpoint", "model.tar.gz", "vector")
+        aos_retrievers.get_relevance_embedding("what is s3", "en", "endpoint", "model.tar.gz", "vector")
+        self.assertEqual(len(self.fake_endpoint.prompts), 2)
+        self.assertTrue(self.fake_endpoint.prompts[1].startswith("Represent this sentence"))
+
+    def test_m3_shares_similarity_and_relevance(self):
+        aos_retrievers.get_similarity_embedding("what is s3", "endpoint", "model.tar.gz", "m3")
+        aos_retrievers.get_relevance_embedding("what is s3", "zh", "endpoint", "model.tar.gz", "m3")
+        self.assertEqual(len(self.fake_endpoint.prompts), 1)
+
+    def test_endpoint_and_model_are_part_of_key(self):
+        aos_retrievers.get_similarity_embedding("what is s3", "endpoint-a", "model.tar.gz", "vector")
+        aos_retrievers.get_similarity_embedding("what is s3", "endpoint-b", "model.tar.gz", "vector")
+        aos_retrievers.get_similarity_embedding("what is s3", "endpoint-a", "other.tar.gz", "vector")
+        self.assertEqual(len(self.fake_endpoint.prompts), 3)
+
+    def test_shared_tier(self):
+        backend = DictSharedBackend()
+        aos_retrievers.query_embedding_cache.set_shared_backend(backend)
+        embedding = aos_retrievers.get_similarity_embedding("what is s3", "endpoint", "model.tar.gz", "vector")
+        # a cold container only sees the shared tier
+        aos_retrievers.query_embedding_cache.clear()
+        self.assertEqual(
+            aos_retrievers.get_similarity_embedding("what is s3", "endpoint", "model.tar.gz", "vector"),
+            embedding
+        )
+        self.assertEqual(len(self.fake_endpoint.prompts), 1)
+        self.assertEqual(aos_retrievers.get_embedding_cache_stats()["shared_hits"], 1)
+
+
+class TestLRUTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LRUTTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+    def test_ttl_expiration(self):
+        cache = LRUTTLCache(maxsize=2, ttl=0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+        cache.set("b", 2, ttl=60)
+        self.assertEqual(cache.get("b"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
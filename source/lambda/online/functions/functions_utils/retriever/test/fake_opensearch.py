@@ -0,0 +1,310 @@
+"""Local in-memory stand-in of the opensearch-py client used by retriever tests."""
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import Counter
+from fnmatch import fnmatch
+
+from opensearchpy.exceptions import NotFoundError
+
+
+def get_field_value(source: dict, field: str):
+    value = source
+    for key in field.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+_EXCLUDED = object()
+
+
+def _filter_value(value, path: str, includes: list, excludes: list, included: bool):
+    if any(fnmatch(path, pattern) for pattern in excludes):
+        return _EXCLUDED
+    if not included:
+        included = any(fnmatch(path, pattern) for pattern in includes)
+    if isinstance(value, dict):
+        filtered = {}
+        for k, v in value.items():
+            sub_value = _filter_value(v, f"{path}.{k}", includes, excludes, included)
+            if sub_value is not _EXCLUDED:
+                filtered[k] = sub_value
+        if filtered or included:
+            return filtered
+        return _EXCLUDED
+    return value if included else _EXCLUDED
+
+
+def filter_source(source: dict, source_filter):
+    """`_source` filtering of a search request, wildcards supported"""
+    if source_filter is None or source_filter is True:
+        return source
+    if source_filter is False:
+        return None
+    if isinstance(source_filter, str):
+        source_filter = [source_filter]
+    if isinstance(source_filter, list):
+        source_filter = {"includes": source_filter}
+    includes = source_filter.get("includes") or []
+    excludes = source_filter.get("excludes") or []
+    filtered = {}
+    for k, v in source.items():
+        value = _filter_value(v, k, includes, excludes, not includes)
+        if value is not _EXCLUDED:
+            filtered[k] = value
+    return filtered
+
+
+def get_docvalue_fields(source: dict, docvalue_fields: list):
+    fields = {}
+    for docvalue_field in docvalue_fields:
+        if isinstance(docvalue_field, dict):
+            docvalue_field = docvalue_field["field"]
+        path = docvalue_field[:-len(".keyword")] if docvalue_field.endswith(".keyword") else docvalue_field
+        value = get_field_value(source, path)
+        if value is not None:
+            fields[docvalue_field] = [value]
+    return fields
+
+
+def infer_mapping(docs: list):
+    """dynamic mapping of the fields present in docs"""
+    def _infer(value):
+        if isinstance(value, dict):
+            properties = {}
+            for k, v in value.items():
+                properties[k] = _infer(v)
+            return {"properties": properties}
+        if isinstance(value, bool):
+            return {"type": "boolean"}
+        if isinstance(value, (int, float)):
+            return {"type": "float"}
+        return {"type": "text", "fields": {"keyword": {"type": "keyword"}}}
+
+    properties = {}
+    for doc in docs:
+        for k, v in _infer(doc)["properties"].items():
+            if "properties" in v and "properties" in properties.get(k, {}):
+                properties[k]["properties"].update(v["properties"])
+            else:
+                properties[k] = v
+    return {"properties": properties}
+
+
+def knn_score(vector: list, query_vector: list, engine: str, space_type: str) -> float:
+    """score of a k-NN hit, as documented for the OpenSearch k-NN plugin"""
+    if space_type == "l2":
+        return 1 / (1 + sum((x - y) ** 2 for x, y in zip(vector, query_vector)))
+    inner_product = sum(x * y for x, y in zip(vector, query_vector))
+    if space_type == "cosinesimil":
+        norm = math.sqrt(sum(x * x for x in vector)) * math.sqrt(sum(y * y for y in query_vector))
+        cosine = inner_product / norm if norm else 0.0
+        if engine == "lucene":
+            return (1 + cosine) / 2
+        return 1 / (2 - cosine)
+    if space_type == "innerproduct":
+        return 1 / (1 - inner_product) if inner_product <= 0 else 1 + inner_product
+    raise ValueError(space_type)
+
+
+def get_knn_query(query: dict):
+    if "knn" in query:
+        return query["knn"]
+    for sub_query in query.get("bool", {}).get("must", []):
+        if "knn" in sub_query:
+            return sub_query["knn"]
+    return None
+
+
+class FakeIndices:
+    def __init__(self, fake_client):
+        self.fake_client = fake_client
+
+    def get_mapping(self, index):
+        return self.get(index)
+
+    def get(self, index):
+        self.fake_client._count("indices.get")
+        self.fake_client._sleep()
+        if index not in self.fake_client.indices_data:
+            raise NotFoundError(404, "index_not_found_exception", {})
+        mappings = self.fake_client.mappings.get(index)
+        if mappings is None:
+            mappings = infer_mapping(self.fake_client.indices_data[index])
+        return {index: {"mappings": mappings}}
+
+
+class FakeOpenSearch:
+    """
+    Supports the query shapes built by LLMBotOpenSearchClient:
+    match_phrase (exact equality here), match and knn (returns the first docs,
+    or exact kNN scoring with `knn_scoring`).
+    """
+
+    def __init__(
+        self,
+        indices_data: dict,
+        latency: float = 0.0,
+        mappings: dict = None,
+        max_connections: int = None,
+        item_latency: float = 0.0,
+        knn_scoring: bool = False,
+    ):
+        """
+        :param latency: seconds per request
+        :param max_connections: concurrent requests served, others wait for a connection
+        :param item_latency: extra seconds per search of a msearch request
+        :param knn_scoring: score knn queries with the k-NN method in the mapping of the index
+        """
+        self.indices_data = indices_data
+        self.knn_scoring = knn_scoring
+        self.mappings = mappings or {}
+        self.latency = latency
+        self.item_latency = item_latency
+        self.max_connections = max_connections
+        self._connections = threading.BoundedSemaphore(max_connections) if max_connections else None
+        self._counter_lock = threading.Lock()
+        self.request_counter = Counter()
+        # bytes of the response bodies, per request type
+        self.response_bytes = Counter()
+        self.indices = FakeIndices(self)
+
+    def _count(self, request_type):
+        with self._counter_lock:
+            self.request_counter[request_type] += 1
+
+    def _count_bytes(self, request_type, response):
+        with self._counter_lock:
+            self.response_bytes[request_type] += len(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+
+    @property
+    def transport_bytes(self):
+        return sum(self.response_bytes.values())
+
+    def _sleep(self, item_num: int = 0):
+        latency = self.latency + self.item_latency * item_num
+        if not latency:
+            return
+        if self._connections is None:
+            time.sleep(latency)
+            return
+        with self._connections:
+            time.sleep(latency)
+
+    @property
+    def round_trips(self):
+        return sum(self.request_counter.values())
+
+    def _match(self, source: dict, query: dict):
+        if "bool" in query:
+            should = query["bool"].get("should") or query["bool"].get("must") or []
+            return all(self._match(source, q) for q in should)
+        if "match_phrase" in query:
+            field, value = list(query["match_phrase"].items())[0]
+            return get_field_value(source, field) == value
+        return True
+
+    def _search(self, body: dict, index: str):
+        if index not in self.indices_data:
+            return {"error": {"type": "index_not_found_exception"}, "status": 404}
+        hits = []
+        for i, source in enumerate(self.indices_data[index]):
+            if not self._match(source, body.get("query", {})):
+                continue
+            hit = {"_index": index, "_id": str(i), "_score": 1.0}
+            hit_source = filter_source(source, body.get("_source"))
+            if hit_source is not None:
+                hit["_source"] = hit_source
+            if body.get("docvalue_fields"):
+                hit["fields"] = get_docvalue_fields(source, body["docvalue_fields"])
+            hits.append(hit)
+        knn_query = get_knn_query(body.get("query", {}))
+        if self.knn_scoring and knn_query:
+            field, params = list(knn_query.items())[0]
+            method = self.mappings.get(index, {}).get("properties", {}).get(field, {}).get("method", {})
+            engine, space_type = method.get("engine", "nmslib"), method.get("space_type", "l2")
+            for hit in hits:
+                vector = get_field_value(self.indices_data[index][int(hit["_id"])], field)
+                hit["_score"] = knn_score(vector, params["vector"], engine, space_type)
+            hits = sorted(hits, key=lambda x: -x["_score"])[:params["k"]]
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits[:body.get("size", 10)]}}
+
+    def search(self, body: dict, index: str):
+        self._count("search")
+        self._sleep()
+        response = self._search(body, index)
+        if "error" in response:
+            raise NotFoundError(404, "index_not_found_exception", {})
+        self._count_bytes("search", response)
+        return response
+
+    def msearch(self, body: list, index: str = None):
+        self._count("msearch")
+        self._sleep(len(body) // 2)
+        responses = []
+        for header, query in zip(body[::2], body[1::2]):
+            responses.append(self._search(query, header.get("index", index)))
+        response = {"responses": responses}
+        self._count_bytes("msearch", response)
+        return response
+
+
+class FakeAsyncIndices:
+    def __init__(self, fake_client):
+        self.fake_client = fake_client
+
+    async def get(self, index):
+        return self.fake_client.indices.get(index)
+
+
+class FakeAsyncOpenSearch:
+    """
+    AsyncOpenSearch stand-in serving the data of a FakeOpenSearch,
+    latency is awaited instead of blocking a thread
+    """
+
+    def __init__(self, fake_client: FakeOpenSearch):
+        self.fake_client = fake_client
+        self.indices = FakeAsyncIndices(fake_client)
+        self._connections = None
+
+    async def _sleep(self, item_num: int = 0):
+        latency = self.fake_client.latency + self.fake_client.item_latency * item_num
+        if not latency:
+            return
+        if self.fake_client.max_connections is None:
+            await asyncio.sleep(latency)
+            return
+        # created lazily on the event loop of the transport
+        if self._connections is None:
+            self._connections = asyncio.Semaphore(self.fake_client.max_connections)
+        async with self._connections:
+            await asyncio.sleep(latency)
+
+    async def search(self, body: dict, index: str):
+        self.fake_client._count("search")
+        await self._sleep()
+        response = self.fake_client._search(body, index)
+        if "error" in response:
+            raise NotFoundError(404, "index_not_found_exception", {})
+        self.fake_client._count_bytes("search", response)
+        return response
+
+    async def msearch(self, body: list, index: str = None):
+        self.fake_client._count("msearch")
+        await self._sleep(len(body) // 2)
+        response = {
+            "responses": [
+                self.fake_client._search(query, header.get("index", index))
+                for header, query in zip(body[::2], body[1::2])
+            ]
+        }
+        self.fake_client._count_bytes("msearch", response)
+        return response
+
+    async def close(self):
+        pass
@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import unittest
+from typing import Dict, List
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep", os.path.dirname(__file__)])
+
+from common_logic.common_utils.cache_utils import LRUTTLCache
+from common_logic.common_utils.logger_utils import get_logger
+from functions.functions_utils.retriever import retriever
+from functions.functions_utils.retriever.utils.fan_out_retriever import FanOutRetriever
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.retrievers.merger_retriever import MergerRetriever
+from langchain.schema.retriever import BaseRetriever
+
+logger = get_logger("benchmark")
+
+
+class SleepRetriever(BaseRetriever):
+    index_name: str
+    latency: float = 0.0
+    doc_num: int = 3
+    fail: bool = False
+
+    def _get_relevant_documents(self, question: Dict, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError(f"{self.index_name} is unavailable")
+        return [
+            Document(
+                page_content=f"{self.index_name} {i}",
+                metadata={
+                    "source": self.index_name,
+                    "score": 1.0 - i * 0.1,
+                    "retrieval_score": 1.0 - i * 0.1,
+                    "retrieval_content": question["query"]
+                }
+            )
+            for i in range(self.doc_num)
+        ]
+
+
+def get_sleep_retrievers(config: dict):
+    return [SleepRetriever(**config)]
+
+
+def get_question():
+    return {"query": "q", "debug_info": {}}
+
+
+class TestFanOutRetriever(unittest.TestCase):
+    def test_parity_with_merger_retriever(self):
+        retrievers = [SleepRetriever(index_name=f"index-{i}", doc_num=i + 1) for i in range(3)]
+        expected = MergerRetriever(retrievers=retrievers).invoke(get_question())
+        docs = FanOutRetriever(retrievers=retrievers).invoke(get_question())
+        self.assertEqual([d.page_content for d in docs], [d.page_content for d in expected])
+
+    def test_latency_is_max_of_retrievers(self):
+        retrievers = [SleepRetriever(index_name=f"index-{i}", latency=0.1) for i in range(4)]
+        question = get_question()
+        start = time.perf_counter()
+        docs = FanOutRetriever(retrievers=retrievers).invoke(question)
+        latency = time.perf_counter() - start
+        self.assertEqual(len(docs), 12)
+        self.assertLess(latency, 0.3)
+        stats = question["debug_info"]["retriever_stats"]
+        self.assertEqual([s["status"] for s in stats], ["ok"] * 4)
+        self.assertTrue(all(s["latency"] >= 0.1 for s in stats))
+
+    def test_deadline_returns_partial_results(self):
+        retrievers = [
+            SleepRetriever(index_name="fast", latency=0.01),
+            SleepRetriever(index_name="slow", latency=0.5),
+        ]
+        question = get_question()
+        start = time.perf_counter()
+        docs = FanOutRetriever(retrievers=retrievers, timeouts=[None, 0.1]).invoke(question)
+        self.assertLess(time.perf_counter() - start, 0.3)
+        self.assertEqual({d.metadata["source"] for d in docs}, {"fast"})
+        stats = question["debug_info"]["retriever_stats"]
+        self.assertEqual(stats[0]["status"], "ok")
+        self.assertEqual(stats[1]["status"], "timeout")
+        self.assertEqual(stats[1]["name"], "SleepRetriever_2-slow")
+
+    def test_error_returns_partial_results(self):
+        retrievers = [
+            SleepRetriever(index_name="broken", fail=True),
+            SleepRetriever(index_name="ok"),
+        ]
+        question = get_question()
+        docs = FanOutRetriever(retrievers=retrievers).invoke(question)
+        self.assertEqual(len(docs), 3)
+        self.assertEqual(question["debug_info"]["retriever_stats"][0]["status"], "error")
+
+
+class TestRetrieverLambdaFanOut(unittest.TestCase):
+    def setUp(self):
+        self.origin_cache = retriever.retriever_chain_cache
+        retriever.retriever_chain_cache = LRUTTLCache(maxsize=4)
+        retriever.retriever_dict["sleep"] = get_sleep_retrievers
+
+    def tearDown(self):
+        retriever.retriever_chain_cache = self.origin_cache
+        retriever.retriever_dict.pop("sleep")
+
+    def test_retriever_stats_in_response(self):
+        event = {
+            "retrievers": [
+                {"index_type": "sleep", "index_name": "fast", "latency": 0.01},
+                {"index_type": "sleep", "index_name": "slow", "latency": 0.5, "timeout": 0.1},
+            ],
+            "rerankers": [],
+            "query": "q",
+        }
+        response = retriever.lambda_handler(event)
+        stats = response["result"]["debug_info"]["retriever_stats"]
+        self.assertEqual([s["status"] for s in stats], ["ok", "timeout"])
+        self.assertEqual(len(response["result"]["docs"]), 3)
+
+
+def benchmark(latency=0.05):
+    for retriever_num in (1, 2, 4, 8):
+        retrievers = [SleepRetriever(index_name=f"index-{i}", latency=latency) for i in range(retriever_num)]
+        for name, merger in (
+            ("merger", MergerRetriever(retrievers=retrievers)),
+            ("fan_out", FanOutRetriever(retrievers=retrievers)),
+        ):
+            start = time.perf_counter()
+            merger.invoke(get_question())
+            logger.info(f"bench retrievers: {retriever_num}, {name}: {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -0,0 +1,183 @@
+import os
+import sys
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep", os.path.dirname(__file__)])
+
+from common_logic.common_utils.logger_utils import get_logger
+from fake_opensearch import FakeOpenSearch
+from functions.functions_utils.retriever.utils import aos_retrievers, projection
+from functions.functions_utils.retriever.utils.aos_utils import LLMBotOpenSearchClient
+from functions.functions_utils.retriever.utils.context_expansion import ContextExpander
+from functions.functions_utils.retriever.utils.projection import (
+    DOC_DOCVALUE_FIELDS,
+    DOC_FIELDS,
+    FAQ_FIELDS,
+    plan_projection,
+)
+
+logger = get_logger("benchmark")
+
+QD_INDEX_NAME = "fake-qd-index"
+QQ_INDEX_NAME = "fake-qq-index"
+VECTOR_DIM = 512
+
+
+def build_vector(seed, dim=VECTOR_DIM):
+    return [round((seed * 31 + i) % 97 / 97, 6) for i in range(dim)]
+
+
+def build_qd_chunks(doc_num=3, section_num=8):
+    chunks = []
+    for doc_id in range(1, doc_num + 1):
+        for section_id in range(1, section_num + 1):
+            chunks.append({
+                "text": f"doc {doc_id} section {section_id} " * 10,
+                "vector_field": build_vector(doc_id * 100 + section_id),
+                "metadata": {
+                    "chunk_id": f"${doc_id}-{section_id}",
+                    "content_type": "paragraph",
+                    "file_path": f"s3://bucket/doc_{doc_id}.md",
+                    "heading_hierarchy": {
+                        "previous": f"${doc_id}-{section_id - 1}" if section_id > 1 else "",
+                        "next": f"${doc_id}-{section_id + 1}" if section_id < section_num else "",
+                    },
+                    "additional_vecs": {
+                        "colbert_vecs": [build_vector(section_id + i, 32) for i in range(16)],
+                    },
+                },
+            })
+    return chunks
+
+
+def build_qq_docs(doc_num=10):
+    return [
+        {
+            "text": f"question {i}",
+            "vector_field": build_vector(i),
+            "metadata": {
+                "file_path": f"s3://bucket/faq_{i % 2}.jsonl",
+                "source": f"s3://bucket/faq_{i % 2}.jsonl",
+                "jsonlAnswer": {"question": f"question {i}", "answer": f"answer {i}"},
+                "additional_vecs": {"colbert_vecs": [build_vector(i + j, 32) for j in range(16)]},
+            },
+        }
+        for i in range(doc_num)
+    ]
+
+
+def get_aos_client():
+    fake_client = FakeOpenSearch({QD_INDEX_NAME: build_qd_chunks(), QQ_INDEX_NAME: build_qq_docs()})
+    aos_client = LLMBotOpenSearchClient("fake-opensearch-host", client=fake_client, coalesce=False)
+    aos_client.invalidate_index_metadata()
+    aos_client.index_exists(QD_INDEX_NAME)
+    aos_client.index_exists(QQ_INDEX_NAME)
+    fake_client.response_bytes.clear()
+    return aos_client, fake_client
+
+
+def run_call_sites(aos_client):
+    """results of the call sites covered by the projection planner"""
+    qd_hits = aos_client.search(QD_INDEX_NAME, "knn", build_vector(1), "vector_field", size=3)["hits"]["hits"]
+    qq_response = aos_client.search(QQ_INDEX_NAME, "knn", build_vector(1), "vector_field", size=5, fields=FAQ_FIELDS)
+    return {
+        "get_doc": aos_retrievers.get_doc("s3://bucket/doc_2.md", QD_INDEX_NAME),
+        "get_context": ContextExpander(aos_client, QD_INDEX_NAME).expand(qd_hits, 2),
+        "get_faq_answer": aos_retrievers.get_faq_answer("s3://bucket/faq_1.jsonl", QQ_INDEX_NAME, "file_path"),
+        "organize_faq_results": aos_retrievers.organize_faq_results(qq_response, QQ_INDEX_NAME),
+    }
+
+
+def measure_transport_bytes(enable_projection):
+    origin_enable = projection.enable_field_projection
+    origin_aos_client = aos_retrievers.aos_client
+    projection.enable_field_projection = enable_projection
+    try:
+        aos_client, fake_client = get_aos_client()
+        aos_retrievers.aos_client = aos_client
+        results = {}
+        transport_bytes = {}
+        for name, result in run_call_sites(aos_client).items():
+            results[name] = result
+        # bytes per call site, measured one by one
+        for name in results:
+            fake_client.response_bytes.clear()
+            run_single_call_site(aos_client, name)
+            transport_bytes[name] = fake_client.transport_bytes
+    finally:
+        projection.enable_field_projection = origin_enable
+        aos_retrievers.aos_client = origin_aos_client
+    return results, transport_bytes
+
+
+def run_single_call_site(aos_client, name):
+    if name == "get_doc":
+        aos_retrievers.get_doc("s3://bucket/doc_2.md", QD_INDEX_NAME)
+    elif name == "get_context":
+        hits = [{"_source": chunk} for chunk in build_qd_chunks()[:3]]
+        ContextExpander(aos_client, QD_INDEX_NAME).expand(hits, 2)
+    elif name == "get_faq_answer":
+        aos_retrievers.get_faq_answer("s3://bucket/faq_1.jsonl", QQ_INDEX_NAME, "file_path")
+    elif name == "organize_faq_results":
+        aos_client.search(QQ_INDEX_NAME, "knn", build_vector(1), "vector_field", size=5, fields=FAQ_FIELDS)
+
+
+class TestProjectionPlanner(unittest.TestCase):
+    def test_source_filtering(self):
+        plan = plan_projection(["text", "metadata.chunk_id"])
+        self.assertEqual(plan.to_query_params(), {
+            "_source": {"includes": ["text", "metadata.chunk_id"], "excludes": projection.VECTOR_EXCLUDES}
+        })
+
+    def test_docvalue_fields_of_keyword_mapping(self):
+        index_fields = {"metadata.chunk_id": "text", "metadata.chunk_id.keyword": "keyword", "metadata.content_type": "text"}
+        plan = plan_projection(DOC_FIELDS, DOC_DOCVALUE_FIELDS, index_fields)
+        self.assertEqual(plan.to_query_params()["docvalue_fields"], ["metadata.chunk_id.keyword"])
+        # unmapped as keyword, read from _source
+        self.assertIn("metadata.content_type", plan.source["includes"])
+
+        response = {"hits": {"hits": [{"_source": {"text": "a"}, "fields": {"metadata.chunk_id.keyword": ["$1-1"]}}]}}
+        plan.restore(response)
+        self.assertEqual(response["hits"]["hits"][0], {"_source": {"text": "a", "metadata": {"chunk_id": "$1-1"}}})
+
+    def test_disabled(self):
+        origin_enable = projection.enable_field_projection
+        projection.enable_field_projection = False
+        try:
+            self.assertIsNone(plan_projection(DOC_FIELDS))
+        finally:
+            projection.enable_field_projection = origin_enable
+
+
+class TestFieldProjection(unittest.TestCase):
+    def test_parity_of_call_sites(self):
+        results, _ = measure_transport_bytes(enable_projection=False)
+        projected_results, _ = measure_transport_bytes(enable_projection=True)
+        for name in ("get_doc", "get_context", "get_faq_answer"):
+            self.assertEqual(projected_results[name], results[name], name)
+        self.assertTrue(results["get_doc"])
+        self.assertEqual(
+            [{k: v for k, v in r.items() if k != "detail"} for r in projected_results["organize_faq_results"]],
+            [{k: v for k, v in r.items() if k != "detail"} for r in results["organize_faq_results"]]
+        )
+
+    def test_transport_bytes(self):
+        _, transport_bytes = measure_transport_bytes(enable_projection=False)
+        _, projected_transport_bytes = measure_transport_bytes(enable_projection=True)
+        logger.info(f"transport bytes, before: {transport_bytes}, after: {projected_transport_bytes}")
+        for name in ("get_doc", "get_context", "get_faq_answer"):
+            self.assertLess(projected_transport_bytes[name], transport_bytes[name] * 0.1, name)
+        # the knn query of organize_faq_results already drops the dense vectors
+        self.assertLessEqual(projected_transport_bytes["organize_faq_results"], transport_bytes["organize_faq_results"])
+
+    def test_docvalue_fields_in_request(self):
+        aos_client, _ = get_aos_client()
+        plan = aos_client.plan_projection(QD_INDEX_NAME, DOC_FIELDS, DOC_DOCVALUE_FIELDS)
+        self.assertEqual(plan.docvalue_fields, {
+            "metadata.chunk_id.keyword": "metadata.chunk_id",
+            "metadata.content_type.keyword": "metadata.content_type",
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep", os.path.dirname(__file__)])
+
+from common_logic.common_utils.logger_utils import get_logger
+from context_expansion_TEST import build_chunks
+from fake_opensearch import FakeOpenSearch
+from functions.functions_utils.retriever.utils import aos_utils
+from functions.functions_utils.retriever.utils.aos_utils import LLMBotOpenSearchClient
+from functions.functions_utils.retriever.utils.context_expansion import ContextExpander
+
+logger = get_logger("benchmark")
+
+INDEX_NAME = "fake-qd-index"
+MAPPINGS = {
+    INDEX_NAME: {
+        "properties": {
+            "text": {"type": "text"},
+            "vector_field": {"type": "knn_vector", "dimension": 2},
+            "metadata": {
+                "properties": {
+                    "chunk_id": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+                    "file_path": {"type": "text"},
+                }
+            },
+        }
+    }
+}
+
+
+def get_aos_client(chunks=None):
+    indices_data = {INDEX_NAME: chunks if chunks is not None else build_chunks()}
+    fake_client = FakeOpenSearch(indices_data, mappings=MAPPINGS)
+    aos_client = LLMBotOpenSearchClient("fake-opensearch-host", client=fake_client)
+    aos_client.invalidate_index_metadata()
+    return aos_client, fake_client
+
+
+def run_retrieval(aos_client, context_num=2):
+    response = aos_client.search(
+        index_name=INDEX_NAME,
+        query_type="knn",
+        query_term=[0.1, 0.2],
+        field="vector_field",
+        size=5,
+    )
+    hits = response["hits"]["hits"]
+    ContextExpander(aos_client, INDEX_NAME).expand(hits, context_num)
+
+
+def count_requests_per_retrieval(enable_cache, retrieval_num=5):
+    origin = aos_utils.enable_index_metadata_cache
+    aos_utils.enable_index_metadata_cache = enable_cache
+    try:
+        aos_client, fake_client = get_aos_client()
+        for _ in range(retrieval_num):
+            run_retrieval(aos_client)
+    finally:
+        aos_utils.enable_index_metadata_cache = origin
+    return {k: v / retrieval_num for k, v in fake_client.request_counter.items()}
+
+
+class TestIndexMetadataCache(unittest.TestCase):
+    def test_requests_per_retrieval(self):
+        before = count_requests_per_retrieval(enable_cache=False)
+        after = count_requests_per_retrieval(enable_cache=True)
+        logger.info(f"requests per retrieval, before: {before}, after: {after}")
+        self.assertEqual(before["indices.get"], before["search"] + before["msearch"])
+        # one indices.get for the whole warm container
+        self.assertEqual(after["indices.get"], 1 / 5)
+        self.assertEqual(after["search"], before["search"])
+
+    def test_mapped_fields(self):
+        aos_client, fake_client = get_aos_client()
+        fields = aos_client.get_index_metadata(INDEX_NAME)["fields"]
+        self.assertEqual(fields["vector_field"], "knn_vector")
+        self.assertEqual(fields["metadata.chunk_id.keyword"], "keyword")
+        self.assertTrue(aos_client.has_field(INDEX_NAME, "metadata.file_path"))
+        self.assertEqual(fake_client.request_counter["indices.get"], 1)
+
+    def test_unmapped_field_skips_search(self):
+        aos_client, fake_client = get_aos_client()
+        response = aos_client.search(INDEX_NAME, "basic", "a", field="metadata.unknown")
+        self.assertEqual(response["hits"]["hits"], [])
+        self.assertEqual(fake_client.request_counter["search"], 0)
+
+    def test_missing_field_negative_caching(self):
+        aos_client, fake_client = get_aos_client()
+        for _ in range(3):
+            self.assertFalse(aos_client.has_field(INDEX_NAME, "metadata.unknown"))
+        # the initial lookup and one refresh
+        self.assertEqual(fake_client.request_counter["indices.get"], 2)
+
+        origin = aos_utils.index_metadata_negative_cache_ttl
+        aos_utils.index_metadata_negative_cache_ttl = 0
+        try:
+            self.assertFalse(aos_client.has_field(INDEX_NAME, "metadata.other"))
+            self.assertFalse(aos_client.has_field(INDEX_NAME, "metadata.other"))
+        finally:
+            aos_utils.index_metadata_negative_cache_ttl = origin
+        # expired negative lookups refresh the mapping again
+        self.assertEqual(fake_client.request_counter["indices.get"], 4)
+
+    def test_negative_caching(self):
+        aos_client, fake_client = get_aos_client()
+        for _ in range(3):
+            self.assertEqual(aos_client.search("missing-index", "basic", "a", field="text"), [])
+        self.assertEqual(fake_client.request_counter["indices.get"], 1)
+        self.assertEqual(fake_client.request_counter["search"], 0)
+
+    def test_invalidate_on_404(self):
+        aos_client, fake_client = get_aos_client()
+        run_retrieval(aos_client)
+        del fake_client.indices_data[INDEX_NAME]
+        self.assertEqual(aos_client.search(INDEX_NAME, "basic", "$1-1", field="metadata.chunk_id"), [])
+        self.assertIsNone(aos_client.index_metadata_cache.get(INDEX_NAME))
+        self.assertFalse(aos_client.index_exists(INDEX_NAME))
+
+
+if __name__ == "__main__":
+    unittest.main()
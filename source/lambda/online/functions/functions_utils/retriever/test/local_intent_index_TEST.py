@@ -0,0 +1,234 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep", os.path.dirname(__file__)])
+
+import numpy as np
+from common_logic.common_utils.logger_utils import get_logger
+from doc_store_utils import DocStore, LocalDocStoreBackend
+from fake_opensearch import FakeOpenSearch
+from functions.functions_utils.retriever import retriever
+from functions.functions_utils.retriever.utils import aos_retrievers
+from functions.functions_utils.retriever.utils.aos_utils import LLMBotOpenSearchClient
+from intent_index_utils import (
+    INTENT_INDEX_ARTIFACT,
+    LocalIntentIndex,
+    build_export_query,
+    get_knn_method,
+)
+
+logger = get_logger("benchmark")
+
+INDEX_NAME = "fake-intent-index"
+INTENTS = ("chat", "knowledge_qa", "get_weather", "order_status")
+
+
+def build_intent_docs(rng, example_num=300, dim=64):
+    return [
+        {
+            "text": f"example {i} of {INTENTS[i % len(INTENTS)]}",
+            "vector_field": rng.standard_normal(dim).astype(np.float32).tolist(),
+            "metadata": {
+                "file_path": "s3://bucket/intent.jsonl",
+                "jsonlAnswer": {"intent": INTENTS[i % len(INTENTS)], "kwargs": {"example": i}},
+                "additional_vecs": {"colbert_vecs": [[0.1] * 8]},
+            },
+        }
+        for i in range(example_num)
+    ]
+
+
+def build_mappings(engine, space_type):
+    return {INDEX_NAME: {"properties": {"vector_field": {
+        "type": "knn_vector", "method": {"engine": engine, "space_type": space_type}
+    }}}}
+
+
+def export_intent_index(fake_client, doc_store, max_examples=5000):
+    """the export of the ingestion job, see glue-job-script.export_intent_index"""
+    engine, space_type = get_knn_method(fake_client.indices.get_mapping(index=INDEX_NAME))
+    response = fake_client.search(index=INDEX_NAME, body=build_export_query(max_examples))
+    intent_index = LocalIntentIndex.from_search_response(response, engine=engine, space_type=space_type)
+    doc_store.put_index_artifact(INDEX_NAME, INTENT_INDEX_ARTIFACT, intent_index.to_bytes())
+    return intent_index
+
+
+class IntentIndexTestBase(unittest.TestCase):
+    engine = "nmslib"
+    space_type = "l2"
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.docs = build_intent_docs(self.rng)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.doc_store = DocStore(LocalDocStoreBackend(self.tmp_dir.name))
+        self.fake_client = FakeOpenSearch(
+            {INDEX_NAME: self.docs}, mappings=build_mappings(self.engine, self.space_type), knn_scoring=True
+        )
+        self.query_vectors = {}
+
+        self._origin = (
+            aos_retrievers.aos_client,
+            aos_retrievers.get_similarity_embedding,
+            aos_retrievers._whole_doc_store,
+            aos_retrievers._whole_doc_store_loaded,
+        )
+        aos_retrievers.aos_client = LLMBotOpenSearchClient("fake-opensearch-host", client=self.fake_client, coalesce=False)
+        aos_retrievers.get_similarity_embedding = lambda query, *args, **kwargs: self.query_vectors[query]
+        aos_retrievers._whole_doc_store = self.doc_store
+        aos_retrievers._whole_doc_store_loaded = True
+        aos_retrievers.local_intent_index_cache.clear()
+        retriever.retriever_chain_cache.clear()
+
+    def tearDown(self):
+        (
+            aos_retrievers.aos_client,
+            aos_retrievers.get_similarity_embedding,
+            aos_retrievers._whole_doc_store,
+            aos_retrievers._whole_doc_store_loaded,
+        ) = self._origin
+        aos_retrievers.local_intent_index_cache.clear()
+        self.tmp_dir.cleanup()
+
+    def add_query(self, name, vector):
+        self.query_vectors[name] = np.asarray(vector, dtype=np.float32).tolist()
+
+    def retrieve(self, query, local_index, top_k=5):
+        event = {
+            "retrievers": [{
+                "index_type": "intention",
+                "index_name": INDEX_NAME,
+                "embedding_model_endpoint": "fake-endpoint",
+                "target_model": "bge_m3_model.tar.gz",
+                "top_k": top_k,
+                "local_index": local_index,
+            }],
+            "query": query,
+        }
+        return retriever.lambda_handler(event)["result"]["docs"]
+
+    def assert_parity(self, queries, top_k=5):
+        for query in queries:
+            search_count = self.fake_client.request_counter["search"]
+            aos_docs = self.retrieve(query, local_index=False, top_k=top_k)
+            local_docs = self.retrieve(query, local_index=True, top_k=top_k)
+            # the local path does not query OpenSearch
+            self.assertEqual(self.fake_client.request_counter["search"], search_count + 1)
+            self.assertEqual(len(aos_docs), top_k)
+            for aos_doc, local_doc in zip(aos_docs, local_docs):
+                for key in ("page_content", "source", "answer", "question"):
+                    self.assertEqual(aos_doc[key], local_doc[key])
+                self.assertAlmostEqual(aos_doc["score"], local_doc["score"], delta=1e-6 * max(1, abs(aos_doc["score"])))
+            self.assertEqual(len(aos_docs), len(local_docs))
+
+
+class TestL2Parity(IntentIndexTestBase):
+    def setUp(self):
+        super().setUp()
+        export_intent_index(self.fake_client, self.doc_store)
+        for i in range(20):
+            self.add_query(f"random {i}", self.rng.standard_normal(64))
+        # near duplicates of the examples
+        for i in range(0, 300, 37):
+            self.add_query(f"example {i}", np.asarray(self.docs[i]["vector_field"]) + 0.01)
+
+    def test_parity(self):
+        self.assert_parity(list(self.query_vectors), top_k=5)
+        self.assert_parity(["random 0", "example 37"], top_k=1)
+
+    def test_no_vectors_in_artifact_sources(self):
+        intent_index = LocalIntentIndex.from_bytes(
+            self.doc_store.get_index_artifact(INDEX_NAME, INTENT_INDEX_ARTIFACT)
+        )
+        self.assertEqual(len(intent_index), 300)
+        self.assertEqual(intent_index.embeddings.dtype, np.float32)
+        self.assertTrue(all("vector_field" not in s and "additional_vecs" not in s["metadata"] for s in intent_index.sources))
+
+    def test_fallback_without_artifact(self):
+        self.doc_store.delete_index_artifact(INDEX_NAME, INTENT_INDEX_ARTIFACT)
+        aos_retrievers.local_intent_index_cache.clear()
+        search_count = self.fake_client.request_counter["search"]
+        docs = self.retrieve("random 0", local_index=True)
+        self.assertEqual(self.fake_client.request_counter["search"], search_count + 1)
+        self.assertEqual(len(docs), 5)
+
+    def test_fallback_on_dimension_mismatch(self):
+        # e.g. the embedding model of the index was changed
+        self.add_query("other model", self.rng.standard_normal(32))
+        search_count = self.fake_client.request_counter["search"]
+        self.fake_client.knn_scoring = False
+        self.retrieve("other model", local_index=True)
+        self.assertEqual(self.fake_client.request_counter["search"], search_count + 1)
+
+
+class TestCosineParity(IntentIndexTestBase):
+    space_type = "cosinesimil"
+
+    def test_parity(self):
+        export_intent_index(self.fake_client, self.doc_store)
+        for i in range(10):
+            self.add_query(f"random {i}", self.rng.standard_normal(64))
+        self.assert_parity(list(self.query_vectors))
+
+
+class TestLuceneCosineParity(TestCosineParity):
+    engine = "lucene"
+
+
+class TestInnerProductParity(TestCosineParity):
+    space_type = "innerproduct"
+
+
+class TestLocalIntentIndex(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.default_rng(1)
+        docs = build_intent_docs(rng, example_num=5, dim=8)
+        response = FakeOpenSearch({INDEX_NAME: docs}).search(index=INDEX_NAME, body=build_export_query(10))
+        intent_index = LocalIntentIndex.from_search_response(response, space_type="cosinesimil")
+        loaded = LocalIntentIndex.from_bytes(intent_index.to_bytes())
+        np.testing.assert_array_equal(loaded.embeddings, intent_index.embeddings)
+        self.assertEqual((loaded.sources, loaded.ids, loaded.space_type), (intent_index.sources, intent_index.ids, "cosinesimil"))
+
+    def test_empty_index(self):
+        intent_index = LocalIntentIndex.from_bytes(LocalIntentIndex(np.zeros((0,)), [], []).to_bytes())
+        self.assertEqual(intent_index.search([0.1, 0.2], size=5)["hits"]["hits"], [])
+
+    def test_default_knn_method(self):
+        self.assertEqual(get_knn_method({INDEX_NAME: {"mappings": {"properties": {}}}}), ("nmslib", "l2"))
+        with self.assertRaises(ValueError):
+            LocalIntentIndex(np.zeros((1, 2)), [{}], ["0"], space_type="hamming")
+
+
+def benchmark(example_num=300, dim=1024, query_num=50, aos_latency=0.02):
+    """intent kNN search of an OpenSearch round trip vs the local intent index"""
+    rng = np.random.default_rng(0)
+    docs = build_intent_docs(rng, example_num=example_num, dim=dim)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        doc_store = DocStore(LocalDocStoreBackend(tmp_dir))
+        fake_client = FakeOpenSearch({INDEX_NAME: docs}, mappings=build_mappings("nmslib", "l2"), latency=aos_latency)
+        intent_index = export_intent_index(fake_client, doc_store)
+        artifact_bytes = len(doc_store.get_index_artifact(INDEX_NAME, INTENT_INDEX_ARTIFACT))
+        aos_client = LLMBotOpenSearchClient("fake-opensearch-host", client=fake_client, coalesce=False)
+        queries = [rng.standard_normal(dim).astype(np.float32).tolist() for _ in range(query_num)]
+
+        start = time.perf_counter()
+        for query in queries:
+            aos_client.search(INDEX_NAME, "knn", query, "vector_field", size=5)
+        aos_cost = (time.perf_counter() - start) / query_num
+
+        start = time.perf_counter()
+        for query in queries:
+            intent_index.search(query, size=5)
+        local_cost = (time.perf_counter() - start) / query_num
+    logger.info(f"bench examples: {example_num}, dim: {dim}, artifact: {artifact_bytes / 1024:.0f}KB")
+    logger.info(f"bench opensearch knn (fake, {aos_latency * 1000:.0f}ms rtt): {aos_cost * 1000:.2f}ms, local intent index: {local_cost * 1000:.3f}ms")
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
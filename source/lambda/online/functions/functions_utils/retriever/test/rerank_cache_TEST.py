@@ -0,0 +1,165 @@
+import json
+import sys
+import threading
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils.logger_utils import get_logger
+from functions.functions_utils.retriever.utils import reranker
+from functions.functions_utils.retriever.utils.reranker import (
+    BGEReranker,
+    plan_rerank_budget,
+)
+from langchain.docstore.document import Document
+
+logger = get_logger("benchmark")
+
+
+class FakeRerankEndpoint:
+    """scores a pair by the number of query words in the doc"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.pairs = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, endpoint_name, model_type, stop, region_name, target_model=None, client=None):
+        pairs = json.loads(prompt)
+        with self._lock:
+            self.pairs.extend(pairs)
+        time.sleep(self.latency)
+        return json.dumps([float(sum(word in doc for word in query.split())) for query, doc in pairs])
+
+
+def build_docs(scores, retrieval_type="qd-knn"):
+    return [
+        Document(
+            page_content=f"doc {retrieval_type} {i}",
+            metadata={
+                "source": f"s3://bucket/{retrieval_type}_{i}.md",
+                "retrieval_content": f"what is s3 {i}" if i % 2 else f"doc {i}",
+                "retrieval_score": score,
+                "retrieval_type": retrieval_type,
+            },
+        )
+        for i, score in enumerate(scores)
+    ]
+
+
+class TestRerankScoreCache(unittest.TestCase):
+    def setUp(self):
+        self.fake_endpoint = FakeRerankEndpoint()
+        self._origin_endpoint = reranker.SagemakerEndpointVectorOrCross
+        self._origin_enable_budget = reranker.enable_rerank_adaptive_budget
+        reranker.SagemakerEndpointVectorOrCross = self.fake_endpoint
+        reranker.rerank_score_cache.clear()
+        reranker.rerank_score_cache.reset_stats()
+
+    def tearDown(self):
+        reranker.SagemakerEndpointVectorOrCross = self._origin_endpoint
+        reranker.enable_rerank_adaptive_budget = self._origin_enable_budget
+
+    def rerank(self, docs, query="what is s3", top_k=10, target_model="bge_reranker_model.tar.gz"):
+        query = {"query": query, "debug_info": {}}
+        results = BGEReranker(rerank_model_endpoint="fake-endpoint", target_model=target_model, top_k=top_k) \
+            .compress_documents(docs, query)
+        return results, query["debug_info"]["rerank_stats"]
+
+    def test_cached_scores(self):
+        first, stats = self.rerank(build_docs([1.0] * 6))
+        self.assertEqual(stats["endpoint_pairs"], 6)
+        second, stats = self.rerank(build_docs([1.0] * 6))
+        self.assertEqual(stats["endpoint_pairs"], 0)
+        self.assertEqual(stats["cache_hits"], 6)
+        self.assertEqual(len(self.fake_endpoint.pairs), 6)
+        self.assertEqual(
+            [(d.page_content, d.metadata["rerank_score"]) for d in first],
+            [(d.page_content, d.metadata["rerank_score"]) for d in second]
+        )
+
+    def test_key_includes_model_query_and_doc(self):
+        self.rerank(build_docs([1.0] * 4))
+        _, stats = self.rerank(build_docs([1.0] * 4), target_model="other_model.tar.gz")
+        self.assertEqual(stats["endpoint_pairs"], 4)
+        _, stats = self.rerank(build_docs([1.0] * 4), query="what is ec2")
+        self.assertEqual(stats["endpoint_pairs"], 4)
+        _, stats = self.rerank(build_docs([1.0] * 5))
+        self.assertEqual(stats["endpoint_pairs"], 1)
+
+    def test_disabled(self):
+        origin_enable = reranker.enable_rerank_score_cache
+        reranker.enable_rerank_score_cache = False
+        try:
+            self.rerank(build_docs([1.0] * 3))
+            _, stats = self.rerank(build_docs([1.0] * 3))
+        finally:
+            reranker.enable_rerank_score_cache = origin_enable
+        self.assertEqual(stats["endpoint_pairs"], 3)
+
+
+class TestRerankBudget(unittest.TestCase):
+    def setUp(self):
+        self.fake_endpoint = FakeRerankEndpoint()
+        self._origin_endpoint = reranker.SagemakerEndpointVectorOrCross
+        self._origin_enable_budget = reranker.enable_rerank_adaptive_budget
+        reranker.SagemakerEndpointVectorOrCross = self.fake_endpoint
+        reranker.enable_rerank_adaptive_budget = True
+        reranker.rerank_score_cache.clear()
+
+    def tearDown(self):
+        reranker.SagemakerEndpointVectorOrCross = self._origin_endpoint
+        reranker.enable_rerank_adaptive_budget = self._origin_enable_budget
+
+    def test_plan(self):
+        # clean separation after the 4th candidate
+        self.assertEqual(plan_rerank_budget([0.9, 0.88, 0.87, 0.85, 0.3, 0.29, 0.2], 2), 4)
+        # never below min_candidates
+        self.assertEqual(plan_rerank_budget([0.9, 0.2, 0.19, 0.18], 2), 4)
+        # evenly spread scores are all reranked
+        self.assertEqual(plan_rerank_budget([0.9, 0.8, 0.7, 0.6, 0.5, 0.4], 2), 6)
+        self.assertEqual(plan_rerank_budget([0.5] * 5, 2), 5)
+
+    def test_tail_skipped_per_retriever(self):
+        knn_docs = build_docs([0.9, 0.88, 0.86, 0.85, 0.84, 0.3, 0.29, 0.28], "qd-knn")
+        # bm25 scores are on another scale and evenly spread
+        bm25_docs = build_docs([12.0, 10.0, 8.0, 6.0, 4.0, 2.0], "qd-bm25")
+        query = {"query": "what is s3", "debug_info": {}}
+        results = BGEReranker(rerank_model_endpoint="fake-endpoint", top_k=3).compress_documents(knn_docs + bm25_docs, query)
+        stats = query["debug_info"]["rerank_stats"]
+        self.assertEqual(stats["candidates"], 14)
+        self.assertEqual(stats["skipped"], 3)
+        self.assertEqual(stats["endpoint_pairs"], 11)
+        decisions = {d["retrieval_type"]: d for d in stats["budget_decisions"]}
+        self.assertEqual(decisions["qd-knn"]["reranked"], 5)
+        self.assertEqual(decisions["qd-bm25"]["reranked"], 6)
+        self.assertEqual(len(results), 3)
+
+
+def benchmark():
+    """endpoint pairs and latency of a popular query asked 10 times"""
+    docs = build_docs([0.9 - i * 0.01 for i in range(20)] + [0.4 - i * 0.01 for i in range(20)])
+    for enable_cache, enable_budget in ((False, False), (False, True), (True, True)):
+        fake_endpoint = FakeRerankEndpoint(latency=0.05)
+        origin = (reranker.SagemakerEndpointVectorOrCross, reranker.enable_rerank_score_cache, reranker.enable_rerank_adaptive_budget)
+        reranker.SagemakerEndpointVectorOrCross = fake_endpoint
+        reranker.enable_rerank_score_cache = enable_cache
+        reranker.enable_rerank_adaptive_budget = enable_budget
+        reranker.rerank_score_cache.clear()
+        try:
+            start = time.perf_counter()
+            for _ in range(10):
+                BGEReranker(rerank_model_endpoint="fake-endpoint", top_k=10) \
+                    .compress_documents(docs, {"query": "what is s3", "debug_info": {}})
+            latency = (time.perf_counter() - start) / 10
+        finally:
+            reranker.SagemakerEndpointVectorOrCross, reranker.enable_rerank_score_cache, reranker.enable_rerank_adaptive_budget = origin
+        logger.info(f"bench cache: {enable_cache}, budget: {enable_budget}, endpoint pairs: {len(fake_endpoint.pairs)}, latency: {latency * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import unittest
+from typing import Dict, List
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep", os.path.dirname(__file__)])
+
+from common_logic.common_utils.cache_utils import LRUTTLCache
+from common_logic.common_utils.logger_utils import get_logger
+from functions.functions_utils.retriever import retriever
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.schema.retriever import BaseRetriever
+
+logger = get_logger("benchmark")
+
+
+class FakeRetriever(BaseRetriever):
+    index_name: str
+    top_k: int = 2
+
+    def _get_relevant_documents(self, question: Dict, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [
+            Document(
+                page_content=f"{self.index_name} {question['query']} {i}",
+                metadata={
+                    "source": self.index_name,
+                    "score": 1.0 - i * 0.1,
+                    "retrieval_score": 1.0 - i * 0.1,
+                    "retrieval_content": question["query"]
+                }
+            )
+            for i in range(self.top_k)
+        ]
+
+
+build_num = 0
+
+
+def get_fake_retrievers(config: dict):
+    global build_num
+    build_num += 1
+    return [FakeRetriever(index_name=config["index_name"], top_k=config.get("top_k", 2))]
+
+
+def build_event(query, index_names=("index-a", "index-b"), top_k=2):
+    return {
+        "retrievers": [
+            {"index_type": "fake", "index_name": index_name, "top_k": top_k}
+            for index_name in index_names
+        ],
+        "rerankers": [],
+        "query": query,
+    }
+
+
+def build_qd_event(query, index_num=2):
+    return {
+        "retrievers": [
+            {
+                "index_type": "qd",
+                "index_name": f"qd-index-{i}",
+                "top_k": 5,
+                "context_num": 1,
+                "using_whole_doc": False,
+                "embedding_model_endpoint": "fake-embedding-endpoint",
+                "target_model": "bce_embedding_model.tar.gz",
+                "model_type": "vector",
+            }
+            for i in range(index_num)
+        ],
+        "rerankers": [{"type": "reranker", "config": {"target_model": "bge_reranker_model.tar.gz"}}],
+        "query": query,
+    }
+
+
+class TestRetrieverChainCache(unittest.TestCase):
+    def setUp(self):
+        global build_num
+        build_num = 0
+        self.origin_cache = retriever.retriever_chain_cache
+        self.origin_enable = retriever.enable_retriever_chain_cache
+        retriever.retriever_chain_cache = LRUTTLCache(maxsize=4)
+        retriever.enable_retriever_chain_cache = True
+        retriever.retriever_dict["fake"] = get_fake_retrievers
+
+    def tearDown(self):
+        retriever.retriever_chain_cache = self.origin_cache
+        retriever.enable_retriever_chain_cache = self.origin_enable
+        retriever.retriever_dict.pop("fake")
+
+    def test_chain_built_once_per_config(self):
+        for query in ("a", "b", "c"):
+            retriever.lambda_handler(build_event(query))
+        self.assertEqual(build_num, 2)
+        retriever.lambda_handler(build_event("a", top_k=3))
+        self.assertEqual(build_num, 4)
+        self.assertEqual(retriever.get_retriever_chain_cache_stats()["size"], 2)
+
+    def test_query_bound_at_invoke(self):
+        first = retriever.lambda_handler(build_event("first"))
+        second = retriever.lambda_handler(build_event("second"))
+        self.assertEqual(first["result"]["query"], "first")
+        self.assertEqual(second["result"]["query"], "second")
+        self.assertTrue(all("second" in doc["page_content"] for doc in second["result"]["docs"]))
+        self.assertEqual(len(second["result"]["docs"]), 4)
+
+        retriever.enable_retriever_chain_cache = False
+        uncached = retriever.lambda_handler(build_event("second"))
+        self.assertEqual(uncached["result"]["docs"], second["result"]["docs"])
+
+    def test_real_retriever_chain_reused(self):
+        event = build_qd_event("a")
+        chain = retriever.get_retriever_chain(event["retrievers"], event["rerankers"][0]["config"])
+        same_chain = retriever.get_retriever_chain(
+            build_qd_event("b")["retrievers"], event["rerankers"][0]["config"]
+        )
+        self.assertIs(chain, same_chain)
+        other_chain = retriever.get_retriever_chain(event["retrievers"], {})
+        self.assertIsNot(chain, other_chain)
+
+    def test_lru_bound(self):
+        retriever.retriever_chain_cache = LRUTTLCache(maxsize=2)
+        for index_name in ("a", "b", "c", "a"):
+            retriever.lambda_handler(build_event("q", index_names=(index_name,)))
+        self.assertEqual(build_num, 4)
+        self.assertEqual(retriever.get_retriever_chain_cache_stats()["evictions"], 2)
+
+
+def benchmark(invocation_num=50):
+    origin_enable = retriever.enable_retriever_chain_cache
+    try:
+        for index_num in (1, 2, 4):
+            event = build_qd_event("q", index_num=index_num)
+            reranker_config = event["rerankers"][0]["config"]
+            for enable_cache in (False, True):
+                retriever.enable_retriever_chain_cache = enable_cache
+                retriever.retriever_chain_cache.clear()
+                start = time.perf_counter()
+                for _ in range(invocation_num):
+                    retriever.get_retriever_chain(event["retrievers"], reranker_config)
+                latency = (time.perf_counter() - start) / invocation_num
+                logger.info(f"bench qd indexes: {index_num}, cache: {enable_cache}, chain construction: {latency * 1000:.3f}ms")
+    finally:
+        retriever.enable_retriever_chain_cache = origin_enable
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep", os.path.dirname(__file__)])
+
+from common_logic.common_utils.logger_utils import get_logger
+from doc_store_utils import DocStore, LocalDocStoreBackend, build_doc_text
+from fake_opensearch import FakeOpenSearch
+from functions.functions_utils.retriever.utils import aos_retrievers
+from functions.functions_utils.retriever.utils.aos_utils import LLMBotOpenSearchClient
+
+logger = get_logger("benchmark")
+
+QD_INDEX_NAME = "fake-qd-index"
+
+
+def build_doc_chunks(doc_id, section_num):
+    return [
+        {
+            "text": f"doc {doc_id} section {section_id}",
+            "metadata": {
+                "chunk_id": f"${doc_id}-{section_id}",
+                "content_type": "paragraph",
+                "file_path": f"s3://bucket/doc_{doc_id}.md",
+            },
+        }
+        for section_id in range(1, section_num + 1)
+    ]
+
+
+class TestWholeDocStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.doc_store = DocStore(LocalDocStoreBackend(self.tmp_dir.name))
+        # doc 1 fits in one search, doc 2 is longer than the 100 chunks searched
+        self.chunks = build_doc_chunks(1, 8) + build_doc_chunks(2, 150)
+        self.fake_client = FakeOpenSearch({QD_INDEX_NAME: self.chunks}, latency=0.02)
+        self._origin_aos_client = aos_retrievers.aos_client
+        self._origin_doc_store = aos_retrievers._whole_doc_store
+        aos_retrievers.aos_client = LLMBotOpenSearchClient(
+            "fake-opensearch-host", client=self.fake_client, coalesce=False
+        )
+        aos_retrievers._whole_doc_store = self.doc_store
+        aos_retrievers.whole_doc_cache.clear()
+        aos_retrievers.whole_doc_cache.reset_stats()
+
+    def tearDown(self):
+        aos_retrievers.aos_client = self._origin_aos_client
+        aos_retrievers._whole_doc_store = self._origin_doc_store
+        aos_retrievers.whole_doc_cache.clear()
+        self.tmp_dir.cleanup()
+
+    def ingest(self, doc_id):
+        """write a document the way the ingestion job does, chunks in any order"""
+        file_path = f"s3://bucket/doc_{doc_id}.md"
+        chunks = [
+            (c["metadata"]["chunk_id"], c["metadata"]["content_type"], c["text"])
+            for c in reversed(self.chunks) if c["metadata"]["file_path"] == file_path
+        ]
+        return self.doc_store.put_doc(QD_INDEX_NAME, file_path, chunks)
+
+    def test_parity_with_search(self):
+        search_doc = aos_retrievers.search_doc("s3://bucket/doc_1.md", QD_INDEX_NAME)
+        self.assertEqual(self.ingest(1), 8)
+        self.fake_client.request_counter.clear()
+        doc = aos_retrievers.get_doc("s3://bucket/doc_1.md", QD_INDEX_NAME)
+        self.assertEqual(doc, search_doc)
+        self.assertEqual(self.fake_client.round_trips, 0)
+
+    def test_large_doc_not_truncated(self):
+        search_doc = aos_retrievers.search_doc("s3://bucket/doc_2.md", QD_INDEX_NAME)
+        self.assertEqual(len(search_doc.split("\n")), 100)
+        self.ingest(2)
+        doc = aos_retrievers.get_doc("s3://bucket/doc_2.md", QD_INDEX_NAME)
+        self.assertEqual(len(doc.split("\n")), 150)
+        self.assertTrue(doc.startswith("doc 2 section 1\n"))
+        self.assertTrue(doc.endswith("doc 2 section 150"))
+
+    def test_fallback_to_search(self):
+        doc = aos_retrievers.get_doc("s3://bucket/doc_1.md", QD_INDEX_NAME)
+        self.assertTrue(doc.startswith("doc 1 section 1\n"))
+        self.assertEqual(self.fake_client.request_counter["search"], 1)
+        # searched documents are not cached, they may be truncated
+        self.assertEqual(len(aos_retrievers.whole_doc_cache), 0)
+
+    def test_lru_on_top_of_store(self):
+        self.ingest(1)
+        for _ in range(3):
+            aos_retrievers.get_doc("s3://bucket/doc_1.md", QD_INDEX_NAME)
+        stats = aos_retrievers.get_whole_doc_cache_stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 2)
+
+    def test_delete(self):
+        self.ingest(1)
+        self.doc_store.delete_doc(QD_INDEX_NAME, "s3://bucket/doc_1.md")
+        self.assertIsNone(self.doc_store.get_doc(QD_INDEX_NAME, "s3://bucket/doc_1.md"))
+
+    def test_build_doc_text(self):
+        text, chunk_num = build_doc_text([
+            ("$1-2", "paragraph", "b"),
+            ("$0-1", "paragraph", "a"),
+            ("$1-2", "paragraph", "b"),
+            ("no-order", "paragraph", "x"),
+            ("$1-10", "paragraph", "c"),
+        ])
+        self.assertEqual(text, "a\nb\nc")
+        self.assertEqual(chunk_num, 3)
+
+
+def benchmark():
+    test = TestWholeDocStore()
+    test.setUp()
+    try:
+        test.ingest(2)
+        file_path = "s3://bucket/doc_2.md"
+        start = time.perf_counter()
+        for _ in range(20):
+            aos_retrievers.search_doc(file_path, QD_INDEX_NAME)
+        search_latency = (time.perf_counter() - start) / 20
+        start = time.perf_counter()
+        for _ in range(20):
+            aos_retrievers.get_doc(file_path, QD_INDEX_NAME)
+        store_latency = (time.perf_counter() - start) / 20
+        logger.info(f"bench get_doc, search: {search_latency * 1000:.2f}ms, doc store with lru: {store_latency * 1000:.3f}ms")
+    finally:
+        test.tearDown()
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
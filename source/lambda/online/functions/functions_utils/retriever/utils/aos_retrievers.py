@@ -1,7 +1,6 @@
 import os
 import logging
 import traceback 
-import asyncio
 from typing import Any, Dict, List, Union
 
 from langchain.schema.retriever import BaseRetriever
@@ -9,8 +8,21 @@ from langchain.callbacks.manager import CallbackManagerForRetrieverRun
 from langchain.docstore.document import Document
 
 from common_logic.common_utils.time_utils import timeit
+from common_logic.common_utils.cache_utils import LRUTTLCache, TieredCache
 from .aos_utils import LLMBotOpenSearchClient
+from .context_expansion import ContextExpander
+from .projection import (
+    DOC_DOCVALUE_FIELDS,
+    DOC_FIELDS,
+    FAQ_ANSWER_FIELDS,
+    FAQ_CONTENT_FIELDS,
+    FAQ_FIELDS,
+    PARENT_CONTENT_FIELDS,
+)
 from sm_utils import SagemakerEndpointVectorOrCross
+from doc_store_utils import DocStore
+from intent_index_utils import INTENT_INDEX_ARTIFACT, LocalIntentIndex
+from common_logic.common_utils.aws_client_utils import get_client
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -22,6 +34,128 @@ aos_endpoint = os.environ.get("AOS_ENDPOINT", "")
 
 aos_client = LLMBotOpenSearchClient(aos_endpoint)
 
+enable_embedding_cache = os.environ.get("ENABLE_EMBEDDING_CACHE", "true").lower() in ("true", "1", "t")
+# query embeddings are shared by qq-match, intention and qd retrievers in one turn
+query_embedding_cache = TieredCache(
+    maxsize=int(os.environ.get("EMBEDDING_CACHE_MAXSIZE", 1024)),
+    ttl=float(os.environ.get("EMBEDDING_CACHE_TTL", 3600)),
+)
+
+
+# whole documents written by the ingestion job, see doc_store_utils
+whole_doc_cache = LRUTTLCache(
+    maxsize=int(os.environ.get("WHOLE_DOC_CACHE_MAXSIZE", 128)),
+    ttl=float(os.environ.get("WHOLE_DOC_CACHE_TTL", 600)),
+)
+_whole_doc_store = None
+_whole_doc_store_loaded = False
+
+# intent indexes exported by the ingestion job, see intent_index_utils,
+# re-read after ttl so re-ingested examples are picked up
+local_intent_index_cache = LRUTTLCache(
+    maxsize=int(os.environ.get("LOCAL_INTENT_INDEX_CACHE_MAXSIZE", 16)),
+    ttl=float(os.environ.get("LOCAL_INTENT_INDEX_TTL", 60)),
+)
+
+
+def get_whole_doc_store():
+    """Document store of the configured backend, None if disabled"""
+    global _whole_doc_store, _whole_doc_store_loaded
+    if not _whole_doc_store_loaded:
+        _whole_doc_store = DocStore.from_environ(get_client("s3"))
+        _whole_doc_store_loaded = True
+    return _whole_doc_store
+
+
+def get_whole_doc_cache_stats():
+    return whole_doc_cache.get_stats()
+
+
+def get_local_intent_index(index_name):
+    """
+    Local intent index of the index, None if it is not exported
+
+    :param index_name: Target Index Name
+    """
+    cached = local_intent_index_cache.get(index_name)
+    if cached is not None:
+        return cached[0]
+    intent_index = None
+    doc_store = get_whole_doc_store()
+    if doc_store is not None:
+        try:
+            data = doc_store.get_index_artifact(index_name, INTENT_INDEX_ARTIFACT)
+            if data is not None:
+                intent_index = LocalIntentIndex.from_bytes(data)
+        except Exception:
+            logger.error(f"load the intent index of {index_name} failed: {traceback.format_exc()}")
+    local_intent_index_cache.set(index_name, (intent_index,))
+    return intent_index
+
+
+def get_local_intent_index_cache_stats():
+    return local_intent_index_cache.get_stats()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+def get_embedding_cache_key(endpoint_name, target_model, model_type, instruction_prefix, query):
+    return "|".join([
+        str(endpoint_name),
+        str(target_model),
+        model_type,
+        instruction_prefix,
+        normalize_query(query)
+    ])
+
+
+def get_embedding_cache_stats():
+    return query_embedding_cache.get_stats()
+
+
+def cached_query_embedding(
+    query: str,
+    instruction_prefix: str,
+    embedding_model_endpoint: str,
+    target_model: str,
+    model_type: str
+):
+    """embed query with sagemaker endpoint, reusing cached embeddings
+
+    Args:
+        query (str): query to embed
+        instruction_prefix (str): instruction prepended to the query, part of the cache key
+        embedding_model_endpoint (str): sagemaker endpoint name
+        target_model (str): target model in multi-model endpoint
+        model_type (str): embedding model type
+
+    Returns:
+        list[float]: query embedding
+    """
+    cache_key = get_embedding_cache_key(
+        embedding_model_endpoint, target_model, model_type, instruction_prefix, query
+    )
+    if enable_embedding_cache:
+        embedding = query_embedding_cache.get(cache_key)
+        if embedding is not None:
+            logger.info(f"embedding cache hit, stats: {query_embedding_cache.get_stats()}")
+            return embedding
+    embedding = SagemakerEndpointVectorOrCross(
+        prompt=instruction_prefix + query,
+        endpoint_name=embedding_model_endpoint,
+        model_type=model_type,
+        region_name=None,
+        stop=None,
+        target_model=target_model,
+        client=get_client("sagemaker-runtime")
+    )
+    if enable_embedding_cache:
+        query_embedding_cache.set(cache_key, embedding)
+        logger.info(f"embedding cache miss, stats: {query_embedding_cache.get_stats()}")
+    return embedding
+
 def remove_redundancy_debug_info(results):
     # filtered_results = copy.deepcopy(results)
     filtered_results = results
@@ -38,14 +172,12 @@ def get_similarity_embedding(
     target_model: str,
     model_type: str = "vector"
 ) -> List[List[float]]:
-    query_similarity_embedding_prompt = query
-    response = SagemakerEndpointVectorOrCross(
-        prompt=query_similarity_embedding_prompt,
-        endpoint_name=embedding_model_endpoint,
-        model_type=model_type,
-        stop=None,
-        region_name=None,
-        target_model=target_model
+    response = cached_query_embedding(
+        query,
+        instruction_prefix="",
+        embedding_model_endpoint=embedding_model_endpoint,
+        target_model=target_model,
+        model_type=model_type
     )
     return response
 
@@ -59,27 +191,21 @@ def get_relevance_embedding(
 ):
     if model_type == "vector":
         if query_lang == "zh":
-            query_relevance_embedding_prompt = (
-                "为这个句子生成表示以用于检索相关文章：" + query
-            )
+            instruction_prefix = "为这个句子生成表示以用于检索相关文章："
         elif query_lang == "en":
-            query_relevance_embedding_prompt = (
-                "Represent this sentence for searching relevant passages: "
-                + query
-        )
+            instruction_prefix = "Represent this sentence for searching relevant passages: "
         else:
-            query_relevance_embedding_prompt = query
+            instruction_prefix = ""
     elif model_type == "m3" or model_type == "bce":
-        query_relevance_embedding_prompt = query
+        instruction_prefix = ""
     else:
         raise ValueError(f'invalid embedding model type: {model_type}')
-    response = SagemakerEndpointVectorOrCross(
-        prompt=query_relevance_embedding_prompt,
-        endpoint_name=embedding_model_endpoint,
-        model_type=model_type,
-        region_name=None,
-        stop=None,
-        target_model=target_model
+    response = cached_query_embedding(
+        query,
+        instruction_prefix=instruction_prefix,
+        embedding_model_endpoint=embedding_model_endpoint,
+        target_model=target_model,
+        model_type=model_type
     )
     return response
     # if model_type in ["vector",'m3']:
@@ -101,12 +227,14 @@ def get_faq_answer(source, index_name, source_field):
         query_type="basic",
         query_term=source,
         field=f"metadata.{source_field}",
+        fields=FAQ_ANSWER_FIELDS,
     )
     for r in opensearch_query_response["hits"]["hits"]:
-        if "field" in r["_source"]["metadata"] and "answer" == r["_source"]["metadata"]["field"]:
+        metadata = r["_source"].get("metadata", {})
+        if "field" in metadata and "answer" == metadata["field"]:
             return r["_source"]["content"]
-        elif "jsonlAnswer" in r["_source"]["metadata"]:
-            return r["_source"]["metadata"]["jsonlAnswer"]["answer"]
+        elif "jsonlAnswer" in metadata:
+            return metadata["jsonlAnswer"]["answer"]
     return ""
 
 def get_faq_content(source, index_name):
@@ -115,6 +243,7 @@ def get_faq_content(source, index_name):
         query_type="basic",
         query_term=source,
         field="metadata.source",
+        fields=FAQ_CONTENT_FIELDS,
     )
     for r in opensearch_query_response["hits"]["hits"]:
         if r["_source"]["metadata"]["field"] == "all_text":
@@ -122,21 +251,50 @@ def get_faq_content(source, index_name):
     return ""
 
 def get_doc(file_path, index_name):
+    """
+    Get the whole text of a document, read from the document store and
+    falls back to searching its chunks if the document is not stored
+
+    :param file_path: `metadata.file_path` of the chunks
+    :param index_name: Target Index Name
+    """
+    doc_store = get_whole_doc_store()
+    if doc_store is not None:
+        cache_key = (index_name, file_path)
+        doc = whole_doc_cache.get(cache_key)
+        if doc is not None:
+            return doc
+        try:
+            doc = doc_store.get_doc(index_name, file_path)
+        except Exception:
+            logger.error(f"read {file_path} from the document store failed: {traceback.format_exc()}")
+            doc = None
+        if doc is not None:
+            whole_doc_cache.set(cache_key, doc)
+            return doc
+        logger.info(f"{file_path} is not in the document store, search its chunks")
+    return search_doc(file_path, index_name)
+
+def search_doc(file_path, index_name):
+    """concatenate the chunks of a document, at most 100 chunks are searched"""
     opensearch_query_response = aos_client.search(
         index_name=index_name,
         query_type="basic",
         query_term=file_path,
         field="metadata.file_path",
         size=100,
+        fields=DOC_FIELDS,
+        docvalue_fields=DOC_DOCVALUE_FIELDS,
     )
     chunk_list = []
     chunk_id_set = set()
     for r in opensearch_query_response["hits"]["hits"]:
         try:
-            if "chunk_id" not in r["_source"]["metadata"] or not r["_source"]["metadata"]["chunk_id"].startswith("$"):
+            metadata = r["_source"].get("metadata", {})
+            if "chunk_id" not in metadata or not metadata["chunk_id"].startswith("$"):
                 continue
-            chunk_id = r["_source"]["metadata"]["chunk_id"]
-            content_type = r["_source"]["metadata"]["content_type"]
+            chunk_id = metadata["chunk_id"]
+            content_type = metadata["content_type"]
             chunk_group_id = int(chunk_id.split("-")[0].strip("$"))
             chunk_section_id = int(chunk_id.split("-")[-1])
             if (chunk_id, content_type) in chunk_id_set:
@@ -151,144 +309,20 @@ def get_doc(file_path, index_name):
     return "\n".join(chunk_text_list)
 
 def get_child_context(chunk_id, index_name, window_size):
-    next_content_list = []
-    previous_content_list = []
-    previous_pos = 0
-    next_pos = 0
-    chunk_id_prefix = "-".join(chunk_id.split("-")[:-1])
-    section_id = int(chunk_id.split("-")[-1])
-    previous_section_id = section_id
-    next_section_id = section_id
-    while previous_pos < window_size:
-        previous_section_id -= 1
-        if previous_section_id < 1:
-            break
-        previous_chunk_id = f"{chunk_id_prefix}-{previous_section_id}"
-        opensearch_query_response = aos_client.search(
-            index_name=index_name,
-            query_type="basic",
-            query_term=previous_chunk_id,
-            field="metadata.chunk_id",
-            size=1,
-        )
-        if len(opensearch_query_response["hits"]["hits"]) > 0:
-            r = opensearch_query_response["hits"]["hits"][0]
-            previous_content_list.insert(0, r["_source"]["text"])
-            previous_pos += 1
-        else:
-            break
-    while next_pos < window_size:
-        next_section_id += 1
-        next_chunk_id = f"{chunk_id_prefix}-{next_section_id}"
-        opensearch_query_response = aos_client.search(
-            index_name=index_name,
-            query_type="basic",
-            query_term=next_chunk_id,
-            field="metadata.chunk_id",
-            size=1,
-        )
-        if len(opensearch_query_response["hits"]["hits"]) > 0:
-            r = opensearch_query_response["hits"]["hits"][0]
-            next_content_list.insert(0, r["_source"]["text"])
-            next_pos += 1
-        else:
-            break
-    return [previous_content_list, next_content_list]
+    return get_sibling_context(chunk_id, index_name, window_size)
 
 def get_sibling_context(chunk_id, index_name, window_size):
-    next_content_list = []
-    previous_content_list = []
-    previous_pos = 0
-    next_pos = 0
-    chunk_id_prefix = "-".join(chunk_id.split("-")[:-1])
-    section_id = int(chunk_id.split("-")[-1])
-    previous_section_id = section_id
-    next_section_id = section_id
-    while previous_pos < window_size:
-        previous_section_id -= 1
-        if previous_section_id < 1:
-            break
-        previous_chunk_id = f"{chunk_id_prefix}-{previous_section_id}"
-        opensearch_query_response = aos_client.search(
-            index_name=index_name,
-            query_type="basic",
-            query_term=previous_chunk_id,
-            field="metadata.chunk_id",
-            size=1,
-        )
-        if len(opensearch_query_response["hits"]["hits"]) > 0:
-            r = opensearch_query_response["hits"]["hits"][0]
-            previous_content_list.insert(0, r["_source"]["text"])
-            previous_pos += 1
-        else:
-            break
-    while next_pos < window_size:
-        next_section_id += 1
-        next_chunk_id = f"{chunk_id_prefix}-{next_section_id}"
-        opensearch_query_response = aos_client.search(
-            index_name=index_name,
-            query_type="basic",
-            query_term=next_chunk_id,
-            field="metadata.chunk_id",
-            size=1,
-        )
-        if len(opensearch_query_response["hits"]["hits"]) > 0:
-            r = opensearch_query_response["hits"]["hits"][0]
-            next_content_list.insert(0, r["_source"]["text"])
-            next_pos += 1
-        else:
-            break
-    return [previous_content_list, next_content_list]
+    expander = ContextExpander(aos_client, index_name)
+    return expander.expand_sibling_windows([chunk_id], window_size)[0]
 
 def get_context(aos_hit, index_name, window_size):
-    previous_content_list = []
-    next_content_list = []
-    if "chunk_id" not in aos_hit['_source']["metadata"]:
-        return previous_content_list, next_content_list
-    chunk_id = aos_hit["_source"]["metadata"]["chunk_id"]
-    inner_previous_content_list, inner_next_content_list = get_sibling_context(chunk_id, index_name, window_size)
-    if len(inner_previous_content_list) == window_size and len(inner_next_content_list) == window_size:
-        return inner_previous_content_list, inner_next_content_list
-
-    if "heading_hierarchy" not in aos_hit['_source']["metadata"]:
-        return [previous_content_list, next_content_list]
-    if "previous" in aos_hit['_source']["metadata"]["heading_hierarchy"]:
-        previous_chunk_id = aos_hit['_source']["metadata"]["heading_hierarchy"]["previous"]
-        previous_pos = 0
-        while previous_chunk_id and previous_chunk_id.startswith("$") and previous_pos < window_size:
-            opensearch_query_response = aos_client.search(
-                index_name=index_name,
-                query_type="basic",
-                query_term=previous_chunk_id,
-                field="metadata.chunk_id",
-                size=1,
-            )
-            if len(opensearch_query_response["hits"]["hits"]) > 0:
-                r = opensearch_query_response["hits"]["hits"][0]
-                previous_chunk_id = r["_source"]["metadata"]["heading_hierarchy"]["previous"]
-                previous_content_list.insert(0, r["_source"]["text"])
-                previous_pos += 1
-            else:
-                break
-    if "next" in aos_hit['_source']["metadata"]["heading_hierarchy"]:
-        next_chunk_id = aos_hit['_source']["metadata"]["heading_hierarchy"]["next"]
-        next_pos = 0
-        while next_chunk_id and next_chunk_id.startswith("$") and next_pos < window_size:
-            opensearch_query_response = aos_client.search(
-                index_name=index_name,
-                query_type="basic",
-                query_term=next_chunk_id,
-                field="metadata.chunk_id",
-                size=1,
-            )
-            if len(opensearch_query_response["hits"]["hits"]) > 0:
-                r = opensearch_query_response["hits"]["hits"][0]
-                next_chunk_id = r["_source"]["metadata"]["heading_hierarchy"]["next"]
-                next_content_list.append(r["_source"]["text"])
-                next_pos += 1
-            else:
-                break
-    return [previous_content_list, next_content_list]
+    expander = ContextExpander(aos_client, index_name)
+    return expander.expand([aos_hit], window_size)[0]
+
+def get_contexts(aos_hits, index_name, window_size):
+    """get context windows of all hits with batched neighbor lookups"""
+    expander = ContextExpander(aos_client, index_name)
+    return expander.expand(aos_hits, window_size)
 
 def get_parent_content(previous_chunk_id, next_chunk_id, index_name):
     previous_content_list = []
@@ -299,6 +333,7 @@ def get_parent_content(previous_chunk_id, next_chunk_id, index_name):
             query_term=previous_chunk_id,
             field="metadata.chunk_id",
             size=10,
+            fields=PARENT_CONTENT_FIELDS,
         )
         if len(opensearch_query_response["hits"]["hits"]) > 0:
             r = opensearch_query_response["hits"]["hits"][0]
@@ -314,6 +349,7 @@ def get_parent_content(previous_chunk_id, next_chunk_id, index_name):
             query_term=next_chunk_id,
             field="metadata.chunk_id",
             size=10,
+            fields=PARENT_CONTENT_FIELDS,
         )
         if len(opensearch_query_response["hits"]["hits"]) > 0:
             r = opensearch_query_response["hits"]["hits"][0]
@@ -375,6 +411,19 @@ class QueryQuestionRetriever(BaseRetriever):
     target_model: str
     model_type: str = "vector"
     enable_debug: bool = False
+    # search the local intent index exported by the ingestion job, if any
+    local_index: bool = False
+
+    def local_index_search(self, query_repr):
+        """kNN search of the local intent index, None if it is not available"""
+        intent_index = get_local_intent_index(self.index_name)
+        if intent_index is None:
+            return None
+        try:
+            return intent_index.search(query_repr, size=self.top_k, index_name=self.index_name)
+        except ValueError as e:
+            logger.warning(f"local intent index of {self.index_name} not used: {e}")
+            return None
 
     @timeit
     def _get_relevant_documents(self, question: Dict, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
@@ -382,13 +431,18 @@ class QueryQuestionRetriever(BaseRetriever):
         debug_info = question["debug_info"]
         opensearch_knn_results = []
         query_repr = get_similarity_embedding(query, self.embedding_model_endpoint, self.target_model, self.model_type)
-        opensearch_knn_response = aos_client.search(
-            index_name=self.index_name,
-            query_type="knn",
-            query_term=query_repr,
-            field=self.vector_field,
-            size=self.top_k,
-        )
+        opensearch_knn_response = None
+        if self.local_index:
+            opensearch_knn_response = self.local_index_search(query_repr)
+        if opensearch_knn_response is None:
+            opensearch_knn_response = aos_client.search(
+                index_name=self.index_name,
+                query_type="knn",
+                query_term=query_repr,
+                field=self.vector_field,
+                size=self.top_k,
+                fields=FAQ_FIELDS,
+            )
         opensearch_knn_results.extend(
             organize_faq_results(opensearch_knn_response, self.index_name, self.source_field)
         )
@@ -396,6 +450,7 @@ class QueryQuestionRetriever(BaseRetriever):
         for result in opensearch_knn_results:
             docs.append(Document(page_content=result["content"], metadata={
                 "source": result[self.source_field], "score":result["score"],"retrieval_score": result["score"],
+                "retrieval_type": "qq-knn",
                 "retrieval_content": result["content"],"answer": result["answer"], 
                 "question": result["question"]}))
         if self.enable_debug:
@@ -417,26 +472,6 @@ class QueryDocumentKNNRetriever(BaseRetriever):
     enable_debug: bool = False     
     lang: str = 'zh' 
 
-    async def __ainvoke_get_context(self, aos_hit, window_size, loop):
-        return await loop.run_in_executor(None,
-                                          get_context,
-                                          aos_hit,
-                                          self.index_name,
-                                          window_size)
-
-    async def __spawn_task(self, aos_hits, context_size):
-        loop = asyncio.get_event_loop()
-        task_list = []
-        for aos_hit in aos_hits:
-            if context_size:
-                task = asyncio.create_task(
-                    self.__ainvoke_get_context(
-                        aos_hit,
-                        context_size,
-                        loop))
-                task_list.append(task)
-        return await asyncio.gather(*task_list)
-
     @timeit
     def organize_results(self, response, aos_index=None, source_field="file_path", text_field="text", using_whole_doc=True, context_size=0):
         """
@@ -465,7 +500,7 @@ class QueryDocumentKNNRetriever(BaseRetriever):
                 if doc:
                     result["doc"] = doc
         else:
-            response_list = asyncio.run(self.__spawn_task(aos_hits, context_size))
+            response_list = get_contexts(aos_hits, aos_index, context_size)
             for context, result in zip(response_list, results):
                 result["doc"] = "\n".join(context[0] + [result["content"]] + context[1])
         return results
@@ -508,6 +543,7 @@ class QueryDocumentKNNRetriever(BaseRetriever):
                 "retrieval_content": result["content"],
                 "retrieval_data": result["data"],
                 "retrieval_score": result["score"],
+                "retrieval_type": "qd-knn",
                 # Set common score for llm.
                 "score": result["score"],
             }
@@ -532,26 +568,6 @@ class QueryDocumentBM25Retriever(BaseRetriever):
     enable_debug: Any
     config: Dict={"run_name": "BM25"}
 
-    async def __ainvoke_get_context(self, aos_hit, window_size, loop):
-        return await loop.run_in_executor(None,
-                                          get_context,
-                                          aos_hit,
-                                          self.index_name,
-                                          window_size)
-
-    async def __spawn_task(self, aos_hits, context_size):
-        loop = asyncio.get_event_loop()
-        task_list = []
-        for aos_hit in aos_hits:
-            if context_size:
-                task = asyncio.create_task(
-                    self.__ainvoke_get_context(
-                        aos_hit,
-                        context_size,
-                        loop))
-                task_list.append(task)
-        return await asyncio.gather(*task_list)
-
     @timeit
     def organize_results(self, response, aos_index=None, source_field="file_path", text_field="text", using_whole_doc=True, context_size=0):
         """
@@ -590,7 +606,7 @@ class QueryDocumentBM25Retriever(BaseRetriever):
                 if doc:
                     result["doc"] = doc
         else:
-            response_list = asyncio.run(self.__spawn_task(aos_hits, context_size))
+            response_list = get_contexts(aos_hits, aos_index, context_size)
             for context, result in zip(response_list, results):
                 result["doc"] = "\n".join(context[0] + [result["doc"]] + context[1])
             # context = get_context(aos_hit['_source']["metadata"]["heading_hierarchy"]["previous"],
@@ -637,6 +653,7 @@ class QueryDocumentBM25Retriever(BaseRetriever):
                 "retrieval_content": result["content"],
                 "retrieval_data": result["data"],
                 "retrieval_score": result["score"],
+                "retrieval_type": "qd-bm25",
                 # Set common score for llm.
                 "score": result["score"],
             }
@@ -0,0 +1,177 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+from collections import Counter
+
+from opensearchpy.exceptions import NotFoundError, TransportError
+
+logger = logging.getLogger("aos_transport")
+
+aos_request_timeout = float(os.environ.get("AOS_REQUEST_TIMEOUT", 30))
+msearch_coalesce_window = float(os.environ.get("AOS_MSEARCH_COALESCE_WINDOW_MS", 2)) / 1000
+msearch_max_batch_size = int(os.environ.get("AOS_MSEARCH_MAX_BATCH_SIZE", 50))
+
+IMPORT_AIOHTTP_ERROR = (
+    "Could not import aiohttp. Please install it with `pip install opensearch-py[async]`."
+)
+
+
+class _AsyncIndices:
+    def __init__(self, transport):
+        self.transport = transport
+
+    def get(self, index):
+        return self.transport.run(self.transport.client.indices.get(index=index))
+
+
+class AsyncOpenSearchTransport:
+    """
+    Blocking facade of the async OpenSearch client. Requests from all threads
+    run on one background event loop and share its aiohttp connection pool,
+    so concurrent retrievers do not each hold a connection while waiting.
+    """
+
+    def __init__(self, client=None, host=None, http_auth=None, pool_maxsize=32, port=443):
+        """
+        :param client: prebuilt AsyncOpenSearch compatible client, e.g. a local stand-in
+        :param host: OpenSearch Endpoint, used when client is None
+        :param http_auth: AWSV4SignerAsyncAuth of the endpoint
+        :param pool_maxsize: connections kept alive in the aiohttp pool
+        :param port: OpenSearch port
+        """
+        if client is None:
+            try:
+                from opensearchpy import AIOHttpConnection, AsyncOpenSearch
+            except ImportError:
+                raise ImportError(IMPORT_AIOHTTP_ERROR)
+            client = AsyncOpenSearch(
+                hosts=[{"host": host.replace("https://", ""), "port": port}],
+                http_auth=http_auth,
+                use_ssl=True,
+                verify_certs=True,
+                connection_class=AIOHttpConnection,
+                maxsize=pool_maxsize,
+            )
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="aos_async_transport", daemon=True
+        )
+        self._thread.start()
+        self.indices = _AsyncIndices(self)
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout=aos_request_timeout)
+
+    def search(self, body, index):
+        return self.run(self.client.search(body=body, index=index))
+
+    def msearch(self, body, index=None):
+        if index is None:
+            return self.run(self.client.msearch(body=body))
+        return self.run(self.client.msearch(body=body, index=index))
+
+    def close(self):
+        try:
+            self.run(self.client.close())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=1)
+
+
+class MSearchCoalescer:
+    """
+    Merges searches issued concurrently, e.g. by the retrievers of one turn,
+    into a single `_msearch` request, across indices.
+
+    The first caller of a batch waits for `window` seconds, or until
+    `max_batch_size` searches are queued, and then sends the batch;
+    the other callers wait for their own responses.
+    """
+
+    def __init__(self, client, window: float = msearch_coalesce_window, max_batch_size: int = msearch_max_batch_size):
+        """
+        :param client: OpenSearch compatible client, sync or AsyncOpenSearchTransport
+        :param window: seconds to wait for other searches before sending a batch
+        :param max_batch_size: searches sent in one `_msearch` request
+        """
+        self.client = client
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self._batch_full = None
+        self.stats = Counter()
+
+    def msearch(self, searches: list):
+        """
+        Queue searches and wait for their responses
+
+        :param searches: list of (index_name, query body)
+
+        :return: list of raw `_msearch` responses, aligned with searches,
+            failed searches are returned as their error responses
+        """
+        futures = [concurrent.futures.Future() for _ in searches]
+        with self._lock:
+            self._pending.extend(zip(searches, futures))
+            is_leader = self._batch_full is None
+            if is_leader:
+                self._batch_full = threading.Event()
+            batch_full = self._batch_full
+            if len(self._pending) >= self.max_batch_size:
+                batch_full.set()
+
+        if is_leader:
+            batch_full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._batch_full = None
+            for i in range(0, len(batch), self.max_batch_size):
+                self._send(batch[i:i + self.max_batch_size])
+
+        return [future.result(timeout=aos_request_timeout) for future in futures]
+
+    def search(self, index_name, body):
+        """
+        Queue one search and wait for its response
+
+        :param index_name: Target Index Name
+        :param body: query body
+
+        :return: aos response json, raises NotFoundError if the index is missing
+        """
+        response = self.msearch([(index_name, body)])[0]
+        if "error" in response:
+            status = response.get("status", 500)
+            error = response["error"]
+            error_type = error.get("type", str(error)) if isinstance(error, dict) else str(error)
+            if status == 404:
+                raise NotFoundError(status, error_type, response)
+            raise TransportError(status, error_type, response)
+        return response
+
+    def _send(self, batch):
+        body = []
+        for (index_name, query), _ in batch:
+            body.append({"index": index_name})
+            body.append(query)
+        with self._lock:
+            self.stats["round_trips"] += 1
+            self.stats["searches"] += len(batch)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+        try:
+            responses = self.client.msearch(body=body)["responses"]
+        except Exception as e:
+            logger.error(f"coalesced msearch of {len(batch)} searches failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), response in zip(batch, responses):
+            future.set_result(response)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
@@ -1,10 +1,19 @@
+import logging
 import os
 import threading
+import time
 
 import boto3
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from common_logic.common_utils.cache_utils import LRUTTLCache
+from opensearchpy import AWSV4SignerAsyncAuth, OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 
+from .aos_transport import AsyncOpenSearchTransport, MSearchCoalescer
+from .projection import plan_projection
+
+logger = logging.getLogger("aos_utils")
+logger.setLevel(logging.INFO)
+
 open_search_client_lock = threading.Lock()
 
 credentials = boto3.Session().get_credentials()
@@ -18,6 +27,15 @@ awsauth = AWS4Auth(
     session_token=credentials.token,
 )
 
+enable_index_metadata_cache = os.environ.get("ENABLE_INDEX_METADATA_CACHE", "true").lower() in ("true", "1", "t")
+index_metadata_cache_ttl = float(os.environ.get("INDEX_METADATA_CACHE_TTL", 300))
+index_metadata_negative_cache_ttl = float(os.environ.get("INDEX_METADATA_NEGATIVE_CACHE_TTL", 30))
+# `sync` uses requests, `async` runs requests of all threads on the async client
+aos_transport = os.environ.get("AOS_TRANSPORT", "sync").lower()
+aos_pool_maxsize = int(os.environ.get("AOS_POOL_MAXSIZE", 32))
+# merge searches issued concurrently into one _msearch request
+enable_msearch_coalescing = os.environ.get("ENABLE_AOS_MSEARCH_COALESCING", "false").lower() in ("true", "1", "t")
+
 IMPORT_OPENSEARCH_PY_ERROR = (
     "Could not import OpenSearch. Please install it with `pip install opensearch-py`."
 )
@@ -32,10 +50,26 @@ def _import_not_found_error():
     return NotFoundError
 
 
+def get_mapping_fields(properties: dict, prefix: str = ""):
+    """
+    Flatten index mapping properties into dotted field names,
+    multi-fields like `metadata.source.keyword` included
+    """
+    fields = {}
+    for name, field_mapping in properties.items():
+        path = f"{prefix}{name}"
+        fields[path] = field_mapping.get("type", "object")
+        for sub_name, sub_mapping in field_mapping.get("fields", {}).items():
+            fields[f"{path}.{sub_name}"] = sub_mapping.get("type", "object")
+        if "properties" in field_mapping:
+            fields.update(get_mapping_fields(field_mapping["properties"], prefix=f"{path}."))
+    return fields
+
+
 class LLMBotOpenSearchClient:
     instance = None
 
-    def __new__(cls, host):
+    def __new__(cls, host, client=None, transport=None, coalesce=None):
         with open_search_client_lock:
             if cls.instance is not None and cls.instance.host == host:
                 return cls.instance
@@ -43,29 +77,55 @@ class LLMBotOpenSearchClient:
             cls.instance = obj
             return obj
 
-    def __init__(self, host):
+    def __init__(self, host, client=None, transport=None, coalesce=None):
         """
         Initialize OpenSearch client using OpenSearch Endpoint
+
+        :param host: OpenSearch Endpoint
+        :param client: prebuilt OpenSearch compatible client, e.g. a local stand-in
+        :param transport: `sync` or `async`, defaults to AOS_TRANSPORT
+        :param coalesce: merge concurrent searches into one _msearch request,
+            defaults to ENABLE_AOS_MSEARCH_COALESCING
         """
         self.host = host
-        self.client = OpenSearch(
+        self.client = client or self._build_client(host, transport or aos_transport)
+        if coalesce is None:
+            coalesce = enable_msearch_coalescing
+        self.coalescer = MSearchCoalescer(self.client) if coalesce else None
+        # index_name -> {"exists": bool, "fields": {field: type}}
+        self.index_metadata_cache = LRUTTLCache(
+            maxsize=256, ttl=index_metadata_cache_ttl
+        )
+        self.query_match = {
+            "knn": self._build_knn_search_query,
+            "exact": self._build_exactly_match_query,
+            "fuzzy": self._build_fuzzy_search_query,
+            "basic": self._build_basic_search_query,
+        }
+
+    @staticmethod
+    def _build_client(host, transport):
+        port = int(os.environ.get("AOS_PORT", 443))
+        if transport == "async":
+            return AsyncOpenSearchTransport(
+                host=host,
+                http_auth=AWSV4SignerAsyncAuth(credentials, region),
+                pool_maxsize=aos_pool_maxsize,
+                port=port,
+            )
+        return OpenSearch(
             hosts=[
                 {
                     "host": host.replace("https://", ""),
-                    "port": int(os.environ.get("AOS_PORT", 443)),
+                    "port": port,
                 }
             ],
             http_auth=awsauth,
             use_ssl=True,
             verify_certs=True,
             connection_class=RequestsHttpConnection,
+            pool_maxsize=aos_pool_maxsize,
         )
-        self.query_match = {
-            "knn": self._build_knn_search_query,
-            "exact": self._build_exactly_match_query,
-            "fuzzy": self._build_fuzzy_search_query,
-            "basic": self._build_basic_search_query,
-        }
 
     def _build_basic_search_query(
         self, index_name, query_term, field, size, filter=None
@@ -161,6 +221,94 @@ class LLMBotOpenSearchClient:
         query = {"query": {"match_phrase": {field: query_term}}}
         return query
 
+    def _fetch_index_metadata(self, index_name):
+        not_found_error = _import_not_found_error()
+        try:
+            response = self.client.indices.get(index=index_name)
+        except not_found_error:
+            return {"exists": False, "fields": {}, "missing_fields": {}}
+        fields = {}
+        # index_name may be an alias of several indices
+        for index_info in response.values():
+            properties = index_info.get("mappings", {}).get("properties", {})
+            fields.update(get_mapping_fields(properties))
+        # field -> expiration of the negative lookup, see has_field
+        return {"exists": True, "fields": fields, "missing_fields": {}}
+
+    def get_index_metadata(self, index_name, refresh=False):
+        """
+        Get existence and mapped fields of an index, cached with ttl.
+        Missing indices are cached with a shorter ttl.
+
+        :param index_name: Target Index Name
+        :param refresh: bypass the cached metadata
+
+        :return: {"exists": bool, "fields": {field: type}, "missing_fields": {field: expire_at}}
+        """
+        if enable_index_metadata_cache and not refresh:
+            index_metadata = self.index_metadata_cache.get(index_name)
+            if index_metadata is not None:
+                return index_metadata
+        index_metadata = self._fetch_index_metadata(index_name)
+        if enable_index_metadata_cache:
+            ttl = None if index_metadata["exists"] else index_metadata_negative_cache_ttl
+            self.index_metadata_cache.set(index_name, index_metadata, ttl=ttl)
+        return index_metadata
+
+    def invalidate_index_metadata(self, index_name=None):
+        """
+        Drop cached metadata of an index, or of all indices when index_name is None
+        """
+        if index_name is None:
+            self.index_metadata_cache.clear()
+        else:
+            self.index_metadata_cache.delete(index_name)
+
+    def plan_projection(self, index_name, fields=None, docvalue_fields=None):
+        """
+        Plan the `_source` filtering and doc value fields of a search
+
+        :param index_name: Target Index Name
+        :param fields: `_source` fields consumed by the caller, None returns the whole `_source`
+        :param docvalue_fields: keyword fields consumed by the caller
+
+        :return: ProjectionPlan or None
+        """
+        if fields is None and not docvalue_fields:
+            return None
+        index_fields = None
+        if docvalue_fields:
+            index_fields = self.get_index_metadata(index_name)["fields"]
+        return plan_projection(fields or [], docvalue_fields, index_fields)
+
+    def get_coalescer_stats(self):
+        if self.coalescer is None:
+            return {}
+        return self.coalescer.get_stats()
+
+    def index_exists(self, index_name):
+        return self.get_index_metadata(index_name)["exists"]
+
+    def has_field(self, index_name, field):
+        """
+        Check whether field is mapped in index. An unknown field refreshes the
+        cached mapping once, since dynamic mapping adds fields on ingestion,
+        and is then cached as missing for the negative cache ttl.
+        """
+        if not enable_index_metadata_cache:
+            return True
+        index_metadata = self.get_index_metadata(index_name)
+        if field in index_metadata["fields"]:
+            return True
+        expire_at = index_metadata["missing_fields"].get(field)
+        if expire_at is not None and expire_at > time.monotonic():
+            return False
+        index_metadata = self.get_index_metadata(index_name, refresh=True)
+        if field in index_metadata["fields"]:
+            return True
+        index_metadata["missing_fields"][field] = time.monotonic() + index_metadata_negative_cache_ttl
+        return False
+
     def organize_results(self, query_type, response, field):
         """
         Organize results from aos response
@@ -192,6 +340,8 @@ class LLMBotOpenSearchClient:
         field: str = "text",
         size: int = 10,
         filter=None,
+        fields=None,
+        docvalue_fields=None,
     ):
         """
         Perform search on aos
@@ -202,16 +352,87 @@ class LLMBotOpenSearchClient:
         :param field: search field
         :param size: number of results to return from aos
         :param filter: filter query
+        :param fields: `_source` fields consumed by the caller, None returns the whole `_source`
+        :param docvalue_fields: keyword fields consumed by the caller, read from doc values if mapped
 
         :return: aos response json
         """
-        not_found_error = _import_not_found_error()
-        try:
-            self.client.indices.get(index=index_name)
-        except not_found_error:
+        if not self.index_exists(index_name):
             return []
+        if not self.has_field(index_name, field):
+            logger.warning(f"field: {field} is not mapped in index: {index_name}")
+            return {"hits": {"hits": []}}
+        not_found_error = _import_not_found_error()
         query = self.query_match[query_type](
             index_name, query_term, field, size, filter
         )
-        response = self.client.search(body=query, index=index_name)
+        projection_plan = self.plan_projection(index_name, fields, docvalue_fields)
+        if projection_plan is not None:
+            query.update(projection_plan.to_query_params())
+        try:
+            if self.coalescer is not None:
+                response = self.coalescer.search(index_name, query)
+            else:
+                response = self.client.search(body=query, index=index_name)
+        except not_found_error:
+            self.invalidate_index_metadata(index_name)
+            return []
+        if projection_plan is not None:
+            projection_plan.restore(response)
         return response
+
+    def msearch(
+        self,
+        index_name,
+        query_type,
+        query_terms,
+        field: str = "text",
+        size: int = 10,
+        filter=None,
+        fields=None,
+        docvalue_fields=None,
+    ):
+        """
+        Perform multiple searches of the same type on aos in one round trip
+
+        :param index_name: Target Index Name
+        :param query_type: query type
+        :param query_terms: list of query terms
+        :param field: search field
+        :param size: number of results to return from aos for each query term
+        :param filter: filter query
+        :param fields: `_source` fields consumed by the caller, None returns the whole `_source`
+        :param docvalue_fields: keyword fields consumed by the caller, read from doc values if mapped
+
+        :return: list of aos response json, aligned with query_terms
+        """
+        empty_response = {"hits": {"hits": []}}
+        if not query_terms:
+            return []
+        if not self.index_exists(index_name):
+            return [empty_response for _ in query_terms]
+        queries = [
+            self.query_match[query_type](index_name, query_term, field, size, filter)
+            for query_term in query_terms
+        ]
+        projection_plan = self.plan_projection(index_name, fields, docvalue_fields)
+        if projection_plan is not None:
+            for query in queries:
+                query.update(projection_plan.to_query_params())
+        if self.coalescer is not None:
+            responses = self.coalescer.msearch([(index_name, query) for query in queries])
+        else:
+            body = []
+            for query in queries:
+                body.append({"index": index_name})
+                body.append(query)
+            responses = self.client.msearch(body=body)["responses"]
+        if any(r.get("status") == 404 for r in responses):
+            self.invalidate_index_metadata(index_name)
+        if projection_plan is not None:
+            for r in responses:
+                projection_plan.restore(r)
+        return [
+            empty_response if "error" in r else r
+            for r in responses
+        ]
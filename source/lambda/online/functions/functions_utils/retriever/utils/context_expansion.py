@@ -0,0 +1,193 @@
+import logging
+import time
+from typing import Dict, List, Optional
+
+from .projection import CONTEXT_FIELDS
+
+logger = logging.getLogger("context_expansion")
+logger.setLevel(logging.INFO)
+
+
+def split_chunk_id(chunk_id: str):
+    """split chunk id like `$1-2-3` into prefix `$1-2` and section id 3"""
+    chunk_id_prefix = "-".join(chunk_id.split("-")[:-1])
+    section_id = int(chunk_id.split("-")[-1])
+    return chunk_id_prefix, section_id
+
+
+class ContextExpander:
+    """
+    Batched neighbor context expansion for qd retrievers.
+
+    Instead of walking previous/next chunk ids with one OpenSearch search per
+    neighbor, every chunk id needed by all hits is collected first and resolved
+    with a single `_msearch` call per round, then the ordered windows are
+    rebuilt locally:
+        1. sibling round: all `{prefix}-{section_id +/- k}` ids, one round trip.
+        2. heading hierarchy rounds: only for hits whose sibling window is not
+           full, the previous/next chains are followed in lockstep, at most
+           `window_size` round trips.
+    """
+
+    def __init__(self, aos_client, index_name: str, chunk_id_field: str = "metadata.chunk_id"):
+        self.aos_client = aos_client
+        self.index_name = index_name
+        self.chunk_id_field = chunk_id_field
+        # chunk_id -> _source, None means chunk not found
+        self.resolved: Dict[str, Optional[dict]] = {}
+        self.stats = {"round_trips": 0, "resolved_chunk_ids": 0, "latency": 0.0}
+
+    def resolve(self, chunk_ids: List[str]):
+        """fetch the unresolved chunk ids with one msearch round trip"""
+        pending = [
+            chunk_id for chunk_id in dict.fromkeys(chunk_ids)
+            if chunk_id not in self.resolved
+        ]
+        if not pending:
+            return
+        start = time.perf_counter()
+        responses = self.aos_client.msearch(
+            index_name=self.index_name,
+            query_type="basic",
+            query_terms=pending,
+            field=self.chunk_id_field,
+            size=1,
+            fields=CONTEXT_FIELDS,
+        )
+        self.stats["latency"] += time.perf_counter() - start
+        self.stats["round_trips"] += 1
+        self.stats["resolved_chunk_ids"] += len(pending)
+        for chunk_id, response in zip(pending, responses):
+            hits = response["hits"]["hits"]
+            self.resolved[chunk_id] = hits[0]["_source"] if hits else None
+
+    def expand_sibling_windows(self, chunk_ids: List[str], window_size: int):
+        """
+        Get previous/next sibling contents of each chunk id
+
+        :param chunk_ids: chunk ids of the hits
+        :param window_size: max number of siblings on each side
+
+        :return: list of [previous_content_list, next_content_list], aligned with chunk_ids
+        """
+        neighbor_ids = []
+        for chunk_id in chunk_ids:
+            chunk_id_prefix, section_id = split_chunk_id(chunk_id)
+            for offset in range(1, window_size + 1):
+                if section_id - offset >= 1:
+                    neighbor_ids.append(f"{chunk_id_prefix}-{section_id - offset}")
+                neighbor_ids.append(f"{chunk_id_prefix}-{section_id + offset}")
+        self.resolve(neighbor_ids)
+
+        windows = []
+        for chunk_id in chunk_ids:
+            chunk_id_prefix, section_id = split_chunk_id(chunk_id)
+            previous_content_list = []
+            for previous_section_id in range(section_id - 1, max(section_id - window_size, 1) - 1, -1):
+                source = self.resolved.get(f"{chunk_id_prefix}-{previous_section_id}")
+                if source is None:
+                    break
+                previous_content_list.insert(0, source["text"])
+            next_content_list = []
+            for next_section_id in range(section_id + 1, section_id + window_size + 1):
+                source = self.resolved.get(f"{chunk_id_prefix}-{next_section_id}")
+                if source is None:
+                    break
+                next_content_list.append(source["text"])
+            windows.append([previous_content_list, next_content_list])
+        return windows
+
+    def expand_heading_windows(self, heading_hierarchies: List[dict], window_size: int):
+        """
+        Follow heading_hierarchy previous/next chains of all hits in lockstep
+
+        :param heading_hierarchies: heading_hierarchy metadata of the hits
+        :param window_size: max number of chunks on each side
+
+        :return: list of [previous_content_list, next_content_list], aligned with heading_hierarchies
+        """
+        windows = [[[], []] for _ in heading_hierarchies]
+        # (hit position, direction) -> current chunk id of the chain
+        cursors = {}
+        for i, heading_hierarchy in enumerate(heading_hierarchies):
+            for direction, key in enumerate(("previous", "next")):
+                cursors[(i, direction)] = heading_hierarchy.get(key)
+
+        for _ in range(window_size):
+            cursors = {
+                k: chunk_id for k, chunk_id in cursors.items()
+                if chunk_id and chunk_id.startswith("$")
+            }
+            if not cursors:
+                break
+            self.resolve(list(cursors.values()))
+            next_cursors = {}
+            for (i, direction), chunk_id in cursors.items():
+                source = self.resolved.get(chunk_id)
+                if source is None:
+                    continue
+                if direction == 0:
+                    windows[i][0].insert(0, source["text"])
+                    next_cursors[(i, direction)] = source["metadata"].get("heading_hierarchy", {}).get("previous")
+                else:
+                    windows[i][1].append(source["text"])
+                    next_cursors[(i, direction)] = source["metadata"].get("heading_hierarchy", {}).get("next")
+            cursors = next_cursors
+        return windows
+
+    def expand(self, aos_hits: List[dict], window_size: int):
+        """
+        Get the context windows of aos hits, same semantics as `get_context`
+
+        :param aos_hits: hits in aos response
+        :param window_size: max number of chunks on each side
+
+        :return: list of [previous_content_list, next_content_list], aligned with aos_hits
+        """
+        windows = [[[], []] for _ in aos_hits]
+        if not window_size:
+            return windows
+        sibling_positions = [
+            i for i, aos_hit in enumerate(aos_hits)
+            if "chunk_id" in aos_hit["_source"]["metadata"]
+        ]
+        sibling_windows = self.expand_sibling_windows(
+            [aos_hits[i]["_source"]["metadata"]["chunk_id"] for i in sibling_positions],
+            window_size
+        )
+        heading_positions = []
+        for i, window in zip(sibling_positions, sibling_windows):
+            if len(window[0]) == window_size and len(window[1]) == window_size:
+                windows[i] = window
+            elif "heading_hierarchy" in aos_hits[i]["_source"]["metadata"]:
+                heading_positions.append(i)
+
+        heading_windows = self.expand_heading_windows(
+            [aos_hits[i]["_source"]["metadata"]["heading_hierarchy"] for i in heading_positions],
+            window_size
+        )
+        for i, window in zip(heading_positions, heading_windows):
+            windows[i] = window
+        logger.info(f"context expansion of {len(aos_hits)} hits, stats: {self.stats}")
+        return windows
+
+
+def benchmark_context_expansion(aos_client, index_name: str, aos_hits: List[dict], window_size: int):
+    """
+    Run batched context expansion and report round trips and latency,
+    e.g. against a local fake OpenSearch
+
+    :return: dict with windows and stats
+    """
+    start = time.perf_counter()
+    expander = ContextExpander(aos_client, index_name)
+    windows = expander.expand(aos_hits, window_size)
+    return {
+        "windows": windows,
+        "hit_num": len(aos_hits),
+        "window_size": window_size,
+        "round_trips": expander.stats["round_trips"],
+        "resolved_chunk_ids": expander.stats["resolved_chunk_ids"],
+        "search_latency": expander.stats["latency"],
+        "total_latency": time.perf_counter() - start,
+    }
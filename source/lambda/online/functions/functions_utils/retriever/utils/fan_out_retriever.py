@@ -0,0 +1,116 @@
+import concurrent.futures
+import logging
+import os
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.schema.retriever import BaseRetriever
+
+logger = logging.getLogger("fan_out_retriever")
+
+default_retriever_timeout = float(os.environ.get("RETRIEVER_TIMEOUT", 10))
+retriever_fan_out_max_workers = int(os.environ.get("RETRIEVER_FAN_OUT_MAX_WORKERS", 16))
+
+# shared by all invocations of a warm container, each retriever runs in its
+# own thread so the event loops created by context expansion do not interfere
+_fan_out_executor = None
+
+
+def get_fan_out_executor():
+    global _fan_out_executor
+    if _fan_out_executor is None:
+        _fan_out_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=retriever_fan_out_max_workers,
+            thread_name_prefix="retriever_fan_out"
+        )
+    return _fan_out_executor
+
+
+def get_retriever_name(retriever: BaseRetriever, i: int):
+    index_name = getattr(retriever, "index_name", None)
+    name = f"{type(retriever).__name__}_{i + 1}"
+    if index_name:
+        name = f"{name}-{index_name}"
+    return name
+
+
+class FanOutRetriever(BaseRetriever):
+    """
+    Runs all retrievers concurrently and merges their results in the same
+    order as MergerRetriever. A retriever missing its deadline is dropped from
+    the results, the others are returned as partial results. Per retriever
+    latency and status are written to `debug_info["retriever_stats"]`.
+
+    Timed out retrievers can not be interrupted and keep their worker thread
+    until they return.
+    """
+    retrievers: List[BaseRetriever]
+    # per retriever deadlines in seconds, None uses the default timeout
+    timeouts: Optional[List[Optional[float]]] = None
+    default_timeout: float = default_retriever_timeout
+
+    def _get_timeout(self, i: int):
+        if self.timeouts and i < len(self.timeouts) and self.timeouts[i] is not None:
+            return self.timeouts[i]
+        return self.default_timeout
+
+    def _get_relevant_documents(self, question: Dict, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        executor = get_fan_out_executor()
+        start = time.perf_counter()
+        futures = [
+            executor.submit(
+                self._timed_invoke,
+                retriever,
+                question,
+                run_manager.get_child("retriever_{}".format(i + 1))
+            )
+            for i, retriever in enumerate(self.retrievers)
+        ]
+
+        retriever_docs = []
+        retriever_stats = []
+        for i, (retriever, future) in enumerate(zip(self.retrievers, futures)):
+            timeout = self._get_timeout(i)
+            stat = {"name": get_retriever_name(retriever, i), "timeout": timeout}
+            remaining = max(start + timeout - time.perf_counter(), 0)
+            try:
+                docs, latency = future.result(timeout=remaining)
+                stat.update({"status": "ok", "latency": round(latency, 4), "doc_num": len(docs)})
+            except concurrent.futures.TimeoutError:
+                docs = []
+                stat.update({"status": "timeout", "latency": round(time.perf_counter() - start, 4), "doc_num": 0})
+                logger.warning(f"retriever {stat['name']} missed its deadline of {timeout}s")
+            except Exception as e:
+                docs = []
+                stat.update({
+                    "status": "error",
+                    "latency": round(time.perf_counter() - start, 4),
+                    "doc_num": 0,
+                    "error": f"{type(e).__name__}: {e}"
+                })
+                logger.error(f"retriever {stat['name']} failed: {traceback.format_exc()}")
+            retriever_docs.append(docs)
+            retriever_stats.append(stat)
+
+        total_latency = round(time.perf_counter() - start, 4)
+        logger.info(f"retriever fan out latency: {total_latency}s, stats: {retriever_stats}")
+        if isinstance(question, dict) and isinstance(question.get("debug_info"), dict):
+            question["debug_info"]["retriever_stats"] = retriever_stats
+            question["debug_info"]["retriever_latency"] = total_latency
+
+        merged_documents = []
+        max_docs = max(map(len, retriever_docs), default=0)
+        for i in range(max_docs):
+            for docs in retriever_docs:
+                if i < len(docs):
+                    merged_documents.append(docs[i])
+        return merged_documents
+
+    @staticmethod
+    def _timed_invoke(retriever: BaseRetriever, question: Dict, callbacks):
+        start = time.perf_counter()
+        docs = retriever.invoke(question, config={"callbacks": callbacks})
+        return docs, time.perf_counter() - start
@@ -0,0 +1,98 @@
+import os
+from typing import Dict, List, Optional
+
+enable_field_projection = os.environ.get("ENABLE_AOS_FIELD_PROJECTION", "true").lower() in ("true", "1", "t")
+# read keyword fields from doc values instead of _source when they are mapped
+enable_docvalue_fields = os.environ.get("ENABLE_AOS_DOCVALUE_FIELDS", "true").lower() in ("true", "1", "t")
+
+# dense vectors and colbert/sparse payloads are never consumed by the online path
+VECTOR_EXCLUDES = ["vector_field", "*.additional_vecs"]
+
+# fields consumed by each call site, see aos_retrievers and context_expansion
+CONTEXT_FIELDS = ["text", "metadata.chunk_id", "metadata.heading_hierarchy"]
+DOC_FIELDS = ["text"]
+DOC_DOCVALUE_FIELDS = ["metadata.chunk_id", "metadata.content_type"]
+# organize_faq_results returns the metadata of some faq formats as the answer
+FAQ_FIELDS = ["text", "content", "metadata"]
+FAQ_ANSWER_FIELDS = ["content", "metadata.field", "metadata.jsonlAnswer.answer"]
+FAQ_CONTENT_FIELDS = ["content", "metadata.field"]
+PARENT_CONTENT_FIELDS = ["text", "metadata.chunk_id"]
+
+
+def set_field_value(source: dict, field: str, value):
+    keys = field.split(".")
+    for key in keys[:-1]:
+        source = source.setdefault(key, {})
+    source[keys[-1]] = value
+
+
+class ProjectionPlan:
+    """
+    Request parameters of a field projection and how to restore
+    doc value fields into `_source`, so callers keep reading `_source`
+    """
+
+    def __init__(self, source: dict, docvalue_fields: Dict[str, str] = None):
+        """
+        :param source: `_source` filter of the request
+        :param docvalue_fields: doc value field -> `_source` path
+        """
+        self.source = source
+        self.docvalue_fields = docvalue_fields or {}
+
+    def to_query_params(self):
+        params = {"_source": self.source}
+        if self.docvalue_fields:
+            params["docvalue_fields"] = list(self.docvalue_fields)
+        return params
+
+    def restore(self, response: dict):
+        """move doc values of the hits into their `_source`"""
+        if not self.docvalue_fields or not isinstance(response, dict):
+            return response
+        for hit in response.get("hits", {}).get("hits", []):
+            fields = hit.pop("fields", {})
+            source = hit.setdefault("_source", {})
+            for docvalue_field, path in self.docvalue_fields.items():
+                values = fields.get(docvalue_field)
+                if values:
+                    set_field_value(source, path, values[0])
+        return response
+
+
+def plan_projection(
+    fields: List[str],
+    docvalue_fields: Optional[List[str]] = None,
+    index_fields: Optional[Dict[str, str]] = None,
+    excludes: Optional[List[str]] = None,
+):
+    """
+    Turn the fields consumed by a call site into `_source` filtering and `docvalue_fields`
+
+    :param fields: `_source` fields consumed, dotted paths
+    :param docvalue_fields: keyword fields consumed, read from doc values if mapped as keyword
+    :param index_fields: mapped fields of the index, {field: type}
+    :param excludes: `_source` excludes, defaults to the vector fields
+
+    :return: ProjectionPlan, None if projection is disabled
+    """
+    if not enable_field_projection:
+        return None
+    includes = list(fields)
+    docvalue_paths = {}
+    for field in docvalue_fields or []:
+        docvalue_field = None
+        if enable_docvalue_fields and index_fields:
+            if index_fields.get(field) == "keyword":
+                docvalue_field = field
+            elif index_fields.get(f"{field}.keyword") == "keyword":
+                docvalue_field = f"{field}.keyword"
+        if docvalue_field is None:
+            includes.append(field)
+        else:
+            docvalue_paths[docvalue_field] = field
+    source = {
+        "includes": includes,
+        "excludes": VECTOR_EXCLUDES if excludes is None else excludes
+    }
+    return ProjectionPlan(source, docvalue_paths)
@@ -14,35 +14,127 @@ from langchain.schema import Document
 from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
 
 from sm_utils import SagemakerEndpointVectorOrCross
+from common_logic.common_utils.aws_client_utils import get_client
+from common_logic.common_utils.cache_utils import TieredCache, stable_hash
 
 rerank_model_endpoint = os.environ.get("RERANK_ENDPOINT", "")
+# storage dtype of the padded colbert vectors, float16 halves their memory,
+# token similarities are always computed in float32
+colbert_storage_dtype = np.dtype(os.environ.get("COLBERT_STORAGE_DTYPE", "float32"))
+# upper bound of the (candidates, doc tokens, query tokens) similarities computed at once
+colbert_score_max_block_elements = int(os.environ.get("COLBERT_SCORE_MAX_BLOCK_ELEMENTS", 1 << 24))
 
-"""Document compressor that uses BGE reranker model."""
-class BGEM3Reranker(BaseDocumentCompressor):
+enable_rerank_score_cache = os.environ.get("ENABLE_RERANK_SCORE_CACHE", "true").lower() in ("true", "1", "t")
+# cross-encoder scores of (query, doc) pairs, shared by all invocations of a warm container
+rerank_score_cache = TieredCache(
+    maxsize=int(os.environ.get("RERANK_SCORE_CACHE_MAXSIZE", 4096)),
+    ttl=float(os.environ.get("RERANK_SCORE_CACHE_TTL", 3600)),
+)
+# skip reranking the tail of candidates whose first-stage scores separate cleanly
+enable_rerank_adaptive_budget = os.environ.get("ENABLE_RERANK_ADAPTIVE_BUDGET", "false").lower() in ("true", "1", "t")
+# a gap covering this share of the first-stage score range separates head and tail
+rerank_budget_gap_ratio = float(os.environ.get("RERANK_BUDGET_GAP_RATIO", 0.4))
 
-    """Number of documents to return."""
-    def _colbert_score_np(self, q_reps, p_reps):
-        token_scores = np.einsum('nik,njk->nij', q_reps, p_reps)
-        scores = token_scores.max(-1)
-        scores = np.sum(scores) / q_reps.shape[0]
+
+def pad_colbert_vecs(colbert_vecs_list, dtype=None):
+    """
+    Pad the token matrices of the candidates into one array
+
+    :param colbert_vecs_list: list of token matrices, (tokens, dim) each
+    :param dtype: storage dtype, defaults to COLBERT_STORAGE_DTYPE
+
+    :return: padded array (candidates, max tokens, dim) and token lengths (candidates,)
+    """
+    dtype = colbert_storage_dtype if dtype is None else np.dtype(dtype)
+    token_matrices = [np.asarray(vecs, dtype=dtype) for vecs in colbert_vecs_list]
+    dims = {m.shape[-1] for m in token_matrices if m.size}
+    if len(dims) > 1:
+        raise ValueError(f"colbert vectors of different dims: {dims}")
+    dim = dims.pop() if dims else 0
+    lengths = np.array([m.shape[0] if m.size else 0 for m in token_matrices], dtype=np.int64)
+    padded = np.zeros((len(token_matrices), int(lengths.max(initial=0)), dim), dtype=dtype)
+    for i, m in enumerate(token_matrices):
+        if lengths[i]:
+            padded[i, :lengths[i]] = m
+    return padded, lengths
+
+
+def get_rerank_score_cache_key(model_key: str, query: str, doc: str):
+    return "|".join([model_key, stable_hash(query), stable_hash(doc)])
+
+
+def get_rerank_score_cache_stats():
+    return rerank_score_cache.get_stats()
+
+
+def plan_rerank_budget(scores: Sequence[float], min_candidates: int, gap_ratio: float = None):
+    """
+    Number of candidates to rerank among candidates of one first-stage
+    retriever, sorted by score. The candidates are cut at the largest score
+    gap after the first `min_candidates` if that gap covers at least
+    `gap_ratio` of the score range, otherwise all of them are reranked.
+
+    :param scores: first-stage scores, sorted in descending order
+    :param min_candidates: candidates always reranked, usually the top_k of the reranker
+    :param gap_ratio: defaults to RERANK_BUDGET_GAP_RATIO
+
+    :return: number of head candidates to rerank
+    """
+    gap_ratio = rerank_budget_gap_ratio if gap_ratio is None else gap_ratio
+    if len(scores) <= max(min_candidates, 1):
+        return len(scores)
+    score_range = scores[0] - scores[-1]
+    if score_range <= 0:
+        return len(scores)
+    best_cut, best_gap = len(scores), 0
+    for cut in range(max(min_candidates, 1), len(scores)):
+        gap = scores[cut - 1] - scores[cut]
+        if gap > best_gap:
+            best_cut, best_gap = cut, gap
+    if best_gap / score_range >= gap_ratio:
+        return best_cut
+    return len(scores)
+
+
+def batch_colbert_score(q_reps, p_reps_list, dtype=None):
+    """
+    Late interaction score of one query against all candidates: the sum over
+    query tokens of the max similarity with the candidate tokens, the same
+    score as scoring the candidates one by one. Candidates are scored in
+    blocks bounded by COLBERT_SCORE_MAX_BLOCK_ELEMENTS.
+
+    :param q_reps: query token matrix (query tokens, dim)
+    :param p_reps_list: candidate token matrices, (tokens, dim) each
+    :param dtype: storage dtype of the padded candidates, defaults to COLBERT_STORAGE_DTYPE
+
+    :return: np.ndarray of scores (candidates,), 0 for candidates without tokens
+    """
+    if len(p_reps_list) == 0:
+        return np.zeros(0, dtype=np.float32)
+    q = np.asarray(q_reps, dtype=np.float32)
+    padded, lengths = pad_colbert_vecs(p_reps_list, dtype)
+    candidate_num, max_len = padded.shape[0], padded.shape[1]
+    scores = np.zeros(candidate_num, dtype=np.float32)
+    if max_len == 0 or q.size == 0:
         return scores
+    # padding positions never win the max
+    pad_mask = np.arange(max_len)[None, :] >= lengths[:, None]
+    block_size = max(1, colbert_score_max_block_elements // (max_len * q.shape[0]))
+    for start in range(0, candidate_num, block_size):
+        end = start + block_size
+        block = padded[start:end].astype(np.float32, copy=False)
+        # (block, doc tokens, query tokens)
+        token_scores = block @ q.T
+        token_scores[pad_mask[start:end]] = -np.inf
+        max_scores = token_scores.max(axis=1)
+        scores[start:end] = np.where(lengths[start:end, None] > 0, max_scores, 0).sum(axis=-1)
+    return scores
 
-    async def __ainvoke_rerank_model(self, query_batch, doc_batch, loop):
-        return await loop.run_in_executor(None,
-                                          self._colbert_score_np,
-                                          np.asarray(query_batch),
-                                          np.asarray(doc_batch))
 
-    async def __spawn_task(self, query_colbert_list, doc_colbert_list):
-        batch_size = 1
-        task_list = []
-        loop = asyncio.get_event_loop()
-        for batch_start in range(0, len(query_colbert_list), batch_size):
-            task = asyncio.create_task(self.__ainvoke_rerank_model(
-                query_colbert_list[batch_start:batch_start + batch_size],
-                doc_colbert_list[batch_start:batch_start + batch_size], loop))
-            task_list.append(task)
-        return await asyncio.gather(*task_list)
+"""Document compressor that uses BGE reranker model."""
+class BGEM3Reranker(BaseDocumentCompressor):
+
+    """Number of documents to return."""
 
     def compress_documents(
         self,
@@ -68,14 +160,10 @@ class BGEM3Reranker(BaseDocumentCompressor):
         _docs = [d.metadata["retrieval_data"]['colbert'] for d in doc_list]
 
         rerank_text_length = 1024 * 10
-        query_colbert_list = []
-        doc_colbert_list = []
-        for doc in _docs:
-            query_colbert_list.append(query["colbert"][:rerank_text_length])
-            doc_colbert_list.append(doc[:rerank_text_length])
-        score_list = []
-        logger.info(f'rerank pair num {len(query_colbert_list)}, m3 method: colbert score')
-        score_list = asyncio.run(self.__spawn_task(query_colbert_list, doc_colbert_list))
+        query_colbert = query["colbert"][:rerank_text_length]
+        doc_colbert_list = [doc[:rerank_text_length] for doc in _docs]
+        logger.info(f'rerank pair num {len(doc_colbert_list)}, m3 method: colbert score')
+        score_list = batch_colbert_score(query_colbert, doc_colbert_list).tolist()
         final_results = []
         debug_info = query["debug_info"]
         debug_info["knowledge_qa_rerank"] = []
@@ -118,7 +206,36 @@ class BGEReranker(BaseDocumentCompressor):
                                           None,
                                           "rerank",
                                           None,
-                                          self.target_model)
+                                          self.target_model,
+                                          get_client("sagemaker-runtime"))
+
+    def _get_model_key(self):
+        return f"{self.rerank_model_endpoint}/{self.target_model}"
+
+    def _select_candidates(self, doc_list):
+        """
+        Indices of the candidates to rerank and the budget decisions, candidates
+        are grouped by first-stage retriever since their scores are not comparable
+        """
+        if not enable_rerank_adaptive_budget:
+            return list(range(len(doc_list))), []
+        groups = {}
+        for i, doc in enumerate(doc_list):
+            groups.setdefault(doc.metadata.get("retrieval_type", ""), []).append(i)
+        selected = []
+        decisions = []
+        for retrieval_type, indices in groups.items():
+            indices = sorted(indices, key=lambda i: doc_list[i].metadata.get("retrieval_score", 0), reverse=True)
+            scores = [doc_list[i].metadata.get("retrieval_score", 0) for i in indices]
+            budget = plan_rerank_budget(scores, self.top_k)
+            selected.extend(indices[:budget])
+            decisions.append({
+                "retrieval_type": retrieval_type,
+                "candidates": len(indices),
+                "reranked": budget,
+                "cut_score": scores[budget - 1] if budget < len(indices) else None,
+            })
+        return sorted(selected), decisions
 
     async def __spawn_task(self, rerank_pair):
         batch_size = 128
@@ -150,20 +267,46 @@ class BGEReranker(BaseDocumentCompressor):
         if len(documents) == 0:  # to avoid empty api call
             return []
         doc_list = list(documents)
+        selected, budget_decisions = self._select_candidates(doc_list)
+        doc_list = [doc_list[i] for i in selected]
         _docs = [d.metadata["retrieval_content"] for d in doc_list]
 
-        rerank_pair = []
         rerank_text_length = 1024 * 10
-        for doc in _docs:
-            rerank_pair.append([query["query"], doc[:rerank_text_length]])
-        score_list = []
+        model_key = self._get_model_key()
+        score_list = [None] * len(_docs)
+        cache_keys = [None] * len(_docs)
+        rerank_pair = []
+        rerank_pair_index = []
+        for i, doc in enumerate(_docs):
+            doc = doc[:rerank_text_length]
+            if enable_rerank_score_cache:
+                cache_keys[i] = get_rerank_score_cache_key(model_key, query["query"], doc)
+                score_list[i] = rerank_score_cache.get(cache_keys[i])
+            if score_list[i] is None:
+                rerank_pair.append([query["query"], doc])
+                rerank_pair_index.append(i)
         logger.info(f'rerank pair num {len(rerank_pair)}, endpoint_name: {self.rerank_model_endpoint}')
-        response_list = asyncio.run(self.__spawn_task(rerank_pair))
-        for response in response_list:
-            score_list.extend(json.loads(response))
+        if rerank_pair:
+            response_list = asyncio.run(self.__spawn_task(rerank_pair))
+            new_scores = []
+            for response in response_list:
+                new_scores.extend(json.loads(response))
+            for i, score in zip(rerank_pair_index, new_scores):
+                score_list[i] = score
+                if enable_rerank_score_cache:
+                    rerank_score_cache.set(cache_keys[i], score)
         final_results = []
         debug_info = query["debug_info"]
         debug_info["knowledge_qa_rerank"] = []
+        debug_info["rerank_stats"] = {
+            "candidates": len(documents),
+            "reranked": len(doc_list),
+            "skipped": len(documents) - len(doc_list),
+            "cache_hits": len(doc_list) - len(rerank_pair),
+            "endpoint_pairs": len(rerank_pair),
+            "budget_decisions": budget_decisions,
+        }
+        logger.info(f"rerank stats: {debug_info['rerank_stats']}")
         for doc, score in zip(doc_list, score_list):
             doc.metadata["rerank_score"] = score
             # set common score for llm.
@@ -1,5 +1,7 @@
 # test tool
 import requests
+from common_logic.common_utils.state_projection_utils import state_projection
+
 
 def get_weather(city_name:str):
     if not isinstance(city_name, str):
@@ -29,6 +31,7 @@ def get_weather(city_name:str):
     return str(ret)
 
 
+@state_projection(reads=[], state_key="state")
 def lambda_handler(event_body,context=None):
     result = get_weather(**event_body['kwargs'])
     return {"code":0, "result": result}
\ No newline at end of file
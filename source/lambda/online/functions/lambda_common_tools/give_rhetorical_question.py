@@ -1,4 +1,8 @@
 # give rhetorical question
+from common_logic.common_utils.state_projection_utils import state_projection
+
+
+@state_projection(reads=[], state_key="state")
 def lambda_handler(event_body,context=None):
     try:
         result = event_body['kwargs']['question']
@@ -1,18 +1,23 @@
-from common_logic.common_utils.lambda_invoke_utils import invoke_lambda
+from common_logic.common_utils.constant import LLMTaskType
+from common_logic.common_utils.lambda_invoke_utils import invoke_lambda, send_trace
 from common_logic.common_utils.prompt_utils import get_prompt_templates_from_ddb
-from common_logic.common_utils.constant import (
-    LLMTaskType
-)
-from common_logic.common_utils.lambda_invoke_utils import send_trace
+from common_logic.common_utils.state_projection_utils import state_projection
 
 
+@state_projection(
+    reads=["qq_match_results", "chatbot_config", "query", "chat_history", "stream", "enable_trace"],
+    writes=["extra_response"],
+    field_refs=["chatbot_config.private_knowledge_config.retriever_config.query_key"],
+    state_key="state",
+)
 def lambda_handler(event_body,context=None):
     state = event_body['state']
     context_list = []
     # add qq match results
     context_list.extend(state['qq_match_results'])
     figure_list = []
-    retriever_params = state["chatbot_config"]["private_knowledge_config"]
+    # a copy, the chatbot config is shared by the requests of the chatbot
+    retriever_params = {**state["chatbot_config"]["private_knowledge_config"]}
     retriever_params["query"] = state[retriever_params.get("retriever_config",{}).get("query_key","query")]
     output: str = invoke_lambda(
         event_body=retriever_params,
@@ -28,7 +33,8 @@ def lambda_handler(event_body,context=None):
     # Remove duplicate figures
     unique_set = {tuple(d.items()) for d in figure_list}
     unique_figure_list = [dict(t) for t in unique_set]
-    state['extra_response']['figures'] = unique_figure_list
+    # only the written part of extra_response, merged by its reducer
+    state.setdefault('extra_response', {})['figures'] = unique_figure_list
     
     send_trace(f"\n\n**rag-contexts:** {context_list}", enable_trace=state["enable_trace"])
     
@@ -2,8 +2,10 @@
 from functions import get_tool_by_name,Tool
 from common_logic.common_utils.lambda_invoke_utils import invoke_lambda
 from common_logic.common_utils.lambda_invoke_utils import chatbot_lambda_call_wrapper
+from common_logic.common_utils.state_projection_utils import state_projection
 
 @chatbot_lambda_call_wrapper
+@state_projection(reads=["chatbot_config"], state_key="state")
 def lambda_handler(event_body,context=None):
     tool_name = event_body['tool_name']
     state = event_body['state']
@@ -4,6 +4,7 @@ from langchain.schema.runnable import (
 from common_logic.common_utils.prompt_utils import get_prompt_templates_from_ddb
 from common_logic.common_utils.logger_utils  import get_logger
 from common_logic.common_utils.lambda_invoke_utils import invoke_lambda,chatbot_lambda_call_wrapper
+from common_logic.common_utils.state_projection_utils import state_projection
 from common_logic.common_utils.constant import LLMTaskType
 from functions import get_tool_by_name
 
@@ -60,6 +61,19 @@ def tool_calling(state:dict):
 
 
 @chatbot_lambda_call_wrapper
+@state_projection(
+    reads=[
+        "chatbot_config",
+        "intent_fewshot_tools",
+        "intent_fewshot_examples",
+        "other_chain_kwargs",
+        "agent_llm_type",
+        # llm_input of the tool calling chains
+        "query",
+        "chat_history",
+        "agent_tool_history",
+    ]
+)
 def lambda_handler(state:dict, context=None):
     output = tool_calling(state)
     return output
\ No newline at end of file
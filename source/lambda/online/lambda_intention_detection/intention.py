@@ -1,10 +1,48 @@
 from common_logic.common_utils.logger_utils  import get_logger
 from common_logic.common_utils.lambda_invoke_utils import chatbot_lambda_call_wrapper,invoke_lambda
+import copy
 import json
+import os
 import pathlib
+from functools import lru_cache
 
 logger = get_logger("intention")
 
+# search the intent indexes exported by the ingestion job in-process,
+# indexes without an exported artifact are still queried in OpenSearch
+enable_local_intent_index = os.environ.get("ENABLE_LOCAL_INTENT_INDEX", "false").lower() in ("true", "1", "t")
+
+
+@lru_cache()
+def load_default_intent_examples():
+    """few shot examples of the default intentions, read once per container"""
+    current_path = pathlib.Path(__file__).parent.resolve()
+    try:
+        with open(f'{current_path}/intention_utils/default_intent.jsonl', 'r') as json_file:
+            json_list = list(json_file)
+    except FileNotFoundError:
+        logger.error(f"File note found: {current_path}/intention_utils/default_intent.jsonl")
+        json_list = []
+
+    intent_fewshot_examples = []
+    for json_str in json_list:
+        try:
+            intent_result = json.loads(json_str)
+        except json.JSONDecodeError as e:
+            logger.error(f"Error decoding JSON: {e}")
+            intent_result = {}
+        question = intent_result.get("question","你好")
+        answer = intent_result.get("answer",{})
+        intent_fewshot_examples.append({
+            "query": question,
+            "score": 'n/a',
+            "name": answer.get('intent','chat'),
+            "intent": answer.get('intent','chat'),
+            "kwargs": answer.get('kwargs', {}),
+        })
+    return intent_fewshot_examples
+
+
 def get_intention_results(query:str, intention_config:dict):
     """get intentino few shots results according embedding similarity
 
@@ -20,6 +58,11 @@ def get_intention_results(query:str, intention_config:dict):
         "type": 'qq',
         **intention_config
     }
+    if enable_local_intent_index:
+        event_body["retrievers"] = [
+            {**retriever, "local_index": True}
+            for retriever in intention_config.get("retrievers", [])
+        ]
     # call retriver
     res:list[dict] = invoke_lambda(
         lambda_name='Online_Functions',
@@ -30,31 +73,7 @@ def get_intention_results(query:str, intention_config:dict):
 
     if not res['result']['docs']:
         # add default intention
-        current_path = pathlib.Path(__file__).parent.resolve()
-        try:
-            with open(f'{current_path}/intention_utils/default_intent.jsonl', 'r') as json_file:
-                json_list = list(json_file)
-        except FileNotFoundError:
-            logger.error(f"File note found: {current_path}/intention_utils/default_intent.jsonl")
-            json_list = []
-
-        intent_fewshot_examples = []
-        for json_str in json_list:
-            try:
-                intent_result = json.loads(json_str)
-            except json.JSONDecodeError as e:
-                logger.error(f"Error decoding JSON: {e}")
-                intent_result = {}
-            question = intent_result.get("question","你好")
-            answer = intent_result.get("answer",{})
-            intent_fewshot_examples.append({
-                "query": question,
-                "score": 'n/a',
-                "name": answer.get('intent','chat'),
-                "intent": answer.get('intent','chat'),
-                "kwargs": answer.get('kwargs', {}),
-            })
-                
+        intent_fewshot_examples = copy.deepcopy(load_default_intent_examples())
     else:
         intent_fewshot_examples = [{
             "query": doc['page_content'],
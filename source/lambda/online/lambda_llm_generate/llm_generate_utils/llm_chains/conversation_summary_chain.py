@@ -41,6 +41,7 @@ SYSTEM_MESSAGE_TYPE = MessageType.SYSTEM_MESSAGE_TYPE
 
 class Iternlm2Chat20BConversationSummaryChain(Iternlm2Chat7BChatChain):
     model_id = LLMModelType.INTERNLM2_CHAT_20B
+    deterministic = True
     default_model_kwargs = {
         "max_new_tokens": 300,
         "temperature": 0.1,
@@ -81,6 +82,7 @@ class Iternlm2Chat7BConversationSummaryChain(Iternlm2Chat20BConversationSummaryC
 class Claude2ConversationSummaryChain(LLMChain):
     model_id = LLMModelType.CLAUDE_2
     intent_type = LLMTaskType.CONVERSATION_SUMMARY_TYPE
+    deterministic = True
 
     default_model_kwargs = {"max_tokens": 2000, "temperature": 0.1, "top_p": 0.9}
     prefill = "From PersonU's point of view, here is the single standalone sentence:"
@@ -174,6 +176,7 @@ class Claude2ConversationSummaryChain(LLMChain):
         llm = Model.get_model(
             model_id=cls.model_id,
             model_kwargs=model_kwargs,
+            llm_cache=kwargs.get("llm_cache"),
         )
         messages_chain = cls.create_messages_chain(**kwargs)
         chain = messages_chain | RunnableLambda(lambda x: print_llm_messages(f"conversation summary messages: {x.messages}") or x.messages) \
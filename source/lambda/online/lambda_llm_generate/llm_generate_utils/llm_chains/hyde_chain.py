@@ -82,6 +82,7 @@ internlm2_meta_instruction = "You are a helpful AI Assistant."
 class Iternlm2Chat7BHydeChain(Iternlm2Chat7BChatChain):
     model_id = LLMModelType.INTERNLM2_CHAT_7B
     intent_type = HYDE_TYPE
+    deterministic = True
 
     default_model_kwargs = {"temperature": 0.1, "max_new_tokens": 200}
 
@@ -51,6 +51,7 @@ def load_intention_file(intent_save_path=intent_save_path, seed=42):
 class Iternlm2Chat7BIntentRecognitionChain(Iternlm2Chat7BChatChain):
     model_id = LLMModelType.INTERNLM2_CHAT_7B
     intent_type =LLMTaskType.INTENT_RECOGNITION_TYPE
+    deterministic = True
 
     default_model_kwargs = {
         "temperature": 0.1,
@@ -123,6 +124,7 @@ INTENT_RECOGINITION_EXAMPLE_TEMPLATE = """<query>{query}</query>\n{label}"""
 class Claude2IntentRecognitionChain(LLMChain):
     model_id = LLMModelType.CLAUDE_2
     intent_type = LLMTaskType.INTENT_RECOGNITION_TYPE
+    deterministic = True
 
     default_model_kwargs = {
         "temperature": 0,
@@ -193,7 +195,9 @@ class Claude2IntentRecognitionChain(LLMChain):
         model_kwargs = model_kwargs or {}
         model_kwargs = {**cls.default_model_kwargs, **model_kwargs}
 
-        llm = Model.get_model(cls.model_id, model_kwargs=model_kwargs)
+        llm = Model.get_model(
+            cls.model_id, model_kwargs=model_kwargs, llm_cache=kwargs.get("llm_cache")
+        )
 
         chain = (
             RunnablePassthrough.assign(
@@ -1,3 +1,19 @@
+import copy
+import os
+
+from common_logic.common_utils.cache_utils import LRUTTLCache, stable_hash
+from common_logic.common_utils.time_utils import get_china_now
+
+from ..llm_response_cache import get_llm_response_cache
+
+enable_llm_chain_cache = os.environ.get("ENABLE_LLM_CHAIN_CACHE", "true").lower() in ("true", "1", "t")
+# compiled chains are reused across invocations of a warm container,
+# per-request inputs (query, chat_history, contexts, ...) are bound at invoke time
+llm_chain_cache = LRUTTLCache(maxsize=int(os.environ.get("LLM_CHAIN_CACHE_MAXSIZE", 64)))
+# callers asking a deterministic chain for a higher temperature want sampled answers
+llm_response_cache_max_temperature = float(os.environ.get("LLM_RESPONSE_CACHE_MAX_TEMPERATURE", 0.1))
+
+
 class LLMChainMeta(type):
     def __new__(cls, name, bases, attrs):
         new_cls = type.__new__(cls, name, bases, attrs)
@@ -9,6 +25,12 @@ class LLMChainMeta(type):
 
 class LLMChain(metaclass=LLMChainMeta):
     model_map = {}
+    # chains building per-request data (e.g. goods info, call number) into
+    # the prompt at creation time are not cached
+    chain_cacheable = True
+    # chains with (near) zero temperature, their non streaming model calls
+    # are answered from the llm response cache for identical prompts
+    deterministic = False
 
     @classmethod
     def get_chain_id(cls):
@@ -18,9 +40,53 @@ class LLMChain(metaclass=LLMChainMeta):
     def _get_chain_id(model_id, intent_type):
         return f"{model_id}__{intent_type}"
 
+    @classmethod
+    def get_chain_cache_key(cls, model_kwargs=None, **kwargs):
+        """Canonical hash of the chain-affecting config. The date is part of
+        the key since system prompts may embed the current date."""
+        return stable_hash(
+            cls.get_chain_id(),
+            model_kwargs,
+            kwargs,
+            get_china_now().strftime("%Y-%m-%d")
+        )
+
+    @classmethod
+    def get_llm_cache(cls, model_kwargs=None, stream=False):
+        """
+        Response cache of the model of the chain, passed to create_chain
+        as `llm_cache`. None unless the chain is deterministic, streaming
+        calls always bypass it.
+        """
+        if not cls.deterministic or stream:
+            return None
+        temperature = (model_kwargs or {}).get("temperature", 0)
+        if temperature > llm_response_cache_max_temperature:
+            return None
+        return get_llm_response_cache(cls.intent_type)
+
     @classmethod
     def get_chain(cls, model_id, intent_type, model_kwargs=None, **kwargs):
-        return cls.model_map[cls._get_chain_id(model_id, intent_type)].create_chain(
-            model_kwargs=model_kwargs, **kwargs
+        chain_cls = cls.model_map[cls._get_chain_id(model_id, intent_type)]
+        llm_cache = chain_cls.get_llm_cache(
+            model_kwargs=model_kwargs, stream=kwargs.get("stream", False)
         )
+        cache_kwargs = {} if llm_cache is None else {"llm_cache": llm_cache}
+        if not (enable_llm_chain_cache and chain_cls.chain_cacheable):
+            return chain_cls.create_chain(model_kwargs=model_kwargs, **kwargs, **cache_kwargs)
+
+        cache_key = chain_cls.get_chain_cache_key(
+            model_kwargs=model_kwargs, llm_cache=llm_cache is not None, **kwargs
+        )
+        chain = llm_chain_cache.get(cache_key)
+        if chain is None:
+            # create_chain may update its arguments in place
+            chain = chain_cls.create_chain(
+                model_kwargs=copy.deepcopy(model_kwargs), **copy.deepcopy(kwargs), **cache_kwargs
+            )
+            llm_chain_cache.set(cache_key, chain)
+        return chain
+
 
+def get_llm_chain_cache_stats():
+    return llm_chain_cache.get_stats()
@@ -158,6 +158,8 @@ def convert_openai_tool_to_anthropic(tools:list[dict])->str:
 class Claude2RetailToolCallingChain(LLMChain):
     model_id = LLMModelType.CLAUDE_2
     intent_type = LLMTaskType.RETAIL_TOOL_CALLING
+    # goods info and create time are built into the prompt
+    chain_cacheable = False
     default_model_kwargs = {
         "max_tokens": 2000,
         "temperature": 0.1,
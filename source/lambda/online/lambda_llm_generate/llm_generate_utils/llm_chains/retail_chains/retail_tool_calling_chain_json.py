@@ -50,6 +50,8 @@ GLM4_SYSTEM_PROMPT = """你是安踏的客服助理小安, 主要职责是处理
 class GLM4Chat9BRetailToolCallingChain(GLM4Chat9BChatChain):
     model_id = LLMModelType.GLM_4_9B_CHAT
     intent_type = LLMTaskType.RETAIL_TOOL_CALLING
+    # goods info and create time are built into the prompt
+    chain_cacheable = False
     default_model_kwargs = {
         "max_new_tokens": 1024,
         "timeout": 60,
@@ -155,6 +157,8 @@ from ..chat_chain import Qwen2Instruct7BChatChain
 class Qwen2Instruct72BRetailToolCallingChain(Qwen2Instruct7BChatChain):
     model_id = LLMModelType.QWEN2INSTRUCT72B
     intent_type = LLMTaskType.RETAIL_TOOL_CALLING 
+    # goods info and create time are built into the prompt
+    chain_cacheable = False
     default_model_kwargs = {
         "max_tokens": 1024,
         "temperature": 0.1,
@@ -17,6 +17,7 @@ STEPBACK_PROMPTING_TYPE = LLMTaskType.STEPBACK_PROMPTING_TYPE
 class Iternlm2Chat7BStepBackChain(Iternlm2Chat7BChatChain):
     model_id = LLMModelType.INTERNLM2_CHAT_7B
     intent_type = STEPBACK_PROMPTING_TYPE
+    deterministic = True
 
     default_model_kwargs = {"temperature": 0.1, "max_new_tokens": 200}
 
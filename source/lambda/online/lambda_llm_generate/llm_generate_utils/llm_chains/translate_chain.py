@@ -12,6 +12,7 @@ QUERY_TRANSLATE_TYPE = LLMTaskType.QUERY_TRANSLATE_TYPE
 
 class Iternlm2Chat7BTranslateChain(Iternlm2Chat7BChatChain):
     intent_type = QUERY_TRANSLATE_TYPE
+    deterministic = True
     default_model_kwargs = {"temperature": 0.1, "max_new_tokens": 200}
 
     @classmethod
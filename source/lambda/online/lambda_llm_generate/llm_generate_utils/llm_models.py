@@ -3,16 +3,16 @@ import logging
 import os
 from datetime import datetime
 
-
-import boto3
 from langchain_openai import ChatOpenAI
 from langchain_community.chat_models import BedrockChat
 from langchain_community.llms.sagemaker_endpoint import LineIterator
+from langchain_core.outputs import Generation
 
 from common_logic.common_utils.constant import (
     MessageType,
     LLMModelType
 )
+from common_logic.common_utils.aws_client_utils import get_client
 from common_logic.common_utils.logger_utils import get_logger
 
 AI_MESSAGE_TYPE = MessageType.AI_MESSAGE_TYPE
@@ -57,8 +57,14 @@ class Model(ModeMixins,metaclass=ModelMeta):
     model_map = {}
 
     @classmethod
-    def get_model(cls, model_id, model_kwargs=None, **kwargs):
-        return cls.model_map[model_id].create_model(model_kwargs=model_kwargs, **kwargs)
+    def get_model(cls, model_id, model_kwargs=None, llm_cache=None, **kwargs):
+        """
+        :param llm_cache: response cache of deterministic chains, see llm_response_cache
+        """
+        llm = cls.model_map[model_id].create_model(model_kwargs=model_kwargs, **kwargs)
+        if llm_cache is not None:
+            llm.cache = llm_cache
+        return llm
 
 # Bedrock model type
 class Claude2(Model):
@@ -81,6 +87,11 @@ class Claude2(Model):
             or None
         )
         llm = BedrockChat(
+            client=get_client(
+                "bedrock-runtime",
+                region_name=region_name,
+                credentials_profile_name=credentials_profile_name
+            ),
             credentials_profile_name=credentials_profile_name,
             region_name=region_name,
             model_id=cls.model_id,
@@ -119,10 +130,12 @@ class SagemakerModelBase(Model):
     default_model_kwargs = None
     content_type = "application/json"
     accepts = "application/json"
+    # langchain BaseCache of the non streaming calls, set by Model.get_model
+    cache = None
 
     @classmethod
     def create_client(cls, region_name):
-        client = boto3.client("sagemaker-runtime", region_name=region_name)
+        client = get_client("sagemaker-runtime", region_name=region_name)
         return client
 
     def __init__(self, model_kwargs=None, **kwargs) -> None:
@@ -168,6 +181,18 @@ class SagemakerModelBase(Model):
 
     def _invoke(self, x):
         body = self.transform_input(x)
+        if self.cache is None:
+            return self._invoke_endpoint(body)
+        # the body holds the rendered prompt and the generation params
+        llm_string = f"{self.model_id}|{self.endpoint_name}"
+        cached = self.cache.lookup(body, llm_string)
+        if cached:
+            return json.loads(cached[0].text)
+        response = self._invoke_endpoint(body)
+        self.cache.update(body, llm_string, [Generation(text=json.dumps(response, ensure_ascii=False))])
+        return response
+
+    def _invoke_endpoint(self, body):
         try:
             response = self.client.invoke_endpoint(
                 EndpointName=self.endpoint_name,
@@ -0,0 +1,129 @@
+"""
+Response cache of the deterministic (low temperature) task chains, e.g.
+query rewrite, intention recognition and translation. Entries are keyed by
+the rendered prompt and the model id and generation params (`llm_string`),
+so any change of the prompt template or model config is a miss.
+"""
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Any, Optional, Sequence
+
+from common_logic.common_utils.cache_utils import (
+    SharedCacheBackendBase,
+    TieredCache,
+    stable_hash,
+)
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+logger = logging.getLogger("llm_response_cache")
+
+enable_llm_response_cache = os.environ.get("ENABLE_LLM_RESPONSE_CACHE", "true").lower() in ("true", "1", "t")
+# identical inputs of repeated queries and retries mostly arrive within minutes
+llm_response_store = TieredCache(
+    maxsize=int(os.environ.get("LLM_RESPONSE_CACHE_MAXSIZE", 1024)),
+    ttl=float(os.environ.get("LLM_RESPONSE_CACHE_TTL", 3600)),
+)
+# (task type, "hits" | "misses") -> count
+llm_response_cache_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def dumps_generations(generations: Sequence[Generation]) -> str:
+    """json of the generations, values of the shared tier must be json-serializable"""
+    values = []
+    for generation in generations:
+        if isinstance(generation, ChatGeneration):
+            values.append({"message": message_to_dict(generation.message)})
+        else:
+            values.append({"text": generation.text})
+    return json.dumps(values, ensure_ascii=False)
+
+
+def loads_generations(value: str) -> list:
+    generations = []
+    for item in json.loads(value):
+        if "message" in item:
+            generations.append(ChatGeneration(message=messages_from_dict([item["message"]])[0]))
+        else:
+            generations.append(Generation(text=item["text"]))
+    return generations
+
+
+class LLMResponseCache(BaseCache):
+    """
+    langchain cache of one task type, set as the `cache` of the model of a
+    deterministic chain. The entries are shared by all the task types.
+    Streaming calls never reach the cache.
+    """
+
+    def __init__(self, task_type: str, store: TieredCache = None):
+        self.task_type = task_type
+        self.store = store
+
+    def _get_store(self) -> TieredCache:
+        return self.store if self.store is not None else llm_response_store
+
+    @staticmethod
+    def get_cache_key(prompt: str, llm_string: str) -> str:
+        return stable_hash(prompt, llm_string)
+
+    def _record(self, hit: bool):
+        with _stats_lock:
+            llm_response_cache_stats[(self.task_type, "hits" if hit else "misses")] += 1
+            hits = llm_response_cache_stats[(self.task_type, "hits")]
+            misses = llm_response_cache_stats[(self.task_type, "misses")]
+        logger.info(
+            f"llm response cache {'hit' if hit else 'miss'}, task: {self.task_type}, hits: {hits}, misses: {misses}"
+        )
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[list]:
+        value = self._get_store().get(self.get_cache_key(prompt, llm_string))
+        if value is None:
+            self._record(False)
+            return None
+        try:
+            generations = loads_generations(value)
+        except Exception as e:
+            logger.error(f"invalid llm response cache entry: {e}")
+            self._record(False)
+            return None
+        self._record(True)
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        self._get_store().set(
+            self.get_cache_key(prompt, llm_string), dumps_generations(return_val)
+        )
+
+    def clear(self, **kwargs: Any) -> None:
+        self._get_store().clear()
+
+
+_task_caches = {}
+
+
+def get_llm_response_cache(task_type: str) -> Optional[LLMResponseCache]:
+    """cache of the task type, None if the response cache is disabled"""
+    if not enable_llm_response_cache:
+        return None
+    cache = _task_caches.get(task_type)
+    if cache is None:
+        cache = _task_caches.setdefault(task_type, LLMResponseCache(task_type))
+    return cache
+
+
+def set_llm_response_shared_backend(shared_backend: Optional[SharedCacheBackendBase]):
+    llm_response_store.set_shared_backend(shared_backend)
+
+
+def get_llm_response_cache_stats():
+    with _stats_lock:
+        task_stats = {}
+        for (task_type, name), count in llm_response_cache_stats.items():
+            task_stats.setdefault(task_type, {"hits": 0, "misses": 0})[name] = count
+    return {"tasks": task_stats, "store": llm_response_store.get_stats()}
@@ -0,0 +1,131 @@
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils.cache_utils import LRUTTLCache
+from common_logic.common_utils.constant import LLMModelType, LLMTaskType
+from common_logic.common_utils.logger_utils import get_logger
+from lambda_llm_generate.llm_generate_utils import LLMChain
+from lambda_llm_generate.llm_generate_utils.llm_chains import llm_chain_base
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema.runnable import RunnableLambda
+
+logger = get_logger("benchmark")
+
+FAKE_MODEL_ID = "fake-model"
+
+
+class FakeChatChain(LLMChain):
+    model_id = FAKE_MODEL_ID
+    intent_type = "fake_chat"
+    create_num = 0
+
+    @classmethod
+    def create_chain(cls, model_kwargs=None, **kwargs):
+        cls.create_num += 1
+        model_kwargs = model_kwargs or {}
+        # create_chain is allowed to update its arguments
+        model_kwargs.setdefault("temperature", 0.1)
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", kwargs.get("system_prompt", "you are a bot")),
+            ("human", "{query}")
+        ])
+        return prompt | RunnableLambda(
+            lambda x: f"{x.messages[0].content}|{x.messages[1].content}|{model_kwargs['temperature']}"
+        )
+
+
+class FakePerRequestChain(FakeChatChain):
+    intent_type = "fake_per_request"
+    chain_cacheable = False
+    create_num = 0
+
+
+class TestLLMChainCache(unittest.TestCase):
+    def setUp(self):
+        self.origin_cache = llm_chain_base.llm_chain_cache
+        self.origin_enable = llm_chain_base.enable_llm_chain_cache
+        llm_chain_base.llm_chain_cache = LRUTTLCache(maxsize=8)
+        llm_chain_base.enable_llm_chain_cache = True
+        FakeChatChain.create_num = 0
+        FakePerRequestChain.create_num = 0
+
+    def tearDown(self):
+        llm_chain_base.llm_chain_cache = self.origin_cache
+        llm_chain_base.enable_llm_chain_cache = self.origin_enable
+
+    def test_chain_created_once_per_config(self):
+        config = {"model_id": FAKE_MODEL_ID, "intent_type": "fake_chat", "model_kwargs": {}, "stream": False}
+        chains = [LLMChain.get_chain(**config) for _ in range(5)]
+        self.assertEqual(FakeChatChain.create_num, 1)
+        self.assertTrue(all(chain is chains[0] for chain in chains))
+        # create_chain updating model_kwargs does not leak into the caller config
+        self.assertEqual(config["model_kwargs"], {})
+
+        LLMChain.get_chain(**{**config, "system_prompt": "you are a poet"})
+        LLMChain.get_chain(**{**config, "model_kwargs": {"temperature": 0.5}})
+        self.assertEqual(FakeChatChain.create_num, 3)
+
+    def test_per_request_inputs_bound_at_invoke(self):
+        chain = LLMChain.get_chain(model_id=FAKE_MODEL_ID, intent_type="fake_chat", system_prompt="sys")
+        self.assertEqual(chain.invoke({"query": "a"}), "sys|a|0.1")
+        chain = LLMChain.get_chain(model_id=FAKE_MODEL_ID, intent_type="fake_chat", system_prompt="sys")
+        self.assertEqual(chain.invoke({"query": "b"}), "sys|b|0.1")
+        self.assertEqual(FakeChatChain.create_num, 1)
+
+    def test_not_cacheable_chain(self):
+        for _ in range(3):
+            LLMChain.get_chain(model_id=FAKE_MODEL_ID, intent_type="fake_per_request")
+        self.assertEqual(FakePerRequestChain.create_num, 3)
+
+    def test_lru_bound(self):
+        llm_chain_base.llm_chain_cache = LRUTTLCache(maxsize=2)
+        for prompt in ("a", "b", "c", "a"):
+            LLMChain.get_chain(model_id=FAKE_MODEL_ID, intent_type="fake_chat", system_prompt=prompt)
+        stats = llm_chain_base.get_llm_chain_cache_stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["evictions"], 2)
+        self.assertEqual(FakeChatChain.create_num, 4)
+
+    def test_cache_disabled(self):
+        llm_chain_base.enable_llm_chain_cache = False
+        for _ in range(3):
+            LLMChain.get_chain(model_id=FAKE_MODEL_ID, intent_type="fake_chat")
+        self.assertEqual(FakeChatChain.create_num, 3)
+
+
+def benchmark(invocation_num=100):
+    configs = [
+        {"model_id": LLMModelType.CLAUDE_3_HAIKU, "intent_type": intent_type, "stream": stream}
+        for intent_type in (LLMTaskType.CHAT, LLMTaskType.RAG, LLMTaskType.CONVERSATION_SUMMARY_TYPE)
+        for stream in (False, True)
+    ]
+    # the first construction pays module level costs, e.g. client creation
+    for config in configs:
+        LLMChain.get_chain(**config)
+
+    origin_enable = llm_chain_base.enable_llm_chain_cache
+    try:
+        for enable_cache in (False, True):
+            llm_chain_base.enable_llm_chain_cache = enable_cache
+            llm_chain_base.llm_chain_cache.clear()
+            for config in configs:
+                start = time.perf_counter()
+                for _ in range(invocation_num):
+                    LLMChain.get_chain(**config)
+                latency = (time.perf_counter() - start) / invocation_num
+                logger.info(
+                    f"bench cache: {enable_cache}, {config['intent_type']}, stream: {config['stream']}, "
+                    f"get_chain: {latency * 1000:.3f}ms"
+                )
+    finally:
+        llm_chain_base.enable_llm_chain_cache = origin_enable
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
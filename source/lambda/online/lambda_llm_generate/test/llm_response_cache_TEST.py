@@ -0,0 +1,211 @@
+import io
+import json
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils.cache_utils import (
+    LRUTTLCache,
+    SharedCacheBackendBase,
+    TieredCache,
+)
+from common_logic.common_utils.logger_utils import get_logger
+from lambda_llm_generate.llm_generate_utils import LLMChain, llm_response_cache
+from lambda_llm_generate.llm_generate_utils.llm_chains import llm_chain_base
+from lambda_llm_generate.llm_generate_utils.llm_models import Model, SagemakerModelBase
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema.runnable import RunnableLambda
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+logger = get_logger("benchmark")
+
+FAKE_MODEL_ID = "fake-deterministic-model"
+FAKE_SAGEMAKER_MODEL_ID = "fake-sagemaker-model"
+
+
+class FakeBedrockChat(FakeListChatModel):
+    model_kwargs: dict = {}
+    latency: float = 0
+
+    def _call(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super()._call(*args, **kwargs)
+
+    @property
+    def _identifying_params(self):
+        # as BedrockChat, the generation params are part of the llm_string
+        return {**super()._identifying_params, "model_kwargs": self.model_kwargs}
+
+
+class FakeChatModel(Model):
+    model_id = FAKE_MODEL_ID
+
+    @classmethod
+    def create_model(cls, model_kwargs=None, **kwargs):
+        # every model call returns a new response
+        return FakeBedrockChat(
+            responses=[f"response {i}" for i in range(100)],
+            model_kwargs=model_kwargs or {},
+            latency=kwargs.get("latency", 0),
+        )
+
+
+class FakeSagemakerClient:
+    def __init__(self):
+        self.bodies = []
+
+    def invoke_endpoint(self, EndpointName, Body, ContentType, Accept):
+        self.bodies.append(json.loads(Body))
+        return {"Body": io.BytesIO(json.dumps(f"response {len(self.bodies)}").encode("utf-8"))}
+
+
+class FakeSagemakerModel(SagemakerModelBase):
+    model_id = FAKE_SAGEMAKER_MODEL_ID
+    default_model_kwargs = {"temperature": 0.1}
+    client = FakeSagemakerClient()
+
+    @classmethod
+    def create_client(cls, region_name):
+        return cls.client
+
+    def transform_input(self, x):
+        return json.dumps({"query": x["prompt"], "stream": x["stream"], **self.model_kwargs})
+
+
+class FakeRewriteChain(LLMChain):
+    model_id = FAKE_MODEL_ID
+    intent_type = "fake_rewrite"
+    deterministic = True
+    create_kwargs = []
+
+    @classmethod
+    def create_chain(cls, model_kwargs=None, **kwargs):
+        cls.create_kwargs.append(kwargs)
+        llm = Model.get_model(cls.model_id, model_kwargs=model_kwargs, **kwargs)
+        prompt = ChatPromptTemplate.from_messages([("system", "rewrite the query"), ("human", "{query}")])
+        if kwargs.get("stream", False):
+            return prompt | RunnableLambda(lambda x: llm.stream(x.messages))
+        return prompt | llm | RunnableLambda(lambda x: x.content)
+
+
+class FakeChatChain(FakeRewriteChain):
+    intent_type = "fake_sampled_chat"
+    deterministic = False
+
+
+class FakeSagemakerRewriteChain(LLMChain):
+    model_id = FAKE_SAGEMAKER_MODEL_ID
+    intent_type = "fake_rewrite"
+    deterministic = True
+
+    @classmethod
+    def create_chain(cls, model_kwargs=None, **kwargs):
+        llm = Model.get_model(cls.model_id, model_kwargs=model_kwargs, endpoint_name="fake-endpoint", **kwargs)
+        return RunnableLambda(lambda x: {"prompt": f"rewrite: {x['query']}"}) | RunnableLambda(lambda x: llm.invoke(x))
+
+
+class DictSharedBackend(SharedCacheBackendBase):
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+
+class TestLLMResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.origin_chain_cache = llm_chain_base.llm_chain_cache
+        self.origin_store = llm_response_cache.llm_response_store
+        llm_chain_base.llm_chain_cache = LRUTTLCache(maxsize=8)
+        llm_response_cache.llm_response_store = TieredCache(maxsize=16)
+        llm_response_cache.llm_response_cache_stats.clear()
+        FakeRewriteChain.create_kwargs = []
+        FakeSagemakerModel.client.bodies = []
+
+    def tearDown(self):
+        llm_chain_base.llm_chain_cache = self.origin_chain_cache
+        llm_response_cache.llm_response_store = self.origin_store
+
+    def invoke(self, query, intent_type="fake_rewrite", model_id=FAKE_MODEL_ID, **kwargs):
+        return LLMChain.get_chain(model_id=model_id, intent_type=intent_type, **kwargs).invoke({"query": query})
+
+    def test_deterministic_chain_cached(self):
+        self.assertEqual(self.invoke("what is s3"), "response 0")
+        # the chain is compiled once, the second call is answered by the cache
+        self.assertEqual(self.invoke("what is s3"), "response 0")
+        self.assertEqual(self.invoke("what is ec2"), "response 1")
+        stats = llm_response_cache.get_llm_response_cache_stats()
+        self.assertEqual(stats["tasks"]["fake_rewrite"], {"hits": 1, "misses": 2})
+
+    def test_key_includes_model_params(self):
+        self.invoke("what is s3", model_kwargs={"temperature": 0})
+        self.invoke("what is s3", model_kwargs={"temperature": 0.05})
+        self.assertEqual(llm_response_cache.get_llm_response_cache_stats()["tasks"]["fake_rewrite"]["misses"], 2)
+
+    def test_not_deterministic_chain(self):
+        self.assertEqual(self.invoke("what is s3", intent_type="fake_sampled_chat"), "response 0")
+        self.assertEqual(self.invoke("what is s3", intent_type="fake_sampled_chat"), "response 1")
+        self.assertEqual(llm_response_cache.get_llm_response_cache_stats()["tasks"], {})
+
+    def test_bypassed(self):
+        chunks = list(self.invoke("what is s3", stream=True))
+        self.assertEqual("".join(chunk.content for chunk in chunks), "response 0")
+        self.assertNotIn("llm_cache", FakeRewriteChain.create_kwargs[-1])
+        # callers asking for a sampled answer
+        self.invoke("what is s3", model_kwargs={"temperature": 0.7})
+        self.assertNotIn("llm_cache", FakeRewriteChain.create_kwargs[-1])
+        origin_enable = llm_response_cache.enable_llm_response_cache
+        llm_response_cache.enable_llm_response_cache = False
+        try:
+            self.invoke("what is s3", model_kwargs={"temperature": 0})
+        finally:
+            llm_response_cache.enable_llm_response_cache = origin_enable
+        self.assertNotIn("llm_cache", FakeRewriteChain.create_kwargs[-1])
+        self.assertEqual(llm_response_cache.get_llm_response_cache_stats()["tasks"], {})
+
+    def test_sagemaker_model(self):
+        self.assertEqual(self.invoke("what is s3", model_id=FAKE_SAGEMAKER_MODEL_ID), "response 1")
+        self.assertEqual(self.invoke("what is s3", model_id=FAKE_SAGEMAKER_MODEL_ID), "response 1")
+        self.assertEqual(len(FakeSagemakerModel.client.bodies), 1)
+        self.assertEqual(FakeSagemakerModel.client.bodies[0]["query"], "rewrite: what is s3")
+
+    def test_shared_backend(self):
+        shared_backend = DictSharedBackend()
+        llm_response_cache.llm_response_store.set_shared_backend(shared_backend)
+        self.invoke("what is s3")
+        # e.g. another container
+        llm_response_cache.llm_response_store.clear()
+        self.assertEqual(self.invoke("what is s3"), "response 0")
+        self.assertEqual(llm_response_cache.llm_response_store.get_stats()["shared_hits"], 1)
+        # values of the shared tier are json
+        self.assertTrue(all(isinstance(json.loads(v), list) for v in shared_backend.values.values()))
+
+
+def benchmark(invocation_num=20, latency=0.2):
+    """repeated rewrites of the same query by a model with a fixed latency"""
+    origin_enable = llm_response_cache.enable_llm_response_cache
+    try:
+        for enable_cache in (False, True):
+            llm_response_cache.enable_llm_response_cache = enable_cache
+            llm_response_cache.llm_response_store.clear()
+            llm_chain_base.llm_chain_cache.clear()
+            start = time.perf_counter()
+            for i in range(invocation_num):
+                LLMChain.get_chain(model_id=FAKE_MODEL_ID, intent_type="fake_rewrite", latency=latency) \
+                    .invoke({"query": f"what is s3 {i % 4}"})
+            cost = (time.perf_counter() - start) / invocation_num
+            logger.info(f"bench cache: {enable_cache}, 4 distinct queries, latency: {cost * 1000:.1f}ms")
+    finally:
+        llm_response_cache.enable_llm_response_cache = origin_enable
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -3,14 +3,23 @@ import uuid
 import boto3
 import traceback
 
-from common_logic.common_utils.ddb_utils import DynamoDBChatMessageHistory
+from common_logic.common_utils.ddb_utils import (
+    DynamoDBChatMessageHistory,
+    chat_history_max_messages,
+    chat_history_max_tokens,
+    flush_pending_chat_history,
+)
 from lambda_main.main_utils.online_entries import get_entry
 from common_logic.common_utils.constant import EntryType
 from common_logic.common_utils.logger_utils import get_logger
 from common_logic.common_utils.websocket_utils import load_ws_client
+from common_logic.common_utils.chatbot_utils import warm_up_chatbot_cache
 from common_logic.common_utils.lambda_invoke_utils import (
+    LAMBDA_INVOKE_MODE,
     chatbot_lambda_call_wrapper,
+    get_deployed_lambda_invoke_mode,
     is_running_local,
+    preload_local_handlers,
 )
 from botocore.exceptions import ClientError
 from datetime import datetime, timezone
@@ -36,6 +45,11 @@ chatbot_table = dynamodb.Table(os.environ.get("CHATBOT_TABLE_NAME"))
 model_table = dynamodb.Table(os.environ.get("MODEL_TABLE_NAME"))
 embedding_endpoint = os.environ.get("EMBEDDING_ENDPOINT")
 create_time = str(datetime.now(timezone.utc))
+# resolve the chatbots listed in WARM_UP_CHATBOTS during Lambda init
+warm_up_chatbot_cache()
+# import the handlers of the fused hops during Lambda init
+if get_deployed_lambda_invoke_mode() == LAMBDA_INVOKE_MODE.FUSED.value:
+    preload_local_handlers()
 
 
 def get_secret_value(secret_arn: str):
@@ -63,6 +77,16 @@ def get_secret_value(secret_arn: str):
 
 @chatbot_lambda_call_wrapper
 def lambda_handler(event_body:dict, context:dict):
+    # atexit does not run when lambda freezes or recycles the sandbox,
+    # drain the chat history flushes of a frozen invocation and of this one
+    flush_pending_chat_history()
+    try:
+        return _lambda_handler(event_body, context)
+    finally:
+        flush_pending_chat_history()
+
+
+def _lambda_handler(event_body:dict, context:dict):
     logger.info(f"raw event_body: {event_body}")
     stream = context['stream']
     request_timestamp = context['request_timestamp']
@@ -90,7 +114,10 @@ def lambda_handler(event_body:dict, context:dict):
             client_type=client_type,
         )
     
-    chat_history = ddb_history_obj.messages_as_langchain
+    if chat_history_max_messages or chat_history_max_tokens:
+        chat_history = ddb_history_obj.get_recent_messages_as_langchain()
+    else:
+        chat_history = ddb_history_obj.messages_as_langchain
 
     event_body['stream'] = stream 
     event_body["chat_history"] = chat_history
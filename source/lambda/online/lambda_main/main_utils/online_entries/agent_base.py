@@ -2,6 +2,7 @@ import json
 from langgraph.graph import StateGraph,END
 from common_logic.common_utils.lambda_invoke_utils import invoke_lambda,node_monitor_wrapper
 
+from functions import get_tool_by_name
 from functions.tool_calling_parse import parse_tool_calling as _parse_tool_calling
 from common_logic.common_utils.lambda_invoke_utils import send_trace
 from common_logic.common_utils.exceptions import (
@@ -11,6 +12,12 @@ from common_logic.common_utils.exceptions import (
     ToolNotFound
 )
 from common_logic.common_utils.logger_utils import get_logger
+from common_logic.common_utils.state_projection_utils import (
+    get_state_projection,
+    merge_state_projections,
+    pop_state_writes,
+    project_state,
+)
 from functions.tool_execute_result_format import format_tool_call_results
 
 logger = get_logger("agent_base")
@@ -19,9 +26,7 @@ logger = get_logger("agent_base")
 def tools_choose_and_results_generation(state):
     # check once tool calling
     agent_current_output:dict = invoke_lambda(
-        event_body={
-            **state
-            },
+        event_body=project_state(state, get_state_projection("lambda_agent.agent")),
         lambda_name="Online_Agent",
         lambda_module_path="lambda_agent.agent",
         handler_name="lambda_handler"
@@ -86,20 +91,28 @@ def tool_execution(state):
     tool_calls = state['function_calling_parsed_tool_calls']
     assert len(tool_calls) == 1, tool_calls
     tool_call_results = []
+    state_writes = {}
     for tool_call in tool_calls:
         tool_name = tool_call["name"]
         tool_kwargs = tool_call['kwargs']
+        tool = get_tool_by_name(tool_name, scene=state["chatbot_config"]["scene"])
+        # fields read by the tool router and the tool
+        projection = merge_state_projections(
+            get_state_projection("functions.lambda_tool"),
+            get_state_projection(tool.lambda_module_path, tool.handler_name)
+        )
         # call tool
         output = invoke_lambda(
             event_body = {
                 "tool_name":tool_name,
-                "state":state,
+                "state":project_state(state, projection),
                 "kwargs":tool_kwargs
                 },
             lambda_name="Online_Tool_Execute",
             lambda_module_path="functions.lambda_tool",
             handler_name="lambda_handler"   
         )
+        state_writes.update(pop_state_writes(output))
         tool_call_results.append({
             "name": tool_name,
             "output": output,
@@ -109,7 +122,9 @@ def tool_execution(state):
     
     output = format_tool_call_results(tool_call['model_id'],tool_call_results)
     send_trace(f'**tool_execute_res:** \n{output["tool_message"]["content"]}', enable_trace=state["enable_trace"])
+    # declared writes of the tool, merged by the reducers of the state
     return {
+        **state_writes,
         "agent_tool_history": [output['tool_message']]
         }
 
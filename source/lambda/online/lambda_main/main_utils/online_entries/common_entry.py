@@ -1,28 +1,46 @@
+import concurrent.futures
 import json
+import time
+import traceback
 from typing import Annotated, Any, TypedDict
 
+from common_logic.common_utils.answer_cache_utils import (
+    AnswerRecorder,
+    answer_cache,
+    enable_answer_cache,
+)
 from common_logic.common_utils.constant import (
+    ChatbotMode,
     LLMTaskType,
-    ToolRuningMode,
     SceneType,
-    ChatbotMode
+    ToolRuningMode,
 )
-
 from common_logic.common_utils.lambda_invoke_utils import (
     invoke_lambda,
     is_running_local,
     node_monitor_wrapper,
     send_trace,
 )
-from common_logic.common_utils.python_utils import add_messages, update_nest_dict
 from common_logic.common_utils.logger_utils import get_logger
-from common_logic.common_utils.prompt_utils import get_prompt_templates_from_ddb
-from common_logic.common_utils.serialization_utils import JSONEncoder
+from common_logic.common_utils.prompt_utils import (
+    get_prompt_template_cache_stats,
+    get_prompt_templates_from_ddb,
+    preload_prompt_templates,
+)
+from common_logic.common_utils.python_utils import (
+    add_messages,
+    extend_messages,
+    update_nest_dict,
+)
 from common_logic.common_utils.response_utils import process_response
+from common_logic.common_utils.serialization_utils import JSONEncoder
 from functions import get_tool_by_name
+from lambda_main.main_utils.online_entries.agent_base import (
+    build_agent_graph,
+    tool_execution,
+)
 from lambda_main.main_utils.parse_config import CommonConfigParser
 from langgraph.graph import END, StateGraph
-from lambda_main.main_utils.online_entries.agent_base import build_agent_graph,tool_execution
 
 logger = get_logger('common_entry')
 
@@ -44,7 +62,7 @@ class ChatbotState(TypedDict):
     # message id related to original input question
     message_id: str = None 
     # record running states of different nodes
-    trace_infos: Annotated[list[str], add_messages]
+    trace_infos: Annotated[list[str], extend_messages]
     # whether to enbale trace info update via streaming ouput
     enable_trace: bool 
     # outputs
@@ -95,6 +113,10 @@ class ChatbotState(TypedDict):
     function_calling_parsed_tool_calls: list
     current_agent_tools_def: list
 
+    ########### answer cache states ###########
+    # answer cache scope of the turn, None if the answer is not cached
+    answer_cache_scope: str = None
+
 ####################
 # nodes in graph #
 ####################
@@ -111,47 +133,148 @@ def query_preprocess(state: ChatbotState):
     send_trace(f"\n**query rewrite:** {output}\n**origin query:** {state['query']}")
     return {"query_rewrite": output}
 
-@node_monitor_wrapper
-def intention_detection(state: ChatbotState):
-    # if state['chatbot_config']['agent_config']['only_use_rag_tool']:
-    #     return {
-    #         "intent_type": "intention detected"
-    #     }
-    retriever_params = state["chatbot_config"]["qq_match_config"]
-    retriever_params["query"] = state[retriever_params.get('retriever_config',{}).get("query_key","query")]
+def qq_match_retrieve(state: ChatbotState):
+    qq_match_config = state["chatbot_config"]["qq_match_config"]
+    # a copy, the intention branch may serialize the state concurrently
+    retriever_params = {
+        **qq_match_config,
+        "query": state[qq_match_config.get('retriever_config',{}).get("query_key","query")]
+    }
     output: str = invoke_lambda(
         event_body=retriever_params,
         lambda_name="Online_Functions",
         lambda_module_path="functions.functions_utils.retriever.retriever",
         handler_name="lambda_handler",
     )
+    return output["result"]["docs"]
+
+
+def intention_retrieve(state: ChatbotState):
+    intent_fewshot_examples = invoke_lambda(
+        lambda_module_path="lambda_intention_detection.intention",
+        lambda_name="Online_Intention_Detection",
+        handler_name="lambda_handler",
+        event_body=state,
+    )
+    return intent_fewshot_examples
+
+
+def _timed_call(fn, state):
+    start_time = time.time()
+    output = fn(state)
+    return output, time.time() - start_time
+
+
+def _get_branch_result(future, timeout, branch_name, default, state, branch_infos):
+    """wait for a concurrent branch, a timeout or an error falls back to default.
+    The branch timings are collected in branch_infos, returned by the node."""
+    try:
+        output, elapsed_time = future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        branch_infos.append(f"Branch: {branch_name}, timeout: {timeout} s")
+        send_trace(f"\n\n**{branch_name} timeout after {timeout} s**", state["stream"], state["ws_connection_id"], state["enable_trace"])
+        return default
+    except Exception:
+        logger.error(f"{branch_name} failed: {traceback.format_exc()}")
+        branch_infos.append(f"Branch: {branch_name}, failed")
+        return default
+    branch_infos.append(f"Branch: {branch_name}, elapsed time: {round(elapsed_time*1000)} ms")
+    return output
+
+
+def qq_match_and_intention_retrieve(state: ChatbotState, need_intention: bool, branch_infos: list):
+    """run qq match and intention retrieval concurrently
+
+    Args:
+        state (ChatbotState): chatbot state
+        need_intention (bool): whether to launch intention retrieval
+        branch_infos (list): collects the timings of the branches
+
+    Returns:
+        tuple: qq match docs, intention future and executor
+    """
+    intention_detection_config = state["chatbot_config"]["intention_detection_config"]
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    # each branch gets its own snapshot, a timed out branch keeps running
+    # after the node returns and must not touch the state of the request
+    qq_match_future = executor.submit(
+        _timed_call, qq_match_retrieve, {**state, "trace_infos": list(state["trace_infos"])}
+    )
+    intention_future = None
+    if need_intention:
+        intention_future = executor.submit(
+            _timed_call, intention_retrieve, {**state, "trace_infos": list(state["trace_infos"])}
+        )
+    qq_match_docs = _get_branch_result(
+        qq_match_future,
+        intention_detection_config["qq_match_timeout"],
+        "qq_match",
+        [],
+        state,
+        branch_infos
+    )
+    return qq_match_docs, intention_future, executor
+
+
+@node_monitor_wrapper
+def intention_detection(state: ChatbotState):
+    # if state['chatbot_config']['agent_config']['only_use_rag_tool']:
+    #     return {
+    #         "intent_type": "intention detected"
+    #     }
+    intention_detection_config = state["chatbot_config"]["intention_detection_config"]
+    only_use_rag_tool = state['chatbot_config']['agent_config']['only_use_rag_tool']
+    concurrent_mode = intention_detection_config["concurrent_mode"]
+    intention_future = None
+    executor = None
+    branch_infos = []
+    if concurrent_mode:
+        qq_match_docs, intention_future, executor = qq_match_and_intention_retrieve(
+            state,
+            need_intention=not only_use_rag_tool,
+            branch_infos=branch_infos
+        )
+    else:
+        qq_match_docs = qq_match_retrieve(state)
+
     context_list = []
-    qq_match_threshold = retriever_params['threshold']
-    for doc in output["result"]["docs"]:
+    qq_match_threshold = state["chatbot_config"]["qq_match_config"]['threshold']
+    for doc in qq_match_docs:
         if doc['retrieval_score'] > qq_match_threshold:
             send_trace(f"\n\n**similar query found**\n{doc}", state["stream"], state["ws_connection_id"], state["enable_trace"])
             query_content = doc['answer']
             # query_content = doc['answer']['jsonlAnswer']
+            if executor is not None:
+                # return early, the intention result is ignored
+                executor.shutdown(wait=False, cancel_futures=True)
             return {
                 "answer": query_content,
                 "intent_type": "similar query found",
+                "trace_infos": branch_infos,
             }
         question = doc['question']
         answer = doc['answer']
         context_list.append(f"问题: {question}, \n答案：{answer}")
 
-    if state['chatbot_config']['agent_config']['only_use_rag_tool']:
+    if only_use_rag_tool:
         return {
             "qq_match_results": context_list,
-            "intent_type": "intention detected"
+            "intent_type": "intention detected",
+            "trace_infos": branch_infos,
         }
 
-    intent_fewshot_examples = invoke_lambda(
-        lambda_module_path="lambda_intention_detection.intention",
-        lambda_name="Online_Intention_Detection",
-        handler_name="lambda_handler",
-        event_body=state,
-    )
+    if concurrent_mode:
+        intent_fewshot_examples = _get_branch_result(
+            intention_future,
+            intention_detection_config["intention_timeout"],
+            "intention",
+            [],
+            state,
+            branch_infos
+        )
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        intent_fewshot_examples = intention_retrieve(state)
 
     intent_fewshot_tools: list[str] = list(
         set([e["intent"] for e in intent_fewshot_examples])
@@ -164,6 +287,7 @@ def intention_detection(state: ChatbotState):
         "intent_fewshot_tools": intent_fewshot_tools,
         "qq_match_results": context_list,
         "intent_type": "intention detected",
+        "trace_infos": branch_infos,
     }
 
 
@@ -250,10 +374,90 @@ def llm_direct_results_generation(state: ChatbotState):
     return {"answer": answer}
 
 def final_results_preparation(state: ChatbotState):
-    app_response = process_response(state['event_body'],state)
+    prompt_template_cache_stats = get_prompt_template_cache_stats(state['chatbot_config']['group_name'])
+    state['trace_infos'].append(f"Prompt template cache: {prompt_template_cache_stats}")
+    send_trace(f"\n\n**prompt template cache:** {prompt_template_cache_stats}", state["stream"], state["ws_connection_id"], state["enable_trace"])
+    if not (state.get("answer_cache_scope") and is_answer_cacheable(state)):
+        app_response = process_response(state['event_body'],state)
+        return {"app_response": app_response}
+
+    answer = state["answer"]
+    if state["stream"] and not isinstance(answer, str):
+        answer = AnswerRecorder(answer)
+        app_response = process_response(state['event_body'], {**state, "answer": answer})
+        answer = answer.text if answer.completed else None
+    else:
+        app_response = process_response(state['event_body'],state)
+    if isinstance(answer, str) and answer:
+        answer_cache.set(
+            state["answer_cache_scope"],
+            state["query"],
+            {
+                "answer": answer,
+                "extra_response": state["extra_response"],
+                "ddb_additional_kwargs": state["ddb_additional_kwargs"],
+                "latency": time.time() - state["event_body"]["request_timestamp"],
+            },
+            get_answer_cache_embedding_fn(state["chatbot_config"])
+        )
     return {"app_response": app_response}
 
 
+#################
+# answer cache #
+#################
+
+# answers of these tools only depend on the query and the knowledge base
+ANSWER_CACHEABLE_TOOLS = ("rag_tool", "give_final_response")
+
+
+def is_answer_cacheable(state: dict):
+    if state["chatbot_config"]["chatbot_mode"] == ChatbotMode.chat:
+        return True
+    if state.get("intent_type") == "similar query found":
+        return True
+    tool_calls = state.get("function_calling_parsed_tool_calls") or []
+    return bool(tool_calls) and all(
+        tool_call["name"] in ANSWER_CACHEABLE_TOOLS for tool_call in tool_calls
+    )
+
+
+def get_answer_cache_embedding_fn(chatbot_config: dict):
+    """embed queries with the embedding model of the first retriever, None if there is no retriever"""
+    for task_name in ("qq_match_config", "intention_config", "private_knowledge_config"):
+        for retriever in chatbot_config[task_name]["retrievers"]:
+            if retriever.get("embedding_model_endpoint"):
+                def embedding_fn(query, retriever=retriever):
+                    from functions.functions_utils.retriever.utils.aos_retrievers import (
+                        get_similarity_embedding,
+                    )
+                    return get_similarity_embedding(
+                        query,
+                        retriever["embedding_model_endpoint"],
+                        retriever.get("target_model")
+                    )
+                return embedding_fn
+    return None
+
+
+def cached_answer_response(event_body: dict, entry: dict, hit_info: dict):
+    """send a cached answer through the normal response path"""
+    saved_seconds = max(entry["latency"] - (time.time() - event_body["request_timestamp"]), 0)
+    answer_cache.record_saving(saved_seconds)
+    chatbot_config = event_body["chatbot_config"]
+    send_trace(
+        f"\n\n**answer cache {hit_info['hit_type']} hit:** {hit_info}, saved: {round(saved_seconds, 3)} s, stats: {answer_cache.get_stats()}",
+        event_body["stream"],
+        event_body["ws_connection_id"],
+        chatbot_config["enable_trace"]
+    )
+    return process_response(event_body, {
+        "answer": entry["answer"],
+        "extra_response": entry["extra_response"],
+        "ddb_additional_kwargs": entry["ddb_additional_kwargs"],
+    })
+
+
 def matched_query_return(state: ChatbotState):
     return {"answer": state["answer"]}
 
@@ -396,6 +600,24 @@ def common_entry(event_body):
     message_id = event_body["custom_message_id"]
     ws_connection_id = event_body["ws_connection_id"]
     enable_trace = chatbot_config["enable_trace"]
+    # load all the prompt templates of the group with one query
+    preload_prompt_templates(chatbot_config["group_name"])
+
+    # answers depending on the chat history are not cached
+    answer_cache_scope = None
+    if enable_answer_cache and not chat_history and answer_cache.is_enabled():
+        answer_cache_scope = answer_cache.get_scope(chatbot_config)
+        entry, hit_info = answer_cache.get(
+            answer_cache_scope, query, get_answer_cache_embedding_fn(chatbot_config)
+        )
+        if entry is not None:
+            return cached_answer_response(event_body, entry, hit_info)
+        send_trace(
+            f"\n\n**answer cache miss**, stats: {answer_cache.get_stats()}",
+            stream,
+            ws_connection_id,
+            enable_trace
+        )
 
     # invoke graph and get results
     response = app.invoke(
@@ -415,7 +637,8 @@ def common_entry(event_body):
             "qq_match_results": [],
             "agent_repeated_call_limit": chatbot_config['agent_repeated_call_limit'],
             "agent_current_call_number": 0,
-            "ddb_additional_kwargs":{}
+            "ddb_additional_kwargs":{},
+            "answer_cache_scope": answer_cache_scope
         }
     )
     return response['app_response']
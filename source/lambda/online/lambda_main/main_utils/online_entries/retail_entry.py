@@ -8,7 +8,7 @@ from typing import TypedDict,Any,Annotated
 import validators
 from langgraph.graph import StateGraph,END
 from common_logic.common_utils.lambda_invoke_utils import invoke_lambda,node_monitor_wrapper
-from common_logic.common_utils.python_utils import update_nest_dict,add_messages
+from common_logic.common_utils.python_utils import update_nest_dict,add_messages,extend_messages
 from common_logic.common_utils.constant import (
     LLMTaskType,
     ToolRuningMode,
@@ -52,7 +52,7 @@ class ChatbotState(TypedDict):
     # message id related to original input question
     message_id: str = None 
     # record running states of different nodes
-    trace_infos: Annotated[list[str], add_messages]
+    trace_infos: Annotated[list[str], extend_messages]
     # whether to enbale trace info update via streaming ouput
     enable_trace: bool 
     # outputs
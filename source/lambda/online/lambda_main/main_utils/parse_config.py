@@ -1,5 +1,9 @@
 import copy
+import functools
 import os
+import pickle
+from common_logic.common_utils.cache_utils import LRUTTLCache, stable_hash
+from common_logic.common_utils.chatbot_utils import get_environ_chatbot_manager
 from common_logic.common_utils.constant import IndexType
 from common_logic.common_utils.logger_utils import get_logger
 from common_logic.common_utils.python_utils import update_nest_dict
@@ -12,6 +16,18 @@ from common_logic.common_utils.pydantic_models import (
 )
 logger = get_logger("parse_config")
 
+enable_config_cache = os.environ.get("ENABLE_CONFIG_CACHE", "true").lower() in ("true", "1", "t")
+# compiled chatbot configs, stored pickled so that the cached object can not be mutated
+compiled_config_cache = LRUTTLCache(maxsize=int(os.environ.get("CONFIG_CACHE_MAXSIZE", 128)))
+# keys set per request (see main.py), kept out of the compile so that all users of a chatbot share it
+PER_REQUEST_CONFIG_KEYS = ("user_id", "enable_trace")
+
+
+@functools.lru_cache(maxsize=8)
+def _eval_default_llm_config(default_llm_config_str: str):
+    return eval(default_llm_config_str)
+
+
 class ConfigParserBase:
     default_llm_config_str = "{'model_id': 'anthropic.claude-3-sonnet-20240229-v1:0', 'model_kwargs': {'temperature': 0.01, 'max_tokens': 4096}}"
     default_index_names = {"intention":[], "private_knowledge":[], "qq_match":[]}
@@ -34,7 +50,7 @@ class ConfigParserBase:
     
     @classmethod
     def parse_default_llm_config(cls,chatbot_config):
-        default_llm_config = eval(
+        default_llm_config = _eval_default_llm_config(
             os.environ.get("default_llm_config", cls.default_llm_config_str)
         )
         default_llm_config = update_nest_dict(
@@ -60,8 +76,46 @@ class ConfigParserBase:
         return default_retriever_config
 
     
+    @classmethod
+    def get_compile_key(cls,chatbot_config:dict):
+        """
+        Stable hash of everything the compiled config depends on: the parser,
+        the incoming chatbot config without the per-request keys, the default llm config and the version
+        of the resolved chatbot in ddb, its chatbot, index and model records
+        """
+        chatbot_version = get_environ_chatbot_manager().get_chatbot_version(
+            chatbot_config['group_name'],
+            chatbot_config['chatbot_id']
+        )
+        return stable_hash(
+            cls.__name__,
+            chatbot_config,
+            os.environ.get("default_llm_config", cls.default_llm_config_str),
+            chatbot_version
+        )
+
     @classmethod
     def from_chatbot_config(cls,chatbot_config:dict):
+        """
+        Compile the chatbot config, the compiled config is cached by
+        `get_compile_key` and each call gets its own copy with the
+        per-request keys of the incoming config set on it
+        """
+        if not enable_config_cache:
+            return cls.compile_chatbot_config(chatbot_config)
+        request_config = {k: chatbot_config[k] for k in PER_REQUEST_CONFIG_KEYS if k in chatbot_config}
+        chatbot_config = {k: v for k, v in chatbot_config.items() if k not in PER_REQUEST_CONFIG_KEYS}
+        compile_key = cls.get_compile_key(chatbot_config)
+        compiled_config = compiled_config_cache.get(compile_key)
+        if compiled_config is None:
+            compiled_config = pickle.dumps(cls.compile_chatbot_config(chatbot_config))
+            compiled_config_cache.set(compile_key, compiled_config)
+        compiled_config = pickle.loads(compiled_config)
+        compiled_config.update(request_config)
+        return compiled_config
+
+    @classmethod
+    def compile_chatbot_config(cls,chatbot_config:dict):
         chatbot_config = copy.deepcopy(chatbot_config)
         default_llm_config = cls.parse_default_llm_config(chatbot_config)
         default_index_names = cls.parse_default_index_names(chatbot_config)
@@ -92,8 +146,8 @@ class ConfigParserBase:
 
 class CommonConfigParser(ConfigParserBase):
     @classmethod
-    def from_chatbot_config(cls,chatbot_config:dict):
-        chatbot_config = super().from_chatbot_config(chatbot_config)
+    def compile_chatbot_config(cls,chatbot_config:dict):
+        chatbot_config = super().compile_chatbot_config(chatbot_config)
         # add default tools
         tools: list = chatbot_config["agent_config"]["tools"]
         if "give_rhetorical_question" not in tools:
@@ -109,7 +163,8 @@ class CommonConfigParser(ConfigParserBase):
 
 class RetailConfigParser(ConfigParserBase):
     @classmethod
-    def from_chatbot_config(cls,chatbot_config:dict):
+    def compile_chatbot_config(cls,chatbot_config:dict):
+        chatbot_config = copy.deepcopy(chatbot_config)
         # get index_infos
         index_infos = ChatbotConfig.get_index_infos_from_ddb(
             chatbot_config['group_name'],
@@ -135,5 +190,9 @@ class RetailConfigParser(ConfigParserBase):
         # 
 
         chatbot_config['tools_config'] = default_tools_config
-        chatbot_config = super().from_chatbot_config(chatbot_config)
-        return chatbot_config
\ No newline at end of file
+        chatbot_config = super().compile_chatbot_config(chatbot_config)
+        return chatbot_config
+
+
+def get_config_cache_stats():
+    return compiled_config_cache.get_stats()
@@ -0,0 +1,115 @@
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from lambda_main.main_utils.online_entries import common_entry
+
+
+def build_state(concurrent_mode=True, qq_match_timeout=1, intention_timeout=1, only_use_rag_tool=False):
+    return {
+        "query": "what is s3",
+        "query_rewrite": "what is amazon s3",
+        "stream": False,
+        "ws_connection_id": None,
+        "enable_trace": False,
+        "trace_infos": [],
+        "chatbot_config": {
+            "agent_config": {"only_use_rag_tool": only_use_rag_tool},
+            "qq_match_config": {
+                "threshold": 0.9,
+                "retriever_config": {"query_key": "query_rewrite"},
+                "retrievers": [{"index_name": "admin-qq-default"}],
+            },
+            "intention_detection_config": {
+                "concurrent_mode": concurrent_mode,
+                "qq_match_timeout": qq_match_timeout,
+                "intention_timeout": intention_timeout,
+            },
+        },
+    }
+
+
+class TestConcurrentIntentionDetection(unittest.TestCase):
+    def setUp(self):
+        self.qq_match_score = 0.5
+        self.qq_match_latency = 0.0
+        self.intention_latency = 0.0
+        self.qq_match_queries = []
+        self.intention_event_bodies = []
+        self._origin_invoke_lambda = common_entry.invoke_lambda
+        common_entry.invoke_lambda = self.fake_invoke_lambda
+
+    def tearDown(self):
+        common_entry.invoke_lambda = self._origin_invoke_lambda
+
+    def fake_invoke_lambda(self, event_body, lambda_name, **kwargs):
+        if lambda_name == "Online_Functions":
+            time.sleep(self.qq_match_latency)
+            self.qq_match_queries.append(event_body["query"])
+            return {"result": {"docs": [
+                {"retrieval_score": self.qq_match_score, "question": "what is s3", "answer": "object storage"}
+            ]}}
+        self.intention_event_bodies.append(event_body)
+        time.sleep(self.intention_latency)
+        # a branch still running after its timeout
+        event_body["trace_infos"].append("intention branch trace")
+        return [{"query": "what is s3", "score": 0.9, "name": "rag_tool", "intent": "rag_tool", "kwargs": {}}]
+
+    def test_qq_match_hit_returns_early(self):
+        self.qq_match_score = 0.95
+        self.intention_latency = 0.5
+        state = build_state()
+        start = time.time()
+        output = common_entry.intention_detection(state)
+        self.assertLess(time.time() - start, 0.3)
+        self.assertEqual(output["answer"], "object storage")
+        self.assertEqual(output["intent_type"], "similar query found")
+        self.assertEqual(len(output["trace_infos"]), 1)
+        self.assertTrue(output["trace_infos"][0].startswith("Branch: qq_match, elapsed time:"))
+
+    def test_intention_detected(self):
+        state = build_state()
+        output = common_entry.intention_detection(state)
+        self.assertEqual(output["intent_fewshot_tools"], ["rag_tool"])
+        self.assertEqual(output["qq_match_results"], ["问题: what is s3, \n答案：object storage"])
+        self.assertEqual(self.qq_match_queries, ["what is amazon s3"])
+        # the shared qq match config is not modified
+        self.assertNotIn("query", state["chatbot_config"]["qq_match_config"])
+        # the branch timings are node output, the branches ran on snapshots of the state
+        branch_infos = output["trace_infos"]
+        self.assertEqual(len(branch_infos), 2)
+        self.assertTrue(branch_infos[0].startswith("Branch: qq_match, elapsed time:"))
+        self.assertTrue(branch_infos[1].startswith("Branch: intention, elapsed time:"))
+        self.assertIsNot(self.intention_event_bodies[0], state)
+        self.assertNotIn("intention branch trace", state["trace_infos"])
+
+    def test_branch_timeout(self):
+        self.intention_latency = 0.3
+        state = build_state(intention_timeout=0.05)
+        output = common_entry.intention_detection(state)
+        self.assertEqual(output["intent_fewshot_examples"], [])
+        self.assertIn("Branch: intention, timeout: 0.05 s", output["trace_infos"])
+        # the timed out branch finishes after the node returned
+        trace_infos = list(state["trace_infos"])
+        time.sleep(0.4)
+        self.assertEqual(state["trace_infos"], trace_infos)
+
+        self.intention_latency = 0.0
+        self.qq_match_latency = 0.3
+        state = build_state(qq_match_timeout=0.05)
+        output = common_entry.intention_detection(state)
+        self.assertEqual(output["qq_match_results"], [])
+        self.assertEqual(output["intent_fewshot_tools"], ["rag_tool"])
+        self.assertIn("Branch: qq_match, timeout: 0.05 s", output["trace_infos"])
+
+    def test_sequential_mode(self):
+        state = build_state(concurrent_mode=False)
+        output = common_entry.intention_detection(state)
+        self.assertEqual(output["intent_fewshot_tools"], ["rag_tool"])
+        self.assertEqual(output["trace_infos"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", os.path.join("common_logic", "common_utils", "test")])
+
+from chatbot_cache_TEST import CHATBOT_ID, GROUP_NAME, build_tables
+from common_logic.common_utils import chatbot_utils
+from common_logic.common_utils.logger_utils import get_logger
+from lambda_main.main_utils import parse_config
+from lambda_main.main_utils.parse_config import CommonConfigParser
+
+logger = get_logger("benchmark")
+
+
+def build_chatbot_config(extra_tool_num=0):
+    """a typical chatbot config of the websocket event body"""
+    return {
+        "group_name": GROUP_NAME,
+        "chatbot_id": CHATBOT_ID,
+        "chatbot_mode": "agent",
+        "use_history": True,
+        "enable_trace": True,
+        "default_llm_config": {
+            "model_id": "anthropic.claude-3-sonnet-20240229-v1:0",
+            "model_kwargs": {"temperature": 0.01, "max_tokens": 1000},
+        },
+        "default_retriever_config": {"private_knowledge": {"context_num": 2}},
+        "agent_config": {
+            "only_use_rag_tool": False,
+            "tools": [f"tool_{i}" for i in range(extra_tool_num)],
+        },
+    }
+
+
+def parse(chatbot_config, enable_cache):
+    origin = parse_config.enable_config_cache
+    parse_config.enable_config_cache = enable_cache
+    try:
+        return CommonConfigParser.from_chatbot_config(chatbot_config)
+    finally:
+        parse_config.enable_config_cache = origin
+
+
+class TestConfigCompiler(unittest.TestCase):
+    def setUp(self):
+        self.ddb_resource, chatbot_manager = build_tables()
+        self._origin_manager = chatbot_utils._environ_chatbot_manager
+        chatbot_utils._environ_chatbot_manager = chatbot_manager
+        chatbot_utils.chatbot_cache.clear()
+        parse_config.compiled_config_cache.clear()
+        parse_config.compiled_config_cache.reset_stats()
+
+    def tearDown(self):
+        chatbot_utils._environ_chatbot_manager = self._origin_manager
+
+    def test_parity_with_uncached_parsing(self):
+        chatbot_config = build_chatbot_config()
+        expected = parse(chatbot_config, enable_cache=False)
+        self.assertEqual(parse(chatbot_config, enable_cache=True), expected)
+        self.assertEqual(parse(chatbot_config, enable_cache=True), expected)
+        self.assertEqual(parse_config.get_config_cache_stats()["hits"], 1)
+        # the incoming config is not mutated
+        self.assertIn("default_llm_config", chatbot_config)
+
+    def test_each_request_gets_its_own_copy(self):
+        chatbot_config = build_chatbot_config()
+        compiled = parse(chatbot_config, enable_cache=True)
+        compiled["agent_config"]["tools"].append("changed")
+        compiled["qq_match_config"]["query"] = "changed"
+        self.assertEqual(parse(chatbot_config, enable_cache=True), parse(chatbot_config, enable_cache=False))
+
+    def test_key_changes(self):
+        parse(build_chatbot_config(), enable_cache=True)
+        parse(build_chatbot_config(extra_tool_num=1), enable_cache=True)
+        self.assertEqual(parse_config.get_config_cache_stats()["misses"], 2)
+
+        # a new chatbot version in ddb compiles again
+        index_ids = chatbot_utils._environ_chatbot_manager.chatbot_table.items[(GROUP_NAME, CHATBOT_ID)]["indexIds"]
+        index_ids["qq"]["value"].pop("tag-1")
+        chatbot_utils._environ_chatbot_manager.invalidate(GROUP_NAME, CHATBOT_ID)
+        compiled = parse(build_chatbot_config(), enable_cache=True)
+        self.assertEqual(parse_config.get_config_cache_stats()["misses"], 3)
+        index_names = [r["index_name"] for r in compiled["qq_match_config"]["retrievers"]]
+        self.assertNotIn("index-1", index_names)
+
+    def test_users_share_one_compile(self):
+        compiled = {}
+        for user_id, enable_trace in (("user_1", True), ("user_2", False)):
+            chatbot_config = {**build_chatbot_config(), "user_id": user_id, "enable_trace": enable_trace}
+            compiled[user_id] = parse(chatbot_config, enable_cache=True)
+            self.assertEqual(compiled[user_id], parse(chatbot_config, enable_cache=False))
+        self.assertEqual(parse_config.get_config_cache_stats()["misses"], 1)
+        self.assertEqual(compiled["user_1"]["user_id"], "user_1")
+        self.assertEqual(compiled["user_2"]["user_id"], "user_2")
+        self.assertFalse(compiled["user_2"]["enable_trace"])
+
+    def test_key_changes_with_index_and_model_records(self):
+        parse(build_chatbot_config(), enable_cache=True)
+        chatbot_manager = chatbot_utils._environ_chatbot_manager
+        chatbot_manager.model_table.items[(GROUP_NAME, "model-0")]["parameter"]["ModelEndpoint"] = "new-endpoint"
+        # the resolved chatbot is kept until the max age of the chatbot cache
+        parse(build_chatbot_config(), enable_cache=True)
+        self.assertEqual(parse_config.get_config_cache_stats()["misses"], 1)
+        chatbot_utils.chatbot_cache.clear()
+        parse(build_chatbot_config(), enable_cache=True)
+        self.assertEqual(parse_config.get_config_cache_stats()["misses"], 2)
+
+        chatbot_manager.index_table.items[(GROUP_NAME, "index-1")]["kbType"] = "changed"
+        chatbot_utils.chatbot_cache.clear()
+        parse(build_chatbot_config(), enable_cache=True)
+        self.assertEqual(parse_config.get_config_cache_stats()["misses"], 3)
+
+
+def benchmark(request_num=200):
+    test = TestConfigCompiler()
+    test.setUp()
+    try:
+        for extra_tool_num in (0, 20, 100):
+            chatbot_config = build_chatbot_config(extra_tool_num)
+            for enable_cache in (False, True):
+                parse(chatbot_config, enable_cache)
+                start = time.perf_counter()
+                for _ in range(request_num):
+                    parse(chatbot_config, enable_cache)
+                latency = (time.perf_counter() - start) / request_num
+                logger.info(
+                    f"extra tools: {extra_tool_num}, cache: {enable_cache}, "
+                    f"per-request parsing: {latency * 1000:.3f} ms"
+                )
+    finally:
+        test.tearDown()
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -0,0 +1,213 @@
+import copy
+import json
+import sys
+import time
+import unittest
+
+sys.path.extend([".", "common_logic", "../job/dep/llm_bot_dep"])
+
+from common_logic.common_utils import state_projection_utils
+from common_logic.common_utils.constant import LLMModelType
+from common_logic.common_utils.exceptions import UndeclaredStateFieldError
+from common_logic.common_utils.logger_utils import get_logger
+from common_logic.common_utils.state_projection_utils import (
+    STATE_WRITES_KEY,
+    StateProjection,
+    get_state_projection,
+    merge_state_projections,
+    project_state,
+    state_projection,
+)
+from functions import init_common_tools
+from functions.lambda_common_tools import rag
+from lambda_agent import agent
+from lambda_main.main_utils.online_entries import agent_base
+
+init_common_tools()
+
+logger = get_logger("benchmark")
+
+MODEL_ID = LLMModelType.CLAUDE_3_SONNET
+
+
+def build_state(doc_num=10, history_num=10, trace_num=50):
+    """chatbot state of the common entry when the agent runs"""
+    chatbot_config = {
+        "group_name": "Admin",
+        "chatbot_id": "admin",
+        "scene": "common",
+        "enable_trace": False,
+        "agent_config": {"tools": ["give_final_response"], "llm_config": {"model_id": MODEL_ID}},
+        "private_knowledge_config": {
+            "retrievers": [{"index_name": "admin-qd-default"}],
+            "retriever_config": {"query_key": "query_rewrite"},
+            "llm_config": {"model_id": MODEL_ID},
+        },
+    }
+    chat_history = [{"role": "user" if i % 2 == 0 else "ai", "content": f"message {i} " * 40} for i in range(history_num)]
+    return {
+        "event_body": {"query": "what is s3", "chatbot_config": copy.deepcopy(chatbot_config)},
+        "query": "what is s3",
+        "query_rewrite": "what is amazon s3",
+        "chat_history": chat_history,
+        "chatbot_config": chatbot_config,
+        "ws_connection_id": None,
+        "stream": False,
+        "enable_trace": False,
+        "trace_infos": [f"Enter: node_{i}, time: {1700000000 + i}" for i in range(trace_num)],
+        "extra_response": {"current_agent_intent_type": "rag_tool"},
+        "qq_match_results": [],
+        "contexts": [f"s3 doc {i} " * 200 for i in range(doc_num)],
+        "intent_type": "intention detected",
+        "intent_fewshot_examples": [
+            {"query": f"what is s3 {i}", "score": 0.9, "name": "rag_tool", "intent": "rag_tool", "kwargs": {}}
+            for i in range(5)
+        ],
+        "intent_fewshot_tools": ["rag_tool"],
+        "agent_tool_history": [],
+        "agent_repeated_call_limit": 5,
+        "agent_current_call_number": 0,
+        "function_calling_parsed_tool_calls": [{"name": "rag_tool", "kwargs": {}, "model_id": MODEL_ID}],
+    }
+
+
+class StateProjectionTestBase(unittest.TestCase):
+    def setUp(self):
+        self._origin = (
+            state_projection_utils.validate_state_projection,
+            rag.invoke_lambda,
+            rag.get_prompt_templates_from_ddb,
+            agent.invoke_lambda,
+            agent.get_prompt_templates_from_ddb,
+        )
+        state_projection_utils.validate_state_projection = True
+        self.retriever_queries = []
+        self.llm_inputs = []
+        rag.invoke_lambda = self.fake_invoke_lambda
+        agent.invoke_lambda = self.fake_invoke_lambda
+        rag.get_prompt_templates_from_ddb = agent.get_prompt_templates_from_ddb = lambda *args, **kwargs: {}
+
+    def tearDown(self):
+        (
+            state_projection_utils.validate_state_projection,
+            rag.invoke_lambda,
+            rag.get_prompt_templates_from_ddb,
+            agent.invoke_lambda,
+            agent.get_prompt_templates_from_ddb,
+        ) = self._origin
+
+    def fake_invoke_lambda(self, event_body, lambda_name=None, **kwargs):
+        if lambda_name == "Online_Functions":
+            self.retriever_queries.append(event_body["query"])
+            return {"result": {"docs": [{"page_content": "s3 doc", "figure": [{"url": "s3://figure.png"}]}]}}
+        # the tool calling and rag chains read these fields of llm_input
+        llm_input = event_body["llm_input"]
+        self.llm_inputs.append({key: llm_input[key] for key in ("query", "chat_history")})
+        if event_body["llm_config"]["intent_type"] != "rag":
+            llm_input["agent_tool_history"]
+        return "s3 is an object storage service"
+
+
+class TestStateProjection(StateProjectionTestBase):
+    def test_project_and_merge(self):
+        projection = StateProjection(reads=["query"], field_refs=["chatbot_config.private_knowledge_config.retriever_config.query_key"])
+        state = build_state()
+        self.assertEqual(project_state(state, projection), {"query": "what is s3", "query_rewrite": "what is amazon s3"})
+        self.assertIs(project_state(state, None), state)
+        merged = merge_state_projections(projection, StateProjection(reads=["query", "chat_history"], writes=["extra_response"]))
+        self.assertEqual((merged.reads, merged.writes), (["query", "chat_history"], ["extra_response"]))
+        self.assertIsNone(merge_state_projections(projection, None))
+
+    def test_validator(self):
+        @state_projection(reads=["query"], writes=["answer"], state_key="state")
+        def handler(event_body, context=None):
+            state = event_body["state"]
+            state["answer"] = state["query"]
+            if event_body.get("read"):
+                state.get(event_body["read"])
+            if event_body.get("mutate"):
+                state["chat_history"].append({"role": "ai", "content": "..."})
+            return {"code": 0}
+
+        state = build_state()
+        output = handler({"state": {"query": "what is s3"}})
+        self.assertEqual(output[STATE_WRITES_KEY], {"answer": "what is s3"})
+        with self.assertRaises(UndeclaredStateFieldError):
+            handler({"state": state, "read": "contexts"})
+
+        @state_projection(reads=["query", "chat_history"], state_key="state")
+        def mutating_handler(event_body, context=None):
+            return handler(event_body, context)
+        with self.assertRaises(UndeclaredStateFieldError):
+            mutating_handler({"state": state, "mutate": True})
+
+    def test_rag_tool(self):
+        state = build_state()
+        projection = merge_state_projections(
+            get_state_projection("functions.lambda_tool"), get_state_projection(rag.lambda_handler)
+        )
+        projected_state = project_state(state, projection)
+        self.assertNotIn("contexts", projected_state)
+        self.assertNotIn("event_body", projected_state)
+        output = rag.lambda_handler({"tool_name": "rag_tool", "state": projected_state, "kwargs": {}})
+        self.assertEqual(output[STATE_WRITES_KEY]["extra_response"]["figures"], [{"url": "s3://figure.png"}])
+        self.assertEqual(self.retriever_queries, ["what is amazon s3"])
+        # the shared chatbot config is not modified
+        self.assertNotIn("query", state["chatbot_config"]["private_knowledge_config"])
+
+    def test_agent(self):
+        state = build_state()
+        agent_base.tools_choose_and_results_generation(state)
+        self.assertEqual(self.llm_inputs[0]["query"], "what is s3")
+
+    def test_tool_execution(self):
+        state = build_state()
+        lambda_tool_events = []
+        from functions import lambda_tool
+        origin_invoke_lambda = lambda_tool.invoke_lambda
+
+        def invoke_lambda(event_body, **kwargs):
+            lambda_tool_events.append(event_body)
+            return origin_invoke_lambda(event_body=event_body, **kwargs)
+        lambda_tool.invoke_lambda = invoke_lambda
+        try:
+            output = agent_base.tool_execution(state)
+        finally:
+            lambda_tool.invoke_lambda = origin_invoke_lambda
+        self.assertEqual(
+            sorted(lambda_tool_events[0]["state"]),
+            ["chat_history", "chatbot_config", "enable_trace", "qq_match_results", "query", "query_rewrite", "stream"],
+        )
+        # declared writes are node updates, merged by the reducer of extra_response
+        self.assertEqual(output["extra_response"]["figures"], [{"url": "s3://figure.png"}])
+        self.assertEqual(len(output["agent_tool_history"]), 1)
+
+
+def benchmark(repeat=20):
+    """json payloads of the agent and tool hops, whole state vs projected state"""
+    state = build_state(doc_num=20, history_num=40, trace_num=500)
+    hops = {
+        "agent": get_state_projection("lambda_agent.agent"),
+        "rag_tool": merge_state_projections(
+            get_state_projection("functions.lambda_tool"), get_state_projection(rag.lambda_handler)
+        ),
+        "give_final_response": merge_state_projections(
+            get_state_projection("functions.lambda_tool"),
+            get_state_projection("functions.lambda_common_tools.give_final_response"),
+        ),
+    }
+    for name, projection in hops.items():
+        for projected in (False, True):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                payload = json.dumps(project_state(state, projection) if projected else state)
+                json.loads(payload)
+            cost = (time.perf_counter() - start) / repeat
+            logger.info(f"bench hop: {name}, projected: {projected}, payload: {len(payload) / 1024:.1f}KB, json: {cost * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()